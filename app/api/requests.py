@@ -1,13 +1,91 @@
-from datetime import datetime
-from typing import List
-from pydantic import BaseModel
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+from pydantic import BaseModel, Field, model_validator
+
+
+MAX_BATCH_SLOTS = 96
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_CANCEL_IDS = 10_000
+
+
+# Only ReservationSearchRequest takes these, the other requests reject them rather than ignore them
+DISTANCE_FIELDS = frozenset(('max_distance_km', 'nearest_k'))
 
 
 class ReservationRequest(BaseModel):
     start_time: datetime
     diner_ids: List[int]
 
+    @model_validator(mode='before')
+    @classmethod
+    def reject_distance(cls, data: Any) -> Any:
+        if isinstance(data, dict):
+            unsupported = DISTANCE_FIELDS.intersection(data).difference(cls.model_fields)
+            if unsupported:
+                raise ValueError(f"{', '.join(sorted(unsupported))} only apply to /find_reservation/")
+        return data
+
+    def by_distance(self) -> bool:
+        return False
+
+
+class ReservationSearchRequest(ReservationRequest):
+    """
+    The /find_reservation/ search, which can rank by distance from the group's homes: restaurants
+    within max_distance_km, the nearest_k of them, or the nearest_k within max_distance_km
+    """
+    max_distance_km: Optional[float] = Field(None, gt=0)
+    nearest_k: Optional[int] = Field(None, ge=1, le=MAX_PAGE_SIZE)
+
+    def by_distance(self) -> bool:
+        return self.max_distance_km is not None or self.nearest_k is not None
+
 
 class AvailableReservationRequest(ReservationRequest):
     restaurant_id: int
 
+
+class ReservationPageRequest(ReservationRequest):
+    """A page of the search, cursor is the next_cursor of the previous page"""
+    limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+
+
+
+class CancelReservationsRequest(BaseModel):
+    reservation_ids: List[int] = Field(min_length=1, max_length=MAX_CANCEL_IDS)
+
+
+class BatchReservationRequest(BaseModel):
+    """
+    A group's search over many start times, given either as start_times or as
+    range_start..range_end (inclusive) every step_minutes.
+    """
+    diner_ids: List[int]
+    start_times: Optional[List[datetime]] = None
+    range_start: Optional[datetime] = None
+    range_end: Optional[datetime] = None
+    step_minutes: int = 30
+
+    @model_validator(mode='after')
+    def check_slots(self) -> "BatchReservationRequest":
+        has_range = self.range_start is not None or self.range_end is not None
+        if (self.start_times is not None) == has_range:
+            raise ValueError("Give either start_times or range_start and range_end")
+        if has_range and (self.range_start is None or self.range_end is None or self.range_end < self.range_start):
+            raise ValueError("range_start and range_end are both needed, range_end not before range_start")
+        if self.step_minutes <= 0:
+            raise ValueError("step_minutes must be positive")
+        slots = self.slots()
+        if not slots or len(slots) > MAX_BATCH_SLOTS:
+            raise ValueError(f"Between 1 and {MAX_BATCH_SLOTS} start times per batch")
+        return self
+
+    def slots(self) -> List[datetime]:
+        """Distinct start times, ascending"""
+        if self.start_times is not None:
+            return sorted(set(self.start_times))
+        step = timedelta(minutes=self.step_minutes)
+        count = int((self.range_end - self.range_start) / step) + 1
+        return [self.range_start + step * number for number in range(min(count, MAX_BATCH_SLOTS + 1))]
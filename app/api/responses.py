@@ -1,4 +1,5 @@
-from typing import List
+from datetime import date, datetime
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 
@@ -6,7 +7,48 @@ class RestaurantResponse(BaseModel):
     id: int
     restaurant_name: str
 
+class NearbyRestaurantResponse(RestaurantResponse):
+    distance_km: float
+
+class RestaurantPageResponse(BaseModel):
+    restaurants: List[RestaurantResponse]
+    next_cursor: Optional[str] = None
+
+class SlotAvailabilityResponse(BaseModel):
+    start_time: datetime
+    restaurants: List[RestaurantResponse]
+
 class ReservationResponse(BaseModel):
     id: int
     restaurant_id: int
-    diner_ids: List[int]
\ No newline at end of file
+    diner_ids: List[int]
+
+class CancellationResponse(BaseModel):
+    # The reservations cancelled, ascending
+    reservation_ids: List[int]
+
+class PastReservationResponse(BaseModel):
+    id: int
+    restaurant_id: int
+    start_time: datetime
+    end_time: datetime
+    archived: bool
+
+class ReservationHistoryResponse(BaseModel):
+    reservations: List[PastReservationResponse]
+    # Pass back as before for the following page, null on the last one
+    next_before: Optional[datetime] = None
+
+class HourOccupancyResponse(BaseModel):
+    day: date
+    hour: int
+    capacity: int
+    tables: int
+    booked: int
+    free: int
+
+class RestaurantOccupancyResponse(BaseModel):
+    restaurant_id: int
+    # Tables per capacity, every hour missing from slots has them all free
+    tables: Dict[int, int]
+    slots: List[HourOccupancyResponse]
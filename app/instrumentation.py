@@ -0,0 +1,169 @@
+"""
+Per-request SQL and latency instrumentation.
+
+Statements are counted by listeners on every SQLAlchemy Engine (async engines included, through
+their sync_engine) into the RequestStats of the current context. The ASGI middleware opens one per
+request, observes it into Prometheus-style histograms per handler, served by /metrics, and reports
+it in a Server-Timing header. Outside a tracked context the listeners do nothing.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_seconds: float = 0.0
+    rows: int = 0
+    started: List[float] = field(default_factory=list)
+
+    def count_row(self, cursor, row):
+        """sqlite3 row_factory, counts rows as the caller fetches them"""
+        self.rows += 1
+        return row
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def track_statements() -> Iterator[RequestStats]:
+    """Counts the statements, DB time and rows of everything executed in this context"""
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current.get()
+    if stats is None:
+        return
+    if hasattr(cursor, "row_factory"):
+        # pysqlite hands rows out lazily, count them as they are fetched
+        cursor.row_factory = stats.count_row
+    stats.started.append(time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current.get()
+    if stats is None or not stats.started:
+        return
+    stats.db_seconds += time.perf_counter() - stats.started.pop()
+    stats.statements += 1
+    if cursor.description is None:
+        stats.rows += max(cursor.rowcount, 0)
+        return
+    # The asyncio adapters fetch the whole result inside execute
+    buffered = getattr(cursor, "_rows", None)
+    if buffered is not None:
+        stats.rows += len(buffered)
+
+
+def instrument_engines() -> None:
+    """Listens on every Engine, idempotent"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value, rendered in the Prometheus text format"""
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], label: str = "handler") -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        self.series: Dict[str, List[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self._lock:
+            # One count per bucket (the last is +Inf), then the sum and the total count
+            series = self.series.setdefault(label_value, [0] * (len(self.buckets) + 3))
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self.series.items()):
+                labels = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip([*map(str, self.buckets), "+Inf"], series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RequestMetrics:
+    def __init__(self) -> None:
+        self.latency = Histogram("booking_request_duration_seconds", "Handler latency", SECONDS_BUCKETS)
+        self.db_time = Histogram("booking_request_db_seconds", "Time spent executing SQL", SECONDS_BUCKETS)
+        self.statements = Histogram("booking_request_statements", "SQL statements executed",
+                                    (1, 2, 3, 5, 8, 13, 21, 50, 100))
+        self.rows = Histogram("booking_request_rows", "Rows returned or changed by SQL",
+                              (1, 10, 100, 1_000, 10_000, 100_000))
+
+    def observe(self, handler: str, stats: RequestStats, seconds: float) -> None:
+        self.latency.observe(handler, seconds)
+        self.db_time.observe(handler, stats.db_seconds)
+        self.statements.observe(handler, stats.statements)
+        self.rows.observe(handler, stats.rows)
+
+    def render(self) -> str:
+        histograms = (self.latency, self.db_time, self.statements, self.rows)
+        return "\n".join(line for histogram in histograms for line in histogram.render()) + "\n"
+
+
+def server_timing(stats: RequestStats, seconds: float) -> str:
+    return (f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.statements} statements, {stats.rows} rows", '
+            f'app;dur={seconds * 1000:.2f}')
+
+
+class InstrumentationMiddleware:
+    """
+    Pure ASGI middleware, so handlers and their DB work run in the context it tracks.
+    Requests are labelled by handler name; the Server-Timing header covers the work done
+    before the response starts, which for a streamed body is only the first part.
+    """
+    def __init__(self, app, metrics: RequestMetrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        with track_statements() as stats:
+            async def send_with_timing(message) -> None:
+                if message["type"] == "http.response.start":
+                    header = server_timing(stats, time.perf_counter() - started)
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", header.encode())]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                endpoint = scope.get("endpoint")
+                handler = getattr(endpoint, "__name__", "unmatched")
+                self.metrics.observe(handler, stats, time.perf_counter() - started)
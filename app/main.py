@@ -1,36 +1,324 @@
-from fastapi import FastAPI, status, HTTPException
+import asyncio
+import logging
+import signal
+from contextlib import asynccontextmanager, suppress
+from fastapi import Depends, FastAPI, Query, status, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .models.db import live_session
-from .api.requests import ReservationRequest, AvailableReservationRequest
-from .api.responses import RestaurantResponse, ReservationResponse
-from .reservations.reservation_manager import ReservationManager
-from typing import List
+from .instrumentation import InstrumentationMiddleware, RequestMetrics, instrument_engines
+from .models import async_db
+from .models.async_db import get_async_read_session, get_async_session
+from .models.config import archive_settings, booking_settings, change_feed_settings, reference_data_settings, search_settings
+from .models.db import db_engine, live_session
+from .models.migrations import migrate
+from .api.requests import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ReservationRequest, ReservationSearchRequest, AvailableReservationRequest,
+    BatchReservationRequest, CancelReservationsRequest, ReservationPageRequest
+)
+from .api.responses import (
+    CancellationResponse, HourOccupancyResponse, NearbyRestaurantResponse, PastReservationResponse, ReservationHistoryResponse,
+    RestaurantOccupancyResponse, RestaurantPageResponse, RestaurantResponse, ReservationResponse, SlotAvailabilityResponse
+)
+from .reservations.archive import archive_reservations, retention_cutoff
+from .reservations.availability_index import AvailabilityIndex
+from .reservations.change_feed import (
+    ChangeFeed, begin_snapshot, change_version, install_change_log, prune_changes, remove_change_log
+)
+from .reservations.diner_schedule import DinerSchedule
+from .reservations.reference_data import ReferenceData
+from .reservations.async_reservation_manager import AsyncReservationManager
+from .reservations.search_cache import SearchCache
+from .reservations.write_queue import WriteQueue
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
 
 
-app = FastAPI()
+# Built at startup when BOOKING_SEARCH_BACKEND=index, shared by every request of this process
+availability_index: Optional[AvailabilityIndex] = None
+
+# Built at startup when BOOKING_DINER_SCHEDULE is on, double-booking checks of this process answered in memory
+diner_schedule: Optional[DinerSchedule] = None
+
+# Built at startup when BOOKING_REFERENCE_DATA is on, swapped for a rebuilt snapshot on SIGHUP or when
+# the periodic check finds the reference tables changed
+reference_data: Optional[ReferenceData] = None
+
+# Search results cached per process when BOOKING_SEARCH_CACHE_ENTRIES > 0, invalidated by this process' writes
+search_cache: Optional[SearchCache] = None
+
+# With BOOKING_WRITE_QUEUE on, this process' bookings and deletions are committed in batches by one writer
+write_queue: Optional[WriteQueue] = None
+
+# With BOOKING_CHANGE_FEED on, the structures above follow the writes of every process on the database
+change_feed: Optional[ChangeFeed] = None
+
+
+def archive_past_reservations() -> int:
+    with live_session() as session:
+        archived = archive_reservations(session, retention_cutoff(archive_settings.retention_days), archive_settings.batch_size)
+        prune_changes(session, change_feed_settings.retention)
+        return archived
+
+
+async def archive_periodically(interval_seconds: float) -> None:
+    """Runs the archive job off the event loop every interval, a failed run is logged and retried next time"""
+    while True:
+        try:
+            await asyncio.to_thread(archive_past_reservations)
+        except Exception as e:
+            logging.error(f"Archiving past reservations failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+def refresh_reference_data(if_changed: bool = False) -> bool:
+    with live_session() as session:
+        return reference_data.refresh(session, if_changed=if_changed)
+
+
+async def refresh_reference_data_async(if_changed: bool = False) -> None:
+    """Rebuilds off the event loop, searches keep using the current snapshot until the swap"""
+    try:
+        await asyncio.to_thread(refresh_reference_data, if_changed)
+    except Exception as e:
+        logging.error(f"Refreshing reference data failed: {e}")
+
+
+async def refresh_reference_data_periodically(interval_seconds: float) -> None:
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await refresh_reference_data_async(if_changed=True)
+
+
+async def catch_up_periodically(interval_seconds: float) -> None:
+    """Applies other workers' writes while this one gets no requests, a failed run is logged and retried next time"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(change_feed.catch_up)
+        except Exception as e:
+            logging.error(f"Catching up with the change feed failed: {e}")
+
+
+def prune_change_log() -> int:
+    with live_session() as session:
+        return prune_changes(session, change_feed_settings.retention)
+
+
+async def prune_changes_periodically(interval_seconds: float) -> None:
+    """Keeps the change log at its retention off the event loop, a failed run is logged and retried next time"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(prune_change_log)
+        except Exception as e:
+            logging.error(f"Pruning the change log failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global availability_index, change_feed, diner_schedule, reference_data, search_cache, write_queue
+    migrate(db_engine)
+    with live_session() as session:
+        if change_feed_settings.enabled:
+            install_change_log(session)
+        else:
+            remove_change_log(session)
+        prune_changes(session, change_feed_settings.retention)
+        if change_feed_settings.enabled:
+            # Everything below is built from the commits up to this version, the feed applies the rest
+            begin_snapshot(session)
+            version = change_version(session)
+        if search_settings.backend == 'index':
+            availability_index = AvailabilityIndex.build(session)
+        if booking_settings.diner_schedule:
+            since = datetime.now() - timedelta(days=booking_settings.diner_schedule_days)
+            diner_schedule = DinerSchedule.build(session, since=since)
+        if reference_data_settings.enabled:
+            reference_data = ReferenceData.build(session)
+    if search_settings.cache_entries > 0:
+        search_cache = SearchCache(
+            max_entries=search_settings.cache_entries,
+            ttl_seconds=search_settings.cache_ttl_seconds,
+            bucket_minutes=search_settings.cache_bucket_minutes,
+        )
+    tasks = []
+    sighup = False
+    if reference_data_settings.enabled:
+        loop = asyncio.get_running_loop()
+        # Signal handlers only install on the main thread of a Unix process, not under a test client
+        with suppress(NotImplementedError, RuntimeError, ValueError):
+            loop.add_signal_handler(signal.SIGHUP, lambda: tasks.append(loop.create_task(refresh_reference_data_async())))
+            sighup = True
+        if reference_data_settings.refresh_seconds > 0:
+            tasks.append(asyncio.create_task(refresh_reference_data_periodically(reference_data_settings.refresh_seconds)))
+    if change_feed_settings.enabled:
+        loop = asyncio.get_running_loop()
+        change_feed = ChangeFeed(
+            db_engine, version, availability_index=availability_index, search_cache=search_cache, diner_schedule=diner_schedule,
+            on_reference_change=None if reference_data is None else (
+                lambda: tasks.append(loop.create_task(refresh_reference_data_async()))
+            )
+        )
+        if change_feed_settings.poll_seconds > 0:
+            tasks.append(asyncio.create_task(catch_up_periodically(change_feed_settings.poll_seconds)))
+        if change_feed_settings.prune_seconds > 0:
+            tasks.append(asyncio.create_task(prune_changes_periodically(change_feed_settings.prune_seconds)))
+    if archive_settings.interval_seconds > 0:
+        tasks.append(asyncio.create_task(archive_periodically(archive_settings.interval_seconds)))
+    if booking_settings.write_queue:
+        write_queue = WriteQueue(async_db.async_db_engine, batch_size=booking_settings.write_batch_size)
+        write_queue.start()
+    yield
+    if write_queue is not None:
+        await write_queue.close()
+    if change_feed is not None:
+        change_feed.close()
+    if sighup:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+async def get_reservation_manager(session: AsyncSession = Depends(get_async_session),
+                                  read_session: AsyncSession = Depends(get_async_read_session)) -> AsyncReservationManager:
+    """Sessions only check a connection out when first used, a booking never takes one from the read pool"""
+    return AsyncReservationManager(session=session, availability_index=availability_index, search_cache=search_cache,
+                                   allocation=booking_settings.allocation, diner_schedule=diner_schedule,
+                                   read_session=read_session, reference_data=reference_data,
+                                   write_queue=write_queue, occupancy_prefilter=search_settings.occupancy_prefilter,
+                                   change_feed=change_feed)
+
+
+instrument_engines()
+request_metrics = RequestMetrics()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(InstrumentationMiddleware, metrics=request_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Per handler histograms of latency, SQL time, statements and rows, in the Prometheus text format"""
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/find_reservation/", status_code=status.HTTP_200_OK)
-def find_available_tables(request: ReservationRequest):
+async def find_available_tables(request: ReservationSearchRequest,
+                                manager: AsyncReservationManager = Depends(get_reservation_manager)):
     """
     An endpoint to find restaurants with an available table for a group of users at a specific time.
     Thought about it being a GET since we are fetching, and we can switch to that if needed.
     """
     try:
-        results = ReservationManager(session=live_session()).find_available_restaurant(request)
+        results = await manager.find_available_restaurant(request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Could not find any tables: {e}")
     
+    if request.by_distance():
+        return [NearbyRestaurantResponse(id=result.id, restaurant_name=result.name, distance_km=round(result.distance_km, 3))
+                for result in results]
     return [RestaurantResponse(**{"id": result.id, "restaurant_name": result.name}) for result in results]
 
 
+@app.post("/find_reservation/page/", status_code=status.HTTP_200_OK)
+async def find_available_tables_page(page_request: ReservationPageRequest,
+                                     manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """
+    The search above one page at a time, ordered by restaurant id. Pass the returned next_cursor
+    back as cursor for the following page; it is null on the last one.
+    """
+    results, next_cursor = await manager.find_available_restaurant_page(page_request)
+    return RestaurantPageResponse(
+        restaurants=[RestaurantResponse(id=result.id, restaurant_name=result.name) for result in results],
+        next_cursor=next_cursor
+    )
+
+
+@app.post("/find_reservation/stream/", status_code=status.HTTP_200_OK)
+async def stream_available_tables(request: ReservationRequest):
+    """
+    The whole search as NDJSON, one RestaurantResponse per line, read from the database in keyset pages.
+    The generator owns its session, since request dependencies are closed before a streamed body is sent.
+    """
+    async def lines():
+        async with async_db.AsyncReadSessionLocal() as session:
+            manager = AsyncReservationManager(session=session, availability_index=availability_index,
+                                              search_cache=search_cache, diner_schedule=diner_schedule,
+                                              reference_data=reference_data, change_feed=change_feed,
+                                              occupancy_prefilter=search_settings.occupancy_prefilter)
+            async for page in manager.stream_available_restaurants(request):
+                yield "".join(
+                    RestaurantResponse(id=result.id, restaurant_name=result.name).model_dump_json() + "\n"
+                    for result in page
+                )
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/find_reservation/batch/", status_code=status.HTTP_200_OK)
+async def find_available_tables_by_slot(batch_request: BatchReservationRequest,
+                                        manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """
+    The search above for a grid of start times, e.g. every 30 minutes of an evening, in one call.
+    Takes start_times, or range_start, range_end and step_minutes.
+    """
+    availability = await manager.find_available_restaurants_by_slot(batch_request)
+    return [
+        SlotAvailabilityResponse(start_time=start_time, restaurants=[
+            RestaurantResponse(id=result.id, restaurant_name=result.name) for result in results
+        ])
+        for start_time, results in availability
+    ]
+
+
+@app.get("/diners/{diner_id}/reservations/history", status_code=status.HTTP_200_OK)
+async def diner_reservation_history(diner_id: int, before: Optional[datetime] = None,
+                                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                    manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """
+    A diner's reservations that have ended, newest first, including those moved to the archive.
+    Pass next_before back as before for the following page.
+    """
+    reservations, next_before = await manager.diner_history(diner_id, before=before, limit=limit)
+    return ReservationHistoryResponse(
+        reservations=[PastReservationResponse(id=reservation.id, restaurant_id=reservation.restaurant_id,
+                                              start_time=reservation.start_datetime, end_time=reservation.end_datetime,
+                                              archived=reservation.archived)
+                      for reservation in reservations],
+        next_before=next_before
+    )
+
+
+@app.get("/restaurants/{restaurant_id}/occupancy", status_code=status.HTTP_200_OK)
+async def restaurant_occupancy(restaurant_id: int, start_date: date, end_date: Optional[date] = None,
+                               manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """
+    Booked and free tables per capacity for every booked hour of a restaurant, from start_date to
+    end_date inclusive (start_date alone by default), up to 31 days.
+    """
+    tables, slots = await manager.restaurant_occupancy(restaurant_id, start_date, end_date or start_date)
+    return RestaurantOccupancyResponse(
+        restaurant_id=restaurant_id, tables=tables,
+        slots=[HourOccupancyResponse(day=slot.day, hour=slot.hour, capacity=slot.capacity, tables=slot.tables,
+                                     booked=slot.booked, free=slot.free)
+               for slot in slots]
+    )
+
+
 @app.post("/book_restaurant/", status_code=status.HTTP_201_CREATED)
-def book_table(available_reservation_request: AvailableReservationRequest):
+async def book_table(available_reservation_request: AvailableReservationRequest,
+                     manager: AsyncReservationManager = Depends(get_reservation_manager)):
     """
     Endpoint that creates a reservation for a group of users. This will always be called
     after the search endpoint above.
+    Returns 409 if a diner already holds an overlapping reservation.
     """
-    reservation = ReservationManager(session=live_session()).book_reservation(available_reservation_request=available_reservation_request)
+    reservation = await manager.book_reservation(available_reservation_request=available_reservation_request)
 
     if not reservation:
         raise HTTPException(status_code=404, detail="No available table found")
@@ -42,8 +330,42 @@ def book_table(available_reservation_request: AvailableReservationRequest):
     })
 
 
+@app.get("/search_cache/stats", status_code=status.HTTP_200_OK)
+async def search_cache_stats() -> Dict[str, int]:
+    """Hit, miss, eviction, expiration and invalidation counters of this process' search cache"""
+    if search_cache is None:
+        raise HTTPException(status_code=404, detail="Search cache is disabled")
+    return search_cache.stats()
+
+
 @app.delete("/reservation/{reservation_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_reservation(reservation_id):
+async def delete_reservation(reservation_id: int, manager: AsyncReservationManager = Depends(get_reservation_manager)):
     """Deletes a reservation by id"""
-    ReservationManager(session=live_session()).delete_reservation(reservation_id=reservation_id)
-    return {"ok": True}
\ No newline at end of file
+    await manager.delete_reservation(reservation_id=reservation_id)
+    return {"ok": True}
+
+
+@app.post("/reservations/cancel", status_code=status.HTTP_200_OK)
+async def cancel_reservations(cancel_request: CancelReservationsRequest,
+                              manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """
+    Cancels the given reservations in one transaction. Returns the ids cancelled, unknown ones are
+    left out rather than failing the rest.
+    """
+    return CancellationResponse(reservation_ids=await manager.cancel_reservations(cancel_request.reservation_ids))
+
+
+@app.delete("/restaurants/{restaurant_id}/reservations", status_code=status.HTTP_200_OK)
+async def cancel_restaurant_reservations(restaurant_id: int, start_time: datetime, end_time: datetime,
+                                         manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """Cancels every reservation of the restaurant overlapping start_time to end_time, e.g. when it closes"""
+    return CancellationResponse(
+        reservation_ids=await manager.cancel_restaurant_reservations(restaurant_id, start_time, end_time)
+    )
+
+
+@app.delete("/diners/{diner_id}/reservations", status_code=status.HTTP_200_OK)
+async def cancel_diner_reservations(diner_id: int, after: Optional[datetime] = None,
+                                    manager: AsyncReservationManager = Depends(get_reservation_manager)):
+    """Cancels the diner's reservations, with after only those that have not ended by then"""
+    return CancellationResponse(reservation_ids=await manager.cancel_diner_reservations(diner_id, after=after))
@@ -0,0 +1,58 @@
+from typing import AsyncIterator
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from .config import DatabaseSettings, database_settings
+from .db import apply_sqlite_pragmas
+
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(url: str) -> str:
+    """The same database through its asyncio driver, sqlite:///x.db becomes sqlite+aiosqlite:///x.db"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None or parsed.drivername == driver:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def create_async_db_engine(settings: DatabaseSettings, read_only: bool = False) -> AsyncEngine:
+    engine = create_async_engine(async_url(settings.url), **settings.engine_kwargs())
+    apply_sqlite_pragmas(engine.sync_engine, settings, read_only)
+    return engine
+
+
+# The request path's engines, over the same database and pool settings as models.db.db_engine and
+# models.db.db_read_engine. Scripts such as populate_db keep using the sync engine.
+async_db_engine = create_async_db_engine(database_settings)
+AsyncSessionLocal = async_sessionmaker(bind=async_db_engine, expire_on_commit=False)
+async_read_engine = (create_async_db_engine(database_settings.for_reads(), read_only=True)
+                     if database_settings.separate_reads else async_db_engine)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, expire_on_commit=False)
+
+
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency, the async twin of models.db.get_session"""
+    session = AsyncSessionLocal()
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def get_async_read_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency like get_async_session, on the read engine"""
+    session = AsyncReadSessionLocal()
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
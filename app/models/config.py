@@ -0,0 +1,250 @@
+import os
+from dataclasses import dataclass, replace
+from typing import List
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+SQLITE_JOURNAL_MODES = ('', 'delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SQLITE_SYNCHRONOUS = ('', 'off', 'normal', 'full', 'extra')
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    """
+    Engine and pool configuration, read from BOOKING_DB_* environment variables.
+
+    Searches go to a read engine: read_url when set (a replica), otherwise a second pool on url whose
+    SQLite connections are query_only. Under WAL its readers keep reading while a booking writes.
+    The journal_mode, synchronous and busy_timeout pragmas are applied to every new SQLite connection,
+    an empty journal_mode or synchronous leaves the database's own.
+    """
+    url: str = 'sqlite:///booking-system.db'
+    read_url: str = ''
+    echo: bool = False
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: int = 30
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    journal_mode: str = 'wal'
+    # NORMAL only syncs at checkpoints under WAL, a power loss may drop the last commits but never corrupts
+    synchronous: str = 'normal'
+    busy_timeout_ms: int = 5000
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        journal_mode = os.environ.get('BOOKING_DB_JOURNAL_MODE', cls.journal_mode).strip().lower()
+        if journal_mode not in SQLITE_JOURNAL_MODES:
+            raise ValueError(f"BOOKING_DB_JOURNAL_MODE must be one of {SQLITE_JOURNAL_MODES}, got {journal_mode!r}")
+        synchronous = os.environ.get('BOOKING_DB_SYNCHRONOUS', cls.synchronous).strip().lower()
+        if synchronous not in SQLITE_SYNCHRONOUS:
+            raise ValueError(f"BOOKING_DB_SYNCHRONOUS must be one of {SQLITE_SYNCHRONOUS}, got {synchronous!r}")
+        return cls(
+            url=os.environ.get('BOOKING_DB_URL', cls.url),
+            read_url=os.environ.get('BOOKING_DB_READ_URL', cls.read_url),
+            echo=_env_bool('BOOKING_DB_ECHO', cls.echo),
+            pool_size=_env_int('BOOKING_DB_POOL_SIZE', cls.pool_size),
+            max_overflow=_env_int('BOOKING_DB_MAX_OVERFLOW', cls.max_overflow),
+            pool_timeout=_env_int('BOOKING_DB_POOL_TIMEOUT', cls.pool_timeout),
+            pool_recycle=_env_int('BOOKING_DB_POOL_RECYCLE', cls.pool_recycle),
+            pool_pre_ping=_env_bool('BOOKING_DB_POOL_PRE_PING', cls.pool_pre_ping),
+            journal_mode=journal_mode,
+            synchronous=synchronous,
+            busy_timeout_ms=_env_int('BOOKING_DB_BUSY_TIMEOUT_MS', cls.busy_timeout_ms),
+        )
+
+    @property
+    def is_sqlite_memory(self) -> bool:
+        return self.url.startswith('sqlite') and (':memory:' in self.url or self.url.rstrip('/') == 'sqlite:')
+
+    @property
+    def separate_reads(self) -> bool:
+        """An in-memory database is private to its connection, reads can only share the write engine"""
+        return bool(self.read_url) or not self.is_sqlite_memory
+
+    def for_reads(self) -> "DatabaseSettings":
+        """The settings of the read engine"""
+        return replace(self, url=self.read_url or self.url, read_url='')
+
+    def sqlite_pragmas(self, read_only: bool = False) -> List[str]:
+        """PRAGMA statements for a new connection, the busy timeout first so the others wait for locks"""
+        pragmas = [f'busy_timeout = {int(self.busy_timeout_ms)}']
+        # Switching journal mode needs a write lock and is persisted in the file, that is the writer's job
+        if self.journal_mode and not read_only:
+            pragmas.append(f'journal_mode = {self.journal_mode}')
+        if self.synchronous:
+            pragmas.append(f'synchronous = {self.synchronous}')
+        if read_only:
+            pragmas.append('query_only = ON')
+        return pragmas
+
+    def engine_kwargs(self) -> dict:
+        kwargs = {'echo': self.echo, 'pool_pre_ping': self.pool_pre_ping}
+        # In-memory SQLite uses a singleton connection pool that takes no sizing arguments
+        if not self.is_sqlite_memory:
+            kwargs.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+                pool_recycle=self.pool_recycle,
+            )
+        return kwargs
+
+
+database_settings = DatabaseSettings.from_env()
+
+
+SEARCH_BACKENDS = ('sql', 'index')
+
+
+@dataclass(frozen=True)
+class SearchSettings:
+    """How find_available_restaurant is answered, read from BOOKING_SEARCH_* environment variables"""
+    backend: str = 'sql'
+    # Result cache in front of the backend, off while cache_entries is 0
+    cache_entries: int = 0
+    cache_ttl_seconds: float = 30.0
+    cache_bucket_minutes: int = 1
+    # SQL searches skip restaurants restaurant_occupancy shows full before checking their tables
+    occupancy_prefilter: bool = False
+
+    @classmethod
+    def from_env(cls) -> "SearchSettings":
+        backend = os.environ.get('BOOKING_SEARCH_BACKEND', cls.backend).strip().lower()
+        if backend not in SEARCH_BACKENDS:
+            raise ValueError(f"BOOKING_SEARCH_BACKEND must be one of {SEARCH_BACKENDS}, got {backend!r}")
+        return cls(
+            backend=backend,
+            cache_entries=_env_int('BOOKING_SEARCH_CACHE_ENTRIES', cls.cache_entries),
+            cache_ttl_seconds=_env_float('BOOKING_SEARCH_CACHE_TTL_SECONDS', cls.cache_ttl_seconds),
+            cache_bucket_minutes=_env_int('BOOKING_SEARCH_CACHE_BUCKET_MINUTES', cls.cache_bucket_minutes),
+            occupancy_prefilter=_env_bool('BOOKING_SEARCH_OCCUPANCY_PREFILTER', cls.occupancy_prefilter),
+        )
+
+
+search_settings = SearchSettings.from_env()
+
+
+ALLOCATION_STRATEGIES = ('smallest', 'fit', 'repack')
+
+
+@dataclass(frozen=True)
+class BookingSettings:
+    """
+    How book_reservation picks a table, read from BOOKING_ALLOCATION (see reservations.allocation),
+    and whether double-booking checks use an in-memory diner schedule, from BOOKING_DINER_SCHEDULE
+    """
+    allocation: str = 'smallest'
+    diner_schedule: bool = False
+    # Diner windows ending this many days ago or earlier are left to SQL
+    diner_schedule_days: int = 1
+    # Bookings and deletions through one writer per process, up to write_batch_size per commit
+    write_queue: bool = False
+    write_batch_size: int = 64
+
+    @classmethod
+    def from_env(cls) -> "BookingSettings":
+        allocation = os.environ.get('BOOKING_ALLOCATION', cls.allocation).strip().lower()
+        if allocation not in ALLOCATION_STRATEGIES:
+            raise ValueError(f"BOOKING_ALLOCATION must be one of {ALLOCATION_STRATEGIES}, got {allocation!r}")
+        write_batch_size = _env_int('BOOKING_WRITE_BATCH_SIZE', cls.write_batch_size)
+        if write_batch_size < 1:
+            raise ValueError(f"BOOKING_WRITE_BATCH_SIZE must be at least 1, got {write_batch_size}")
+        return cls(
+            allocation=allocation,
+            diner_schedule=_env_bool('BOOKING_DINER_SCHEDULE', cls.diner_schedule),
+            diner_schedule_days=_env_int('BOOKING_DINER_SCHEDULE_DAYS', cls.diner_schedule_days),
+            write_queue=_env_bool('BOOKING_WRITE_QUEUE', cls.write_queue),
+            write_batch_size=write_batch_size,
+        )
+
+
+booking_settings = BookingSettings.from_env()
+
+
+@dataclass(frozen=True)
+class ArchiveSettings:
+    """The background job moving past reservations to the archive tables, read from BOOKING_ARCHIVE_*"""
+    # Off while 0, otherwise seconds between runs
+    interval_seconds: float = 0.0
+    # Reservations that ended more than this many days ago are archived
+    retention_days: int = 1
+    batch_size: int = 2000
+
+    @classmethod
+    def from_env(cls) -> "ArchiveSettings":
+        return cls(
+            interval_seconds=_env_float('BOOKING_ARCHIVE_INTERVAL_SECONDS', cls.interval_seconds),
+            retention_days=_env_int('BOOKING_ARCHIVE_RETENTION_DAYS', cls.retention_days),
+            batch_size=_env_int('BOOKING_ARCHIVE_BATCH_SIZE', cls.batch_size),
+        )
+
+
+archive_settings = ArchiveSettings.from_env()
+
+
+@dataclass(frozen=True)
+class ReferenceDataSettings:
+    """
+    The in-memory snapshot of restaurants, tables and diner restrictions (see reservations.reference_data),
+    read from BOOKING_REFERENCE_DATA and BOOKING_REFERENCE_DATA_REFRESH_SECONDS
+    """
+    enabled: bool = False
+    # Off while 0, otherwise seconds between checks of the reference tables, rebuilding when they changed
+    refresh_seconds: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "ReferenceDataSettings":
+        return cls(
+            enabled=_env_bool('BOOKING_REFERENCE_DATA', cls.enabled),
+            refresh_seconds=_env_float('BOOKING_REFERENCE_DATA_REFRESH_SECONDS', cls.refresh_seconds),
+        )
+
+
+reference_data_settings = ReferenceDataSettings.from_env()
+
+
+@dataclass(frozen=True)
+class ChangeFeedSettings:
+    """
+    Keeping each worker's index, schedule, search cache and reference snapshot in step with the writes of
+    every worker on the database (see reservations.change_feed), read from BOOKING_CHANGE_FEED_*
+    """
+    # Needed as soon as several processes with in-memory structures share one database
+    enabled: bool = False
+    # An idle worker still catches up this often, so it never falls behind the pruned log
+    poll_seconds: float = 1.0
+    # Changes kept in reservation_changes, pruned every prune_seconds and by the archive job
+    retention: int = 100_000
+    prune_seconds: float = 3600.0
+
+    @classmethod
+    def from_env(cls) -> "ChangeFeedSettings":
+        retention = _env_int('BOOKING_CHANGE_FEED_RETENTION', cls.retention)
+        if retention < 1:
+            raise ValueError(f"BOOKING_CHANGE_FEED_RETENTION must be at least 1, got {retention}")
+        return cls(
+            enabled=_env_bool('BOOKING_CHANGE_FEED', cls.enabled),
+            poll_seconds=_env_float('BOOKING_CHANGE_FEED_POLL_SECONDS', cls.poll_seconds),
+            retention=retention,
+            prune_seconds=_env_float('BOOKING_CHANGE_FEED_PRUNE_SECONDS', cls.prune_seconds),
+        )
+
+
+change_feed_settings = ChangeFeedSettings.from_env()
@@ -1,35 +1,102 @@
-from sqlalchemy import Column, ForeignKey, Integer, Float, Sequence, String, Table, create_engine, DateTime
-from sqlalchemy.ext.declarative import declarative_base
+import random
+from typing import Iterator, List, Tuple
+from sqlalchemy import DDL, Column, Date, ForeignKey, Index, Integer, Float, MetaData, Sequence, String, Table, create_engine, DateTime, event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm.session import Session
 
+from .config import DatabaseSettings, database_settings
 
-db_engine = create_engine('sqlite:///booking-system.db', echo = True)
+
+def apply_sqlite_pragmas(engine: Engine, settings: DatabaseSettings, read_only: bool = False) -> None:
+    """Run the settings' pragmas on every connection the engine opens, other databases are left alone"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = settings.sqlite_pragmas(read_only)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(f'PRAGMA {pragma}')
+        finally:
+            cursor.close()
+
+
+def create_db_engine(settings: DatabaseSettings, read_only: bool = False) -> Engine:
+    engine = create_engine(settings.url, **settings.engine_kwargs())
+    apply_sqlite_pragmas(engine, settings, read_only)
+    return engine
+
+
+# One engine and session factory per process, sessions are cheap, engines and pools are not.
+# Searches read through their own pool, which is the write engine when reads cannot be separated.
+db_engine = create_db_engine(database_settings)
+SessionLocal = sessionmaker(bind=db_engine, future=True)
+db_read_engine = (create_db_engine(database_settings.for_reads(), read_only=True)
+                  if database_settings.separate_reads else db_engine)
+ReadSessionLocal = sessionmaker(bind=db_read_engine, future=True)
 Base = declarative_base()
 
-def live_session():
-    Session = sessionmaker(bind=db_engine, future=True)
-    session = Session()
-    return session
+def live_session() -> Session:
+    """A session for scripts, the caller is responsible for closing it"""
+    return SessionLocal()
+
+
+def get_session() -> Iterator[Session]:
+    """
+    FastAPI dependency yielding one session per request.
+    Rolls back if the request failed and always closes, returning the connection to the pool.
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_read_session() -> Iterator[Session]:
+    """FastAPI dependency like get_session, on the read engine"""
+    session = ReadSessionLocal()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 
 # Association Tables
+# Composite primary keys double as the index for lookups by their leading column
 diner_dietary_restriction_association = Table(
     'diner_dietary_restriction', Base.metadata,
-    Column('diner_id', Integer, ForeignKey('diners.id')),
-    Column('dietary_restriction_id', Integer, ForeignKey('dietary_restrictions.id'))
+    Column('diner_id', Integer, ForeignKey('diners.id'), primary_key=True),
+    Column('dietary_restriction_id', Integer, ForeignKey('dietary_restrictions.id'), primary_key=True)
 )
 
 restaurant_dietary_restriction_association = Table(
     'restaurant_dietary_restriction', Base.metadata,
-    Column('restaurant_id', Integer, ForeignKey('restaurants.id')),
-    Column('dietary_restriction_id', Integer, ForeignKey('dietary_restrictions.id'))
+    Column('restaurant_id', Integer, ForeignKey('restaurants.id'), primary_key=True),
+    Column('dietary_restriction_id', Integer, ForeignKey('dietary_restrictions.id'), primary_key=True)
 )
 
 diner_reservation_association = Table(
     'diner_reservation', Base.metadata,
-    Column('diner_id', Integer, ForeignKey('diners.id')),
-    Column('reservation_id', Integer, ForeignKey('reservations.id'))
+    Column('diner_id', Integer, ForeignKey('diners.id'), primary_key=True),
+    Column('reservation_id', Integer, ForeignKey('reservations.id'), primary_key=True),
+    # Copies of the reservation's window, kept in step by DINER_WINDOW_TRIGGERS
+    Column('start_datetime', DateTime(), nullable=True),
+    Column('end_datetime', DateTime(), nullable=True),
+    # Loading and deleting a reservation's diners goes by reservation id
+    Index('ix_diner_reservation_reservation_id', 'reservation_id', 'diner_id'),
+    # Double-booking checks: a diner's reservations ending after a window starts are a seek, not their whole history
+    Index('ix_diner_reservation_diner_window', 'diner_id', 'end_datetime', 'start_datetime')
 )
 
 class Diner(Base):
@@ -38,6 +105,8 @@ class Diner(Base):
     name = Column(String(50), unique=True)
     home_latitude = Column(Float(150), nullable=True)
     home_longitude = Column(Float(50), nullable=True)
+    # One bit per dietary restriction (see restriction_bit), kept in step by RESTRICTION_MASK_TRIGGERS
+    dietary_restriction_mask = Column(Integer, nullable=False, default=0, server_default='0')
     dietary_restrictions = relationship(
         'DietaryRestriction',
         secondary=diner_dietary_restriction_association,
@@ -57,6 +126,10 @@ class Restaurant(Base):
     __tablename__ = 'restaurants'
     id = Column(Integer, primary_key=True)
     name = Column(String(50), unique=True)
+    dietary_restriction_mask = Column(Integer, nullable=False, default=0, server_default='0')
+    # Degrees, NULL until geocoded; indexed by restaurant_locations (see LOCATION_INDEX)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
     dietary_restrictions = relationship(
         'DietaryRestriction', 
         secondary=restaurant_dietary_restriction_association, 
@@ -72,7 +145,18 @@ class RestaurantTable(Base):
     id = Column(Integer, primary_key=True)
     capacity = Column(Integer()) # In case we have 100
     restaurant_id = Column(Integer, ForeignKey('restaurants.id'), nullable=False)
-    
+    # Tables of a restaurant sharing a group can be pushed together for one party, NULL never combines
+    combination_group = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Booking picks the smallest table of a restaurant that seats the group,
+        # search walks it as a covering index grouped by restaurant
+        Index('ix_restaurant_tables_restaurant_capacity', 'restaurant_id', 'capacity'),
+        # Only the few combinable tables, for the combined capacity checks of search
+        Index('ix_restaurant_tables_combination', 'restaurant_id', 'combination_group', 'capacity',
+              sqlite_where=text('combination_group IS NOT NULL')),
+    )
+
     def __repr__(self):
         return f'RestaurantTable {self.id}: capacity: {self.capacity} with Restaurant {self.restaurant_id}'
 
@@ -82,15 +166,91 @@ class Reservation(Base):
     table_id = Column(Integer, ForeignKey('restaurant_tables.id'), nullable=False)
     start_datetime = Column(DateTime())
     end_datetime = Column(DateTime())
+    # Set on the rows holding the extra tables of a combined booking, pointing at the reservation with the diners
+    combined_with_id = Column(Integer, ForeignKey('reservations.id'), nullable=True)
     diners = relationship(
         'Diner', 
         secondary=diner_reservation_association, 
         back_populates='reservations'
     )
+
+    __table_args__ = (
+        # Overlap check for one table: table_id = ? AND start_datetime < ? AND end_datetime > ?
+        Index('ix_reservations_table_window', 'table_id', 'start_datetime', 'end_datetime'),
+        # Overlap check across all tables, bounded on start_datetime (see search.busy_table_ids)
+        Index('ix_reservations_window', 'start_datetime', 'end_datetime', 'table_id'),
+        # The holds of a combined booking, by the reservation they belong to
+        Index('ix_reservations_combined_with', 'combined_with_id', sqlite_where=text('combined_with_id IS NOT NULL')),
+        # Ids are never handed out again, archived reservations keep theirs (see reservations.archive)
+        {'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f'Reservation {self.id}: table: {self.table_id} from {self.start_datetime} to {self.end_datetime}'
 
 
+# Past reservations moved out of the hot tables by reservations.archive, queried only for history.
+# Rows keep their reservation id; no overlap guards, the windows are over.
+reservation_archive = Table(
+    'reservations_archive', Base.metadata,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('table_id', Integer, ForeignKey('restaurant_tables.id'), nullable=False),
+    Column('start_datetime', DateTime()),
+    Column('end_datetime', DateTime()),
+    Column('combined_with_id', Integer, nullable=True),
+    Column('archived_at', DateTime(), nullable=False),
+    Index('ix_reservations_archive_window', 'start_datetime', 'end_datetime'),
+    # The occupancy triggers' check for another reservation of the table in an hour, as on reservations
+    Index('ix_reservations_archive_table_window', 'table_id', 'start_datetime', 'end_datetime'),
+)
+
+diner_reservation_archive = Table(
+    'diner_reservation_archive', Base.metadata,
+    Column('diner_id', Integer, ForeignKey('diners.id'), primary_key=True),
+    Column('reservation_id', Integer, ForeignKey('reservations_archive.id'), primary_key=True),
+    Column('start_datetime', DateTime()),
+    Column('end_datetime', DateTime()),
+    # A diner's history, newest first
+    Index('ix_diner_reservation_archive_diner_window', 'diner_id', 'end_datetime'),
+)
+
+
+# Tables booked per restaurant, day, hour and table capacity, kept by OCCUPANCY_TRIGGERS below: a table
+# counts once in every hour its reservations touch, archived ones included. Only hours with a booking have
+# a row, the free tables of an hour are the restaurant's tables of that capacity less booked_tables.
+restaurant_occupancy = Table(
+    'restaurant_occupancy', Base.metadata,
+    Column('restaurant_id', Integer, ForeignKey('restaurants.id'), primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('hour', Integer, primary_key=True),
+    Column('capacity', Integer, primary_key=True),
+    Column('booked_tables', Integer, nullable=False),
+)
+
+
+# One row per committed change to table availability or diner windows, and a marker for reference data,
+# written by CHANGE_LOG_TRIGGERS below inside the writer's own transaction, whichever process it runs in.
+# The triggers only exist while the deployment runs a change feed (see change_feed.install_change_log). The id is
+# the database's change version: every process applies the rows past the last one it has seen to its
+# in-memory structures (see reservations.change_feed). AUTOINCREMENT, so pruned ids are never reused; the
+# last pruned row is kept as a 'pruned' row telling the feeds behind it what they lost.
+CHANGE_BOOKED, CHANGE_RELEASED = 'booked', 'released'
+CHANGE_DINER_BOOKED, CHANGE_DINER_RELEASED = 'diner_booked', 'diner_released'
+CHANGE_REFERENCE, CHANGE_PRUNED = 'reference', 'pruned'
+
+reservation_changes = Table(
+    'reservation_changes', Base.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('kind', String(16), nullable=False),
+    Column('restaurant_id', Integer),
+    Column('table_id', Integer),
+    Column('diner_id', Integer),
+    Column('start_datetime', DateTime()),
+    Column('end_datetime', DateTime()),
+    sqlite_autoincrement=True,
+)
+
+
 class DietaryRestriction(Base):
     __tablename__ = 'dietary_restrictions'
     id = Column(Integer, primary_key=True)
@@ -110,3 +270,373 @@ class DietaryRestriction(Base):
 
     def __repr__(self):
         return f'Dietary Restriction {self.id}: {self.name}'
+
+
+# Overlap guards, SQLite has no exclusion constraints so triggers abort any write that would
+# double book a table or give a diner two overlapping reservations, whichever code path issued it
+TABLE_OVERLAP_MESSAGE = 'table already booked for an overlapping window'
+DINER_OVERLAP_MESSAGE = 'diner already has an overlapping reservation'
+
+OVERLAP_GUARDS = [
+    (Reservation.__table__, DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_table_overlap_insert_guard
+        BEFORE INSERT ON reservations
+        WHEN EXISTS (
+            SELECT 1 FROM reservations AS booked
+            WHERE booked.table_id = NEW.table_id
+              AND booked.start_datetime < NEW.end_datetime
+              AND booked.end_datetime > NEW.start_datetime
+        )
+        BEGIN SELECT RAISE(ABORT, '{TABLE_OVERLAP_MESSAGE}'); END
+    """)),
+    (Reservation.__table__, DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_table_overlap_update_guard
+        BEFORE UPDATE OF table_id, start_datetime, end_datetime ON reservations
+        WHEN EXISTS (
+            SELECT 1 FROM reservations AS booked
+            WHERE booked.table_id = NEW.table_id
+              AND booked.id != NEW.id
+              AND booked.start_datetime < NEW.end_datetime
+              AND booked.end_datetime > NEW.start_datetime
+        )
+        BEGIN SELECT RAISE(ABORT, '{TABLE_OVERLAP_MESSAGE}'); END
+    """)),
+    (diner_reservation_association, DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS diner_reservation_overlap_guard
+        BEFORE INSERT ON diner_reservation
+        WHEN EXISTS (
+            SELECT 1 FROM reservations AS new_reservation
+            JOIN diner_reservation AS held ON held.diner_id = NEW.diner_id
+            WHERE new_reservation.id = NEW.reservation_id
+              AND held.reservation_id != new_reservation.id
+              AND held.end_datetime > new_reservation.start_datetime
+              AND held.start_datetime < new_reservation.end_datetime
+        )
+        BEGIN SELECT RAISE(ABORT, '{DINER_OVERLAP_MESSAGE}'); END
+    """)),
+]
+
+for guarded_table, guard in OVERLAP_GUARDS:
+    event.listen(guarded_table, 'after_create', guard.execute_if(dialect='sqlite'))
+
+
+# Each diner_reservation row carries its reservation's window, filled in when a link is inserted without
+# one (ORM relationship writes) and followed when a reservation is moved in time
+DINER_WINDOW_TRIGGERS = [
+    (diner_reservation_association, DDL("""
+        CREATE TRIGGER IF NOT EXISTS diner_reservation_window_insert
+        AFTER INSERT ON diner_reservation
+        WHEN NEW.start_datetime IS NULL
+        BEGIN
+            UPDATE diner_reservation SET
+                start_datetime = (SELECT start_datetime FROM reservations WHERE id = NEW.reservation_id),
+                end_datetime = (SELECT end_datetime FROM reservations WHERE id = NEW.reservation_id)
+            WHERE diner_id = NEW.diner_id AND reservation_id = NEW.reservation_id;
+        END
+    """)),
+    # Created with diner_reservation, which comes after reservations
+    (diner_reservation_association, DDL("""
+        CREATE TRIGGER IF NOT EXISTS reservations_diner_window_update
+        AFTER UPDATE OF start_datetime, end_datetime ON reservations
+        WHEN OLD.start_datetime IS NOT NEW.start_datetime OR OLD.end_datetime IS NOT NEW.end_datetime
+        BEGIN
+            UPDATE diner_reservation SET start_datetime = NEW.start_datetime, end_datetime = NEW.end_datetime
+            WHERE reservation_id = NEW.id;
+        END
+    """)),
+]
+
+for windowed_table, trigger in DINER_WINDOW_TRIGGERS:
+    event.listen(windowed_table, 'after_create', trigger.execute_if(dialect='sqlite'))
+
+
+# Restriction masks, each diner and restaurant carries the OR of restriction_bit over its restrictions
+# so "restaurant satisfies group" is restaurant_mask & group_mask == group_mask. The triggers keep the
+# masks in step with the association tables, for ORM writes and bulk Core inserts alike.
+def restriction_bit(restriction_id: int) -> int:
+    return 1 << (restriction_id - 1)
+
+
+def _restriction_mask_triggers(association: Table, owner: str, owner_column: str) -> list:
+    return [
+        (association, DDL(f"""
+            CREATE TRIGGER IF NOT EXISTS {association.name}_mask_insert
+            AFTER INSERT ON {association.name}
+            BEGIN
+                UPDATE {owner} SET dietary_restriction_mask = dietary_restriction_mask | (1 << (NEW.dietary_restriction_id - 1))
+                WHERE id = NEW.{owner_column};
+            END
+        """)),
+        (association, DDL(f"""
+            CREATE TRIGGER IF NOT EXISTS {association.name}_mask_delete
+            AFTER DELETE ON {association.name}
+            BEGIN
+                UPDATE {owner} SET dietary_restriction_mask = dietary_restriction_mask & ~(1 << (OLD.dietary_restriction_id - 1))
+                WHERE id = OLD.{owner_column};
+            END
+        """)),
+    ]
+
+
+RESTRICTION_MASK_TRIGGERS = (
+    _restriction_mask_triggers(diner_dietary_restriction_association, 'diners', 'diner_id')
+    + _restriction_mask_triggers(restaurant_dietary_restriction_association, 'restaurants', 'restaurant_id')
+)
+
+for masked_table, trigger in RESTRICTION_MASK_TRIGGERS:
+    event.listen(masked_table, 'after_create', trigger.execute_if(dialect='sqlite'))
+
+
+# Restaurant locations in an SQLite R*Tree, a point per restaurant as a zero sized box, so proximity
+# searches seek the restaurants inside a bounding box instead of scanning them all. The triggers keep
+# it in step with restaurants.latitude and longitude; restaurants without a location stay out of it.
+# Not part of Base.metadata, create_all would make it a plain table, this Table only builds queries.
+restaurant_locations = Table(
+    'restaurant_locations', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('min_latitude', Float), Column('max_latitude', Float),
+    Column('min_longitude', Float), Column('max_longitude', Float),
+)
+
+# (latitude range, longitude range) of Mexico City, where the seed diners live
+CITY_AREA = ((19.30, 19.50), (-99.25, -99.05))
+
+
+def placeholder_location(name: str, area: tuple = CITY_AREA) -> Tuple[float, float]:
+    """
+    A stable point in the area, seeded by the restaurant's name. The seed CSV has restaurant names but
+    no addresses to geocode, so restaurants without a Location column are placed where the diners live.
+    """
+    rng = random.Random(name)
+    (min_latitude, max_latitude), (min_longitude, max_longitude) = area
+    return rng.uniform(min_latitude, max_latitude), rng.uniform(min_longitude, max_longitude)
+
+
+LOCATION_INDEX = [
+    DDL("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS restaurant_locations
+        USING rtree(id, min_latitude, max_latitude, min_longitude, max_longitude)
+    """),
+    DDL("""
+        CREATE TRIGGER IF NOT EXISTS restaurants_location_insert
+        AFTER INSERT ON restaurants
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT INTO restaurant_locations VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+    """),
+    DDL("""
+        CREATE TRIGGER IF NOT EXISTS restaurants_location_update
+        AFTER UPDATE OF latitude, longitude ON restaurants
+        BEGIN
+            DELETE FROM restaurant_locations WHERE id = OLD.id;
+            INSERT INTO restaurant_locations
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+    """),
+    DDL("""
+        CREATE TRIGGER IF NOT EXISTS restaurants_location_delete
+        AFTER DELETE ON restaurants
+        BEGIN
+            DELETE FROM restaurant_locations WHERE id = OLD.id;
+        END
+    """),
+]
+
+for location_ddl in LOCATION_INDEX:
+    event.listen(Restaurant.__table__, 'after_create', location_ddl.execute_if(dialect='sqlite'))
+# Dropped with restaurants, or a recreated schema would find the old locations
+event.listen(Restaurant.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS restaurant_locations').execute_if(dialect='sqlite'))
+
+
+# restaurant_occupancy follows every write to reservations. A reservation touches the hour slots from
+# its start's hour up to its end; in each, its table is counted unless another of the table's
+# reservations, live or archived, already touches that slot. Archiving moves a reservation rather than
+# releasing its table, so a row deleted once copied to reservations_archive keeps its hours counted.
+# Slots are written as SQLAlchemy stores DateTime, so they compare with the stored windows as strings,
+# and reservations are assumed to last under a day.
+OCCUPANCY_SLOT_FORMAT = '%Y-%m-%d %H:00:00.000000'
+OCCUPANCY_MAX_HOURS = 24
+_OCCUPANCY_OFFSETS = '[' + ','.join(str(offset) for offset in range(OCCUPANCY_MAX_HOURS + 1)) + ']'
+
+
+def _percent(sql: str, escape: bool) -> str:
+    """DDL() formats its statement, so a literal % is doubled there and left alone in text()"""
+    return sql.replace('%', '%%') if escape else sql
+
+
+# Live and archived reservations, what the rebuild counts
+_OCCUPANCY_RESERVATIONS = (
+    "(SELECT table_id, start_datetime, end_datetime FROM reservations "
+    "UNION ALL SELECT table_id, start_datetime, end_datetime FROM reservations_archive) AS reservations, "
+)
+
+
+def _occupancy_slots(reservation: str, escape: bool, rebuild: bool = False) -> str:
+    """
+    Subquery of (restaurant_id, capacity, table_id, slot) for every hour slot `reservation` touches,
+    the trigger's NEW or OLD row, or with rebuild every live and archived reservation
+    """
+    slot = _percent(f"strftime('{OCCUPANCY_SLOT_FORMAT}', {reservation}.start_datetime, '+' || offsets.value || ' hours')", escape)
+    return f"""(
+        SELECT tables.restaurant_id AS restaurant_id, tables.capacity AS capacity, tables.id AS table_id, {slot} AS slot
+        FROM {_OCCUPANCY_RESERVATIONS if rebuild else ''}restaurant_tables AS tables, json_each('{_OCCUPANCY_OFFSETS}') AS offsets
+        WHERE tables.id = {reservation}.table_id AND {slot} < {reservation}.end_datetime
+    ) AS slots"""
+
+
+def _occupancy_key(escape: bool) -> str:
+    return _percent("slots.restaurant_id, date(slots.slot), CAST(strftime('%H', slots.slot) AS INTEGER), slots.capacity", escape)
+
+
+def _sole_occupancy_slots(row: str) -> str:
+    """The (restaurant_id, day, hour, capacity) slots where the trigger's `row` is its table's only reservation"""
+    slot_format = _percent(OCCUPANCY_SLOT_FORMAT, True)
+    others = " AND ".join(f"""NOT EXISTS (
+            SELECT 1 FROM {table} AS other
+            WHERE other.table_id = {row}.table_id AND other.id != {row}.id
+              AND other.start_datetime < strftime('{slot_format}', slots.slot, '+1 hours')
+              AND other.start_datetime > strftime('{slot_format}', slots.slot, '-{OCCUPANCY_MAX_HOURS} hours')
+              AND other.end_datetime > slots.slot
+        )""" for table in ('reservations', 'reservations_archive'))
+    return f"""
+        SELECT {_occupancy_key(True)}
+        FROM {_occupancy_slots(row, True)}
+        WHERE {others}
+    """
+
+
+def _occupancy_booked(row: str) -> str:
+    return f"""
+        INSERT INTO restaurant_occupancy (restaurant_id, day, hour, capacity, booked_tables)
+        SELECT *, 1 FROM ({_sole_occupancy_slots(row)}) WHERE true
+        ON CONFLICT (restaurant_id, day, hour, capacity) DO UPDATE SET booked_tables = booked_tables + 1;
+    """
+
+
+def _occupancy_released(row: str) -> str:
+    return f"""
+        UPDATE restaurant_occupancy SET booked_tables = booked_tables - 1
+        WHERE (restaurant_id, day, hour, capacity) IN ({_sole_occupancy_slots(row)});
+        DELETE FROM restaurant_occupancy
+        WHERE booked_tables <= 0 AND (restaurant_id, day, hour, capacity) IN ({_sole_occupancy_slots(row)});
+    """
+
+
+OCCUPANCY_TRIGGERS = [
+    DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_occupancy_insert
+        AFTER INSERT ON reservations
+        BEGIN {_occupancy_booked('NEW')} END
+    """),
+    DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_occupancy_delete
+        AFTER DELETE ON reservations
+        WHEN NOT EXISTS (SELECT 1 FROM reservations_archive WHERE id = OLD.id)
+        BEGIN {_occupancy_released('OLD')} END
+    """),
+    DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_occupancy_update
+        AFTER UPDATE OF table_id, start_datetime, end_datetime ON reservations
+        BEGIN {_occupancy_released('OLD')} {_occupancy_booked('NEW')} END
+    """),
+]
+
+# Every slot of every live and archived reservation counted at once, what the triggers add up to one row at a time
+OCCUPANCY_REBUILD = [
+    text('DELETE FROM restaurant_occupancy'),
+    text(f"""
+        INSERT INTO restaurant_occupancy (restaurant_id, day, hour, capacity, booked_tables)
+        SELECT {_occupancy_key(False)}, count(DISTINCT slots.table_id)
+        FROM {_occupancy_slots('reservations', False, rebuild=True)}
+        GROUP BY 1, 2, 3, 4
+    """),
+]
+
+# Created with reservations; the bodies name restaurant_occupancy, which SQLite resolves when they run
+for occupancy_trigger in OCCUPANCY_TRIGGERS:
+    event.listen(Reservation.__table__, 'after_create', occupancy_trigger.execute_if(dialect='sqlite'))
+
+
+# reservation_changes follows reservations, diner links and the reference tables. A moved reservation is
+# logged as released from its old table and booked on the new one. Reference markers carry no details,
+# any of them makes a process reload what it keeps of the reference tables; consecutive reference changes,
+# a bulk load's included, leave a single marker, the latest, as the previous one is replaced.
+def _table_change(kind: str, row: str) -> str:
+    return f"""
+        INSERT INTO reservation_changes (kind, restaurant_id, table_id, start_datetime, end_datetime)
+        VALUES ('{kind}', (SELECT restaurant_id FROM restaurant_tables WHERE id = {row}.table_id),
+                {row}.table_id, {row}.start_datetime, {row}.end_datetime);
+    """
+
+
+def _diner_change(kind: str, row: str) -> str:
+    """Links inserted without their window get it from DINER_WINDOW_TRIGGERS, so it is read from the reservation"""
+    return f"""
+        INSERT INTO reservation_changes (kind, restaurant_id, diner_id, start_datetime, end_datetime)
+        SELECT '{kind}', restaurant_tables.restaurant_id, {row}.diner_id,
+               coalesce({row}.start_datetime, reservations.start_datetime),
+               coalesce({row}.end_datetime, reservations.end_datetime)
+        FROM reservations LEFT JOIN restaurant_tables ON restaurant_tables.id = reservations.table_id
+        WHERE reservations.id = {row}.reservation_id;
+    """
+
+
+def _reference_change(name: str, event_clause: str, table: str) -> Tuple[str, DDL]:
+    return name, DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS {name}
+        AFTER {event_clause} ON {table}
+        BEGIN
+            DELETE FROM reservation_changes
+            WHERE id = (SELECT max(id) FROM reservation_changes) AND kind = '{CHANGE_REFERENCE}';
+            INSERT INTO reservation_changes (kind) VALUES ('{CHANGE_REFERENCE}');
+        END
+    """)
+
+
+# (name, DDL), not created with the schema
+CHANGE_LOG_TRIGGERS: List[Tuple[str, DDL]] = [
+    ('reservations_change_insert', DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_change_insert
+        AFTER INSERT ON reservations
+        BEGIN {_table_change(CHANGE_BOOKED, 'NEW')} END
+    """)),
+    ('reservations_change_delete', DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_change_delete
+        AFTER DELETE ON reservations
+        BEGIN {_table_change(CHANGE_RELEASED, 'OLD')} END
+    """)),
+    ('reservations_change_update', DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS reservations_change_update
+        AFTER UPDATE OF table_id, start_datetime, end_datetime ON reservations
+        BEGIN {_table_change(CHANGE_RELEASED, 'OLD')} {_table_change(CHANGE_BOOKED, 'NEW')} END
+    """)),
+    ('diner_reservation_change_insert', DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS diner_reservation_change_insert
+        AFTER INSERT ON diner_reservation
+        BEGIN {_diner_change(CHANGE_DINER_BOOKED, 'NEW')} END
+    """)),
+    # Before the reservation row, which goes after its links
+    ('diner_reservation_change_delete', DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS diner_reservation_change_delete
+        AFTER DELETE ON diner_reservation
+        BEGIN {_diner_change(CHANGE_DINER_RELEASED, 'OLD')} END
+    """)),
+    # A reservation moved in time; not the window filled in on insert, logged with the insert already
+    ('diner_reservation_change_update', DDL(f"""
+        CREATE TRIGGER IF NOT EXISTS diner_reservation_change_update
+        AFTER UPDATE OF start_datetime, end_datetime ON diner_reservation
+        WHEN OLD.start_datetime IS NOT NULL
+         AND (OLD.start_datetime IS NOT NEW.start_datetime OR OLD.end_datetime IS NOT NEW.end_datetime)
+        BEGIN {_diner_change(CHANGE_DINER_RELEASED, 'OLD')} {_diner_change(CHANGE_DINER_BOOKED, 'NEW')} END
+    """)),
+    _reference_change('restaurants_change_insert', 'INSERT', 'restaurants'),
+    _reference_change('restaurants_change_delete', 'DELETE', 'restaurants'),
+    _reference_change('restaurants_change_mask', 'UPDATE OF dietary_restriction_mask', 'restaurants'),
+    _reference_change('restaurant_tables_change_insert', 'INSERT', 'restaurant_tables'),
+    _reference_change('restaurant_tables_change_delete', 'DELETE', 'restaurant_tables'),
+    _reference_change('restaurant_tables_change_update', 'UPDATE', 'restaurant_tables'),
+    _reference_change('diners_change_mask', 'UPDATE OF dietary_restriction_mask', 'diners'),
+]
@@ -0,0 +1,329 @@
+"""
+Schema migrations for databases created before a model change.
+
+Fresh databases are built with Base.metadata.create_all and stamped with the latest version.
+Existing ones are upgraded in order, the applied version is kept in SQLite's PRAGMA user_version.
+
+    python -m app.models.migrations
+"""
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, List
+
+from sqlalchemy import Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from .db import (
+    CHANGE_LOG_TRIGGERS, DINER_WINDOW_TRIGGERS, LOCATION_INDEX, OCCUPANCY_REBUILD, OCCUPANCY_TRIGGERS, OVERLAP_GUARDS, RESTRICTION_MASK_TRIGGERS, Base, Diner, Reservation, Restaurant, RestaurantTable,
+    diner_dietary_restriction_association, diner_reservation_archive, diner_reservation_association,
+    placeholder_location, reservation_archive, reservation_changes, restaurant_dietary_restriction_association,
+    restaurant_occupancy
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def rebuild_with_primary_key(connection: Connection, table: Table) -> None:
+    """
+    SQLite cannot add a primary key to an existing table, so the table is recreated
+    from the model and the distinct, complete rows are copied over.
+    """
+    existing = inspect(connection).get_pk_constraint(table.name)
+    if existing.get('constrained_columns'):
+        return
+
+    # Columns added to the model since are left to their own migrations
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    columns = ', '.join(column.name for column in table.columns if column.name in existing)
+    not_null = ' AND '.join(f'{column.name} IS NOT NULL' for column in table.primary_key.columns)
+    legacy_name = f'{table.name}_legacy'
+    connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {legacy_name}'))
+    # Plain CREATE TABLE, the model's indexes and triggers belong to the later migrations
+    connection.execute(CreateTable(table))
+    connection.execute(text(
+        f'INSERT INTO {table.name} ({columns}) SELECT DISTINCT {columns} FROM {legacy_name} WHERE {not_null}'
+    ))
+    connection.execute(text(f'DROP TABLE {legacy_name}'))
+
+
+def association_primary_keys(connection: Connection) -> None:
+    for table in (diner_dietary_restriction_association, restaurant_dietary_restriction_association,
+                  diner_reservation_association):
+        rebuild_with_primary_key(connection, table)
+
+
+# The indexes of version 2, later ones may cover columns added after it
+HOT_PATH_INDEXES = ('ix_reservations_table_window', 'ix_reservations_window',
+                    'ix_restaurant_tables_restaurant_capacity', 'ix_diner_reservation_reservation_id')
+
+
+def hot_path_indexes(connection: Connection) -> None:
+    for table in (Reservation.__table__, RestaurantTable.__table__, diner_reservation_association):
+        for index in table.indexes:
+            if index.name in HOT_PATH_INDEXES:
+                index.create(connection, checkfirst=True)
+
+
+def overlap_guards(connection: Connection) -> None:
+    if connection.dialect.name != 'sqlite':
+        return
+    for _, guard in OVERLAP_GUARDS:
+        connection.execute(guard)
+
+
+def refresh_restriction_masks(connection: Connection) -> None:
+    """Recomputes every diner and restaurant mask from the association tables, SUM equals OR as each bit appears once"""
+    for owner, association, owner_column in (
+        ('diners', diner_dietary_restriction_association.name, 'diner_id'),
+        ('restaurants', restaurant_dietary_restriction_association.name, 'restaurant_id'),
+    ):
+        connection.execute(text(
+            f'UPDATE {owner} SET dietary_restriction_mask = ('
+            f'SELECT coalesce(sum(1 << (dietary_restriction_id - 1)), 0) FROM {association} '
+            f'WHERE {association}.{owner_column} = {owner}.id)'
+        ))
+
+
+def restriction_masks(connection: Connection) -> None:
+    for table in (Diner.__table__, Restaurant.__table__):
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        if 'dietary_restriction_mask' not in existing:
+            connection.execute(text(
+                f'ALTER TABLE {table.name} ADD COLUMN dietary_restriction_mask INTEGER NOT NULL DEFAULT 0'
+            ))
+    if connection.dialect.name == 'sqlite':
+        for _, trigger in RESTRICTION_MASK_TRIGGERS:
+            connection.execute(trigger)
+    refresh_restriction_masks(connection)
+
+
+def add_column(connection: Connection, table: Table, definition: str) -> None:
+    name = definition.split()[0]
+    if name not in {column['name'] for column in inspect(connection).get_columns(table.name)}:
+        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {definition}'))
+
+
+def combinable_tables(connection: Connection) -> None:
+    add_column(connection, RestaurantTable.__table__, 'combination_group INTEGER')
+    add_column(connection, Reservation.__table__, 'combined_with_id INTEGER REFERENCES reservations (id)')
+    for table in (RestaurantTable.__table__, Reservation.__table__):
+        for index in table.indexes:
+            if index.name in ('ix_restaurant_tables_combination', 'ix_reservations_combined_with'):
+                index.create(connection, checkfirst=True)
+
+
+def diner_reservation_windows(connection: Connection) -> None:
+    """Copies every reservation's window onto its diner links, then indexes them per diner"""
+    add_column(connection, diner_reservation_association, 'start_datetime DATETIME')
+    add_column(connection, diner_reservation_association, 'end_datetime DATETIME')
+    connection.execute(text(
+        'UPDATE diner_reservation SET '
+        'start_datetime = (SELECT start_datetime FROM reservations WHERE id = diner_reservation.reservation_id), '
+        'end_datetime = (SELECT end_datetime FROM reservations WHERE id = diner_reservation.reservation_id)'
+    ))
+    for index in diner_reservation_association.indexes:
+        if index.name == 'ix_diner_reservation_diner_window':
+            index.create(connection, checkfirst=True)
+    if connection.dialect.name != 'sqlite':
+        return
+    # The diner guard now reads the copied windows, replace the version 3 trigger
+    connection.execute(text('DROP TRIGGER IF EXISTS diner_reservation_overlap_guard'))
+    for _, trigger in OVERLAP_GUARDS + DINER_WINDOW_TRIGGERS:
+        connection.execute(trigger)
+
+
+def archive_tables(connection: Connection) -> None:
+    for table in (reservation_archive, diner_reservation_archive):
+        table.create(connection, checkfirst=True)
+
+
+def place_unlocated_restaurants(connection: Connection) -> None:
+    """Restaurants without coordinates get the placeholder_location the seed gives those without a Location"""
+    placed = []
+    for id, name in connection.execute(text('SELECT id, name FROM restaurants WHERE latitude IS NULL OR longitude IS NULL')):
+        latitude, longitude = placeholder_location(name)
+        placed.append({'id': id, 'latitude': latitude, 'longitude': longitude})
+    if placed:
+        connection.execute(text('UPDATE restaurants SET latitude = :latitude, longitude = :longitude WHERE id = :id'), placed)
+
+
+def restaurant_locations(connection: Connection) -> None:
+    """
+    Restaurant coordinates and their R*Tree. Diner homes were loaded as (longitude, latitude) from
+    the CSV's "latitude,longitude"; a latitude beyond +-90 can only be such a swapped pair.
+    """
+    add_column(connection, Restaurant.__table__, 'latitude FLOAT')
+    add_column(connection, Restaurant.__table__, 'longitude FLOAT')
+    connection.execute(text(
+        'UPDATE diners SET home_latitude = home_longitude, home_longitude = home_latitude '
+        'WHERE abs(home_latitude) > 90'
+    ))
+    place_unlocated_restaurants(connection)
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in LOCATION_INDEX:
+        connection.execute(ddl)
+    connection.execute(text(
+        'INSERT OR REPLACE INTO restaurant_locations SELECT id, latitude, latitude, longitude, longitude '
+        'FROM restaurants WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+    ))
+
+
+def occupancy(connection: Connection) -> None:
+    """The occupancy table, counted from every reservation before its triggers keep it"""
+    restaurant_occupancy.create(connection, checkfirst=True)
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in OCCUPANCY_TRIGGERS:
+        connection.execute(ddl)
+    for statement in OCCUPANCY_REBUILD:
+        connection.execute(statement)
+
+
+def occupancy_keeps_archived_hours(connection: Connection) -> None:
+    """Triggers that leave archived reservations counted, and the occupancy counted again with them"""
+    for index in reservation_archive.indexes:
+        index.create(connection, checkfirst=True)
+    if connection.dialect.name != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        connection.execute(text(f'DROP TRIGGER IF EXISTS reservations_occupancy_{trigger}'))
+    for ddl in OCCUPANCY_TRIGGERS:
+        connection.execute(ddl)
+    for statement in OCCUPANCY_REBUILD:
+        connection.execute(statement)
+
+
+def change_log(connection: Connection) -> None:
+    """The change log starts empty, processes read its version when they build their in-memory structures"""
+    reservation_changes.create(connection, checkfirst=True)
+
+
+def change_log_off_by_default(connection: Connection) -> None:
+    """The log triggers are left to processes running a change feed, which install them at startup"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for name, _ in CHANGE_LOG_TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+    connection.execute(reservation_changes.delete())
+
+
+def reservations_autoincrement(connection: Connection) -> None:
+    """
+    SQLite cannot make a key AUTOINCREMENT in place, so reservations is recreated from the model with its
+    indexes and triggers. The counter starts past every live and archived id, no booking takes an
+    archived reservation's id again; occupancy is counted again, bookings that did lost their release.
+    """
+    if connection.dialect.name != 'sqlite':
+        return
+    table = Reservation.__table__
+    triggers = {name for name, in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+    columns = ', '.join(column.name for column in table.columns)
+    # Other tables' triggers and foreign keys keep naming reservations, the new table
+    connection.execute(text('PRAGMA legacy_alter_table = ON'))
+    connection.execute(text('ALTER TABLE reservations RENAME TO reservations_legacy'))
+    connection.execute(CreateTable(table))
+    connection.execute(text(f'INSERT INTO reservations ({columns}) SELECT {columns} FROM reservations_legacy'))
+    connection.execute(text('DROP TABLE reservations_legacy'))
+    connection.execute(text('PRAGMA legacy_alter_table = OFF'))
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'reservations'"))
+    connection.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'reservations', max("
+        "(SELECT coalesce(max(id), 0) FROM reservations), (SELECT coalesce(max(id), 0) FROM reservations_archive))"
+    ))
+    for index in table.indexes:
+        index.create(connection)
+    # The ones on reservations went with the old table, the rest already exist
+    for _, ddl in OVERLAP_GUARDS + DINER_WINDOW_TRIGGERS:
+        connection.execute(ddl)
+    for ddl in OCCUPANCY_TRIGGERS:
+        connection.execute(ddl)
+    for name, ddl in CHANGE_LOG_TRIGGERS:
+        if name in triggers:
+            connection.execute(ddl)
+    for statement in OCCUPANCY_REBUILD:
+        connection.execute(statement)
+
+
+def locate_restaurants(connection: Connection) -> None:
+    """For databases upgraded past version 8 before it placed them, the R*Tree triggers index the new points"""
+    place_unlocated_restaurants(connection)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'composite primary keys on association tables', association_primary_keys),
+    Migration(2, 'indexes for reservation overlap and table capacity lookups', hot_path_indexes),
+    Migration(3, 'triggers rejecting overlapping table and diner reservations', overlap_guards),
+    Migration(4, 'dietary restriction bitmasks on diners and restaurants', restriction_masks),
+    Migration(5, 'combinable tables and reservations holding several tables', combinable_tables),
+    Migration(6, 'reservation windows on diner links for indexed double-booking checks', diner_reservation_windows),
+    Migration(7, 'archive tables for past reservations', archive_tables),
+    Migration(8, 'restaurant locations with a spatial index, diner homes as latitude, longitude', restaurant_locations),
+    Migration(9, 'booked tables per restaurant, hour and capacity, kept by triggers', occupancy),
+    Migration(10, 'log of committed changes for processes keeping in-memory copies', change_log),
+    Migration(11, 'occupancy keeps the hours of archived reservations', occupancy_keeps_archived_hours),
+    Migration(12, 'change log triggers only while a change feed runs', change_log_off_by_default),
+    Migration(13, 'reservation ids never reused, archived ones included', reservations_autoincrement),
+    Migration(14, 'restaurants upgraded without a location placed like the seed does', locate_restaurants),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection: Connection) -> int:
+    return connection.execute(text('PRAGMA user_version')).scalar()
+
+
+def set_version(connection: Connection, version: int) -> None:
+    # PRAGMA does not take bound parameters
+    connection.execute(text(f'PRAGMA user_version = {int(version)}'))
+
+
+@contextmanager
+def ddl_transaction(engine: Engine) -> Iterator[Connection]:
+    """A transaction that also covers DDL, pysqlite only opens one on its own before DML"""
+    with engine.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('BEGIN')
+        yield connection
+        connection.commit()
+
+
+def create_schema(engine: Engine) -> None:
+    """Creates every table at the latest version"""
+    Base.metadata.create_all(engine, checkfirst=True)
+    with engine.begin() as connection:
+        set_version(connection, LATEST_VERSION)
+
+
+def migrate(engine: Engine) -> List[int]:
+    """Applies pending migrations, each in its own transaction. Returns the versions applied"""
+    with engine.connect() as connection:
+        fresh = not inspect(connection).get_table_names()
+        version = current_version(connection)
+    if fresh:
+        create_schema(engine)
+        return []
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logging.info(f"Applying migration {migration.version}: {migration.description}")
+        with ddl_transaction(engine) as connection:
+            migration.upgrade(connection)
+            set_version(connection, migration.version)
+        applied.append(migration.version)
+    return applied
+
+
+if __name__ == '__main__':
+    from .db import db_engine
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f"Applied migrations: {migrate(db_engine) or 'none'}")
@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.models.async_db import create_async_db_engine
+from app.models.config import DatabaseSettings
+from app.models.db import create_db_engine
+from app.models.migrations import create_schema
+
+
+def pragma(engine, name: str):
+    with engine.connect() as connection:
+        return connection.execute(text(f'PRAGMA {name}')).scalar()
+
+
+@pytest.fixture(scope='function')
+def settings(tmp_path):
+    return DatabaseSettings(url=f"sqlite:///{os.path.join(tmp_path, 'booking.db')}", pool_size=2, max_overflow=0)
+
+
+class TestEngines:
+    def test__create_db_engine__applies_pragmas_on_connect(self, settings):
+        engine = create_db_engine(settings)
+        assert pragma(engine, 'journal_mode') == 'wal'
+        # 0 off, 1 normal, 2 full
+        assert pragma(engine, 'synchronous') == 1
+        assert pragma(engine, 'busy_timeout') == 5000
+        assert pragma(engine, 'query_only') == 0
+        engine.dispose()
+
+    def test__create_db_engine__empty_modes_keep_the_databases_own(self, settings):
+        engine = create_db_engine(DatabaseSettings(url=settings.url, journal_mode='', synchronous='', busy_timeout_ms=250))
+        assert pragma(engine, 'journal_mode') == 'delete'
+        assert pragma(engine, 'synchronous') == 2
+        assert pragma(engine, 'busy_timeout') == 250
+        engine.dispose()
+
+    def test__read_engine__sees_commits_and_rejects_writes(self, settings):
+        engine = create_db_engine(settings)
+        create_schema(engine)
+        read_engine = create_db_engine(settings.for_reads(), read_only=True)
+        assert pragma(read_engine, 'query_only') == 1
+
+        with read_engine.connect() as reader:
+            assert reader.execute(text('SELECT count(*) FROM diners')).scalar() == 0
+            with engine.begin() as writer:
+                writer.execute(text("INSERT INTO diners (name) VALUES ('Ada')"))
+            assert reader.execute(text('SELECT count(*) FROM diners')).scalar() == 1
+            with pytest.raises(OperationalError):
+                reader.execute(text("INSERT INTO diners (name) VALUES ('Bob')"))
+        read_engine.dispose()
+        engine.dispose()
+
+    def test__read_engine__async_connections_are_read_only(self, settings):
+        create_schema(create_db_engine(settings))
+
+        async def main():
+            engine = create_async_db_engine(settings.for_reads(), read_only=True)
+            try:
+                async with engine.connect() as connection:
+                    assert (await connection.execute(text('PRAGMA query_only'))).scalar() == 1
+                    assert (await connection.execute(text('PRAGMA journal_mode'))).scalar() == 'wal'
+            finally:
+                await engine.dispose()
+        asyncio.run(main())
+
+    def test__separate_reads__memory_databases_share_the_write_engine(self):
+        assert DatabaseSettings(url='sqlite://').separate_reads is False
+        assert DatabaseSettings(url='sqlite:///booking.db').separate_reads is True
+        replica = DatabaseSettings(url='postgresql://primary/booking', read_url='postgresql://replica/booking')
+        assert replica.separate_reads is True
+        assert replica.for_reads().url == 'postgresql://replica/booking'
+
+    def test__sqlite_pragmas__readers_leave_the_journal_mode_to_the_writer(self):
+        settings = DatabaseSettings(journal_mode='wal', synchronous='full', busy_timeout_ms=100)
+        assert settings.sqlite_pragmas() == ['busy_timeout = 100', 'journal_mode = wal', 'synchronous = full']
+        assert settings.sqlite_pragmas(read_only=True) == ['busy_timeout = 100', 'synchronous = full', 'query_only = ON']
@@ -0,0 +1,228 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from app.models.db import placeholder_location
+from app.models.migrations import (
+    LATEST_VERSION, MIGRATIONS, current_version, ddl_transaction, migrate, reservations_autoincrement, set_version
+)
+from app.reservations.change_feed import install_change_log
+
+
+# Schema as created by create_all before association primary keys and indexes existed
+LEGACY_SCHEMA = [
+    "CREATE TABLE diners (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(50) UNIQUE, home_latitude FLOAT, home_longitude FLOAT)",
+    "CREATE TABLE restaurants (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(50) UNIQUE)",
+    "CREATE TABLE dietary_restrictions (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(50) UNIQUE)",
+    "CREATE TABLE restaurant_tables (id INTEGER NOT NULL PRIMARY KEY, capacity INTEGER, "
+    "restaurant_id INTEGER NOT NULL REFERENCES restaurants (id))",
+    "CREATE TABLE reservations (id INTEGER NOT NULL PRIMARY KEY, table_id INTEGER NOT NULL REFERENCES restaurant_tables (id), "
+    "start_datetime DATETIME, end_datetime DATETIME)",
+    "CREATE TABLE diner_dietary_restriction (diner_id INTEGER REFERENCES diners (id), "
+    "dietary_restriction_id INTEGER REFERENCES dietary_restrictions (id))",
+    "CREATE TABLE restaurant_dietary_restriction (restaurant_id INTEGER REFERENCES restaurants (id), "
+    "dietary_restriction_id INTEGER REFERENCES dietary_restrictions (id))",
+    "CREATE TABLE diner_reservation (diner_id INTEGER REFERENCES diners (id), "
+    "reservation_id INTEGER REFERENCES reservations (id))",
+]
+
+
+@pytest.fixture(scope='function')
+def legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO diner_dietary_restriction VALUES (1, 1), (1, 1), (1, 2), (2, NULL)"))
+        connection.execute(text("INSERT INTO diner_reservation VALUES (1, 1), (2, 1)"))
+    yield engine
+    engine.dispose()
+
+
+class TestMigrations:
+    def test__migrate__fresh_database_is_created_at_latest_version(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+        assert migrate(engine) == []
+        with engine.connect() as connection:
+            assert current_version(connection) == LATEST_VERSION
+            assert 'ix_reservations_table_window' in {index['name'] for index in inspect(connection).get_indexes('reservations')}
+
+    def test__migrate__adds_primary_keys_and_keeps_distinct_rows(self, legacy_engine):
+        assert migrate(legacy_engine) == [migration.version for migration in MIGRATIONS]
+        with legacy_engine.connect() as connection:
+            inspector = inspect(connection)
+            assert inspector.get_pk_constraint('diner_dietary_restriction')['constrained_columns'] == ['diner_id', 'dietary_restriction_id']
+            assert inspector.get_pk_constraint('diner_reservation')['constrained_columns'] == ['diner_id', 'reservation_id']
+            rows = connection.execute(text("SELECT diner_id, dietary_restriction_id FROM diner_dietary_restriction ORDER BY 1, 2")).all()
+            assert [tuple(row) for row in rows] == [(1, 1), (1, 2)]
+            assert connection.execute(text("SELECT count(*) FROM diner_reservation")).scalar() == 2
+
+    def test__migrate__adds_hot_path_indexes(self, legacy_engine):
+        migrate(legacy_engine)
+        with legacy_engine.connect() as connection:
+            inspector = inspect(connection)
+            assert {index['name'] for index in inspector.get_indexes('reservations')} == {
+                'ix_reservations_table_window', 'ix_reservations_window', 'ix_reservations_combined_with'
+            }
+            assert sorted(index['column_names'] for index in inspector.get_indexes('restaurant_tables')) == [
+                ['restaurant_id', 'capacity'], ['restaurant_id', 'combination_group', 'capacity']
+            ]
+            assert sorted(index['name'] for index in inspector.get_indexes('diner_reservation')) == [
+                'ix_diner_reservation_diner_window', 'ix_diner_reservation_reservation_id'
+            ]
+
+    def test__migrate__adds_overlap_guards(self, legacy_engine):
+        migrate(legacy_engine)
+        with legacy_engine.connect() as connection:
+            triggers = connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%guard' ORDER BY name"
+            )).scalars().all()
+        assert triggers == [
+            'diner_reservation_overlap_guard',
+            'reservations_table_overlap_insert_guard',
+            'reservations_table_overlap_update_guard',
+        ]
+
+    def test__migrate__backfills_and_maintains_restriction_masks(self, legacy_engine):
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO diners (id, name) VALUES (1, 'Masked 1'), (2, 'Masked 2')"))
+        migrate(legacy_engine)
+        with legacy_engine.begin() as connection:
+            masks = connection.execute(text("SELECT id, dietary_restriction_mask FROM diners ORDER BY id")).all()
+            assert [tuple(row) for row in masks] == [(1, 0b11), (2, 0)]
+
+            connection.execute(text("INSERT INTO diner_dietary_restriction VALUES (2, 3)"))
+            connection.execute(text("DELETE FROM diner_dietary_restriction WHERE diner_id = 1 AND dietary_restriction_id = 1"))
+            masks = connection.execute(text("SELECT id, dietary_restriction_mask FROM diners ORDER BY id")).all()
+            assert [tuple(row) for row in masks] == [(1, 0b10), (2, 0b100)]
+
+    def test__migrate__adds_combinable_table_columns(self, legacy_engine):
+        migrate(legacy_engine)
+        with legacy_engine.connect() as connection:
+            inspector = inspect(connection)
+            assert 'combination_group' in {column['name'] for column in inspector.get_columns('restaurant_tables')}
+            assert 'combined_with_id' in {column['name'] for column in inspector.get_columns('reservations')}
+
+    def test__migrate__copies_reservation_windows_onto_diner_links(self, legacy_engine):
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO reservations VALUES (1, 1, '2099-08-24 19:00:00.000000', '2099-08-24 21:00:00.000000')"))
+        migrate(legacy_engine)
+        with legacy_engine.begin() as connection:
+            windows = connection.execute(text("SELECT DISTINCT start_datetime, end_datetime FROM diner_reservation")).all()
+            assert [tuple(window) for window in windows] == [('2099-08-24 19:00:00.000000', '2099-08-24 21:00:00.000000')]
+
+            # Moved reservations take their diners' windows along, new links get theirs on insert
+            connection.execute(text("UPDATE reservations SET start_datetime = '2099-08-24 20:00:00.000000' WHERE id = 1"))
+            connection.execute(text("INSERT INTO diner_reservation (diner_id, reservation_id) VALUES (3, 1)"))
+            starts = connection.execute(text("SELECT diner_id, start_datetime FROM diner_reservation ORDER BY 1")).all()
+            assert [tuple(start) for start in starts] == [(diner_id, '2099-08-24 20:00:00.000000') for diner_id in (1, 2, 3)]
+
+    def test__migrate__creates_archive_tables(self, legacy_engine):
+        migrate(legacy_engine)
+        with legacy_engine.connect() as connection:
+            inspector = inspect(connection)
+            assert {'reservations_archive', 'diner_reservation_archive'} <= set(inspector.get_table_names())
+            assert [index['name'] for index in inspector.get_indexes('diner_reservation_archive')] == [
+                'ix_diner_reservation_archive_diner_window'
+            ]
+
+    def test__migrate__indexes_restaurant_locations_and_unswaps_diner_homes(self, legacy_engine):
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO diners VALUES (1, 'Swapped', -99.18, 19.41), (2, 'Fine', 19.40, -99.16)"))
+            connection.execute(text("INSERT INTO restaurants VALUES (1, 'Lardo')"))
+        migrate(legacy_engine)
+        with legacy_engine.begin() as connection:
+            homes = connection.execute(text("SELECT home_latitude, home_longitude FROM diners ORDER BY id")).all()
+            assert [tuple(home) for home in homes] == [(19.41, -99.18), (19.40, -99.16)]
+            # Placed as the seed places restaurants without a Location
+            latitude, longitude = placeholder_location('Lardo')
+            assert tuple(connection.execute(text(
+                "SELECT min_latitude, min_longitude FROM restaurant_locations WHERE id = 1"
+            )).one()) == pytest.approx((latitude, longitude), abs=1e-4)
+            connection.execute(text("UPDATE restaurants SET latitude = 19.42, longitude = -99.17 WHERE id = 1"))
+            assert connection.execute(text(
+                "SELECT id FROM restaurant_locations WHERE max_latitude >= 19.4 AND min_latitude <= 19.45"
+            )).scalars().all() == [1]
+
+    def test__migrate__counts_and_maintains_occupancy(self, legacy_engine):
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO restaurants VALUES (1, 'Lardo')"))
+            connection.execute(text("INSERT INTO restaurant_tables VALUES (1, 2, 1), (2, 4, 1)"))
+            connection.execute(text("INSERT INTO reservations VALUES (1, 1, '2099-08-24 19:00:00.000000', '2099-08-24 21:00:00.000000')"))
+        migrate(legacy_engine)
+        occupancy = "SELECT day, hour, capacity, booked_tables FROM restaurant_occupancy ORDER BY 1, 2, 3"
+        with legacy_engine.begin() as connection:
+            assert [tuple(row) for row in connection.execute(text(occupancy))] == [
+                ('2099-08-24', 19, 2, 1), ('2099-08-24', 20, 2, 1)
+            ]
+            connection.execute(text("INSERT INTO reservations (id, table_id, start_datetime, end_datetime) "
+                                    "VALUES (2, 2, '2099-08-24 20:30:00.000000', '2099-08-24 22:30:00.000000')"))
+            connection.execute(text("DELETE FROM reservations WHERE id = 1"))
+            assert [tuple(row) for row in connection.execute(text(occupancy))] == [
+                ('2099-08-24', 20, 4, 1), ('2099-08-24', 21, 4, 1), ('2099-08-24', 22, 4, 1)
+            ]
+
+    def test__migrate__leaves_logging_changes_to_the_feed(self, legacy_engine):
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO restaurants VALUES (1, 'Lardo')"))
+            connection.execute(text("INSERT INTO restaurant_tables VALUES (1, 2, 1)"))
+        migrate(legacy_engine)
+        changes = "SELECT kind, restaurant_id, table_id FROM reservation_changes ORDER BY id"
+        book = ("INSERT INTO reservations (id, table_id, start_datetime, end_datetime) "
+                "VALUES (1, 1, '2099-08-24 19:00:00.000000', '2099-08-24 21:00:00.000000')")
+        with legacy_engine.begin() as connection:
+            connection.execute(text(book))
+            connection.execute(text("DELETE FROM reservations WHERE id = 1"))
+            assert connection.execute(text(changes)).all() == []
+        with Session(legacy_engine) as session:
+            install_change_log(session)
+        with legacy_engine.begin() as connection:
+            connection.execute(text(book))
+            connection.execute(text("DELETE FROM reservations WHERE id = 1"))
+            assert [tuple(row) for row in connection.execute(text(changes))] == [('booked', 1, 1), ('released', 1, 1)]
+
+    def test__migrate__never_reuses_reservation_ids(self, legacy_engine, tmp_path):
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO restaurants VALUES (1, 'Lardo')"))
+            connection.execute(text("INSERT INTO restaurant_tables VALUES (1, 2, 1)"))
+            connection.execute(text("INSERT INTO reservations VALUES (1, 1, '2099-08-24 19:00:00.000000', '2099-08-24 21:00:00.000000'), "
+                                    "(2, 1, '2099-08-25 19:00:00.000000', '2099-08-25 21:00:00.000000')"))
+        migrate(legacy_engine)
+        with Session(legacy_engine) as session:
+            install_change_log(session)
+        book = ("INSERT INTO reservations (table_id, start_datetime, end_datetime) "
+                "VALUES (1, '2099-08-26 19:00:00.000000', '2099-08-26 21:00:00.000000') RETURNING id")
+        triggers = "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'reservations' ORDER BY name"
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO reservations_archive (id, table_id, start_datetime, end_datetime, archived_at) "
+                                    "VALUES (7, 1, '2099-08-20 19:00:00.000000', '2099-08-20 21:00:00.000000', '2099-08-21')"))
+            connection.execute(text("DELETE FROM reservations WHERE id = 2"))
+            assert connection.execute(text(book)).scalar() == 3
+            connection.execute(text("DELETE FROM reservations WHERE id = 3"))
+            installed = connection.execute(text(triggers)).scalars().all()
+        # Run again, as on a database archived and booked since with the change log installed
+        with ddl_transaction(legacy_engine) as connection:
+            reservations_autoincrement(connection)
+        with legacy_engine.begin() as connection:
+            assert connection.execute(text(book)).scalar() == 8
+            assert connection.execute(text(triggers)).scalars().all() == installed
+            assert {'reservations_occupancy_delete', 'reservations_table_overlap_insert_guard',
+                    'reservations_change_delete', 'reservations_diner_window_update'} <= set(installed)
+            assert 'AUTOINCREMENT' in connection.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'reservations'")).scalar()
+
+    def test__migrate__places_restaurants_an_earlier_upgrade_left_without_a_location(self, legacy_engine):
+        migrate(legacy_engine)
+        with legacy_engine.begin() as connection:
+            connection.execute(text("INSERT INTO restaurants (id, name) VALUES (1, 'Lardo'), (2, 'Rosetta')"))
+            connection.execute(text("UPDATE restaurants SET latitude = 19.42, longitude = -99.17 WHERE id = 2"))
+            set_version(connection, 13)
+        assert migrate(legacy_engine) == [14]
+        with legacy_engine.begin() as connection:
+            located = connection.execute(text("SELECT id, latitude, longitude FROM restaurants ORDER BY id")).all()
+            assert [tuple(row) for row in located] == [(1, *placeholder_location('Lardo')), (2, 19.42, -99.17)]
+            assert connection.execute(text("SELECT id FROM restaurant_locations ORDER BY id")).scalars().all() == [1, 2]
+
+    def test__migrate__is_idempotent(self, legacy_engine):
+        migrate(legacy_engine)
+        assert migrate(legacy_engine) == []
@@ -1,10 +1,19 @@
+import argparse
 import logging
 import csv
+import random
 import sys
-from sqlalchemy import or_, orm
-from typing import List
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from sqlalchemy import func, insert, or_, orm, select
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-from models.db import live_session, db_engine, Base, Restaurant, Diner, RestaurantTable, DietaryRestriction
+from models.db import (
+    CITY_AREA, live_session, db_engine, Base, Restaurant, Diner, RestaurantTable, DietaryRestriction,
+    diner_dietary_restriction_association, placeholder_location, restaurant_dietary_restriction_association
+)
+from models.migrations import create_schema
 
 
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +21,13 @@ DIRECTORY = 'data/'
 DINER_CSV_PATH = f'{DIRECTORY}diner_data.csv'
 RESTAURANT_CSV_PATH = f'{DIRECTORY}restaurant_data.csv'
 DIETARY_RESTRICTIONS = ["Nut-Free", "Paleo", "Gluten-Free", "Vegetarian", "Vegan"]
+TABLE_COLUMNS = {2: "No. of two-top tables", 4: "No. of four-top tables", 6: "No. of six-top tables"}
+# Optional, the capacities whose tables can be pushed together, e.g. "2, 4"
+COMBINABLE_COLUMN = "Combinable tables"
+# Optional, "latitude,longitude" like the diners' "Home Location"
+LOCATION_COLUMN = "Location"
+# Trade durability for speed while seeding, a failed load is simply rerun
+SQLITE_LOAD_PRAGMAS = ["journal_mode = MEMORY", "synchronous = OFF", "temp_store = MEMORY", "cache_size = -262144"]
 
 
 class PopulateData:
@@ -42,20 +58,18 @@ class PopulateData:
                 reader = csv.DictReader(csvfile, delimiter=',')
                 for row in reader:
                     endorsements = row["Endorsements"]
+                    latitude, longitude = restaurant_location(row)
                     restaurant = Restaurant(
                         name=row["Name"],
+                        latitude=latitude,
+                        longitude=longitude,
                         dietary_restrictions=self.fetch_dietary_restrictions(endorsements) if endorsements else []
                     )
                     self.session.add(restaurant)
                     self.session.commit()
 
-                    two_tables = int(row["No. of two-top tables"])
-                    four_tables = int(row["No. of two-top tables"])
-                    six_tables = int(row["No. of two-top tables"])
-
-                    self.add_tables(restaurant=restaurant, capacity=2, num_of_tables=two_tables)
-                    self.add_tables(restaurant=restaurant, capacity=4, num_of_tables=four_tables)
-                    self.add_tables(restaurant=restaurant, capacity=6, num_of_tables=six_tables)
+                    for capacity, column in TABLE_COLUMNS.items():
+                        self.add_tables(restaurant=restaurant, capacity=capacity, num_of_tables=int(row[column]))
 
         except Exception as e:
             logging.warning(f"Could not create restaurant row: {e}")
@@ -66,11 +80,11 @@ class PopulateData:
                 diners = []
                 reader = csv.DictReader(csvfile, delimiter=',')
                 for row in reader:
-                    longitude, latitude = row["Home Location"].split(",")
+                    latitude, longitude = parse_home_location(row["Home Location"])
                     diner = Diner(
                         name=row['Name'], 
-                        home_longitude=float(longitude),
-                        home_latitude=float(latitude), 
+                        home_latitude=latitude,
+                        home_longitude=longitude,
                     )
                     diner.dietary_restrictions = self.fetch_dietary_restrictions(row["Dietary Restrictions"]) if row["Dietary Restrictions"] else []
                     diners.append(diner)
@@ -86,16 +100,229 @@ class PopulateData:
         self.session.commit()
 
 
-def main() -> None:
+def parse_home_location(home_location: str) -> Tuple[float, float]:
+    """(latitude, longitude) of a "latitude,longitude" pair, the order the seed CSV writes them in"""
+    latitude, longitude = home_location.split(",")
+    return float(latitude), float(longitude)
+
+
+def restaurant_location(row: Dict[str, str]) -> Tuple[float, float]:
+    location = row.get(LOCATION_COLUMN)
+    return parse_home_location(location) if location else placeholder_location(row["Name"])
+
+
+@dataclass
+class RestaurantRecord:
+    name: str
+    tables: Dict[int, int] = field(default_factory=dict)  # capacity -> number of tables
+    dietary_restrictions: List[str] = field(default_factory=list)  # restriction names or name prefixes
+    combinable_capacities: List[int] = field(default_factory=list)  # tables of these sizes form one combination group
+    latitude: float = None
+    longitude: float = None
+
+
+@dataclass
+class DinerRecord:
+    name: str
+    home_latitude: float = None
+    home_longitude: float = None
+    dietary_restrictions: List[str] = field(default_factory=list)
+
+
+def csv_restaurants(path: str = RESTAURANT_CSV_PATH) -> Iterator[RestaurantRecord]:
+    """Streams restaurant rows, the file is never held in memory"""
+    with open(path, newline='') as csvfile:
+        for row in csv.DictReader(csvfile, delimiter=','):
+            endorsements = row["Endorsements"]
+            latitude, longitude = restaurant_location(row)
+            yield RestaurantRecord(
+                name=row["Name"],
+                tables={capacity: int(row[column]) for capacity, column in TABLE_COLUMNS.items()},
+                dietary_restrictions=PopulateData.parse_restaurant_dietary_restrictions(endorsements) if endorsements else [],
+                combinable_capacities=[int(capacity) for capacity in (row.get(COMBINABLE_COLUMN) or "").split(",")
+                                       if capacity.strip()],
+                latitude=latitude,
+                longitude=longitude
+            )
+
+
+def csv_diners(path: str = DINER_CSV_PATH) -> Iterator[DinerRecord]:
+    with open(path, newline='') as csvfile:
+        for row in csv.DictReader(csvfile, delimiter=','):
+            latitude, longitude = parse_home_location(row["Home Location"])
+            restrictions = row["Dietary Restrictions"]
+            yield DinerRecord(
+                name=row["Name"],
+                home_latitude=latitude,
+                home_longitude=longitude,
+                dietary_restrictions=PopulateData.parse_restaurant_dietary_restrictions(restrictions) if restrictions else []
+            )
+
+
+def synthetic_restaurants(count: int, seed: int = 42) -> Iterator[RestaurantRecord]:
+    """Deterministic fake restaurants for load tests"""
+    rng = random.Random(seed)
+    for number in range(1, count + 1):
+        yield RestaurantRecord(
+            name=f"Synthetic Restaurant {number}",
+            tables={2: rng.randint(0, 6), 4: rng.randint(0, 4), 6: rng.randint(0, 2)},
+            dietary_restrictions=rng.sample(DIETARY_RESTRICTIONS, rng.randint(0, len(DIETARY_RESTRICTIONS))),
+            latitude=rng.uniform(*CITY_AREA[0]),
+            longitude=rng.uniform(*CITY_AREA[1])
+        )
+
+
+def synthetic_diners(count: int, seed: int = 42) -> Iterator[DinerRecord]:
+    """Deterministic fake diners spread around Mexico City, like the seed data"""
+    rng = random.Random(seed)
+    for number in range(1, count + 1):
+        yield DinerRecord(
+            name=f"Synthetic Diner {number}",
+            home_latitude=rng.uniform(*CITY_AREA[0]),
+            home_longitude=rng.uniform(*CITY_AREA[1]),
+            dietary_restrictions=rng.sample(DIETARY_RESTRICTIONS, rng.choice([0, 0, 0, 1, 1, 2]))
+        )
+
+
+def chunked(records: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(records)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class BulkPopulateData:
+    """
+    Bulk ingestion: records are consumed in chunks, ids are assigned up front so every row of a chunk
+    (entities, tables and association rows) goes out as one executemany per table in one transaction.
+    Restrictions resolve from a name -> id map loaded once instead of a LIKE query per row.
+    """
+    def __init__(self, session: orm.session.Session, chunk_size: int = 10_000) -> None:
+        self.session = session
+        self.chunk_size = chunk_size
+        self._restriction_ids = None
+        self._resolved = {}
+
+    def apply_load_pragmas(self) -> None:
+        """Only for SQLite, run before the first write since journal_mode cannot change inside a transaction"""
+        connection = self.session.connection()
+        if connection.dialect.name != 'sqlite':
+            return
+        for pragma in SQLITE_LOAD_PRAGMAS:
+            connection.exec_driver_sql(f"PRAGMA {pragma}")
+
+    @property
+    def restriction_ids(self) -> Dict[str, int]:
+        if self._restriction_ids is None:
+            self._restriction_ids = {
+                name: id for id, name in self.session.execute(select(DietaryRestriction.id, DietaryRestriction.name))
+            }
+        return self._restriction_ids
+
+    def resolve_restrictions(self, names: List[str]) -> List[int]:
+        """Same prefix semantics as fetch_dietary_restrictions ("Gluten" -> "Gluten-Free"), memoized"""
+        key = tuple(names)
+        if key not in self._resolved:
+            self._resolved[key] = sorted({
+                id for name in names for full_name, id in self.restriction_ids.items() if full_name.startswith(name)
+            })
+        return self._resolved[key]
+
+    def _next_id(self, column) -> int:
+        return (self.session.execute(select(func.max(column))).scalar() or 0) + 1
+
+    def _insert(self, table, rows: List[dict]) -> None:
+        if rows:
+            self.session.execute(insert(table), rows)
+
+    def load_restaurants(self, records: Iterable[RestaurantRecord]) -> int:
+        next_id = self._next_id(Restaurant.id)
+        loaded = 0
+        for chunk in chunked(records, self.chunk_size):
+            restaurants, tables, endorsements = [], [], []
+            for id, record in enumerate(chunk, start=next_id):
+                restaurants.append({"id": id, "name": record.name,
+                                    "latitude": record.latitude, "longitude": record.longitude})
+                tables.extend(
+                    {"restaurant_id": id, "capacity": capacity,
+                     "combination_group": 1 if capacity in record.combinable_capacities else None}
+                    for capacity, count in record.tables.items() for _ in range(count)
+                )
+                endorsements.extend(
+                    {"restaurant_id": id, "dietary_restriction_id": restriction_id}
+                    for restriction_id in self.resolve_restrictions(record.dietary_restrictions)
+                )
+            self._insert(Restaurant.__table__, restaurants)
+            self._insert(RestaurantTable.__table__, tables)
+            self._insert(restaurant_dietary_restriction_association, endorsements)
+            self.session.commit()
+            next_id += len(chunk)
+            loaded += len(chunk)
+            logging.info(f"Loaded {loaded} restaurants")
+        return loaded
+
+    def load_diners(self, records: Iterable[DinerRecord]) -> int:
+        next_id = self._next_id(Diner.id)
+        loaded = 0
+        for chunk in chunked(records, self.chunk_size):
+            diners, restrictions = [], []
+            for id, record in enumerate(chunk, start=next_id):
+                diners.append({
+                    "id": id, "name": record.name,
+                    "home_latitude": record.home_latitude, "home_longitude": record.home_longitude,
+                })
+                restrictions.extend(
+                    {"diner_id": id, "dietary_restriction_id": restriction_id}
+                    for restriction_id in self.resolve_restrictions(record.dietary_restrictions)
+                )
+            self._insert(Diner.__table__, diners)
+            self._insert(diner_dietary_restriction_association, restrictions)
+            self.session.commit()
+            next_id += len(chunk)
+            loaded += len(chunk)
+            logging.info(f"Loaded {loaded} diners")
+        return loaded
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Recreates booking-system.db and seeds it")
+    parser.add_argument("--bulk", action="store_true", help="chunked executemany loading instead of the ORM")
+    parser.add_argument("--pragmas", action="store_true", help="apply SQLite load pragmas (bulk mode only)")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--synthetic-restaurants", type=int, default=0,
+                        help="seed this many generated restaurants instead of the CSV (bulk mode only)")
+    parser.add_argument("--synthetic-diners", type=int, default=0,
+                        help="seed this many generated diners instead of the CSV (bulk mode only)")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
     Base.metadata.drop_all(db_engine)
 
     logging.info("Creating DB")
-    Base.metadata.create_all(db_engine, checkfirst=True)
-    populate_data = PopulateData(session=live_session())
-    
+    create_schema(db_engine)
+    session = live_session()
+    populate_data = PopulateData(session=session)
     populate_data.populate_dietary_restrictions()
-    populate_data.populate_restaurants()
-    populate_data.populate_diners()
+
+    if not args.bulk:
+        populate_data.populate_restaurants()
+        populate_data.populate_diners()
+        session.close()
+        return
+
+    started = time.perf_counter()
+    bulk_data = BulkPopulateData(session=session, chunk_size=args.chunk_size)
+    if args.pragmas:
+        bulk_data.apply_load_pragmas()
+    bulk_data.load_restaurants(
+        synthetic_restaurants(args.synthetic_restaurants) if args.synthetic_restaurants else csv_restaurants()
+    )
+    bulk_data.load_diners(
+        synthetic_diners(args.synthetic_diners) if args.synthetic_diners else csv_diners()
+    )
+    session.close()
+    logging.info(f"Bulk load finished in {time.perf_counter() - started:.1f}s")
 
 
 if __name__ == '__main__':
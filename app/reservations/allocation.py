@@ -0,0 +1,186 @@
+"""
+Which table a booking gets.
+
+The original choice, kept as the 'smallest' strategy, is the smallest free table that seats the group.
+It fragments a restaurant's day: a 2-top left between two bookings on a 6-top leaves gaps too short
+for anyone, and the later 6-top is turned away. Here
+    fit      scores every free table by the seat time it blocks: its capacity times the booking plus
+             the gaps next to it that become too short to hold another reservation, and takes the lowest
+    repack   like fit, and when no table is free re-assigns the restaurant's unseated future reservations
+             (interval partitioning by start time, best fit first) so the new group fits as well
+Everything here is plain Python over (table, window) tuples; booking.py loads them and applies the plan.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+
+# Reservations within this of a booking may be re-packed for it
+ALLOCATION_HORIZON = timedelta(hours=12)
+# Moved reservations that would collide mid-way are parked here, one minute apart by id, until their table frees up
+PARKING_START = datetime(1900, 1, 1)
+
+
+class Table(NamedTuple):
+    id: int
+    capacity: int
+
+
+class Booked(NamedTuple):
+    id: int
+    table_id: int
+    start_datetime: datetime
+    end_datetime: datetime
+    size: int
+    movable: bool = True
+
+
+class TableMove(NamedTuple):
+    reservation_id: int
+    from_table_id: int
+    to_table_id: int
+    start_datetime: datetime
+    end_datetime: datetime
+
+
+@dataclass
+class Plan:
+    table_id: int
+    moves: List[TableMove] = field(default_factory=list)
+    # (reservation id, table id, start, end) updates in an order every intermediate state is valid
+    steps: List[Tuple[int, int, datetime, datetime]] = field(default_factory=list)
+
+
+Calendar = Dict[int, List[Tuple[datetime, datetime]]]
+
+
+def calendars_of(bookings: Iterable[Booked]) -> Calendar:
+    calendars = defaultdict(list)
+    for booked in bookings:
+        calendars[booked.table_id].append((booked.start_datetime, booked.end_datetime))
+    for windows in calendars.values():
+        windows.sort()
+    return calendars
+
+
+def is_free(windows: Sequence[Tuple[datetime, datetime]], start_datetime: datetime, end_datetime: datetime) -> bool:
+    position = bisect_left(windows, (end_datetime,))
+    # Windows are disjoint and sorted, only the last one starting before end_datetime can overlap
+    return position == 0 or windows[position - 1][1] <= start_datetime
+
+
+def blocked_seconds(windows: Sequence[Tuple[datetime, datetime]], start_datetime: datetime,
+                    end_datetime: datetime, duration: timedelta) -> float:
+    """The booking itself plus the free time beside it left too short for another reservation"""
+    position = bisect_left(windows, (end_datetime,))
+    previous_end = windows[position - 1][1] if position else None
+    next_start = windows[position][0] if position < len(windows) else None
+    blocked = end_datetime - start_datetime
+    for fragment in (previous_end and start_datetime - previous_end, next_start and next_start - end_datetime):
+        if fragment is not None and fragment < duration:
+            blocked += fragment
+    return blocked.total_seconds()
+
+
+def choose_table(tables: Sequence[Table], calendars: Calendar, size: int, start_datetime: datetime,
+                 end_datetime: datetime, duration: timedelta, strategy: str = 'fit',
+                 prefer: Optional[int] = None) -> Optional[int]:
+    """The free table seating `size` to book, None when none is free. `prefer` wins ties, to keep moves few"""
+    candidates = [table for table in tables
+                  if table.capacity >= size and is_free(calendars.get(table.id, ()), start_datetime, end_datetime)]
+    if not candidates:
+        return None
+    if strategy == 'smallest':
+        return min(candidates, key=lambda table: (table.capacity, table.id)).id
+    return min(candidates, key=lambda table: (
+        table.capacity * blocked_seconds(calendars.get(table.id, ()), start_datetime, end_datetime, duration),
+        table.id != prefer, table.capacity, table.id
+    )).id
+
+
+def repack(tables: Sequence[Table], fixed: Sequence[Booked], movable: Sequence[Booked],
+           duration: timedelta) -> Optional[Dict[int, int]]:
+    """
+    Table per movable reservation, around the fixed ones, or None if some group cannot be seated.
+    Interval partitioning: by start time, each group takes the fitting table that wastes least, which
+    for equal capacities is the one freed most recently. Largest groups first is tried as a fallback.
+    """
+    for order in ((lambda booked: (booked.start_datetime, -booked.size)),
+                  (lambda booked: (-booked.size, booked.start_datetime))):
+        calendars = calendars_of(fixed)
+        assignment = {}
+        for booked in sorted(movable, key=order):
+            table_id = choose_table(tables, calendars, booked.size, booked.start_datetime, booked.end_datetime,
+                                    duration, prefer=booked.table_id)
+            if table_id is None:
+                break
+            assignment[booked.id] = table_id
+            windows = calendars.setdefault(table_id, [])
+            windows.insert(bisect_left(windows, (booked.start_datetime,)), (booked.start_datetime, booked.end_datetime))
+        else:
+            return assignment
+    return None
+
+
+def ordered_steps(bookings: Sequence[Booked], moves: List[TableMove]) -> List[Tuple[int, int, datetime, datetime]]:
+    """
+    Updates applying `moves` one row at a time without ever double booking a table, so the overlap
+    guards accept every step. A cycle of swaps is broken by parking one reservation in the past.
+    """
+    calendars = {key: list(windows) for key, windows in calendars_of(bookings).items()}
+    pending, steps = list(moves), []
+
+    def vacate(table_id: int, start_datetime: datetime, end_datetime: datetime) -> None:
+        calendars[table_id].remove((start_datetime, end_datetime))
+
+    while pending:
+        for move in pending:
+            if is_free(calendars.get(move.to_table_id, ()), move.start_datetime, move.end_datetime):
+                pending.remove(move)
+                if move.from_table_id is not None:
+                    vacate(move.from_table_id, move.start_datetime, move.end_datetime)
+                windows = calendars.setdefault(move.to_table_id, [])
+                windows.insert(bisect_left(windows, (move.start_datetime,)), (move.start_datetime, move.end_datetime))
+                steps.append((move.reservation_id, move.to_table_id, move.start_datetime, move.end_datetime))
+                break
+        else:
+            parked = pending.pop(0)
+            parking = PARKING_START + timedelta(minutes=parked.reservation_id)
+            vacate(parked.from_table_id, parked.start_datetime, parked.end_datetime)
+            steps.append((parked.reservation_id, parked.from_table_id, parking, parking + timedelta(minutes=1)))
+            pending.append(parked._replace(from_table_id=None))
+    return steps
+
+
+def plan_booking(tables: Sequence[Table], bookings: Sequence[Booked], size: int, start_datetime: datetime,
+                 end_datetime: datetime, strategy: str, now: Optional[datetime] = None,
+                 horizon: Optional[timedelta] = None) -> Optional[Plan]:
+    """
+    Where to seat a new group given the restaurant's tables and nearby reservations, None if nowhere.
+    With 'repack' the reservations starting after `now` (all of them when now is None) and lying within
+    `horizon` of the booking may move; `bookings` must then hold everything overlapping a horizon past that.
+    """
+    duration = end_datetime - start_datetime
+    calendars = calendars_of(bookings)
+    table_id = choose_table(tables, calendars, size, start_datetime, end_datetime, duration, strategy)
+    if table_id is not None or strategy != 'repack':
+        return None if table_id is None else Plan(table_id=table_id)
+
+    def is_movable(booked: Booked) -> bool:
+        if not booked.movable or now is not None and booked.start_datetime <= now:
+            return False
+        return horizon is None or (start_datetime - horizon <= booked.start_datetime
+                                   and booked.end_datetime <= end_datetime + horizon)
+
+    movable = [booked for booked in bookings if is_movable(booked)]
+    fixed = [booked for booked in bookings if not is_movable(booked)]
+    new = Booked(id=0, table_id=None, start_datetime=start_datetime, end_datetime=end_datetime, size=size)
+    assignment = repack(tables, fixed, [*movable, new], duration)
+    if assignment is None:
+        return None
+
+    moves = [TableMove(booked.id, booked.table_id, assignment[booked.id], booked.start_datetime, booked.end_datetime)
+             for booked in movable if assignment[booked.id] != booked.table_id]
+    return Plan(table_id=assignment[new.id], moves=moves, steps=ordered_steps(bookings, moves))
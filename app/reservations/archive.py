@@ -0,0 +1,131 @@
+"""
+Moving past reservations out of the hot tables.
+
+Searches, bookings and the overlap guards only ever look at windows around now, yet reservations and
+diner_reservation keep every reservation ever made. archive_reservations moves those that ended before
+a cutoff, with their diner links, to reservations_archive and diner_reservation_archive, a batch per
+transaction so bookings wait at most one batch for the write lock. Past diner histories stay readable
+through diner_history_select, which reads both.
+
+The cutoff should stay behind now: a booking or search for a window already archived no longer sees
+the reservations that held it.
+
+    python -m app.reservations.archive
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, delete, false, insert, literal, select, true, union_all
+from sqlalchemy.orm.session import Session
+
+from ..models.db import Reservation, RestaurantTable, diner_reservation_archive, diner_reservation_association, reservation_archive
+from .booking import begin_immediate
+
+
+ARCHIVE_BATCH_SIZE = 2000
+
+
+class PastReservation(NamedTuple):
+    id: int
+    restaurant_id: int
+    start_datetime: datetime
+    end_datetime: datetime
+    archived: bool
+
+
+def archivable_ids_select(before: datetime, batch_size: int) -> Select:
+    """Ids of up to batch_size reservations ending at or before `before`, oldest first, a range seek on ix_reservations_window"""
+    return select(Reservation.id).where(
+        Reservation.start_datetime < before,
+        Reservation.end_datetime <= before,
+    ).order_by(Reservation.start_datetime).limit(batch_size)
+
+
+def archive_batch(session: Session, before: datetime, batch_size: int = ARCHIVE_BATCH_SIZE,
+                  archived_at: Optional[datetime] = None) -> List[int]:
+    """Moves one batch in one transaction, returns the archived reservation ids"""
+    begin_immediate(session)
+    ids = session.execute(archivable_ids_select(before, batch_size)).scalars().all()
+    if not ids:
+        session.rollback()
+        return []
+
+    reservations, links = Reservation.__table__.c, diner_reservation_association.c
+    session.execute(insert(reservation_archive).from_select(
+        ['id', 'table_id', 'start_datetime', 'end_datetime', 'combined_with_id', 'archived_at'],
+        select(reservations.id, reservations.table_id, reservations.start_datetime, reservations.end_datetime,
+               reservations.combined_with_id, literal(archived_at or datetime.now()))
+        .where(reservations.id.in_(ids))
+    ))
+    session.execute(insert(diner_reservation_archive).from_select(
+        ['diner_id', 'reservation_id', 'start_datetime', 'end_datetime'],
+        select(links.diner_id, links.reservation_id, links.start_datetime, links.end_datetime)
+        .where(links.reservation_id.in_(ids))
+    ))
+    session.execute(delete(diner_reservation_association).where(links.reservation_id.in_(ids)))
+    session.execute(delete(Reservation.__table__).where(reservations.id.in_(ids)))
+    session.commit()
+    return ids
+
+
+def archive_reservations(session: Session, before: datetime, batch_size: int = ARCHIVE_BATCH_SIZE,
+                         max_batches: Optional[int] = None) -> int:
+    """Archives every reservation ending at or before `before`, or max_batches of them. Returns how many"""
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = archive_batch(session, before, batch_size)
+        if not ids:
+            break
+        archived += len(ids)
+        batches += 1
+    logging.info(f"Archived {archived} reservations ending before {before} in {batches} batches")
+    return archived
+
+
+def retention_cutoff(retention_days: int, now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.now()) - timedelta(days=retention_days)
+
+
+def diner_history_select(diner_id: int, before: datetime, limit: int) -> Select:
+    """
+    PastReservation rows of a diner's reservations ending at or before `before`, newest first, from
+    the live and archive tables. Each side is a descending seek on its (diner_id, end_datetime) index.
+    A diner's windows never overlap, so the start of the last row is the `before` of the next page.
+    """
+    parts = []
+    for links, reservations, archived in (
+        (diner_reservation_association, Reservation.__table__, false()),
+        (diner_reservation_archive, reservation_archive, true()),
+    ):
+        parts.append(select(
+            links.c.reservation_id.label('id'), RestaurantTable.restaurant_id.label('restaurant_id'),
+            links.c.start_datetime.label('start_datetime'), links.c.end_datetime.label('end_datetime'),
+            archived.label('archived')
+        ).join(
+            reservations, reservations.c.id == links.c.reservation_id
+        ).join(
+            RestaurantTable, RestaurantTable.id == reservations.c.table_id
+        ).where(
+            links.c.diner_id == diner_id,
+            links.c.end_datetime <= before
+        ).order_by(links.c.end_datetime.desc()).limit(limit).subquery())
+
+    history = union_all(*(select(part) for part in parts)).subquery()
+    return select(history).order_by(history.c.end_datetime.desc()).limit(limit)
+
+
+def history_page(rows: Sequence, limit: int) -> Tuple[List[PastReservation], Optional[datetime]]:
+    """The first limit of up to limit + 1 rows, and the `before` of the next page or None"""
+    page = [PastReservation(row.id, row.restaurant_id, row.start_datetime, row.end_datetime, bool(row.archived))
+            for row in rows[:limit]]
+    next_before = page[-1].start_datetime if len(rows) > limit else None
+    return page, next_before
+
+
+if __name__ == '__main__':
+    from ..models.config import archive_settings
+    from ..models.db import live_session
+    logging.basicConfig(level=logging.INFO)
+    with live_session() as session:
+        archive_reservations(session, retention_cutoff(archive_settings.retention_days), archive_settings.batch_size)
@@ -0,0 +1,338 @@
+from fastapi import HTTPException
+from ..api.requests import DEFAULT_PAGE_SIZE, AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest, ReservationSearchRequest
+from ..models.db import Reservation, Restaurant
+from .availability_index import AvailabilityIndex, IndexedRestaurant
+from .search_cache import SearchCache
+from .diner_schedule import DinerSchedule
+from .reference_data import ReferenceData, ReferenceSnapshot, group_filter
+from .batch_search import SlotAvailability, async_available_restaurants_by_slot
+from .booking import (
+    Booking, Cancellation, async_book_atomically, async_book_in_transaction, async_cancel_atomically,
+    async_cancel_in_transaction, async_delete_in_transaction, cancel_diner_select, cancel_ids_select,
+    cancel_restaurant_select
+)
+from .change_feed import ChangeFeed
+from .archive import PastReservation, diner_history_select, history_page
+from .occupancy import OCCUPANCY_MAX_DAYS, HourOccupancy, hourly_occupancy, occupancy_select, table_counts_select
+from .proximity import NearbyRestaurant, async_nearby_restaurants, group_centroid_select
+from .pagination import after_cursor, page_of, rows_after
+from .search import RESERVATION_DURATION, available_restaurant_rows_select, booked_diners_select
+from .write_queue import WriteQueue
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import asyncio
+import logging
+
+
+STREAM_PAGE_SIZE = 500
+
+
+class AsyncReservationManager:
+    """
+    ReservationManager for the asyncio request path, on an AsyncSession.
+    Same statements, backends and availability index handling; scripts keep the sync manager.
+    Searches return (id, name) rows rather than Restaurant entities, which is all the endpoints send.
+    Like the sync manager, searches run on read_session when given and writes on session.
+    With a write_queue, bookings and deletions go through the process' single writer instead of
+    session, and the in-memory structures are updated here once the writer has committed them.
+    With a change_feed they follow every process' writes instead, this manager's included.
+    """
+    def __init__(self, session: AsyncSession, availability_index: Optional[AvailabilityIndex] = None,
+                 search_backend: Optional[str] = None, search_cache: Optional[SearchCache] = None,
+                 allocation: str = 'smallest', diner_schedule: Optional[DinerSchedule] = None,
+                 read_session: Optional[AsyncSession] = None, reference_data: Optional[ReferenceData] = None,
+                 write_queue: Optional[WriteQueue] = None, occupancy_prefilter: bool = False,
+                 change_feed: Optional[ChangeFeed] = None) -> None:
+        self.session = session
+        self.write_queue = write_queue
+        self.read_session = read_session or session
+        self.availability_index = availability_index
+        self.search_cache = search_cache
+        self.allocation = allocation
+        self.diner_schedule = diner_schedule
+        self.reference_data = reference_data
+        self.occupancy_prefilter = occupancy_prefilter
+        self.change_feed = change_feed
+        self.search_backend = search_backend or ('index' if availability_index else 'sql')
+        if self.search_backend == 'index' and availability_index is None:
+            raise ValueError("The index search backend needs an availability_index")
+
+    def reference_snapshot(self) -> Optional[ReferenceSnapshot]:
+        """The current snapshot, taken once per call so a refresh mid-call cannot mix two"""
+        return None if self.reference_data is None else self.reference_data.snapshot
+
+    async def catch_up(self) -> None:
+        """
+        Applies the writes any process committed since the last call, when there is a change feed.
+        The feed reads with blocking calls and may wait on another request's catch up, so in a thread.
+        """
+        if self.change_feed is not None:
+            await asyncio.to_thread(self.change_feed.catch_up)
+
+    async def group_booked(self, diner_ids: List[int], start_datetime: datetime, end_datetime: datetime) -> bool:
+        """
+        A diner of the group already holds a reservation overlapping the window, so no search finds anything.
+        Answered by the diner schedule when it covers the window, by one query on the index backend;
+        SQL searches otherwise check it inside their own statement (search.group_is_free).
+        """
+        if self.diner_schedule is not None and self.diner_schedule.covers(start_datetime):
+            return bool(self.diner_schedule.booked_diner_ids(diner_ids, start_datetime, end_datetime))
+        if self.search_backend == 'index':
+            statement = booked_diners_select(diner_ids, start_datetime, end_datetime).limit(1)
+            return (await self.read_session.execute(statement)).first() is not None
+        return False
+
+    async def find_available_restaurant(self, reservation_request: ReservationRequest) -> List[Union[IndexedRestaurant, NearbyRestaurant]]:
+        if reservation_request.by_distance():
+            return await self.find_nearby_restaurants(reservation_request)
+        diner_ids = reservation_request.diner_ids
+        start_datetime = reservation_request.start_time
+        end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+
+        logging.info(f"Find restauarants for diners {diner_ids}")
+        await self.catch_up()
+        if self.search_cache is not None:
+            cached = self.search_cache.lookup(diner_ids, start_datetime)
+            if cached is not None:
+                return cached
+            version = self.search_cache.version
+
+        seatable, group_mask = group_filter(self.reference_snapshot(), diner_ids)
+        if not seatable:
+            logging.info(f"No restaurant could ever seat diners {diner_ids}")
+            restaurants = []
+        elif await self.group_booked(diner_ids, start_datetime, end_datetime):
+            logging.info(f"A diner of {diner_ids} is already booked at {start_datetime}")
+            restaurants = []
+        elif self.search_backend == 'index':
+            restaurants = self.availability_index.available_restaurants(diner_ids, start_datetime, end_datetime)
+        else:
+            result = await self.read_session.execute(available_restaurant_rows_select(
+                diner_ids, start_datetime, end_datetime, group_mask=group_mask,
+                occupancy_prefilter=self.occupancy_prefilter
+            ))
+            restaurants = [IndexedRestaurant(id, name) for id, name in result]
+
+        if self.search_cache is not None:
+            self.search_cache.store(diner_ids, start_datetime, restaurants, version)
+        return restaurants
+
+    async def find_nearby_restaurants(self, reservation_request: ReservationSearchRequest) -> List[NearbyRestaurant]:
+        diner_ids = reservation_request.diner_ids
+        start_datetime = reservation_request.start_time
+        end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+
+        logging.info(f"Find restauarants near diners {diner_ids}")
+        await self.catch_up()
+        seatable, group_mask = group_filter(self.reference_snapshot(), diner_ids)
+        if not seatable or await self.group_booked(diner_ids, start_datetime, end_datetime):
+            return []
+        centroid = tuple((await self.read_session.execute(group_centroid_select(diner_ids))).one())
+        if None in centroid:
+            raise HTTPException(status_code=400, detail=f"None of diners {diner_ids} has a home location")
+        return await async_nearby_restaurants(
+            self.read_session, diner_ids, start_datetime, end_datetime, centroid,
+            max_distance_km=reservation_request.max_distance_km, nearest_k=reservation_request.nearest_k,
+            group_mask=group_mask
+        )
+
+    async def find_available_restaurant_page(self, page_request: ReservationPageRequest) -> Tuple[List[IndexedRestaurant], Optional[str]]:
+        diner_ids = page_request.diner_ids
+        start_datetime = page_request.start_time
+        end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+        after_id = after_cursor(page_request.cursor)
+
+        logging.info(f"Find restauarants for diners {diner_ids} after {after_id}")
+        await self.catch_up()
+        seatable, group_mask = group_filter(self.reference_snapshot(), diner_ids)
+        if not seatable or await self.group_booked(diner_ids, start_datetime, end_datetime):
+            return [], None
+        if self.search_backend == 'index':
+            rows = self.availability_index.available_restaurants(diner_ids, start_datetime, end_datetime)
+            return page_of(rows_after(rows, after_id, page_request.limit), page_request.limit)
+
+        result = await self.read_session.execute(available_restaurant_rows_select(
+            diner_ids, start_datetime, end_datetime, after_id=after_id, limit=page_request.limit + 1,
+            group_mask=group_mask, occupancy_prefilter=self.occupancy_prefilter
+        ))
+        return page_of(result.all(), page_request.limit)
+
+    async def stream_available_restaurants(self, reservation_request: ReservationRequest,
+                                           page_size: int = STREAM_PAGE_SIZE) -> AsyncIterator[List[IndexedRestaurant]]:
+        """The whole search in keyset pages of page_size, so at most one page is held at a time"""
+        cursor = None
+        while True:
+            page, cursor = await self.find_available_restaurant_page(ReservationPageRequest(
+                start_time=reservation_request.start_time, diner_ids=reservation_request.diner_ids,
+                limit=page_size, cursor=cursor
+            ))
+            if page:
+                yield page
+            if cursor is None:
+                return
+
+    async def find_available_restaurants_by_slot(self, batch_request: BatchReservationRequest) -> List[SlotAvailability]:
+        diner_ids = batch_request.diner_ids
+        slots = batch_request.slots()
+
+        logging.info(f"Find restauarants for diners {diner_ids} over {len(slots)} start times")
+        await self.catch_up()
+        snapshot = self.reference_snapshot()
+        if not group_filter(snapshot, diner_ids)[0]:
+            return [(slot, []) for slot in slots]
+        if self.search_backend == 'index':
+            duration = timedelta(hours=RESERVATION_DURATION)
+            return [(slot, [] if await self.group_booked(diner_ids, slot, slot + duration)
+                     else self.availability_index.available_restaurants(diner_ids, slot, slot + duration))
+                    for slot in slots]
+
+        return await async_available_restaurants_by_slot(session=self.read_session, diner_ids=diner_ids, slots=slots,
+                                                         reference=snapshot)
+
+    async def diner_history(self, diner_id: int, before: Optional[datetime] = None,
+                            limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[PastReservation], Optional[datetime]]:
+        """
+        Up to limit of the diner's reservations that ended by `before` (now by default), newest first,
+        archived or not, and the `before` of the next page or None
+        """
+        rows = (await self.read_session.execute(diner_history_select(diner_id, before or datetime.now(), limit + 1))).all()
+        return history_page(rows, limit)
+
+    async def restaurant_occupancy(self, restaurant_id: int, first_day: date,
+                                   last_day: date) -> Tuple[Dict[int, int], List[HourOccupancy]]:
+        if last_day < first_day or (last_day - first_day).days >= OCCUPANCY_MAX_DAYS:
+            raise HTTPException(status_code=400, detail=f"Occupancy covers 1 to {OCCUPANCY_MAX_DAYS} days")
+        table_counts = (await self.read_session.execute(table_counts_select(restaurant_id))).all()
+        if not table_counts and await self.read_session.get(Restaurant, restaurant_id) is None:
+            logging.warning(f"Could not find restaurant {restaurant_id}")
+            raise HTTPException(status_code=400, detail="Restaurant not found")
+        booked_rows = (await self.read_session.execute(occupancy_select(restaurant_id, first_day, last_day))).all()
+        return hourly_occupancy(table_counts, booked_rows)
+
+    async def book_reservation(self, available_reservation_request: AvailableReservationRequest) -> Optional[Reservation]:
+        restaurant_id = available_reservation_request.restaurant_id
+        diner_ids = available_reservation_request.diner_ids
+        start_datetime = available_reservation_request.start_time
+        end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+
+        logging.info(f"Booking a reservation for diners {diner_ids} with restaurant {restaurant_id}")
+        snapshot = self.reference_snapshot()
+        if snapshot is not None and snapshot.cannot_seat(restaurant_id, len(diner_ids)):
+            logging.warning(f"Restaurant {restaurant_id} has no table for {len(diner_ids)} diners")
+            return None
+        # The diner schedule's quick rejections go by the latest writes
+        await self.catch_up()
+        if self.write_queue is not None:
+            booking = await self.write_queue.submit(lambda session: async_book_in_transaction(
+                session, restaurant_id, diner_ids, start_datetime, end_datetime,
+                allocation=self.allocation, diner_schedule=self.diner_schedule
+            ))
+        else:
+            booking = await async_book_atomically(
+                session=self.session,
+                restaurant_id=restaurant_id,
+                diner_ids=diner_ids,
+                start_datetime=start_datetime,
+                end_datetime=end_datetime,
+                allocation=self.allocation,
+                diner_schedule=self.diner_schedule
+            )
+
+        if not booking:
+            logging.warning(f"Didnt find a table for Restaurant {restaurant_id}")
+            return None
+
+        reservation = booking.reservation
+        if self.change_feed is not None:
+            # This booking comes back through the feed, in commit order with every other process' writes
+            await self.catch_up()
+        else:
+            self.apply_booking(restaurant_id, diner_ids, booking)
+
+        logging.warning(f"Booking table {reservation.table_id} with reservation {reservation.id}")
+        return reservation
+
+    def apply_booking(self, restaurant_id: int, diner_ids: List[int], booking: Booking) -> None:
+        """Brings the in-memory structures in line with a committed booking of this manager"""
+        reservation = booking.reservation
+        for move in booking.moves:
+            # A re-packed reservation frees one table and takes another, searches either way may change
+            if self.availability_index is not None:
+                self.availability_index.remove_reservation(move.from_table_id, move.start_datetime, move.end_datetime)
+                self.availability_index.add_reservation(move.to_table_id, move.start_datetime, move.end_datetime)
+            if self.search_cache is not None:
+                self.search_cache.invalidate_release(move.start_datetime, move.end_datetime)
+
+        if self.availability_index is not None:
+            for table_id in (reservation.table_id, *booking.combined_table_ids):
+                self.availability_index.add_reservation(table_id, reservation.start_datetime, reservation.end_datetime)
+        if self.diner_schedule is not None:
+            self.diner_schedule.add(diner_ids, reservation.start_datetime, reservation.end_datetime)
+        if self.search_cache is not None:
+            self.search_cache.invalidate_booking(restaurant_id, reservation.start_datetime, reservation.end_datetime,
+                                                 diner_ids=diner_ids)
+
+    async def delete_reservation(self, reservation_id: int) -> bool:
+        if self.write_queue is not None:
+            diner_ids, released = await self.write_queue.submit(
+                lambda session: async_delete_in_transaction(session, reservation_id)
+            )
+        else:
+            diner_ids, released = await async_delete_in_transaction(self.session, reservation_id)
+            await self.session.commit()
+        if self.change_feed is not None:
+            await self.catch_up()
+        else:
+            self.apply_deletion(diner_ids, released)
+
+        logging.warning(f"Deleted reservation {reservation_id}")
+        return True
+
+    def apply_deletion(self, diner_ids: List[int], released: List[Tuple[int, datetime, datetime]]) -> None:
+        """Brings the in-memory structures in line with a committed deletion of this manager"""
+        if self.availability_index is not None:
+            for booked_window in released:
+                self.availability_index.remove_reservation(*booked_window)
+        if self.diner_schedule is not None:
+            self.diner_schedule.remove(diner_ids, *released[0][1:])
+        if self.search_cache is not None:
+            self.search_cache.invalidate_release(*released[0][1:])
+
+    async def cancel_reservations(self, reservation_ids: List[int]) -> List[int]:
+        return await self.cancel(cancel_ids_select(reservation_ids))
+
+    async def cancel_restaurant_reservations(self, restaurant_id: int, start_datetime: datetime,
+                                             end_datetime: datetime) -> List[int]:
+        if end_datetime <= start_datetime:
+            raise HTTPException(status_code=400, detail="The cancelled window must end after it starts")
+        return await self.cancel(cancel_restaurant_select(restaurant_id, start_datetime, end_datetime))
+
+    async def cancel_diner_reservations(self, diner_id: int, after: Optional[datetime] = None) -> List[int]:
+        return await self.cancel(cancel_diner_select(diner_id, after))
+
+    async def cancel(self, targets: Select) -> List[int]:
+        if self.write_queue is not None:
+            cancellation = await self.write_queue.submit(lambda session: async_cancel_in_transaction(session, targets))
+        else:
+            cancellation = await async_cancel_atomically(self.session, targets)
+        if self.change_feed is not None:
+            await self.catch_up()
+        else:
+            self.apply_cancellation(cancellation)
+
+        logging.warning(f"Cancelled {len(cancellation.reservation_ids)} reservations")
+        return cancellation.reservation_ids
+
+    def apply_cancellation(self, cancellation: Cancellation) -> None:
+        """Brings the in-memory structures in line with committed cancellations of this manager"""
+        if self.availability_index is not None:
+            for booked_window in cancellation.released:
+                self.availability_index.remove_reservation(*booked_window)
+        if self.diner_schedule is not None:
+            for diner_id, start_datetime, end_datetime in cancellation.diners:
+                self.diner_schedule.remove([diner_id], start_datetime, end_datetime)
+        if self.search_cache is not None:
+            for window in {booked_window[1:] for booked_window in cancellation.released}:
+                self.search_cache.invalidate_release(*window)
@@ -0,0 +1,253 @@
+import logging
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm.session import Session
+
+from ..models.db import Diner, Reservation, Restaurant, RestaurantTable
+from .restriction_masks import RestaurantMasks, combined_mask
+
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOT_MICROSECONDS = SLOT_MINUTES * 60 * 1_000_000
+EPOCH = datetime(1970, 1, 1)
+
+
+class IndexedRestaurant(NamedTuple):
+    """Returned instead of Restaurant rows, building ORM objects costs more than the search itself"""
+    id: int
+    name: str
+
+
+def timestamp(value: datetime) -> int:
+    """Exact microseconds since EPOCH, windows are kept as plain ints rather than datetime objects"""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def slot_masks(start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    (day, bitmask) pairs covering every 15 minute slot the window [start, end) touches.
+    Slots are rounded outwards, so a mask can only over-report a conflict, never miss one.
+    """
+    first = start // SLOT_MICROSECONDS
+    last = -(-end // SLOT_MICROSECONDS)
+    masks = []
+    for day in range(first // SLOTS_PER_DAY, (last - 1) // SLOTS_PER_DAY + 1):
+        day_start = day * SLOTS_PER_DAY
+        low = max(first, day_start) - day_start
+        high = min(last, day_start + SLOTS_PER_DAY) - day_start
+        masks.append((day, ((1 << (high - low)) - 1) << low))
+    return masks
+
+
+class TableCalendar:
+    """One table: a booked-slot bitmask per day for the fast path and the exact sorted windows"""
+    __slots__ = ('table_id', 'restaurant_id', 'capacity', 'combination_group', 'days', 'starts', 'ends')
+
+    def __init__(self, table_id: int, restaurant_id: int, capacity: int, combination_group: int = None) -> None:
+        self.table_id = table_id
+        self.restaurant_id = restaurant_id
+        self.capacity = capacity
+        self.combination_group = combination_group
+        self.days: Dict[int, int] = {}
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def book(self, start: int, end: int) -> None:
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        for day, mask in slot_masks(start, end):
+            self.days[day] = self.days.get(day, 0) | mask
+
+    def release(self, start: int, end: int) -> bool:
+        position = bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start and self.ends[position] != end:
+            position += 1
+        if position == len(self.starts) or self.starts[position] != start:
+            return False
+        del self.starts[position]
+        del self.ends[position]
+
+        # Recompute the days the window touched from the windows still booked around it
+        touched = [day for day, _ in slot_masks(start, end)]
+        for day in touched:
+            self.days.pop(day, None)
+        day_microseconds = SLOTS_PER_DAY * SLOT_MICROSECONDS
+        first = bisect_left(self.starts, touched[0] * day_microseconds - day_microseconds)
+        last = bisect_right(self.starts, (touched[-1] + 1) * day_microseconds)
+        for neighbour in range(first, last):
+            for day, mask in slot_masks(self.starts[neighbour], self.ends[neighbour]):
+                if day in touched:
+                    self.days[day] = self.days.get(day, 0) | mask
+        return True
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """
+        Exact check behind the masks. Windows of one table never overlap each other, so only the
+        last one starting before `end` can reach into the window.
+        """
+        position = bisect_left(self.starts, end)
+        return position > 0 and self.ends[position - 1] > start
+
+    def is_free(self, start: int, end: int, masks: List[Tuple[int, int]] = None) -> bool:
+        days = self.days
+        if not any(days.get(day, 0) & mask for day, mask in masks or slot_masks(start, end)):
+            return True
+        return not self.overlaps(start, end)
+
+
+class AvailabilityIndex:
+    """
+    Process-local copy of everything a search needs, so searches are answered without SQL:
+        - a TableCalendar per table, tables bucketed per restaurant by capacity (smallest first)
+        - the combinable tables of the restaurants having any, for groups no single table seats
+        - restaurant names, restaurant and diner restriction masks
+    The database stays the source of truth; ReservationManager applies its own bookings and
+    deletions here after they commit, and build() reloads everything from the DB.
+    """
+    def __init__(self) -> None:
+        self.tables: Dict[int, TableCalendar] = {}
+        self.restaurant_tables: Dict[int, List[TableCalendar]] = defaultdict(list)
+        self.combinable_tables: Dict[int, List[TableCalendar]] = defaultdict(list)
+        self.restaurant_names: Dict[int, str] = {}
+        self.restaurant_masks = RestaurantMasks([], [])
+        self.diner_masks: Dict[int, int] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, session: Session) -> "AvailabilityIndex":
+        index = cls()
+        index.reload_reference(session)
+        for table_id, start_datetime, end_datetime in session.execute(
+            select(Reservation.table_id, Reservation.start_datetime, Reservation.end_datetime)
+            .order_by(Reservation.table_id, Reservation.start_datetime)
+        ):
+            index.add_reservation(table_id, start_datetime, end_datetime)
+        logging.info(f"Availability index built: {len(index.tables)} tables, {index.reservation_count()} reservations")
+        return index
+
+    def reload_reference(self, session: Session) -> None:
+        """
+        Reloads names, restriction masks and tables after reference changes (see ChangeFeed). Tables
+        already indexed keep their calendars, new ones start empty: the change log has their bookings after them.
+        """
+        names = dict(session.execute(select(Restaurant.id, Restaurant.name)).all())
+        restaurant_masks = RestaurantMasks.load(session)
+        diner_masks = dict(session.execute(
+            select(Diner.id, Diner.dietary_restriction_mask).where(Diner.dietary_restriction_mask != 0)
+        ).all())
+        tables = session.execute(
+            select(RestaurantTable.id, RestaurantTable.restaurant_id, RestaurantTable.capacity,
+                   RestaurantTable.combination_group)
+        ).all()
+        with self._lock:
+            indexed = self.tables
+            self.tables, self.restaurant_tables, self.combinable_tables = {}, defaultdict(list), defaultdict(list)
+            for id, restaurant_id, capacity, combination_group in tables:
+                self.add_table(id, restaurant_id, capacity, combination_group)
+                if id in indexed:
+                    table, calendar = self.tables[id], indexed[id]
+                    table.days, table.starts, table.ends = calendar.days, calendar.starts, calendar.ends
+            self.restaurant_names, self.restaurant_masks, self.diner_masks = names, restaurant_masks, diner_masks
+
+    def add_table(self, table_id: int, restaurant_id: int, capacity: int, combination_group: int = None) -> None:
+        with self._lock:
+            table = TableCalendar(table_id, restaurant_id, capacity or 0, combination_group)
+            self.tables[table_id] = table
+            insort(self.restaurant_tables[restaurant_id], table, key=lambda calendar: (calendar.capacity, calendar.table_id))
+            if combination_group is not None:
+                self.combinable_tables[restaurant_id].append(table)
+
+    def add_reservation(self, table_id: int, start_datetime: datetime, end_datetime: datetime) -> None:
+        with self._lock:
+            table = self.tables.get(table_id)
+            if table is not None:
+                table.book(timestamp(start_datetime), timestamp(end_datetime))
+
+    def remove_reservation(self, table_id: int, start_datetime: datetime, end_datetime: datetime) -> None:
+        with self._lock:
+            table = self.tables.get(table_id)
+            if table is not None:
+                table.release(timestamp(start_datetime), timestamp(end_datetime))
+
+    def reservation_count(self) -> int:
+        return sum(len(table.starts) for table in self.tables.values())
+
+    def group_mask(self, diner_ids: List[int]) -> int:
+        return combined_mask(self.diner_masks.get(diner_id, 0) for diner_id in diner_ids)
+
+    def free_tables(self, restaurant_id: int, capacity: int,
+                    start_datetime: datetime, end_datetime: datetime) -> List[int]:
+        """Free tables of a restaurant seating `capacity`, smallest first"""
+        start, end = timestamp(start_datetime), timestamp(end_datetime)
+        masks = slot_masks(start, end)
+        with self._lock:
+            return [
+                table.table_id for table in self.restaurant_tables.get(restaurant_id, [])
+                if table.capacity >= capacity and table.is_free(start, end, masks)
+            ]
+
+    def seats_combined(self, restaurant_id: int, capacity: int, start: int, end: int,
+                       masks: List[Tuple[int, int]]) -> bool:
+        """The free tables of one of the restaurant's combination groups seat `capacity` together"""
+        free_seats: Dict[int, int] = defaultdict(int)
+        for table in self.combinable_tables.get(restaurant_id, ()):
+            if table.is_free(start, end, masks):
+                free_seats[table.combination_group] += table.capacity
+                if free_seats[table.combination_group] >= capacity:
+                    return True
+        return False
+
+    def available_restaurant_ids(self, diner_ids: List[int],
+                                 start_datetime: datetime, end_datetime: datetime) -> List[int]:
+        capacity = len(diner_ids)
+        start, end = timestamp(start_datetime), timestamp(end_datetime)
+        masks = slot_masks(start, end)
+        # A two hour window almost always sits inside one day, check that mask inline
+        day, mask = masks[0] if len(masks) == 1 else (None, 0)
+        available = []
+        with self._lock:
+            for restaurant_id in self.restaurant_masks.matching(self.group_mask(diner_ids)):
+                for table in self.restaurant_tables.get(restaurant_id, ()):
+                    if table.capacity < capacity:
+                        continue
+                    if day is not None:
+                        if not table.days.get(day, 0) & mask or not table.overlaps(start, end):
+                            break
+                    elif table.is_free(start, end, masks):
+                        break
+                else:
+                    if not self.seats_combined(restaurant_id, capacity, start, end, masks):
+                        continue
+                available.append(restaurant_id)
+        return available
+
+    def available_restaurants(self, diner_ids: List[int],
+                              start_datetime: datetime, end_datetime: datetime) -> List[IndexedRestaurant]:
+        return [
+            IndexedRestaurant(restaurant_id, self.restaurant_names.get(restaurant_id))
+            for restaurant_id in self.available_restaurant_ids(diner_ids, start_datetime, end_datetime)
+        ]
+
+    def memory_report(self) -> Dict[str, float]:
+        """Approximate bytes held by the calendars, shared restriction sets and names excluded"""
+        calendar_bytes = 0
+        for table in self.tables.values():
+            calendar_bytes += sys.getsizeof(table) + sys.getsizeof(table.days)
+            calendar_bytes += sys.getsizeof(table.starts) + sys.getsizeof(table.ends)
+            calendar_bytes += sum(sys.getsizeof(mask) for mask in table.days.values())
+        tables = max(1, len(self.tables))
+        return {
+            "tables": len(self.tables),
+            "reservations": self.reservation_count(),
+            "calendar_bytes": calendar_bytes,
+            "bytes_per_table": calendar_bytes / tables,
+        }
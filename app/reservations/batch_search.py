@@ -0,0 +1,149 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Select, null, or_, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.session import Session
+
+from ..models.db import Reservation, Restaurant, RestaurantTable, diner_reservation_association
+from .availability_index import IndexedRestaurant
+from .reference_data import ReferenceSnapshot
+from .search import RESERVATION_DURATION, diner_overlaps, group_mask_clause, overlaps, satisfies_group
+
+
+SlotAvailability = Tuple[datetime, List[IndexedRestaurant]]
+
+
+def seats_group(diner_ids: List[int]):
+    """Tables that seat the group on their own or may be combined with others to"""
+    return or_(RestaurantTable.capacity >= len(diner_ids), RestaurantTable.combination_group.isnot(None))
+
+
+def candidate_tables_select(diner_ids: List[int], group_mask: Optional[int] = None) -> Select:
+    """
+    (table id, restaurant id, restaurant name, capacity, combination group) of every table that can
+    seat the group, at restaurants covering the group's restrictions. The group's mask is computed
+    once, inside the statement, unless given.
+    """
+    return select(
+        RestaurantTable.id, Restaurant.id, Restaurant.name, RestaurantTable.capacity, RestaurantTable.combination_group
+    ).join(
+        Restaurant, Restaurant.id == RestaurantTable.restaurant_id
+    ).where(
+        seats_group(diner_ids),
+        satisfies_group(Restaurant.dietary_restriction_mask, group_mask_clause(diner_ids, group_mask))
+    )
+
+
+def candidate_reservations_select(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime,
+                                  group_mask: Optional[int] = None):
+    """
+    (table id, start, end) of reservations on candidate tables overlapping the whole range, in one pass,
+    followed by the group's own reservations over the range with no table id
+    """
+    candidates = select(Reservation.table_id, Reservation.start_datetime, Reservation.end_datetime).join(
+        RestaurantTable, RestaurantTable.id == Reservation.table_id
+    ).join(
+        Restaurant, Restaurant.id == RestaurantTable.restaurant_id
+    ).where(
+        overlaps(start_datetime, end_datetime),
+        seats_group(diner_ids),
+        satisfies_group(Restaurant.dietary_restriction_mask, group_mask_clause(diner_ids, group_mask))
+    )
+    group_windows = select(
+        null(), diner_reservation_association.c.start_datetime, diner_reservation_association.c.end_datetime
+    ).where(
+        diner_overlaps(diner_ids, start_datetime, end_datetime)
+    )
+    return union_all(candidates, group_windows)
+
+
+def overlapped_slots(slots: List[datetime], start_datetime: datetime, end_datetime: datetime) -> range:
+    """Positions of the slots whose window [slot, slot + RESERVATION_DURATION) overlaps [start_datetime, end_datetime)"""
+    first = bisect_right(slots, start_datetime - timedelta(hours=RESERVATION_DURATION))
+    return range(first, bisect_left(slots, end_datetime))
+
+
+def sweep(slots: List[datetime], tables: Iterable[tuple], reservations: Iterable[tuple],
+          size: int) -> List[SlotAvailability]:
+    """
+    Available restaurants per slot, with `slots` sorted ascending. Each reservation marks its table
+    busy in every slot whose window [slot, slot + RESERVATION_DURATION) it overlaps, found by bisecting
+    the slots; a restaurant is available in a slot while one of its tables seating `size` is not busy,
+    or the free tables of one of its combination groups seat `size` together. Slots overlapping a
+    reservation without a table, one of the group's own, have no restaurant at all.
+    """
+    restaurant_of: Dict[int, int] = {}
+    names: Dict[int, str] = {}
+    table_counts: Dict[int, int] = defaultdict(int)
+    # Combinable tables by (restaurant, group) with their seats, only a few restaurants have any
+    combinable: Dict[int, Tuple[Tuple[int, int], int]] = {}
+    group_seats: Dict[Tuple[int, int], int] = defaultdict(int)
+    for table_id, restaurant_id, name, capacity, combination_group in tables:
+        names[restaurant_id] = name
+        if capacity >= size:
+            restaurant_of[table_id] = restaurant_id
+            table_counts[restaurant_id] += 1
+        if combination_group is not None:
+            combinable[table_id] = ((restaurant_id, combination_group), capacity)
+            group_seats[restaurant_id, combination_group] += capacity
+
+    busy_tables = [set() for _ in slots]
+    group_booked = set()
+    for table_id, start_datetime, end_datetime in reservations:
+        if table_id is None:
+            group_booked.update(overlapped_slots(slots, start_datetime, end_datetime))
+            continue
+        for position in overlapped_slots(slots, start_datetime, end_datetime):
+            busy_tables[position].add(table_id)
+
+    restaurants = [IndexedRestaurant(restaurant_id, names[restaurant_id]) for restaurant_id in sorted(names)]
+    availability = []
+    for position, (slot, busy) in enumerate(zip(slots, busy_tables)):
+        if position in group_booked:
+            availability.append((slot, []))
+            continue
+        busy_counts: Dict[int, int] = defaultdict(int)
+        free_seats = dict(group_seats)
+        for table_id in busy:
+            if table_id in restaurant_of:
+                busy_counts[restaurant_of[table_id]] += 1
+            if table_id in combinable:
+                group, capacity = combinable[table_id]
+                free_seats[group] -= capacity
+        seated_combined = {restaurant_id for (restaurant_id, _), seats in free_seats.items() if seats >= size}
+        availability.append((slot, [
+            restaurant for restaurant in restaurants
+            if busy_counts[restaurant.id] < table_counts[restaurant.id] or restaurant.id in seated_combined
+        ]))
+    return availability
+
+
+def slots_range(slots: List[datetime]) -> Tuple[datetime, datetime]:
+    """The window spanned by every slot's reservation window"""
+    return slots[0], slots[-1] + timedelta(hours=RESERVATION_DURATION)
+
+
+def available_restaurants_by_slot(session: Session, diner_ids: List[int], slots: List[datetime],
+                                  reference: Optional[ReferenceSnapshot] = None) -> List[SlotAvailability]:
+    """The candidate tables come from the reference snapshot when given, leaving one statement"""
+    if reference is None:
+        group_mask, tables = None, session.execute(candidate_tables_select(diner_ids)).all()
+    else:
+        group_mask = reference.group_mask(diner_ids)
+        tables = reference.candidate_tables(len(diner_ids), group_mask)
+    reservations = session.execute(candidate_reservations_select(diner_ids, *slots_range(slots), group_mask)).all()
+    return sweep(slots, tables, reservations, len(diner_ids))
+
+
+async def async_available_restaurants_by_slot(session: AsyncSession, diner_ids: List[int], slots: List[datetime],
+                                              reference: Optional[ReferenceSnapshot] = None) -> List[SlotAvailability]:
+    if reference is None:
+        group_mask, tables = None, (await session.execute(candidate_tables_select(diner_ids))).all()
+    else:
+        group_mask = reference.group_mask(diner_ids)
+        tables = reference.candidate_tables(len(diner_ids), group_mask)
+    reservations = (await session.execute(candidate_reservations_select(diner_ids, *slots_range(slots), group_mask))).all()
+    return sweep(slots, tables, reservations, len(diner_ids))
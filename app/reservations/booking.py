@@ -0,0 +1,527 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Select, and_, asc, delete, exists, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.session import Session
+
+from ..models.db import (
+    DINER_OVERLAP_MESSAGE, Diner, Reservation, RestaurantTable, diner_reservation_association
+)
+from .allocation import ALLOCATION_HORIZON, Booked, Plan, Table, TableMove, plan_booking
+from .combinations import CombinableTable, Combination, cheapest_combination
+from .diner_schedule import DinerSchedule
+from .search import booked_diners_select, overlaps
+
+
+BOOKING_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 0.01
+
+
+class DinerAlreadyBooked(Exception):
+    pass
+
+
+class Cancellation(NamedTuple):
+    # The booked reservations cancelled, ascending; holds of their combined tables went with them
+    reservation_ids: List[int]
+    # (diner id, start, end) of every diner link removed
+    diners: List[Tuple[int, datetime, datetime]]
+    # (table id, start, end) every deleted row freed, holds included
+    released: List[Tuple[int, datetime, datetime]]
+
+
+class Booking(NamedTuple):
+    reservation: Reservation
+    # Reservations moved to another table of the restaurant to make room, only when re-packing
+    moves: List[TableMove]
+    # Tables held next to reservation.table_id when the group sits at combined tables
+    combined_table_ids: List[int]
+
+
+# (reservation id, moved reservations, tables held with it) of an insert
+Allocated = Tuple[int, List[TableMove], List[int]]
+
+
+def begin_immediate(session: Session) -> None:
+    """
+    Takes SQLite's write lock before anything is read, so the free table we pick cannot be taken
+    by another writer between the check and the insert. pysqlite would otherwise only BEGIN at the
+    first INSERT. Outside SQLite, or when the connection already holds a transaction, the overlap
+    guards in models.db still reject a double booking at insert time.
+    """
+    connection = session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+async def async_begin_immediate(session: AsyncSession) -> None:
+    """begin_immediate for aiosqlite, whose adapted connection exposes the same in_transaction flag"""
+    connection = await session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+    raw_connection = await connection.get_raw_connection()
+    if not raw_connection.driver_connection.in_transaction:
+        await connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def free_table_insert(restaurant_id: int, capacity: int, start_datetime: datetime, end_datetime: datetime):
+    """
+    INSERT ... SELECT of the smallest free table that seats the group, in one statement.
+    Returns the new reservation id, or no row when no table is free.
+    """
+    free_table = select(
+        RestaurantTable.id, literal(start_datetime, Reservation.start_datetime.type),
+        literal(end_datetime, Reservation.end_datetime.type)
+    ).where(
+        RestaurantTable.restaurant_id == restaurant_id,
+        RestaurantTable.capacity >= capacity,
+        ~exists().where(and_(Reservation.table_id == RestaurantTable.id, overlaps(start_datetime, end_datetime)))
+    ).order_by(
+        asc(RestaurantTable.capacity), asc(RestaurantTable.id)
+    ).limit(1)
+
+    return insert(Reservation).from_select(
+        ['table_id', 'start_datetime', 'end_datetime'], free_table
+    ).returning(Reservation.id)
+
+
+def attach_diners_insert(reservation_id: int, diner_ids: List[int]):
+    """Links the existing diners of the group with the reservation's window, unknown ids are skipped like before"""
+    return insert(diner_reservation_association).from_select(
+        ['diner_id', 'reservation_id', 'start_datetime', 'end_datetime'],
+        select(
+            Diner.id, literal(reservation_id),
+            select(Reservation.start_datetime).where(Reservation.id == reservation_id).scalar_subquery(),
+            select(Reservation.end_datetime).where(Reservation.id == reservation_id).scalar_subquery()
+        ).where(Diner.id.in_(diner_ids))
+    )
+
+
+def restaurant_tables_select(restaurant_id: int):
+    return select(RestaurantTable.id, RestaurantTable.capacity).where(RestaurantTable.restaurant_id == restaurant_id)
+
+
+def nearby_reservations_select(restaurant_id: int, start_datetime: datetime, end_datetime: datetime):
+    """
+    The restaurant's reservations within twice ALLOCATION_HORIZON of the window with their diner counts:
+    everything a reservation movable for this booking could collide with
+    """
+    holds = Reservation.__table__.alias('holds')
+    return select(
+        Reservation.id, Reservation.table_id, Reservation.start_datetime, Reservation.end_datetime,
+        func.count(diner_reservation_association.c.diner_id),
+        # Combined tables stay together, neither the reservation nor its holds are re-packed
+        and_(Reservation.combined_with_id.is_(None), ~exists().where(holds.c.combined_with_id == Reservation.id))
+    ).join(
+        RestaurantTable, RestaurantTable.id == Reservation.table_id
+    ).outerjoin(
+        diner_reservation_association, diner_reservation_association.c.reservation_id == Reservation.id
+    ).where(
+        RestaurantTable.restaurant_id == restaurant_id,
+        overlaps(start_datetime - 2 * ALLOCATION_HORIZON, end_datetime + 2 * ALLOCATION_HORIZON)
+    ).group_by(Reservation.id)
+
+
+def reservation_insert(table_id: int, start_datetime: datetime, end_datetime: datetime):
+    return insert(Reservation).values(
+        table_id=table_id, start_datetime=start_datetime, end_datetime=end_datetime
+    ).returning(Reservation.id)
+
+
+def free_combinable_tables_select(restaurant_id: int, start_datetime: datetime, end_datetime: datetime):
+    return select(RestaurantTable.id, RestaurantTable.capacity, RestaurantTable.combination_group).where(
+        RestaurantTable.restaurant_id == restaurant_id,
+        RestaurantTable.combination_group.isnot(None),
+        ~exists().where(and_(Reservation.table_id == RestaurantTable.id, overlaps(start_datetime, end_datetime)))
+    )
+
+
+def holds_insert(reservation_id: int, table_ids: List[int], start_datetime: datetime, end_datetime: datetime):
+    """One reservation row per extra table of a combined booking, all pointing at the booked one"""
+    return insert(Reservation).values([
+        {'table_id': table_id, 'start_datetime': start_datetime, 'end_datetime': end_datetime,
+         'combined_with_id': reservation_id}
+        for table_id in table_ids
+    ])
+
+
+def diners_delete(reservation_id: int):
+    """Unlinks the reservation's diners, returning their ids"""
+    return delete(diner_reservation_association).where(
+        diner_reservation_association.c.reservation_id == reservation_id
+    ).returning(diner_reservation_association.c.diner_id)
+
+
+def reservation_delete(reservation_id: int):
+    """
+    Deletes a booked reservation with the holds of its combined tables, returning the (table id,
+    start, end) each row freed. The id of a hold on its own matches nothing.
+    """
+    return delete(Reservation).where(or_(
+        and_(Reservation.id == reservation_id, Reservation.combined_with_id.is_(None)),
+        Reservation.combined_with_id == reservation_id
+    )).returning(Reservation.table_id, Reservation.start_datetime, Reservation.end_datetime)
+
+
+def in_ids(column, ids: List[int]):
+    """column IN the ids, bound as one JSON array rather than a parameter per id"""
+    return column.in_(select(func.json_each(json.dumps(ids)).table_valued('value').c.value))
+
+
+def cancel_ids_select(reservation_ids: List[int]) -> Select:
+    """The booked reservations among reservation_ids, unknown ids and holds of combined tables match nothing"""
+    return select(Reservation.id).where(in_ids(Reservation.id, reservation_ids), Reservation.combined_with_id.is_(None))
+
+
+def cancel_restaurant_select(restaurant_id: int, start_datetime: datetime, end_datetime: datetime) -> Select:
+    """The restaurant's booked reservations overlapping [start_datetime, end_datetime), a seek per table"""
+    return select(Reservation.id).join(RestaurantTable, RestaurantTable.id == Reservation.table_id).where(
+        RestaurantTable.restaurant_id == restaurant_id,
+        Reservation.combined_with_id.is_(None),
+        overlaps(start_datetime, end_datetime)
+    )
+
+
+def cancel_diner_select(diner_id: int, after: Optional[datetime] = None) -> Select:
+    """The reservations the diner is booked on, with `after` only those still running at that time"""
+    links = diner_reservation_association.c
+    statement = select(links.reservation_id).where(links.diner_id == diner_id)
+    return statement if after is None else statement.where(links.end_datetime > after)
+
+
+def cancelled_diners_delete(reservation_ids: List[int]):
+    links = diner_reservation_association.c
+    return delete(diner_reservation_association).where(in_ids(links.reservation_id, reservation_ids)).returning(
+        links.diner_id, links.start_datetime, links.end_datetime
+    )
+
+
+def cancelled_reservations_delete(reservation_ids: List[int]):
+    """The booked reservations and the holds of their combined tables, returning what each row freed"""
+    return delete(Reservation).where(or_(
+        in_ids(Reservation.id, reservation_ids), in_ids(Reservation.combined_with_id, reservation_ids)
+    )).returning(Reservation.table_id, Reservation.start_datetime, Reservation.end_datetime)
+
+
+def table_move_update(reservation_id: int, table_id: int, start_datetime: datetime, end_datetime: datetime):
+    return update(Reservation).where(Reservation.id == reservation_id).values(
+        table_id=table_id, start_datetime=start_datetime, end_datetime=end_datetime
+    )
+
+
+def allocation_plan(table_rows, reservation_rows, size: int, start_datetime: datetime, end_datetime: datetime,
+                    allocation: str, now: datetime) -> Optional[Plan]:
+    """plan_booking over loaded rows; a reservation without diners is sized by its table"""
+    tables = [Table(*row) for row in table_rows]
+    capacities = dict(tables)
+    bookings = [Booked(reservation_id, table_id, booked_start, booked_end, diners or capacities[table_id], movable)
+                for reservation_id, table_id, booked_start, booked_end, diners, movable in reservation_rows]
+    return plan_booking(tables, bookings, size, start_datetime, end_datetime, allocation,
+                        now=now, horizon=ALLOCATION_HORIZON)
+
+
+def booked_diner_ids(session: Session, diner_ids: List[int],
+                     start_datetime: datetime, end_datetime: datetime) -> List[int]:
+    return list(session.execute(booked_diners_select(diner_ids, start_datetime, end_datetime)).scalars())
+
+
+def schedule_clears(diner_schedule: Optional[DinerSchedule], diner_ids: List[int],
+                    start_datetime: datetime, end_datetime: datetime) -> bool:
+    """
+    The diner schedule finds none of the group booked, so the SQL check can be skipped: a booking it
+    missed, made by another process, is still rejected by the diner overlap guard at insert time.
+    Diners it does name are confirmed in SQL, as its deletions may lag other processes too.
+    """
+    return (diner_schedule is not None and diner_schedule.covers(start_datetime)
+            and not diner_schedule.booked_diner_ids(diner_ids, start_datetime, end_datetime))
+
+
+def insert_into_free_table(session: Session, restaurant_id: int, capacity: int,
+                           start_datetime: datetime, end_datetime: datetime) -> Optional[int]:
+    return session.execute(free_table_insert(restaurant_id, capacity, start_datetime, end_datetime)).scalar()
+
+
+def combination_of(table_rows, size: int) -> Optional[Combination]:
+    return cheapest_combination([CombinableTable(*row) for row in table_rows], size)
+
+
+def insert_allocated(session: Session, restaurant_id: int, size: int, start_datetime: datetime,
+                     end_datetime: datetime, allocation: str, now: datetime) -> Optional[Allocated]:
+    """
+    Inserts the reservation on the table the allocation strategy picks, after moving others for it.
+    When no single table can seat the group it takes the cheapest set of free combinable tables.
+    """
+    if allocation == 'smallest':
+        reservation_id = insert_into_free_table(session, restaurant_id, size, start_datetime, end_datetime)
+        if reservation_id is not None:
+            return reservation_id, [], []
+    else:
+        plan = allocation_plan(
+            session.execute(restaurant_tables_select(restaurant_id)).all(),
+            session.execute(nearby_reservations_select(restaurant_id, start_datetime, end_datetime)).all(),
+            size, start_datetime, end_datetime, allocation, now
+        )
+        if plan is not None:
+            for step in plan.steps:
+                session.execute(table_move_update(*step))
+            return session.execute(reservation_insert(plan.table_id, start_datetime, end_datetime)).scalar(), plan.moves, []
+
+    combination = combination_of(
+        session.execute(free_combinable_tables_select(restaurant_id, start_datetime, end_datetime)).all(), size
+    )
+    if combination is None:
+        return None
+    table_id, *held = combination.table_ids
+    reservation_id = session.execute(reservation_insert(table_id, start_datetime, end_datetime)).scalar()
+    session.execute(holds_insert(reservation_id, held, start_datetime, end_datetime))
+    return reservation_id, [], held
+
+
+async def async_insert_allocated(session: AsyncSession, restaurant_id: int, size: int, start_datetime: datetime,
+                                 end_datetime: datetime, allocation: str, now: datetime) -> Optional[Allocated]:
+    if allocation == 'smallest':
+        reservation_id = (await session.execute(
+            free_table_insert(restaurant_id, size, start_datetime, end_datetime)
+        )).scalar()
+        if reservation_id is not None:
+            return reservation_id, [], []
+    else:
+        plan = allocation_plan(
+            (await session.execute(restaurant_tables_select(restaurant_id))).all(),
+            (await session.execute(nearby_reservations_select(restaurant_id, start_datetime, end_datetime))).all(),
+            size, start_datetime, end_datetime, allocation, now
+        )
+        if plan is not None:
+            for step in plan.steps:
+                await session.execute(table_move_update(*step))
+            reservation_id = (await session.execute(reservation_insert(plan.table_id, start_datetime, end_datetime))).scalar()
+            return reservation_id, plan.moves, []
+
+    combination = combination_of(
+        (await session.execute(free_combinable_tables_select(restaurant_id, start_datetime, end_datetime))).all(), size
+    )
+    if combination is None:
+        return None
+    table_id, *held = combination.table_ids
+    reservation_id = (await session.execute(reservation_insert(table_id, start_datetime, end_datetime))).scalar()
+    await session.execute(holds_insert(reservation_id, held, start_datetime, end_datetime))
+    return reservation_id, [], held
+
+
+def attach_diners(session: Session, reservation_id: int, diner_ids: List[int]) -> None:
+    session.execute(attach_diners_insert(reservation_id, diner_ids))
+
+
+def diner_conflict(error: Exception) -> Optional[HTTPException]:
+    """The 409 of a booking rejected because a diner already holds an overlapping reservation, else None"""
+    if isinstance(error, DinerAlreadyBooked):
+        return HTTPException(status_code=409, detail=f"Diners {error.args[0]} already have an overlapping reservation")
+    if isinstance(error, IntegrityError) and DINER_OVERLAP_MESSAGE in str(error.orig):
+        return HTTPException(status_code=409, detail="A diner already has an overlapping reservation")
+    return None
+
+
+def raise_unless_retryable(error: Exception, attempt: int, restaurant_id: int, start_datetime: datetime) -> None:
+    """
+    Turns a failed attempt, already rolled back, into the error the caller sees.
+    Returns when the attempt lost a race to a concurrent writer and should be retried.
+    """
+    conflict = diner_conflict(error)
+    if conflict is not None:
+        if isinstance(error, DinerAlreadyBooked):
+            logging.warning(f"Diners {error.args[0]} already have a reservation overlapping {start_datetime}")
+        raise conflict
+    if isinstance(error, IntegrityError):
+        logging.info(f"Booking attempt {attempt} lost a race for restaurant {restaurant_id}, retrying")
+        return
+    if 'locked' not in str(error.orig) and 'busy' not in str(error.orig):
+        raise error
+    logging.info(f"Booking attempt {attempt} timed out on the write lock, retrying")
+
+
+def backoff_seconds(attempt: int) -> float:
+    return random.uniform(0, RETRY_BACKOFF_SECONDS * attempt)
+
+
+def allocate_booking(session: Session, restaurant_id: int, diner_ids: List[int], start_datetime: datetime,
+                     end_datetime: datetime, allocation: str, now: datetime,
+                     diner_schedule: Optional[DinerSchedule] = None) -> Optional[Allocated]:
+    """
+    One booking inside the session's open transaction, neither committed nor rolled back: checks the
+    diners are free, inserts the reservation where the allocation puts it and links the diners.
+    None when no table is free, raises DinerAlreadyBooked when a diner is booked.
+    """
+    if not schedule_clears(diner_schedule, diner_ids, start_datetime, end_datetime):
+        conflicting_diners = booked_diner_ids(session, diner_ids, start_datetime, end_datetime)
+        if conflicting_diners:
+            raise DinerAlreadyBooked(conflicting_diners)
+
+    allocated = insert_allocated(session, restaurant_id, len(diner_ids), start_datetime, end_datetime, allocation, now)
+    if allocated is not None:
+        attach_diners(session, allocated[0], diner_ids)
+    return allocated
+
+
+async def async_allocate_booking(session: AsyncSession, restaurant_id: int, diner_ids: List[int],
+                                 start_datetime: datetime, end_datetime: datetime, allocation: str, now: datetime,
+                                 diner_schedule: Optional[DinerSchedule] = None) -> Optional[Allocated]:
+    if not schedule_clears(diner_schedule, diner_ids, start_datetime, end_datetime):
+        conflicting_diners = list((await session.execute(
+            booked_diners_select(diner_ids, start_datetime, end_datetime)
+        )).scalars())
+        if conflicting_diners:
+            raise DinerAlreadyBooked(conflicting_diners)
+
+    allocated = await async_insert_allocated(session, restaurant_id, len(diner_ids), start_datetime,
+                                             end_datetime, allocation, now)
+    if allocated is not None:
+        await session.execute(attach_diners_insert(allocated[0], diner_ids))
+    return allocated
+
+
+def book_atomically(session: Session, restaurant_id: int, diner_ids: List[int],
+                    start_datetime: datetime, end_datetime: datetime, allocation: str = 'smallest',
+                    now: Optional[datetime] = None, diner_schedule: Optional[DinerSchedule] = None) -> Optional[Booking]:
+    """
+    Books a free table of the restaurant for the group, the smallest one unless another allocation
+    strategy is given; reservations starting after now (default the current time) may be re-packed.
+    A group no single table seats gets the cheapest set of free combinable tables instead.
+    Each attempt runs in one write transaction; lock timeouts and guard violations caused by a
+    concurrent writer are rolled back and retried with jittered backoff.
+    Returns None when no table is free and raises HTTPException 409 when a diner is already booked.
+    With a diner_schedule the double-booking check is answered in memory, see schedule_clears.
+    """
+    now = now or datetime.now()
+    for attempt in range(1, BOOKING_ATTEMPTS + 1):
+        try:
+            begin_immediate(session)
+            allocated = allocate_booking(session, restaurant_id, diner_ids, start_datetime, end_datetime,
+                                         allocation, now, diner_schedule)
+            if allocated is None:
+                session.rollback()
+                return None
+
+            reservation_id, moves, combined_table_ids = allocated
+            session.commit()
+            return Booking(session.get(Reservation, reservation_id), moves, combined_table_ids)
+        except (DinerAlreadyBooked, IntegrityError, OperationalError) as e:
+            session.rollback()
+            raise_unless_retryable(e, attempt, restaurant_id, start_datetime)
+        time.sleep(backoff_seconds(attempt))
+
+    raise HTTPException(status_code=503, detail="Could not book under contention, try again")
+
+
+async def async_book_atomically(session: AsyncSession, restaurant_id: int, diner_ids: List[int],
+                                start_datetime: datetime, end_datetime: datetime, allocation: str = 'smallest',
+                                now: Optional[datetime] = None,
+                                diner_schedule: Optional[DinerSchedule] = None) -> Optional[Booking]:
+    """book_atomically on an AsyncSession, same statements and retry policy"""
+    now = now or datetime.now()
+    for attempt in range(1, BOOKING_ATTEMPTS + 1):
+        try:
+            await async_begin_immediate(session)
+            allocated = await async_allocate_booking(session, restaurant_id, diner_ids, start_datetime, end_datetime,
+                                                     allocation, now, diner_schedule)
+            if allocated is None:
+                await session.rollback()
+                return None
+
+            reservation_id, moves, combined_table_ids = allocated
+            await session.commit()
+            return Booking(await session.get(Reservation, reservation_id), moves, combined_table_ids)
+        except (DinerAlreadyBooked, IntegrityError, OperationalError) as e:
+            await session.rollback()
+            raise_unless_retryable(e, attempt, restaurant_id, start_datetime)
+        await asyncio.sleep(backoff_seconds(attempt))
+
+    raise HTTPException(status_code=503, detail="Could not book under contention, try again")
+
+
+async def async_book_in_transaction(session: AsyncSession, restaurant_id: int, diner_ids: List[int],
+                                    start_datetime: datetime, end_datetime: datetime, allocation: str = 'smallest',
+                                    now: Optional[datetime] = None,
+                                    diner_schedule: Optional[DinerSchedule] = None) -> Optional[Booking]:
+    """
+    async_allocate_booking with its Booking, for a writer that commits many bookings together (see
+    write_queue). The reservation is loaded before the commit, so the session must not expire on commit.
+    """
+    allocated = await async_allocate_booking(session, restaurant_id, diner_ids, start_datetime, end_datetime,
+                                             allocation, now or datetime.now(), diner_schedule)
+    if allocated is None:
+        return None
+    reservation_id, moves, combined_table_ids = allocated
+    return Booking(await session.get(Reservation, reservation_id), moves, combined_table_ids)
+
+
+def cancel_in_transaction(session: Session, targets: Select) -> Cancellation:
+    """
+    Cancels the reservations `targets` selects inside the session's open transaction: their ids are
+    read once, then the diner links and the reservations with their holds go in one DELETE each,
+    however many there are.
+    """
+    reservation_ids = sorted(session.execute(targets).scalars().all())
+    if not reservation_ids:
+        return Cancellation([], [], [])
+    diners = session.execute(cancelled_diners_delete(reservation_ids)).all()
+    released = session.execute(cancelled_reservations_delete(reservation_ids)).all()
+    return Cancellation(reservation_ids, diners, released)
+
+
+async def async_cancel_in_transaction(session: AsyncSession, targets: Select) -> Cancellation:
+    reservation_ids = sorted((await session.execute(targets)).scalars().all())
+    if not reservation_ids:
+        return Cancellation([], [], [])
+    diners = (await session.execute(cancelled_diners_delete(reservation_ids))).all()
+    released = (await session.execute(cancelled_reservations_delete(reservation_ids))).all()
+    return Cancellation(reservation_ids, diners, released)
+
+
+def cancel_atomically(session: Session, targets: Select) -> Cancellation:
+    """
+    cancel_in_transaction in one write transaction, taken before the targets are read so a booking
+    committed meanwhile cannot slip between the selection and the deletes
+    """
+    try:
+        begin_immediate(session)
+        cancellation = cancel_in_transaction(session, targets)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return cancellation
+
+
+async def async_cancel_atomically(session: AsyncSession, targets: Select) -> Cancellation:
+    try:
+        await async_begin_immediate(session)
+        cancellation = await async_cancel_in_transaction(session, targets)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    return cancellation
+
+
+async def async_delete_in_transaction(session: AsyncSession, reservation_id: int) -> Tuple[List[int], List[Tuple]]:
+    """
+    Deletes the reservation inside the session's open transaction, returning its diner ids and the
+    (table id, start, end) each deleted row freed. Raises HTTPException 400 when there is no such reservation.
+    """
+    diner_ids = (await session.execute(diners_delete(reservation_id))).scalars().all()
+    released = (await session.execute(reservation_delete(reservation_id))).all()
+    if not released:
+        # Nothing matched, so nothing was written
+        logging.warning(f"Could not find reservation for id {reservation_id}")
+        raise HTTPException(status_code=400, detail="Reservation not found")
+    return diner_ids, released
@@ -0,0 +1,237 @@
+"""
+Keeps a process' in-memory structures coherent with the writes of every process on the database.
+
+Each uvicorn worker builds its own availability index, diner schedule, search cache and reference
+snapshot. Without a feed a worker only learns of its own bookings and deletions, so with several
+workers on one database the others' writes leave it serving stale availability until a restart or
+the cache TTL. CHANGE_LOG_TRIGGERS log every committed change to reservation_changes in the writer's
+own transaction, and a ChangeFeed applies the rows past the last one its process has seen:
+
+    booked / released               the table's window in the index, searches overlapping it in the cache
+    diner_booked / diner_released   the diner's window in the schedule, searches of groups with the diner
+    reference                       the index's names, masks and tables, the whole cache, and the
+                                    reference snapshot is rebuilt
+
+The managers catch up before every search and write, so a worker never answers from structures older
+than the last commit it could see. The feed reads on a connection of its own that never writes, whose
+PRAGMA data_version moves whenever any other connection commits: when nothing changed, catching up is
+that one pragma. The database file is the channel, no socket or shared memory between the workers, and
+it needs a file database, on an in-memory one every session shares the feed's connection. The managers'
+own writes come back through the feed too, in commit order with everyone else's.
+
+The triggers cost every write a row, so they only exist while the deployment runs a feed: a process
+starting with one installs them (install_change_log), one starting without removes them. The log is
+pruned to CHANGE_RETENTION rows periodically by processes running a feed, by the archive job or with
+
+    python -m app.reservations.change_feed
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+
+from sqlalchemy import delete, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.session import Session
+
+from ..models.db import (
+    CHANGE_BOOKED, CHANGE_DINER_BOOKED, CHANGE_DINER_RELEASED, CHANGE_LOG_TRIGGERS, CHANGE_PRUNED, CHANGE_REFERENCE,
+    CHANGE_RELEASED, reservation_changes
+)
+from .availability_index import AvailabilityIndex
+from .diner_schedule import DinerSchedule
+from .search_cache import SearchCache
+
+
+# Rows kept by prune_changes. A process further behind than that finds a gap in the log, see ChangeFeed.apply
+CHANGE_RETENTION = 100_000
+
+# AUTOINCREMENT's counter rather than max(id), which goes back down when the newest rows are pruned
+CHANGE_VERSION = text("SELECT coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'reservation_changes'), 0)")
+
+
+def install_change_log(session: Session) -> None:
+    """Creates the triggers logging changes, before the first feed's snapshot so no commit after it is missed"""
+    for _, ddl in CHANGE_LOG_TRIGGERS:
+        session.execute(ddl)
+    session.commit()
+
+
+def remove_change_log(session: Session) -> None:
+    """Drops the triggers, writes stop being logged. The rows left are pruned like any other"""
+    for name, _ in CHANGE_LOG_TRIGGERS:
+        session.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+    session.commit()
+
+
+def begin_snapshot(session: Session) -> None:
+    """
+    Opens a read transaction, so the change version and the structures built after it in the same
+    session see exactly the same commits. pysqlite would not begin one before a SELECT on its own.
+    """
+    session.connection().exec_driver_sql('BEGIN')
+
+
+def change_version(session: Session) -> int:
+    return session.execute(CHANGE_VERSION).scalar()
+
+
+class Change(NamedTuple):
+    id: int
+    kind: str
+    restaurant_id: Optional[int]
+    table_id: Optional[int]
+    diner_id: Optional[int]
+    start_datetime: Optional[datetime]
+    end_datetime: Optional[datetime]
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Change":
+        """A row of the DB-API cursor, windows still the strings SQLAlchemy stored"""
+        *values, start, end = row
+        return cls(*values, *(None if value is None else datetime.fromisoformat(value) for value in (start, end)))
+
+
+CHANGES_AFTER = (
+    "SELECT id, kind, restaurant_id, table_id, diner_id, start_datetime, end_datetime "
+    "FROM reservation_changes WHERE id > ? ORDER BY id"
+)
+
+
+def prune_changes(session: Session, keep: int = CHANGE_RETENTION) -> int:
+    """
+    Deletes all but the newest `keep` changes. Returns the number pruned. Ids also skip the reference
+    markers replaced by later ones, so the last pruned row stays behind as a CHANGE_PRUNED row: a feed
+    reading it has lost the changes up to its id, one skipping ids without reading it has not.
+    """
+    # The newest rows are counted rather than the ids, for the same reason
+    last = session.scalar(select(reservation_changes.c.id).order_by(reservation_changes.c.id.desc())
+                          .limit(1).offset(keep))
+    if last is None:
+        return 0
+    pruned = session.execute(delete(reservation_changes).where(reservation_changes.c.id < last)).rowcount
+    pruned += session.execute(update(reservation_changes).where(
+        reservation_changes.c.id == last, reservation_changes.c.kind != CHANGE_PRUNED
+    ).values(kind=CHANGE_PRUNED, restaurant_id=None, table_id=None, diner_id=None,
+             start_datetime=None, end_datetime=None)).rowcount
+    session.commit()
+    return pruned
+
+
+class ChangeFeed:
+    """
+    Applies reservation_changes to the process' structures, the ones given may be None. `version` is
+    the change the structures were built at, read in their build's transaction (see begin_snapshot).
+    A reference change reloads the index's names, masks and tables on a session of engine, and
+    on_reference_change is called, without arguments, once per batch holding reference changes.
+    The feed's connection is taken out of engine's pool for good, close() closes it.
+    """
+    def __init__(self, engine: Engine, version: int, availability_index: Optional[AvailabilityIndex] = None,
+                 search_cache: Optional[SearchCache] = None, diner_schedule: Optional[DinerSchedule] = None,
+                 on_reference_change: Optional[Callable[[], None]] = None) -> None:
+        self.engine = engine
+        self.version = version
+        self.availability_index = availability_index
+        self.search_cache = search_cache
+        self.diner_schedule = diner_schedule
+        self.on_reference_change = on_reference_change
+        self.applied = self.gaps = 0
+        self.connection = engine.raw_connection()
+        self.connection.detach()
+        # Unknown until the first call reads it, commits made since `version` are then read in any case
+        self.data_version: Optional[int] = None
+        # Held from reading to applying, so a caller finding nothing new knows the structures are current
+        self._lock = threading.RLock()
+
+    def catch_up(self) -> int:
+        """Applies every change committed since the last call. Returns how many were new"""
+        with self._lock:
+            cursor = self.connection.cursor()
+            try:
+                data_version = cursor.execute('PRAGMA data_version').fetchone()[0]
+                if data_version == self.data_version:
+                    return 0
+                # Read before the changes, a commit in between moves it again and the next call reads that one
+                self.data_version = data_version
+                changes = [Change.from_row(row) for row in cursor.execute(CHANGES_AFTER, (self.version,))]
+            finally:
+                cursor.close()
+            return self.apply(changes)
+
+    def apply(self, changes: Sequence[Change]) -> int:
+        """
+        Changes in id order. Those at or below the version are skipped, so each is applied once: the
+        index and schedule would count a window added twice. Ids skip replaced reference markers, only
+        a CHANGE_PRUNED row (see prune_changes) tells changes were lost.
+        """
+        applied = 0
+        reference_changed = False
+        with self._lock:
+            for change in changes:
+                if change.id <= self.version:
+                    continue
+                if change.kind == CHANGE_PRUNED:
+                    self._lost(self.version + 1, change.id)
+                else:
+                    self._apply(change)
+                    reference_changed = reference_changed or change.kind == CHANGE_REFERENCE
+                    applied += 1
+                self.version = change.id
+            self.applied += applied
+        if reference_changed and self.on_reference_change is not None:
+            self.on_reference_change()
+        return applied
+
+    def _apply(self, change: Change) -> None:
+        window = (change.start_datetime, change.end_datetime)
+        if change.kind == CHANGE_BOOKED:
+            if self.availability_index is not None:
+                self.availability_index.add_reservation(change.table_id, *window)
+            if self.search_cache is not None:
+                self.search_cache.invalidate_booking(change.restaurant_id, *window)
+        elif change.kind == CHANGE_RELEASED:
+            if self.availability_index is not None:
+                self.availability_index.remove_reservation(change.table_id, *window)
+            if self.search_cache is not None:
+                self.search_cache.invalidate_release(*window)
+        elif change.kind == CHANGE_DINER_BOOKED:
+            if self.diner_schedule is not None:
+                self.diner_schedule.add([change.diner_id], *window)
+            if self.search_cache is not None:
+                self.search_cache.invalidate_booking(change.restaurant_id, *window, diner_ids=[change.diner_id])
+        elif change.kind == CHANGE_DINER_RELEASED:
+            if self.diner_schedule is not None:
+                self.diner_schedule.remove([change.diner_id], *window)
+            if self.search_cache is not None:
+                self.search_cache.invalidate_release(*window)
+        elif change.kind == CHANGE_REFERENCE:
+            # In log order, so the bookings of a table added here find it in the index
+            if self.availability_index is not None:
+                with Session(self.engine) as session:
+                    self.availability_index.reload_reference(session)
+            if self.search_cache is not None:
+                self.search_cache.clear()
+
+    def _lost(self, first: int, last: int) -> None:
+        """
+        Changes pruned before this process read them. Cached searches can simply go, the index and the
+        schedule cannot be repaired from the log and stay off by those changes until the worker restarts.
+        """
+        self.gaps += 1
+        if self.search_cache is not None:
+            self.search_cache.clear()
+        logging.error(f"Changes {first} to {last} were pruned before this process applied them, "
+                      f"restart it to rebuild its availability index and diner schedule")
+
+    def stats(self) -> Dict[str, int]:
+        return {"version": self.version, "applied": self.applied, "gaps": self.gaps}
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    from ..models.db import live_session
+    logging.basicConfig(level=logging.INFO)
+    with live_session() as session:
+        logging.info(f"Pruned {prune_changes(session)} changes")
@@ -0,0 +1,106 @@
+"""
+Seating a group no single free table fits on several combinable tables.
+
+Tables of a restaurant sharing a combination_group can be pushed together. The cheapest set is the
+one with the fewest seats at or above the group size, then the fewest tables: a bounded subset sum
+solved by branch and bound over the distinct capacities of the free tables, so dozens of tables with
+a handful of sizes stay a small search. Largest capacities are tried first, the first set found
+already seats the group, so a search cut short by the node budget still returns a valid one.
+A group fits a combination group exactly when its free capacities add up to at least the group size,
+which is what search checks in SQL (search.has_free_combination) and the availability index in memory.
+"""
+from collections import defaultdict
+from functools import reduce
+from itertools import groupby
+from math import gcd
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+# Branches explored per combination group before the best set found so far is taken
+SEARCH_NODE_LIMIT = 10_000
+
+
+class CombinableTable(NamedTuple):
+    id: int
+    capacity: int
+    combination_group: int
+
+
+class Combination(NamedTuple):
+    seats: int
+    table_ids: List[int]
+
+
+def cheapest_subset(capacities: List[Tuple[int, List[int]]], size: int,
+                    node_limit: int = SEARCH_NODE_LIMIT) -> Optional[Combination]:
+    """
+    Fewest seats, then fewest tables, seating `size` from (capacity, table ids) pairs sorted by
+    capacity descending. Tables of equal capacity are interchangeable, the lowest ids are used.
+    """
+    remaining = [0] * (len(capacities) + 1)
+    for position in range(len(capacities) - 1, -1, -1):
+        capacity, table_ids = capacities[position]
+        remaining[position] = remaining[position + 1] + capacity * len(table_ids)
+    if remaining[0] < size:
+        return None
+
+    # Every set seats a multiple of the capacities' gcd, no set can seat fewer than `fewest`
+    step = reduce(gcd, (capacity for capacity, _ in capacities))
+    fewest = -(-size // step) * step
+    best: List = [None]
+    taken = [0] * len(capacities)
+    nodes = 0
+
+    def search(position: int, seats: int, tables: int) -> None:
+        nonlocal nodes
+        nodes += 1
+        if seats >= size:
+            if best[0] is None or (seats, tables) < best[0][:2]:
+                best[0] = (seats, tables, list(taken))
+            return
+        # Out of tables or unable to reach the group
+        if position == len(capacities) or seats + remaining[position] < size:
+            return
+        capacity, table_ids = capacities[position]
+        # Unable to beat the best set, or out of budget once there is one
+        if best[0] is not None:
+            best_seats, best_tables, _ = best[0]
+            if seats >= best_seats or nodes > node_limit:
+                return
+            if best_seats == fewest and tables + -(-(size - seats) // capacity) >= best_tables:
+                return
+        # More tables of this size than needed to reach the group only add seats
+        most = min(len(table_ids), -(-(size - seats) // capacity))
+        for count in range(most, -1, -1):
+            taken[position] = count
+            search(position + 1, seats + count * capacity, tables + count)
+        taken[position] = 0
+
+    search(0, 0, 0)
+    if best[0] is None:
+        return None
+    seats, _, counts = best[0]
+    return Combination(seats, [table_id for (_, table_ids), count in zip(capacities, counts)
+                               for table_id in table_ids[:count]])
+
+
+def cheapest_combination(tables: Iterable[CombinableTable], size: int,
+                         node_limit: int = SEARCH_NODE_LIMIT) -> Optional[Combination]:
+    """
+    The cheapest set of free combinable `tables` seating `size`, across their combination groups,
+    ties broken by fewer tables then lower ids. Table ids come largest table first.
+    """
+    groups: Dict[int, List[CombinableTable]] = defaultdict(list)
+    for table in tables:
+        groups[table.combination_group].append(table)
+
+    best = None
+    for group in groups.values():
+        ordered = sorted(group, key=lambda table: (-table.capacity, table.id))
+        capacities = [(capacity, [table.id for table in same])
+                      for capacity, same in groupby(ordered, key=lambda table: table.capacity)]
+        combination = cheapest_subset(capacities, size, node_limit)
+        if combination is not None and (best is None or (combination.seats, len(combination.table_ids), combination.table_ids)
+                                        < (best.seats, len(best.table_ids), best.table_ids)):
+            best = combination
+    return best
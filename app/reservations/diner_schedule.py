@@ -0,0 +1,98 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm.session import Session
+
+from ..models.db import diner_reservation_association
+from .availability_index import timestamp
+
+
+class DinerCalendar:
+    """One diner's reservation windows, sorted by start"""
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self) -> None:
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def book(self, start: int, end: int) -> None:
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+
+    def release(self, start: int, end: int) -> bool:
+        position = bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start and self.ends[position] != end:
+            position += 1
+        if position == len(self.starts) or self.starts[position] != start:
+            return False
+        del self.starts[position]
+        del self.ends[position]
+        return True
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """A diner's windows never overlap each other, only the last one starting before `end` can reach into the window"""
+        position = bisect_left(self.starts, end)
+        return position > 0 and self.ends[position - 1] > start
+
+
+class DinerSchedule:
+    """
+    Process-local copy of every diner's reservation windows, so double-booking checks are a bisect
+    per diner instead of SQL. Like AvailabilityIndex the database stays the source of truth: the
+    managers apply their own bookings and deletions after they commit, and build() reloads.
+
+    Built with `since`, windows ending before it are not loaded and covers() is False for searches
+    starting before it, which go to SQL instead. That keeps long diner histories out of memory.
+    """
+    def __init__(self, since: Optional[datetime] = None) -> None:
+        self.since = since
+        self.diners: Dict[int, DinerCalendar] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, session: Session, since: Optional[datetime] = None) -> "DinerSchedule":
+        schedule = cls(since)
+        links = diner_reservation_association.c
+        statement = select(links.diner_id, links.start_datetime, links.end_datetime)
+        if since is not None:
+            statement = statement.where(links.end_datetime > since)
+        for diner_id, start_datetime, end_datetime in session.execute(statement.order_by(links.diner_id, links.start_datetime)):
+            schedule.add([diner_id], start_datetime, end_datetime)
+        logging.info(f"Diner schedule built: {len(schedule.diners)} diners, {schedule.reservation_count()} reservations")
+        return schedule
+
+    def covers(self, start_datetime: datetime) -> bool:
+        return self.since is None or start_datetime >= self.since
+
+    def add(self, diner_ids: Iterable[int], start_datetime: datetime, end_datetime: datetime) -> None:
+        start, end = timestamp(start_datetime), timestamp(end_datetime)
+        with self._lock:
+            for diner_id in diner_ids:
+                calendar = self.diners.get(diner_id)
+                if calendar is None:
+                    calendar = self.diners[diner_id] = DinerCalendar()
+                calendar.book(start, end)
+
+    def remove(self, diner_ids: Iterable[int], start_datetime: datetime, end_datetime: datetime) -> None:
+        start, end = timestamp(start_datetime), timestamp(end_datetime)
+        with self._lock:
+            for diner_id in diner_ids:
+                calendar = self.diners.get(diner_id)
+                if calendar is not None:
+                    calendar.release(start, end)
+
+    def booked_diner_ids(self, diner_ids: List[int], start_datetime: datetime, end_datetime: datetime) -> List[int]:
+        """Diners of the group holding a reservation overlapping the window, like search.booked_diners_select"""
+        start, end = timestamp(start_datetime), timestamp(end_datetime)
+        with self._lock:
+            return [diner_id for diner_id in diner_ids
+                    if diner_id in self.diners and self.diners[diner_id].overlaps(start, end)]
+
+    def reservation_count(self) -> int:
+        return sum(len(calendar.starts) for calendar in self.diners.values())
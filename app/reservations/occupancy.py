@@ -0,0 +1,84 @@
+"""
+Booked and free tables per restaurant, hour and table capacity.
+
+restaurant_occupancy holds, for every hour slot with a booking, how many of a restaurant's tables of
+each capacity are busy at some point of that hour. The triggers in models.db keep it in step with
+every insert, move and delete on reservations, inside the same transaction, so it is never behind a
+committed booking. Free tables are the restaurant's tables of that capacity less the booked ones.
+Archived reservations stay counted, so past days read the same before and after the archive job.
+rebuild_occupancy counts it again from scratch, live and archived reservations, for a database loaded
+with the triggers off or to check them.
+
+Searches may use it as a pre-filter (search.has_occupancy_room, BOOKING_SEARCH_OCCUPANCY_PREFILTER):
+a restaurant with every table big enough for the group booked in an hour of the window is skipped
+before its tables are checked one by one.
+
+    python -m app.reservations.occupancy
+"""
+import logging
+from datetime import date
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from sqlalchemy import Select, func, select
+from sqlalchemy.orm.session import Session
+
+from ..models.db import OCCUPANCY_REBUILD, RestaurantTable, restaurant_occupancy
+from .booking import begin_immediate
+
+
+OCCUPANCY_MAX_DAYS = 31
+
+
+class HourOccupancy(NamedTuple):
+    day: date
+    hour: int
+    capacity: int
+    tables: int
+    booked: int
+
+    @property
+    def free(self) -> int:
+        return self.tables - self.booked
+
+
+def table_counts_select(restaurant_id: int) -> Select:
+    """(capacity, tables) of the restaurant, a seek on its (restaurant_id, capacity) index"""
+    return select(RestaurantTable.capacity, func.count()).where(
+        RestaurantTable.restaurant_id == restaurant_id
+    ).group_by(RestaurantTable.capacity).order_by(RestaurantTable.capacity)
+
+
+def occupancy_select(restaurant_id: int, first_day: date, last_day: date) -> Select:
+    """(day, hour, capacity, booked_tables) of the restaurant's booked hours from first_day to last_day"""
+    occupancy = restaurant_occupancy.c
+    return select(occupancy.day, occupancy.hour, occupancy.capacity, occupancy.booked_tables).where(
+        occupancy.restaurant_id == restaurant_id,
+        occupancy.day >= first_day,
+        occupancy.day <= last_day
+    ).order_by(occupancy.day, occupancy.hour, occupancy.capacity)
+
+
+def hourly_occupancy(table_counts: Sequence[Tuple[int, int]],
+                     booked_rows: Sequence[Tuple[date, int, int, int]]) -> Tuple[Dict[int, int], List[HourOccupancy]]:
+    """Tables per capacity, and every booked hour with the tables of its capacity"""
+    tables = {capacity: count for capacity, count in table_counts}
+    return tables, [HourOccupancy(day, hour, capacity, tables.get(capacity, 0), booked)
+                    for day, hour, capacity, booked in booked_rows]
+
+
+def rebuild_occupancy(session: Session) -> int:
+    """Counts restaurant_occupancy again from every reservation in one transaction, returns its rows"""
+    begin_immediate(session)
+    for statement in OCCUPANCY_REBUILD:
+        session.execute(statement)
+    rows = session.scalar(select(func.count()).select_from(restaurant_occupancy))
+    session.commit()
+    logging.info(f"Rebuilt {rows} occupancy rows")
+    return rows
+
+
+if __name__ == '__main__':
+    from ..models.db import live_session
+    logging.basicConfig(level=logging.INFO)
+    with live_session() as session:
+        rebuild_occupancy(session)
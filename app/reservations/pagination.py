@@ -0,0 +1,55 @@
+import base64
+import binascii
+import logging
+from bisect import bisect_right
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from .availability_index import IndexedRestaurant
+
+
+CURSOR_PREFIX = "after:"
+
+
+def encode_cursor(after_id: int) -> str:
+    """Opaque to clients: the last restaurant id of a page, base64url encoded"""
+    return base64.urlsafe_b64encode(f"{CURSOR_PREFIX}{after_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """The restaurant id a cursor resumes after, ValueError for anything encode_cursor did not produce"""
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed cursor {cursor!r}") from e
+    if not decoded.startswith(CURSOR_PREFIX) or not decoded[len(CURSOR_PREFIX):].isdigit():
+        raise ValueError(f"Malformed cursor {cursor!r}")
+    return int(decoded[len(CURSOR_PREFIX):])
+
+
+def after_cursor(cursor: Optional[str]) -> Optional[int]:
+    """decode_cursor for the managers, 400 for a cursor this API did not hand out"""
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        logging.warning(f"{e}")
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_of(rows: Sequence[IndexedRestaurant], limit: int) -> Tuple[List[IndexedRestaurant], Optional[str]]:
+    """
+    Splits up to limit + 1 rows, ascending by id, into the page and the cursor of the next one.
+    The extra row only tells whether a next page exists.
+    """
+    page = [IndexedRestaurant(row.id, row.name) for row in rows[:limit]]
+    next_cursor = encode_cursor(page[-1].id) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def rows_after(rows: Sequence[IndexedRestaurant], after_id: Optional[int], limit: int) -> List[IndexedRestaurant]:
+    """Keyset page of an in-memory result sorted by id, with the extra row page_of looks for"""
+    first = 0 if after_id is None else bisect_right(rows, after_id, key=lambda row: row.id)
+    return list(rows[first:first + limit + 1])
@@ -0,0 +1,142 @@
+"""
+Searches ranked by distance from the group.
+
+The group stands at the centroid of its diners' homes. Restaurants are pruned to a bounding box around
+it through the restaurant_locations R*Tree, only those are checked for a free table, and the free ones
+are ranked by great-circle distance. With nearest_k the box starts small and grows until it holds k
+restaurants within its radius, so a neighbourhood query never checks the rest of the city.
+"""
+from datetime import datetime
+from math import asin, cos, degrees, pi, radians, sin, sqrt
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.session import Session
+
+from ..models.db import Diner, Restaurant, restaurant_locations
+from .search import group_is_free, group_mask_clause, has_free_combination, has_free_table, satisfies_group
+
+
+EARTH_RADIUS_KM = 6371.0088
+# Half the circumference, every point on earth is this close
+MAX_RADIUS_KM = pi * EARTH_RADIUS_KM
+FIRST_RADIUS_KM = 1.0
+RADIUS_GROWTH = 4
+
+Box = Tuple[float, float, float, float]
+
+
+class NearbyRestaurant(NamedTuple):
+    id: int
+    name: str
+    distance_km: float
+
+
+def haversine_km(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """Great-circle distance between two points in degrees"""
+    half_latitude = radians(other_latitude - latitude) / 2
+    half_longitude = radians(other_longitude - longitude) / 2
+    a = sin(half_latitude) ** 2 + cos(radians(latitude)) * cos(radians(other_latitude)) * sin(half_longitude) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float) -> Box:
+    """
+    (min latitude, max latitude, min longitude, max longitude) holding every point within radius_km.
+    Longitudes span all of [-180, 180] when the circle reaches a pole or crosses the antimeridian.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    min_latitude, max_latitude = latitude - degrees(angle), latitude + degrees(angle)
+    if min_latitude <= -90 or max_latitude >= 90 or angle >= pi / 2:
+        return max(min_latitude, -90.0), min(max_latitude, 90.0), -180.0, 180.0
+    spread = degrees(asin(min(1.0, sin(angle) / cos(radians(latitude)))))
+    if longitude - spread < -180 or longitude + spread > 180:
+        return min_latitude, max_latitude, -180.0, 180.0
+    return min_latitude, max_latitude, longitude - spread, longitude + spread
+
+
+def search_radii(max_distance_km: Optional[float], nearest_k: Optional[int]) -> Iterator[float]:
+    """A single search at max_distance_km, or growing radii up to it while looking for nearest_k"""
+    limit = max_distance_km or MAX_RADIUS_KM
+    if nearest_k is None:
+        yield limit
+        return
+    radius = FIRST_RADIUS_KM
+    while radius < limit:
+        yield radius
+        radius *= RADIUS_GROWTH
+    yield limit
+
+
+def group_centroid_select(diner_ids: List[int]) -> Select:
+    """
+    Mean latitude and longitude of the diners' homes, both NULL when none has one. Averaging degrees is
+    close enough at city scale, away from the antimeridian.
+    """
+    return select(func.avg(Diner.home_latitude), func.avg(Diner.home_longitude)).where(
+        Diner.id.in_(diner_ids), Diner.home_latitude.isnot(None), Diner.home_longitude.isnot(None)
+    )
+
+
+def nearby_restaurants_select(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime,
+                              box: Box, group_mask: Optional[int] = None) -> Select:
+    """
+    (id, name, latitude, longitude) of the restaurants in the box with a table free for the group.
+    SQLite reads the box's ids from the R*Tree, then checks each of those restaurants like a search page does.
+    """
+    locations = restaurant_locations.c
+    min_latitude, max_latitude, min_longitude, max_longitude = box
+    in_box = select(locations.id).where(
+        locations.max_latitude >= min_latitude, locations.min_latitude <= max_latitude,
+        locations.max_longitude >= min_longitude, locations.min_longitude <= max_longitude,
+    )
+    return select(Restaurant.id, Restaurant.name, Restaurant.latitude, Restaurant.longitude).where(
+        Restaurant.id.in_(in_box),
+        group_is_free(diner_ids, start_datetime, end_datetime),
+        satisfies_group(Restaurant.dietary_restriction_mask, group_mask_clause(diner_ids, group_mask)),
+        or_(has_free_table(len(diner_ids), start_datetime, end_datetime),
+            has_free_combination(len(diner_ids), start_datetime, end_datetime))
+    )
+
+
+def ranked(rows: Sequence, centroid: Tuple[float, float], radius_km: float) -> List[NearbyRestaurant]:
+    """The rows within radius_km of the centroid, nearest first, ties by id"""
+    nearby = [NearbyRestaurant(id, name, haversine_km(*centroid, latitude, longitude))
+              for id, name, latitude, longitude in rows]
+    return sorted((restaurant for restaurant in nearby if restaurant.distance_km <= radius_km),
+                  key=lambda restaurant: (restaurant.distance_km, restaurant.id))
+
+
+def nearby_restaurants(session: Session, diner_ids: List[int], start_datetime: datetime, end_datetime: datetime,
+                       centroid: Tuple[float, float], max_distance_km: Optional[float] = None,
+                       nearest_k: Optional[int] = None, group_mask: Optional[int] = None) -> List[NearbyRestaurant]:
+    """
+    Free restaurants within max_distance_km of the centroid, or the nearest_k of them, or both, nearest first.
+    Every restaurant closer than the last radius searched was seen, so once nearest_k are found within
+    it they are the nearest overall.
+    """
+    found = []
+    for radius in search_radii(max_distance_km, nearest_k):
+        box = bounding_box(*centroid, radius)
+        rows = session.execute(nearby_restaurants_select(diner_ids, start_datetime, end_datetime, box, group_mask)).all()
+        found = ranked(rows, centroid, radius)
+        if nearest_k is not None and len(found) >= nearest_k:
+            break
+    return found[:nearest_k]
+
+
+async def async_nearby_restaurants(session: AsyncSession, diner_ids: List[int], start_datetime: datetime,
+                                   end_datetime: datetime, centroid: Tuple[float, float],
+                                   max_distance_km: Optional[float] = None, nearest_k: Optional[int] = None,
+                                   group_mask: Optional[int] = None) -> List[NearbyRestaurant]:
+    found = []
+    for radius in search_radii(max_distance_km, nearest_k):
+        box = bounding_box(*centroid, radius)
+        rows = (await session.execute(
+            nearby_restaurants_select(diner_ids, start_datetime, end_datetime, box, group_mask)
+        )).all()
+        found = ranked(rows, centroid, radius)
+        if nearest_k is not None and len(found) >= nearest_k:
+            break
+    return found[:nearest_k]
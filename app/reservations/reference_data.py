@@ -0,0 +1,221 @@
+import logging
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Select, func, select, true
+from sqlalchemy.orm.session import Session
+
+from ..models.db import Diner, Restaurant, RestaurantTable
+from .restriction_masks import combined_mask
+
+
+NO_GROUP = -1
+
+
+def reference_fingerprint_select() -> Select:
+    """
+    One row summing up the reference tables: their counts, highest ids and the totals of the columns
+    the snapshot keeps. Adding or removing a restaurant, table or diner, or changing a restriction,
+    moves it, so comparing it tells whether a rebuild is due without reading every row into Python.
+    """
+    restaurants, diners, tables = (summary.subquery() for summary in (
+        select(func.count(), func.max(Restaurant.id), func.total(Restaurant.dietary_restriction_mask)),
+        select(func.count(), func.max(Diner.id), func.total(Diner.dietary_restriction_mask)),
+        select(func.count(), func.max(RestaurantTable.id), func.total(RestaurantTable.capacity),
+               func.total(RestaurantTable.combination_group)),
+    ))
+    return select(*restaurants.c, *diners.c, *tables.c).select_from(
+        restaurants.join(diners, true()).join(tables, true())
+    )
+
+
+def columns(rows: Iterable[tuple], width: int) -> Tuple[tuple, ...]:
+    """Rows turned into `width` column tuples, empty ones when there are no rows"""
+    return tuple(zip(*rows)) or ((),) * width
+
+
+class ReferenceSnapshot:
+    """
+    Restaurants, their tables and the diners' restriction masks as they were when built, in flat
+    arrays: nothing here depends on time, so it answers the filters that do not need SQL.
+        - restaurants ascending by id with their mask, name and largest group they can ever seat,
+          on one table or on a combination group
+        - their tables, grouped per restaurant (table_offsets[position] to table_offsets[position + 1])
+          by capacity then id, with their combination group or NO_GROUP
+        - the diners with a restriction, ascending by id, every other diner's mask is 0
+    Never modified once built; ReferenceData swaps in a new one on refresh.
+    """
+    __slots__ = ('version', 'built_at', 'fingerprint', 'restaurant_ids', 'restaurant_masks', 'restaurant_names',
+                 'largest_seating', 'table_offsets', 'table_ids', 'table_capacities', 'table_groups', 'diner_ids',
+                 'diner_masks', 'seating_by_mask')
+
+    def __init__(self, version: int, restaurants: Iterable[Tuple[int, str, int]],
+                 tables: Iterable[Tuple[int, int, int, Optional[int]]], diners: Iterable[Tuple[int, int]],
+                 built_at: Optional[datetime] = None, fingerprint: tuple = ()) -> None:
+        """
+        restaurants as (id, name, mask) ordered by id, tables as (id, restaurant id, capacity, group)
+        ordered by restaurant id, capacity and id, diners as (id, mask) ordered by id. Columns go into
+        the arrays whole, only combinable tables are walked one by one.
+        """
+        self.version = version
+        self.built_at = built_at or datetime.now()
+        self.fingerprint = fingerprint
+        restaurant_ids, names, masks = columns(restaurants, 3)
+        self.restaurant_ids = array('q', restaurant_ids)
+        self.restaurant_masks = array('q', (mask or 0 for mask in masks))
+        self.restaurant_names = tuple(names)
+
+        table_ids, table_restaurants, capacities, groups = columns(tables, 4)
+        self.table_ids = array('q', table_ids)
+        self.table_capacities = array('h', (capacity or 0 for capacity in capacities))
+        self.table_groups = array('q', (NO_GROUP if group is None else group for group in groups))
+        self.table_offsets = array('q', (bisect_left(table_restaurants, restaurant_id) for restaurant_id in restaurant_ids))
+        self.table_offsets.append(len(self.table_ids))
+
+        # Tables run smallest first, so a restaurant's last table is its largest
+        self.largest_seating = array('i', (
+            self.table_capacities[end - 1] if end > start else 0
+            for start, end in zip(self.table_offsets, self.table_offsets[1:])
+        ))
+        group_seats: Dict[Tuple[int, int], int] = {}
+        for row, combination_group in enumerate(groups):
+            if combination_group is not None:
+                key = (table_restaurants[row], combination_group)
+                group_seats[key] = group_seats.get(key, 0) + self.table_capacities[row]
+        for (restaurant_id, _), seats in group_seats.items():
+            position = self._position(self.restaurant_ids, restaurant_id)
+            if position is not None:
+                self.largest_seating[position] = max(self.largest_seating[position], seats)
+
+        diner_ids, diner_masks = columns(diners, 2)
+        self.diner_ids, self.diner_masks = array('q', diner_ids), array('q', diner_masks)
+
+        # Masks take a handful of distinct values, the largest seating per value answers seats_anywhere
+        seating_by_mask: Dict[int, int] = {}
+        for mask, seating in zip(self.restaurant_masks, self.largest_seating):
+            seating_by_mask[mask] = max(seating_by_mask.get(mask, 0), seating)
+        self.seating_by_mask = seating_by_mask
+
+    @classmethod
+    def build(cls, session: Session, version: int = 1) -> "ReferenceSnapshot":
+        # Core rows fetched whole on the session's connection, ORM result processing or row by row
+        # fetches would double the build time
+        connection = session.connection()
+        # Read first: a change landing mid-build leaves the fingerprint behind and the next check rebuilds
+        fingerprint = tuple(connection.execute(reference_fingerprint_select()).one())
+        return cls(
+            version,
+            connection.execute(select(Restaurant.id, Restaurant.name, Restaurant.dietary_restriction_mask)
+                               .order_by(Restaurant.id)).all(),
+            connection.execute(select(RestaurantTable.id, RestaurantTable.restaurant_id, RestaurantTable.capacity,
+                                      RestaurantTable.combination_group)
+                               .order_by(RestaurantTable.restaurant_id, RestaurantTable.capacity, RestaurantTable.id)).all(),
+            connection.execute(select(Diner.id, Diner.dietary_restriction_mask)
+                               .where(Diner.dietary_restriction_mask != 0).order_by(Diner.id)).all(),
+            fingerprint=fingerprint,
+        )
+
+    def _position(self, ids: array, id: int) -> Optional[int]:
+        position = bisect_left(ids, id)
+        return position if position < len(ids) and ids[position] == id else None
+
+    def diner_mask(self, diner_id: int) -> int:
+        position = self._position(self.diner_ids, diner_id)
+        return 0 if position is None else self.diner_masks[position]
+
+    def group_mask(self, diner_ids: List[int]) -> int:
+        return combined_mask(self.diner_mask(diner_id) for diner_id in diner_ids)
+
+    def restaurant_name(self, restaurant_id: int) -> Optional[str]:
+        position = self._position(self.restaurant_ids, restaurant_id)
+        return None if position is None else self.restaurant_names[position]
+
+    def cannot_seat(self, restaurant_id: int, size: int) -> bool:
+        """
+        The restaurant has no table, nor combination group, seating `size` even when all of it is free.
+        Restaurants added since the snapshot was built are left to the database.
+        """
+        position = self._position(self.restaurant_ids, restaurant_id)
+        return position is not None and self.largest_seating[position] < size
+
+    def seats_anywhere(self, size: int, group_mask: int) -> bool:
+        """Some restaurant endorsing the group's restrictions could seat it, were every table free"""
+        return any(mask & group_mask == group_mask and seating >= size for mask, seating in self.seating_by_mask.items())
+
+    def candidate_tables(self, size: int, group_mask: int) -> List[Tuple[int, int, str, int, Optional[int]]]:
+        """The rows of batch_search.candidate_tables_select, read from the arrays instead"""
+        rows = []
+        for position, mask in enumerate(self.restaurant_masks):
+            if mask & group_mask != group_mask or self.largest_seating[position] < size:
+                continue
+            restaurant_id, name = self.restaurant_ids[position], self.restaurant_names[position]
+            for row in range(self.table_offsets[position], self.table_offsets[position + 1]):
+                capacity, combination_group = self.table_capacities[row], self.table_groups[row]
+                if capacity >= size or combination_group != NO_GROUP:
+                    rows.append((self.table_ids[row], restaurant_id, name, capacity,
+                                 None if combination_group == NO_GROUP else combination_group))
+        return rows
+
+    def memory_bytes(self) -> int:
+        """Arrays, the names tuple and its strings; the mask dict is a few dozen entries"""
+        arrays = (self.restaurant_ids, self.restaurant_masks, self.largest_seating, self.table_offsets, self.table_ids,
+                  self.table_capacities, self.table_groups, self.diner_ids, self.diner_masks)
+        return (sum(sys.getsizeof(values) for values in arrays) + sys.getsizeof(self.restaurant_names)
+                + sum(sys.getsizeof(name) for name in self.restaurant_names))
+
+
+class ReferenceData:
+    """
+    Holds the current ReferenceSnapshot. refresh() builds a new one off to the side and swaps the
+    reference, so readers taking `.snapshot` once per call never see a half-built or mixed state.
+    A snapshot older than the current one is never swapped back in. The app refreshes on SIGHUP, and
+    every BOOKING_REFERENCE_DATA_REFRESH_SECONDS when the reference tables' fingerprint moved.
+    """
+    def __init__(self, snapshot: ReferenceSnapshot) -> None:
+        self.snapshot = snapshot
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, session: Session) -> "ReferenceData":
+        return cls(cls.logged(ReferenceSnapshot.build(session)))
+
+    @staticmethod
+    def logged(snapshot: ReferenceSnapshot) -> ReferenceSnapshot:
+        logging.info(f"Reference data v{snapshot.version}: {len(snapshot.restaurant_ids)} restaurants, "
+                     f"{len(snapshot.table_ids)} tables, {len(snapshot.diner_ids)} diners with restrictions, "
+                     f"{snapshot.memory_bytes() / 2 ** 20:.1f} MiB")
+        return snapshot
+
+    def swap(self, snapshot: ReferenceSnapshot) -> bool:
+        with self._lock:
+            if snapshot.version <= self.snapshot.version:
+                return False
+            self.snapshot = snapshot
+            return True
+
+    def changed(self, session: Session) -> bool:
+        return tuple(session.connection().execute(reference_fingerprint_select()).one()) != self.snapshot.fingerprint
+
+    def refresh(self, session: Session, if_changed: bool = False) -> bool:
+        """
+        Rebuilds from the database as the next version and swaps it in, with if_changed only when the
+        fingerprint moved since the current snapshot. Returns whether a new snapshot was swapped in.
+        """
+        if if_changed and not self.changed(session):
+            return False
+        return self.swap(self.logged(ReferenceSnapshot.build(session, version=self.snapshot.version + 1)))
+
+
+def group_filter(snapshot: Optional[ReferenceSnapshot], diner_ids: List[int]) -> Tuple[bool, Optional[int]]:
+    """
+    Whether any restaurant could seat the group at all, and the group's restriction mask, answered by
+    the snapshot without a query. (True, None) without one, SQL then works both out itself.
+    """
+    if snapshot is None:
+        return True, None
+    group_mask = snapshot.group_mask(diner_ids)
+    return snapshot.seats_anywhere(len(diner_ids), group_mask), group_mask
@@ -1,62 +1,237 @@
 from fastapi import HTTPException
-from ..api.requests import AvailableReservationRequest, ReservationRequest
-from ..models.db import (
-    DietaryRestriction, Diner, Reservation, Restaurant, RestaurantTable, 
-    diner_dietary_restriction_association, restaurant_dietary_restriction_association
+from ..api.requests import DEFAULT_PAGE_SIZE, AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest, ReservationSearchRequest
+from ..models.db import Reservation, Restaurant
+from .availability_index import AvailabilityIndex, IndexedRestaurant
+from .search_cache import SearchCache
+from .diner_schedule import DinerSchedule
+from .reference_data import ReferenceData, ReferenceSnapshot, group_filter
+from .batch_search import SlotAvailability, available_restaurants_by_slot
+from .booking import (
+    Booking, Cancellation, book_atomically, cancel_atomically, cancel_diner_select, cancel_ids_select,
+    cancel_restaurant_select, diners_delete, reservation_delete
 )
+from .change_feed import ChangeFeed
+from .archive import PastReservation, diner_history_select, history_page
+from .occupancy import OCCUPANCY_MAX_DAYS, HourOccupancy, hourly_occupancy, occupancy_select, table_counts_select
+from .pagination import after_cursor, page_of, rows_after
+from .proximity import NearbyRestaurant, group_centroid_select, nearby_restaurants
+from .search import RESERVATION_DURATION, available_restaurant_rows_select, available_restaurants_query, booked_diners_select
+from sqlalchemy import Select
 from sqlalchemy.orm.session import Session
-from datetime import timedelta
-from typing import List
-from sqlalchemy import and_, asc, exists
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 
 logging.basicConfig(level=logging.INFO)
-RESERVATION_DURATION = 2
 
 
 class ReservationManager:
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, availability_index: Optional[AvailabilityIndex] = None,
+                 search_backend: Optional[str] = None, search_cache: Optional[SearchCache] = None,
+                 allocation: str = 'smallest', diner_schedule: Optional[DinerSchedule] = None,
+                 read_session: Optional[Session] = None, reference_data: Optional[ReferenceData] = None,
+                 occupancy_prefilter: bool = False, change_feed: Optional[ChangeFeed] = None) -> None:
+        """
+        availability_index: optional in-memory index kept in sync with this manager's bookings and deletions
+        search_backend: 'sql' or 'index', defaults to the index when one is given
+        search_cache: optional result cache, invalidated by this manager's bookings and deletions
+        allocation: 'smallest', 'fit' or 'repack', how bookings pick a table (see allocation.py)
+        diner_schedule: optional in-memory diner windows for double-booking checks, kept in sync like the index
+        read_session: optional session on the read engine for searches, bookings and deletions stay on session
+        reference_data: optional snapshot of restaurants, tables and diner masks answering the filters that
+            do not depend on time: groups no restaurant could seat find nothing without a query, SQL
+            searches get the group's mask as a value, bookings skip restaurants too small for the group
+        occupancy_prefilter: SQL searches skip restaurants restaurant_occupancy shows without a free table
+            big enough in some hour of the window before checking their tables (see occupancy.py)
+        change_feed: optional feed of every process' committed writes, applied to the index, cache and
+            schedule before each search and write; this manager's own writes then reach them through it too
+        """
         self.session = session
+        self.read_session = read_session or session
+        self.availability_index = availability_index
+        self.search_cache = search_cache
+        self.allocation = allocation
+        self.diner_schedule = diner_schedule
+        self.reference_data = reference_data
+        self.occupancy_prefilter = occupancy_prefilter
+        self.change_feed = change_feed
+        self.search_backend = search_backend or ('index' if availability_index else 'sql')
+        if self.search_backend == 'index' and availability_index is None:
+            raise ValueError("The index search backend needs an availability_index")
+
+    def reference_snapshot(self) -> Optional[ReferenceSnapshot]:
+        """The current snapshot, taken once per call so a refresh mid-call cannot mix two"""
+        return None if self.reference_data is None else self.reference_data.snapshot
+
+    def catch_up(self) -> None:
+        """Applies the writes any process committed since the last call, when there is a change feed"""
+        if self.change_feed is not None:
+            self.change_feed.catch_up()
 
-    def find_available_restaurant(self, reservation_request: ReservationRequest) -> List[Restaurant]:
+    def group_booked(self, diner_ids: List[int], start_datetime: datetime, end_datetime: datetime) -> bool:
+        """
+        A diner of the group already holds a reservation overlapping the window, so no search finds anything.
+        Answered by the diner schedule when it covers the window, by one query on the index backend;
+        SQL searches otherwise check it inside their own statement (search.group_is_free).
+        """
+        if self.diner_schedule is not None and self.diner_schedule.covers(start_datetime):
+            return bool(self.diner_schedule.booked_diner_ids(diner_ids, start_datetime, end_datetime))
+        if self.search_backend == 'index':
+            statement = booked_diners_select(diner_ids, start_datetime, end_datetime).limit(1)
+            return self.read_session.execute(statement).first() is not None
+        return False
+
+    def find_available_restaurant(self, reservation_request: ReservationRequest) -> List[Union[Restaurant, IndexedRestaurant, NearbyRestaurant]]:
         """
         Params:
             given a available_reservation_request (diners, restaurant_id and start_datetime)
         Returns:
-            Available Restaurants
+            Available Restaurants, IndexedRestaurant (id, name) rows on the index backend or from the search cache,
+            NearbyRestaurant rows nearest first when the request asks for a distance or the nearest_k
         """
+        if reservation_request.by_distance():
+            return self.find_nearby_restaurants(reservation_request)
         diner_ids = reservation_request.diner_ids
-        capacity = len(diner_ids)
         start_datetime = reservation_request.start_time
         end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
 
         logging.info(f"Find restauarants for diners {diner_ids}")
-        # Ignore restaurants with conflicting reservations
-        conflicting_restaurants = self.session.query(Restaurant.id).join(RestaurantTable).join(Reservation).filter(
-            and_(Reservation.start_datetime < end_datetime, Reservation.end_datetime > start_datetime)
-        ).distinct().all()
-        conflicting_restaurant_ids = [row.id for row in conflicting_restaurants]
-
-        # Filter diner restrictions
-        diner_dietary_restrictions = self.session.query(DietaryRestriction.id).join(diner_dietary_restriction_association)\
-            .filter(diner_dietary_restriction_association.c.diner_id.in_(diner_ids)).all()
-        diner_dietary_restriction_ids = [row.id for row in diner_dietary_restrictions]
-            
-        query = self.session.query(Restaurant).join(RestaurantTable).filter(
-            and_(
-                RestaurantTable.capacity >= capacity,
-                Restaurant.id.notin_(conflicting_restaurant_ids),
-                *[exists().where(
-                    and_(
-                        restaurant_dietary_restriction_association.c.restaurant_id == Restaurant.id,
-                        restaurant_dietary_restriction_association.c.dietary_restriction_id == restriction_id
-                    )
-                ) for restriction_id in diner_dietary_restriction_ids]
-            )
-            ).distinct()
-
-        return query.all()
+        self.catch_up()
+        if self.search_cache is not None:
+            cached = self.search_cache.lookup(diner_ids, start_datetime)
+            if cached is not None:
+                return cached
+            version = self.search_cache.version
+
+        seatable, group_mask = group_filter(self.reference_snapshot(), diner_ids)
+        if not seatable:
+            logging.info(f"No restaurant could ever seat diners {diner_ids}")
+            restaurants = []
+        elif self.group_booked(diner_ids, start_datetime, end_datetime):
+            logging.info(f"A diner of {diner_ids} is already booked at {start_datetime}")
+            restaurants = []
+        elif self.search_backend == 'index':
+            # id and name rows answered from memory, without touching the database
+            restaurants = self.availability_index.available_restaurants(diner_ids, start_datetime, end_datetime)
+        else:
+            restaurants = available_restaurants_query(
+                session=self.read_session,
+                diner_ids=diner_ids,
+                start_datetime=start_datetime,
+                end_datetime=end_datetime,
+                group_mask=group_mask,
+                occupancy_prefilter=self.occupancy_prefilter
+            ).all()
+
+        if self.search_cache is not None:
+            self.search_cache.store(diner_ids, start_datetime, restaurants, version)
+        return restaurants
+
+    def find_nearby_restaurants(self, reservation_request: ReservationSearchRequest) -> List[NearbyRestaurant]:
+        """
+        Params:
+            given a reservation_request with max_distance_km, nearest_k or both
+        Returns:
+            (id, name, distance_km) rows nearest the centroid of the diners' homes first. Always answered
+            in SQL through the restaurant_locations R*Tree, which neither the index nor the cache holds.
+        """
+        diner_ids = reservation_request.diner_ids
+        start_datetime = reservation_request.start_time
+        end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+
+        logging.info(f"Find restauarants near diners {diner_ids}")
+        self.catch_up()
+        seatable, group_mask = group_filter(self.reference_snapshot(), diner_ids)
+        if not seatable or self.group_booked(diner_ids, start_datetime, end_datetime):
+            return []
+        centroid = tuple(self.read_session.execute(group_centroid_select(diner_ids)).one())
+        if None in centroid:
+            raise HTTPException(status_code=400, detail=f"None of diners {diner_ids} has a home location")
+        return nearby_restaurants(
+            self.read_session, diner_ids, start_datetime, end_datetime, centroid,
+            max_distance_km=reservation_request.max_distance_km, nearest_k=reservation_request.nearest_k,
+            group_mask=group_mask
+        )
+
+    def find_available_restaurant_page(self, page_request: ReservationPageRequest) -> Tuple[List[IndexedRestaurant], Optional[str]]:
+        """
+        Params:
+            given a page_request (diners, start_datetime, limit and the previous page's cursor)
+        Returns:
+            Up to limit (id, name) rows ordered by id, and the cursor of the next page or None
+        """
+        diner_ids = page_request.diner_ids
+        start_datetime = page_request.start_time
+        end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+        after_id = after_cursor(page_request.cursor)
+
+        logging.info(f"Find restauarants for diners {diner_ids} after {after_id}")
+        self.catch_up()
+        seatable, group_mask = group_filter(self.reference_snapshot(), diner_ids)
+        if not seatable or self.group_booked(diner_ids, start_datetime, end_datetime):
+            return [], None
+        if self.search_backend == 'index':
+            rows = self.availability_index.available_restaurants(diner_ids, start_datetime, end_datetime)
+            return page_of(rows_after(rows, after_id, page_request.limit), page_request.limit)
+
+        rows = self.read_session.execute(available_restaurant_rows_select(
+            diner_ids, start_datetime, end_datetime, after_id=after_id, limit=page_request.limit + 1,
+            group_mask=group_mask, occupancy_prefilter=self.occupancy_prefilter
+        )).all()
+        return page_of(rows, page_request.limit)
+
+    def find_available_restaurants_by_slot(self, batch_request: BatchReservationRequest) -> List[SlotAvailability]:
+        """
+        Params:
+            given a batch_request (diners and their start times)
+        Returns:
+            (start_time, available IndexedRestaurant rows) per distinct start time, ascending.
+            On SQL the group's candidate tables and their reservations over the whole range are
+            read once and swept in memory, instead of one search per start time.
+        """
+        diner_ids = batch_request.diner_ids
+        slots = batch_request.slots()
 
+        logging.info(f"Find restauarants for diners {diner_ids} over {len(slots)} start times")
+        self.catch_up()
+        snapshot = self.reference_snapshot()
+        if not group_filter(snapshot, diner_ids)[0]:
+            return [(slot, []) for slot in slots]
+        if self.search_backend == 'index':
+            duration = timedelta(hours=RESERVATION_DURATION)
+            return [(slot, [] if self.group_booked(diner_ids, slot, slot + duration)
+                     else self.availability_index.available_restaurants(diner_ids, slot, slot + duration))
+                    for slot in slots]
+
+        return available_restaurants_by_slot(session=self.read_session, diner_ids=diner_ids, slots=slots,
+                                             reference=snapshot)
+
+
+    def diner_history(self, diner_id: int, before: Optional[datetime] = None,
+                      limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[PastReservation], Optional[datetime]]:
+        """
+        Up to limit of the diner's reservations that ended by `before` (now by default), newest first,
+        archived or not, and the `before` of the next page or None
+        """
+        rows = self.read_session.execute(diner_history_select(diner_id, before or datetime.now(), limit + 1)).all()
+        return history_page(rows, limit)
+
+    def restaurant_occupancy(self, restaurant_id: int, first_day: date,
+                             last_day: date) -> Tuple[Dict[int, int], List[HourOccupancy]]:
+        """
+        Params:
+            restaurant_id and the days from first_day to last_day, at most OCCUPANCY_MAX_DAYS of them
+        Returns:
+            The restaurant's tables per capacity, and its booked hours with booked and free tables per capacity
+        """
+        if last_day < first_day or (last_day - first_day).days >= OCCUPANCY_MAX_DAYS:
+            raise HTTPException(status_code=400, detail=f"Occupancy covers 1 to {OCCUPANCY_MAX_DAYS} days")
+        table_counts = self.read_session.execute(table_counts_select(restaurant_id)).all()
+        if not table_counts and self.read_session.get(Restaurant, restaurant_id) is None:
+            logging.warning(f"Could not find restaurant {restaurant_id}")
+            raise HTTPException(status_code=400, detail="Restaurant not found")
+        booked_rows = self.read_session.execute(occupancy_select(restaurant_id, first_day, last_day)).all()
+        return hourly_occupancy(table_counts, booked_rows)
 
     def book_reservation(self, available_reservation_request: AvailableReservationRequest) -> Reservation:
         """
@@ -65,48 +240,61 @@ class ReservationManager:
         Returns:
             Reservation
         """
-        # Get reserved tables to ignore
         restaurant_id = available_reservation_request.restaurant_id 
         diner_ids = available_reservation_request.diner_ids
-        capacity = len(diner_ids)
         start_datetime = available_reservation_request.start_time
         end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
         
         logging.info(f"Booking a reservation for diners {diner_ids} with restaurant {restaurant_id}")
-        reserved_tables = self.session.query(RestaurantTable.id).join(Reservation).filter(
-                and_(
-                    Reservation.table_id == RestaurantTable.id,
-                    Reservation.start_datetime < end_datetime,
-                    Reservation.end_datetime > start_datetime
-                )
-            )
-        reserved_table_ids = [table.id for table in reserved_tables]
-
-        available_table = self.session.query(RestaurantTable).filter(
-            RestaurantTable.restaurant_id == restaurant_id,
-            RestaurantTable.capacity >= capacity,
-            RestaurantTable.id.notin_(reserved_table_ids)
-        ).order_by(
-            asc(RestaurantTable.capacity)
-        ).first()
-
-        if not available_table:
-            logging.warning(f"Didnt find a table for Restaurant {restaurant_id}")
+        snapshot = self.reference_snapshot()
+        if snapshot is not None and snapshot.cannot_seat(restaurant_id, len(diner_ids)):
+            logging.warning(f"Restaurant {restaurant_id} has no table for {len(diner_ids)} diners")
             return None
-
-        diners = self.session.query(Diner).filter(Diner.id.in_(diner_ids)).all()
-        available_reservation = Reservation(
-            table_id=available_table.id,
+        # The diner schedule's quick rejections go by the latest writes
+        self.catch_up()
+        booking = book_atomically(
+            session=self.session,
+            restaurant_id=restaurant_id,
+            diner_ids=diner_ids,
             start_datetime=start_datetime,
-            end_datetime = end_datetime,
-            diners=diners
+            end_datetime=end_datetime,
+            allocation=self.allocation,
+            diner_schedule=self.diner_schedule
         )
 
-        logging.warning(f"Booking table {available_table.id} with reservation {available_reservation.id}")
-        self.session.add(available_reservation)
-        self.session.commit()
-        self.session.refresh(available_reservation)
-        return available_reservation
+        if not booking:
+            logging.warning(f"Didnt find a table for Restaurant {restaurant_id}")
+            return None
+
+        reservation = booking.reservation
+        if self.change_feed is not None:
+            # This booking comes back through the feed, in commit order with every other process' writes
+            self.catch_up()
+        else:
+            self.apply_booking(restaurant_id, diner_ids, booking)
+
+        logging.warning(f"Booking table {reservation.table_id} with reservation {reservation.id}")
+        return reservation
+
+    def apply_booking(self, restaurant_id: int, diner_ids: List[int], booking: Booking) -> None:
+        """Brings the in-memory structures in line with a committed booking of this manager"""
+        reservation = booking.reservation
+        for move in booking.moves:
+            # A re-packed reservation frees one table and takes another, searches either way may change
+            if self.availability_index is not None:
+                self.availability_index.remove_reservation(move.from_table_id, move.start_datetime, move.end_datetime)
+                self.availability_index.add_reservation(move.to_table_id, move.start_datetime, move.end_datetime)
+            if self.search_cache is not None:
+                self.search_cache.invalidate_release(move.start_datetime, move.end_datetime)
+
+        if self.availability_index is not None:
+            for table_id in (reservation.table_id, *booking.combined_table_ids):
+                self.availability_index.add_reservation(table_id, reservation.start_datetime, reservation.end_datetime)
+        if self.diner_schedule is not None:
+            self.diner_schedule.add(diner_ids, reservation.start_datetime, reservation.end_datetime)
+        if self.search_cache is not None:
+            self.search_cache.invalidate_booking(restaurant_id, reservation.start_datetime, reservation.end_datetime,
+                                                 diner_ids=diner_ids)
 
     def delete_reservation(self, reservation_id: int) -> bool:
         """
@@ -116,13 +304,72 @@ class ReservationManager:
             Deletes True if successfuly deleted
         """
         
-        reservation = self.session.get(Reservation, reservation_id)
-        if not reservation:
-            logging.warning(f"Could not find reservation for id {id}")
+        # Set based, the reservation goes with the holds of any tables combined for it
+        diner_ids = self.session.execute(diners_delete(reservation_id)).scalars().all()
+        released = self.session.execute(reservation_delete(reservation_id)).all()
+        if not released:
+            # Nothing matched, so nothing was written
+            logging.warning(f"Could not find reservation for id {reservation_id}")
             raise HTTPException(status_code=400, detail="Reservation not found")
-        
-        self.session.delete(reservation)
+
         self.session.commit()
+        if self.change_feed is not None:
+            self.catch_up()
+        else:
+            self.apply_deletion(diner_ids, released)
 
-        logging.warning(f"Deleted reservation {reservation.id}")
+        logging.warning(f"Deleted reservation {reservation_id}")
         return True
+
+    def apply_deletion(self, diner_ids: List[int], released: List[Tuple[int, datetime, datetime]]) -> None:
+        """Brings the in-memory structures in line with a committed deletion of this manager"""
+        if self.availability_index is not None:
+            for booked_window in released:
+                self.availability_index.remove_reservation(*booked_window)
+        if self.diner_schedule is not None:
+            self.diner_schedule.remove(diner_ids, *released[0][1:])
+        if self.search_cache is not None:
+            self.search_cache.invalidate_release(*released[0][1:])
+
+    def cancel_reservations(self, reservation_ids: List[int]) -> List[int]:
+        """
+        Params:
+            reservation_ids of booked reservations to cancel
+        Returns:
+            The ids cancelled, ascending; unknown ids are left out
+        """
+        return self.cancel(cancel_ids_select(reservation_ids))
+
+    def cancel_restaurant_reservations(self, restaurant_id: int, start_datetime: datetime,
+                                       end_datetime: datetime) -> List[int]:
+        """Cancels the restaurant's reservations overlapping the window, e.g. a night it closes. Returns their ids"""
+        if end_datetime <= start_datetime:
+            raise HTTPException(status_code=400, detail="The cancelled window must end after it starts")
+        return self.cancel(cancel_restaurant_select(restaurant_id, start_datetime, end_datetime))
+
+    def cancel_diner_reservations(self, diner_id: int, after: Optional[datetime] = None) -> List[int]:
+        """Cancels the diner's reservations, with `after` only those still running then. Returns their ids"""
+        return self.cancel(cancel_diner_select(diner_id, after))
+
+    def cancel(self, targets: Select) -> List[int]:
+        """Set based: one write transaction and three statements however many reservations `targets` selects"""
+        cancellation = cancel_atomically(self.session, targets)
+        if self.change_feed is not None:
+            self.catch_up()
+        else:
+            self.apply_cancellation(cancellation)
+
+        logging.warning(f"Cancelled {len(cancellation.reservation_ids)} reservations")
+        return cancellation.reservation_ids
+
+    def apply_cancellation(self, cancellation: Cancellation) -> None:
+        """Brings the in-memory structures in line with committed cancellations of this manager"""
+        if self.availability_index is not None:
+            for booked_window in cancellation.released:
+                self.availability_index.remove_reservation(*booked_window)
+        if self.diner_schedule is not None:
+            for diner_id, start_datetime, end_datetime in cancellation.diners:
+                self.diner_schedule.remove([diner_id], start_datetime, end_datetime)
+        if self.search_cache is not None:
+            for window in {booked_window[1:] for booked_window in cancellation.released}:
+                self.search_cache.invalidate_release(*window)
@@ -0,0 +1,59 @@
+from functools import reduce
+from operator import or_
+from typing import Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.orm.session import Session
+
+from ..models.db import Diner, Restaurant
+
+try:
+    import numpy
+except ImportError:  # optional, `pip install numpy` (poetry extra "fast") for the vectorized filter
+    numpy = None
+
+
+def combined_mask(masks: Iterable[int]) -> int:
+    return reduce(or_, masks, 0)
+
+
+def diner_group_mask(session: Session, diner_ids: List[int]) -> int:
+    """OR of the group's diner masks, one primary key lookup"""
+    return combined_mask(session.execute(
+        select(Diner.dietary_restriction_mask).where(Diner.id.in_(diner_ids))
+    ).scalars())
+
+
+class RestaurantMasks:
+    """
+    Restaurant ids and restriction masks as parallel arrays. matching() filters every restaurant
+    in one vectorized pass with NumPy and falls back to a plain loop without it.
+    """
+    def __init__(self, ids: List[int], masks: List[int]) -> None:
+        self.positions = {restaurant_id: position for position, restaurant_id in enumerate(ids)}
+        if numpy is not None:
+            self.ids = numpy.asarray(ids, dtype=numpy.int64)
+            self.masks = numpy.asarray(masks, dtype=numpy.int64)
+        else:
+            self.ids = list(ids)
+            self.masks = list(masks)
+
+    @classmethod
+    def load(cls, session: Session) -> "RestaurantMasks":
+        rows = session.execute(select(Restaurant.id, Restaurant.dietary_restriction_mask).order_by(Restaurant.id)).all()
+        return cls([id for id, _ in rows], [mask for _, mask in rows])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def mask_of(self, restaurant_id: int) -> int:
+        return int(self.masks[self.positions[restaurant_id]])
+
+    def set_mask(self, restaurant_id: int, mask: int) -> None:
+        self.masks[self.positions[restaurant_id]] = mask
+
+    def matching(self, group_mask: int) -> List[int]:
+        """Ids of restaurants endorsing every restriction in group_mask, ascending"""
+        if numpy is not None:
+            return self.ids[(self.masks & group_mask) == group_mask].tolist()
+        return [id for id, mask in zip(self.ids, self.masks) if mask & group_mask == group_mask]
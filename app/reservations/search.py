@@ -0,0 +1,239 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import Select, and_, exists, func, literal, or_, select, true, union
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.session import Session
+
+from ..models.db import DietaryRestriction, Diner, Reservation, Restaurant, RestaurantTable, diner_reservation_association, restaurant_occupancy
+
+
+RESERVATION_DURATION = 2
+
+
+def overlaps(start_datetime: datetime, end_datetime: datetime):
+    """
+    Reservations overlapping [start_datetime, end_datetime).
+    No reservation lasts longer than RESERVATION_DURATION, so the redundant lower bound on
+    start_datetime turns the check into a range seek on the start_datetime indexes.
+    """
+    return and_(
+        Reservation.start_datetime < end_datetime,
+        Reservation.start_datetime > start_datetime - timedelta(hours=RESERVATION_DURATION),
+        Reservation.end_datetime > start_datetime
+    )
+
+
+def busy_table_ids(start_datetime: datetime, end_datetime: datetime):
+    """Select of table ids holding a reservation that overlaps [start_datetime, end_datetime)"""
+    return select(Reservation.table_id).where(overlaps(start_datetime, end_datetime))
+
+
+def free_restaurant_ids(capacity: int, start_datetime: datetime, end_datetime: datetime):
+    """
+    Restaurants with at least one table that seats `capacity` and is free for the whole window,
+    or a combination group whose free tables seat it together (see combinations.py).
+    Availability is checked per table, so one booked table does not hide the rest of the restaurant.
+    """
+    single_table = select(RestaurantTable.restaurant_id).where(
+        and_(
+            RestaurantTable.capacity >= capacity,
+            RestaurantTable.id.notin_(busy_table_ids(start_datetime, end_datetime))
+        )
+    )
+    combined_tables = select(RestaurantTable.restaurant_id).where(
+        RestaurantTable.combination_group.isnot(None),
+        RestaurantTable.id.notin_(busy_table_ids(start_datetime, end_datetime))
+    ).group_by(
+        RestaurantTable.restaurant_id, RestaurantTable.combination_group
+    ).having(
+        func.sum(RestaurantTable.capacity) >= capacity
+    )
+    return union(single_table, combined_tables).subquery('free_restaurants')
+
+
+def has_free_table(capacity: int, start_datetime: datetime, end_datetime: datetime):
+    """
+    EXISTS a table of the outer Restaurant that seats `capacity` and is free for the whole window.
+    Correlated per restaurant, each table is checked with a seek on ix_reservations_table_window.
+    """
+    return exists().where(
+        RestaurantTable.restaurant_id == Restaurant.id,
+        RestaurantTable.capacity >= capacity,
+        ~exists().where(Reservation.table_id == RestaurantTable.id, overlaps(start_datetime, end_datetime))
+    )
+
+
+def has_free_combination(capacity: int, start_datetime: datetime, end_datetime: datetime):
+    """EXISTS a combination group of the outer Restaurant whose free tables together seat `capacity`"""
+    return select(RestaurantTable.combination_group).where(
+        RestaurantTable.restaurant_id == Restaurant.id,
+        RestaurantTable.combination_group.isnot(None),
+        ~exists().where(Reservation.table_id == RestaurantTable.id, overlaps(start_datetime, end_datetime))
+    ).group_by(
+        RestaurantTable.combination_group
+    ).having(
+        func.sum(RestaurantTable.capacity) >= capacity
+    ).exists()
+
+
+def covered_hours(start_datetime: datetime, end_datetime: datetime) -> List[Tuple[date, int]]:
+    """(day, hour) of the hour slots lying wholly inside [start_datetime, end_datetime)"""
+    hour = start_datetime.replace(minute=0, second=0, microsecond=0)
+    if hour < start_datetime:
+        hour += timedelta(hours=1)
+    hours = []
+    while hour + timedelta(hours=1) <= end_datetime:
+        hours.append((hour.date(), hour.hour))
+        hour += timedelta(hours=1)
+    return hours
+
+
+def has_occupancy_room(capacity: int, start_datetime: datetime, end_datetime: datetime):
+    """
+    No hour wholly inside the window has every table of the outer Restaurant that seats `capacity`
+    booked, read from restaurant_occupancy. A table booked in such an hour is busy for the window, so a
+    restaurant failing this has no single free table; one passing it may still have none, it only
+    spares has_free_table the restaurants the occupancy rows already rule out.
+    """
+    hours = covered_hours(start_datetime, end_datetime)
+    if not hours:
+        return true()
+    occupancy = restaurant_occupancy.c
+    seating_tables = select(func.count()).where(
+        RestaurantTable.restaurant_id == Restaurant.id,
+        RestaurantTable.capacity >= capacity
+    ).correlate(Restaurant).scalar_subquery()
+    # Each hour a seek on the primary key (restaurant_id, day, hour, capacity)
+    booked = [select(func.coalesce(func.sum(occupancy.booked_tables), 0)).where(
+        occupancy.restaurant_id == Restaurant.id,
+        occupancy.day == day,
+        occupancy.hour == hour,
+        occupancy.capacity >= capacity
+    ).correlate(Restaurant).scalar_subquery() for day, hour in hours]
+    return seating_tables > (booked[0] if len(booked) == 1 else func.max(*booked))
+
+
+def can_seat(capacity: int, start_datetime: datetime, end_datetime: datetime, occupancy_prefilter: bool = False):
+    """
+    The outer Restaurant has a free table or combination for `capacity`, the single tables checked
+    only where has_occupancy_room lets them through when occupancy_prefilter is set
+    """
+    free_table = has_free_table(capacity, start_datetime, end_datetime)
+    if occupancy_prefilter:
+        free_table = and_(has_occupancy_room(capacity, start_datetime, end_datetime), free_table)
+    return or_(free_table, has_free_combination(capacity, start_datetime, end_datetime))
+
+
+def diner_overlaps(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime):
+    """
+    Reservations of the diners overlapping [start_datetime, end_datetime), read from the windows copied
+    onto diner_reservation. A diner's reservations never overlap each other, so seeking
+    ix_diner_reservation_diner_window from end_datetime > start_datetime only walks the ones ending
+    after the window starts, not the diner's whole history.
+    """
+    links = diner_reservation_association.c
+    return and_(links.diner_id.in_(diner_ids), links.end_datetime > start_datetime, links.start_datetime < end_datetime)
+
+
+def booked_diners_select(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime) -> Select:
+    """Diners of the group already holding a reservation overlapping the window"""
+    return select(diner_reservation_association.c.diner_id).where(
+        diner_overlaps(diner_ids, start_datetime, end_datetime)
+    ).distinct()
+
+
+def group_is_free(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime):
+    """
+    No diner of the group is booked in the window. Uncorrelated, so SQLite checks it once before
+    walking any restaurant and a group with a booked member finds nothing.
+    """
+    return ~exists().where(diner_overlaps(diner_ids, start_datetime, end_datetime))
+
+
+def group_restriction_mask(diner_ids: List[int]):
+    """
+    Scalar OR of the group's diner masks. SQLite has no bitwise OR aggregate, so it sums the bit of
+    every restriction any diner of the group holds, each counted once.
+    """
+    bit = literal(1).op('<<')(DietaryRestriction.id - 1)
+    return select(func.coalesce(func.sum(bit), 0)).where(
+        exists().where(Diner.id.in_(diner_ids), Diner.dietary_restriction_mask.op('&')(bit) != 0)
+    ).scalar_subquery()
+
+
+def satisfies_group(mask, group_mask):
+    """The restaurant endorses every restriction of the group: mask & group_mask == group_mask"""
+    return mask.op('&')(group_mask) == group_mask
+
+
+def group_mask_clause(diner_ids: List[int], group_mask: Optional[int] = None):
+    """The group's mask as a bound value when already known, from reference data, else the subquery"""
+    return group_restriction_mask(diner_ids) if group_mask is None else literal(group_mask)
+
+
+def available_restaurants_select(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime,
+                                 columns: tuple = (Restaurant,), group_mask: Optional[int] = None,
+                                 occupancy_prefilter: bool = False) -> Select:
+    """
+    One statement answering the whole search:
+        - join restaurants to the ones with a free table big enough for the group
+        - keep those whose restriction mask covers the group's mask
+        - none at all when a diner of the group is already booked in the window
+    Selects full Restaurant entities unless other columns are given. With occupancy_prefilter the
+    tables are checked per restaurant instead, after has_occupancy_room.
+    """
+    group_mask = group_mask_clause(diner_ids, group_mask)
+    if occupancy_prefilter:
+        return select(*columns).where(
+            group_is_free(diner_ids, start_datetime, end_datetime),
+            satisfies_group(Restaurant.dietary_restriction_mask, group_mask),
+            can_seat(len(diner_ids), start_datetime, end_datetime, occupancy_prefilter=True)
+        ).order_by(
+            Restaurant.id
+        )
+    free = free_restaurant_ids(len(diner_ids), start_datetime, end_datetime)
+
+    return select(*columns).join(
+        free, free.c.restaurant_id == Restaurant.id
+    ).where(
+        group_is_free(diner_ids, start_datetime, end_datetime),
+        satisfies_group(Restaurant.dietary_restriction_mask, group_mask)
+    ).order_by(
+        Restaurant.id
+    )
+
+
+def available_restaurant_rows_select(diner_ids: List[int], start_datetime: datetime, end_datetime: datetime,
+                                    after_id: Optional[int] = None, limit: Optional[int] = None,
+                                    group_mask: Optional[int] = None, occupancy_prefilter: bool = False) -> Select:
+    """
+    The search as (id, name) rows, without loading entities.
+    A keyset page when after_id and limit are given: the next `limit` restaurants with an id above
+    after_id. Pages check free tables per restaurant while walking the primary key, so a page stops
+    after `limit` matches instead of first computing every free restaurant like the full search does.
+    """
+    if limit is None:
+        statement = available_restaurants_select(
+            diner_ids, start_datetime, end_datetime, columns=(Restaurant.id, Restaurant.name), group_mask=group_mask,
+            occupancy_prefilter=occupancy_prefilter
+        )
+    else:
+        statement = select(Restaurant.id, Restaurant.name).where(
+            group_is_free(diner_ids, start_datetime, end_datetime),
+            satisfies_group(Restaurant.dietary_restriction_mask, group_mask_clause(diner_ids, group_mask)),
+            can_seat(len(diner_ids), start_datetime, end_datetime, occupancy_prefilter=occupancy_prefilter)
+        ).order_by(
+            Restaurant.id
+        ).limit(limit)
+    if after_id is not None:
+        statement = statement.where(Restaurant.id > after_id)
+    return statement
+
+
+def available_restaurants_query(session: Session, diner_ids: List[int], start_datetime: datetime,
+                                end_datetime: datetime, group_mask: Optional[int] = None,
+                                occupancy_prefilter: bool = False) -> Query:
+    return session.query(Restaurant).from_statement(
+        available_restaurants_select(diner_ids, start_datetime, end_datetime, group_mask=group_mask,
+                                     occupancy_prefilter=occupancy_prefilter)
+    )
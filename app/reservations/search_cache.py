@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from .availability_index import IndexedRestaurant
+from .search import RESERVATION_DURATION
+
+
+CacheKey = Tuple[Tuple[int, ...], datetime]
+
+
+@dataclass
+class CachedSearch:
+    start_datetime: datetime
+    restaurants: List[IndexedRestaurant]
+    restaurant_ids: FrozenSet[int]
+    expires_at: float
+
+
+class SearchCache:
+    """
+    Bounded LRU + TTL cache of find_available_restaurant results, keyed on the sorted diner ids
+    and the start time truncated to bucket_minutes.
+
+    Invalidation follows the writes, see invalidate_booking / invalidate_release. Entries are
+    filed per hour of their start so a write only looks at the searches whose window can overlap
+    it. A search that raced with a write is not stored, see version.
+    """
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 30.0, bucket_minutes: int = 1) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bucket_minutes = bucket_minutes
+        self.entries: "OrderedDict[CacheKey, CachedSearch]" = OrderedDict()
+        self.by_hour: Dict[datetime, Set[CacheKey]] = defaultdict(set)
+        self.version = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def key(self, diner_ids: List[int], start_datetime: datetime) -> CacheKey:
+        bucket = start_datetime.replace(second=0, microsecond=0)
+        bucket -= timedelta(minutes=bucket.minute % self.bucket_minutes)
+        return tuple(sorted(diner_ids)), bucket
+
+    @staticmethod
+    def _hour(start_datetime: datetime) -> datetime:
+        return start_datetime.replace(minute=0, second=0, microsecond=0)
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self.entries.pop(key)
+        hour = self._hour(entry.start_datetime)
+        self.by_hour[hour].discard(key)
+        if not self.by_hour[hour]:
+            del self.by_hour[hour]
+
+    def lookup(self, diner_ids: List[int], start_datetime: datetime) -> Optional[List[IndexedRestaurant]]:
+        key = self.key(diner_ids, start_datetime)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry.restaurants)
+
+    def store(self, diner_ids: List[int], start_datetime: datetime, restaurants: list, version: int) -> None:
+        """
+        Caches a result computed after reading `version`. If a write invalidated anything since,
+        the result may predate it and is dropped rather than cached.
+        """
+        key = self.key(diner_ids, start_datetime)
+        rows = [IndexedRestaurant(restaurant.id, restaurant.name) for restaurant in restaurants]
+        with self._lock:
+            if version != self.version:
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = CachedSearch(
+                start_datetime=key[1],
+                restaurants=rows,
+                restaurant_ids=frozenset(row.id for row in rows),
+                expires_at=time.monotonic() + self.ttl_seconds,
+            )
+            self.by_hour[self._hour(key[1])].add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _overlapping(self, start_datetime: datetime, end_datetime: datetime) -> List[CacheKey]:
+        """
+        Cached searches whose window [start, start + RESERVATION_DURATION) overlaps [start_datetime, end_datetime).
+        Entries are filed under their bucket, which may start up to bucket_minutes before the searched time.
+        """
+        earliest = start_datetime - timedelta(hours=RESERVATION_DURATION, minutes=self.bucket_minutes)
+        overlapping = []
+        hour = self._hour(earliest)
+        while hour < end_datetime:
+            for key in self.by_hour.get(hour, ()):
+                if earliest < self.entries[key].start_datetime < end_datetime:
+                    overlapping.append(key)
+            hour += timedelta(hours=1)
+        return overlapping
+
+    def _invalidate(self, keys: List[CacheKey]) -> None:
+        self.version += 1
+        for key in keys:
+            self._drop(key)
+        self.invalidations += len(keys)
+
+    def invalidate_booking(self, restaurant_id: int, start_datetime: datetime, end_datetime: datetime,
+                           diner_ids: Iterable[int] = ()) -> None:
+        """
+        A booking only takes availability away, so only searches that listed the restaurant can go stale,
+        and searches of groups with a booked diner, who find nothing overlapping the booking any more
+        """
+        booked = frozenset(diner_ids)
+        with self._lock:
+            self._invalidate([
+                key for key in self._overlapping(start_datetime, end_datetime)
+                if restaurant_id in self.entries[key].restaurant_ids or not booked.isdisjoint(key[0])
+            ])
+
+    def invalidate_release(self, start_datetime: datetime, end_datetime: datetime) -> None:
+        """A deleted reservation frees a table, any overlapping search may now find its restaurant"""
+        with self._lock:
+            self._invalidate(self._overlapping(start_datetime, end_datetime))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidate(list(self.entries))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
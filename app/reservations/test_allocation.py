@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import Diner, Reservation, Restaurant, RestaurantTable
+from app.models.migrations import create_schema
+from app.reservations.allocation import Booked, Table, TableMove, blocked_seconds, choose_table, calendars_of, \
+    ordered_steps, plan_booking
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.booking import table_move_update
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+
+
+DAY = datetime(2099, 8, 24)
+TWO_HOURS = timedelta(hours=2)
+
+
+def at(hour: int) -> datetime:
+    return DAY + timedelta(hours=hour)
+
+
+def booked(reservation_id: int, table_id: int, hour: int, size: int = 2) -> Booked:
+    return Booked(reservation_id, table_id, at(hour), at(hour) + TWO_HOURS, size)
+
+
+@pytest.fixture(scope='function')
+def database_path(tmp_path):
+    """One restaurant with a 2-top (table 1) and a 6-top (table 2), twelve diners"""
+    path = tmp_path / 'allocation.db'
+    engine = create_engine(f'sqlite:///{path}')
+    create_schema(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Diner(name=f"Diner {number}") for number in range(1, 13)])
+    session.add(Restaurant(name="Tables for two and six"))
+    session.flush()
+    session.add_all([RestaurantTable(restaurant_id=1, capacity=2), RestaurantTable(restaurant_id=1, capacity=6)])
+    session.commit()
+    session.close()
+    engine.dispose()
+    return path
+
+
+@pytest.fixture(scope='function')
+def session(database_path):
+    engine = create_engine(f'sqlite:///{database_path}')
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def book(manager, diner_ids, hour):
+    return manager.book_reservation(AvailableReservationRequest(start_time=at(hour), diner_ids=diner_ids,
+                                                                restaurant_id=1))
+
+
+class TestScoring:
+    def test__blocked_seconds__counts_gaps_too_short_to_book(self):
+        windows = calendars_of([booked(1, 1, 15), booked(2, 1, 20)])[1]
+        # 17:00-19:00 leaves an hour before 20:00 that nobody can book
+        assert blocked_seconds(windows, at(17), at(19), TWO_HOURS) == 3 * 3600
+        assert blocked_seconds(windows, at(22), at(24), TWO_HOURS) == 2 * 3600
+
+    def test__choose_table__fit_avoids_fragmenting_gaps(self):
+        tables = [Table(1, 4), Table(2, 4)]
+        calendars = calendars_of([booked(1, 1, 20), booked(2, 2, 15)])
+        assert choose_table(tables, calendars, 4, at(17), at(19), TWO_HOURS, 'smallest') == 1
+        assert choose_table(tables, calendars, 4, at(17), at(19), TWO_HOURS, 'fit') == 2
+
+    def test__choose_table__fit_prefers_small_tables(self):
+        tables = [Table(1, 6), Table(2, 2)]
+        assert choose_table(tables, {}, 2, at(19), at(21), TWO_HOURS, 'fit') == 2
+        assert choose_table(tables, {}, 3, at(19), at(21), TWO_HOURS, 'fit') == 1
+        assert choose_table(tables, {}, 7, at(19), at(21), TWO_HOURS, 'fit') is None
+
+
+class TestRepack:
+    def test__plan_booking__moves_a_couple_off_the_big_table(self):
+        tables, bookings = [Table(1, 2), Table(2, 6)], [booked(10, 2, 19)]
+        assert plan_booking(tables, bookings, 6, at(20), at(22), 'fit') is None
+
+        plan = plan_booking(tables, bookings, 6, at(20), at(22), 'repack')
+        assert plan.table_id == 2
+        assert plan.moves == [TableMove(10, 2, 1, at(19), at(21))]
+
+    def test__plan_booking__keeps_started_reservations(self):
+        tables, bookings = [Table(1, 2), Table(2, 6)], [booked(10, 2, 19)]
+        assert plan_booking(tables, bookings, 6, at(20), at(22), 'repack', now=at(19)) is None
+        assert plan_booking(tables, bookings, 6, at(20), at(22), 'repack', now=at(18)) is not None
+
+    def test__plan_booking__keeps_reservations_past_the_horizon(self):
+        tables, bookings = [Table(1, 2), Table(2, 6)], [booked(10, 2, 19)]
+        assert plan_booking(tables, bookings, 6, at(20), at(22), 'repack', horizon=timedelta(minutes=30)) is None
+
+    def test__ordered_steps__parks_one_reservation_of_a_swap(self):
+        bookings = [booked(10, 1, 19, size=4), booked(11, 2, 19, size=4)]
+        moves = [TableMove(10, 1, 2, at(19), at(21)), TableMove(11, 2, 1, at(19), at(21))]
+        steps = ordered_steps(bookings, moves)
+
+        assert len(steps) == 3
+        assert steps[0][:2] == (10, 1) and steps[0][2] < datetime(2000, 1, 1)
+        assert steps[1:] == [(11, 1, at(19), at(21)), (10, 2, at(19), at(21))]
+
+
+class TestBookingAllocation:
+    def test__repack__seats_a_group_the_greedy_choice_turns_away(self, session):
+        index = AvailabilityIndex.build(session)
+        manager = ReservationManager(session=session, availability_index=index, search_cache=SearchCache(),
+                                     allocation='repack')
+        # The 2-top is taken when the couple books, so they get the 6-top
+        first = book(manager, [1], 18)
+        couple = book(manager, [2, 3], 19)
+        assert (first.table_id, couple.table_id) == (1, 2)
+        manager.delete_reservation(first.id)
+        trio = ReservationRequest(start_time=at(17) + timedelta(minutes=30), diner_ids=[1, 9, 10])
+        assert manager.find_available_restaurant(trio) == []
+
+        six = book(manager, [4, 5, 6, 7, 8], 20)
+
+        assert six.table_id == 2
+        session.expire_all()
+        assert session.get(Reservation, couple.id).table_id == 1
+        # Moving the couple freed the 6-top before 20:00, for the index and the cached search alike
+        assert [restaurant.id for restaurant in index.available_restaurants(
+            trio.diner_ids, trio.start_time, trio.start_time + TWO_HOURS)] == [1]
+        assert [restaurant.id for restaurant in manager.find_available_restaurant(trio)] == [1]
+
+    def test__smallest__leaves_the_group_unseated(self, session):
+        manager = ReservationManager(session=session)
+        book(manager, [2, 3], 19)
+        session.execute(table_move_update(1, 2, at(19), at(21)))
+        session.commit()
+        assert book(manager, [4, 5, 6, 7, 8], 20) is None
+
+    def test__swap_steps__pass_the_overlap_guards(self, session):
+        session.add_all([Reservation(id=10, table_id=1, start_datetime=at(19), end_datetime=at(21)),
+                         Reservation(id=11, table_id=2, start_datetime=at(19), end_datetime=at(21))])
+        session.commit()
+        bookings = [booked(10, 1, 19), booked(11, 2, 19)]
+        for step in ordered_steps(bookings, [TableMove(10, 1, 2, at(19), at(21)), TableMove(11, 2, 1, at(19), at(21))]):
+            session.execute(table_move_update(*step))
+        session.commit()
+
+        rows = session.execute(select(Reservation.id, Reservation.table_id, Reservation.start_datetime)
+                               .order_by(Reservation.id)).all()
+        assert rows == [(10, 2, at(19)), (11, 1, at(19))]
+
+    def test__async_repack__books_like_sync(self, session, database_path):
+        book(ReservationManager(session=session), [2, 3], 19)
+        session.execute(table_move_update(1, 2, at(19), at(21)))
+        session.commit()
+
+        async def book_six():
+            engine = create_async_engine(f'sqlite+aiosqlite:///{database_path}')
+            try:
+                async with async_sessionmaker(bind=engine)() as async_session:
+                    manager = AsyncReservationManager(session=async_session, allocation='repack')
+                    return await manager.book_reservation(AvailableReservationRequest(
+                        start_time=at(20), diner_ids=[4, 5, 6, 7, 8], restaurant_id=1
+                    ))
+            finally:
+                await engine.dispose()
+
+        assert asyncio.run(book_six()).table_id == 2
+        session.expire_all()
+        assert session.get(Reservation, 1).table_id == 1
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import (
+    Reservation, diner_reservation_archive, diner_reservation_association, reservation_archive, restaurant_occupancy
+)
+from app.reservations.archive import archive_reservations
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.dataset import FIRST_DAY, DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=40, diners=200, reservations=4000, days=10, diners_per_reservation=2)
+CUTOFF = FIRST_DAY + timedelta(days=6)
+
+
+def count(session, table) -> int:
+    return session.execute(select(func.count()).select_from(table)).scalar()
+
+
+class TestArchive:
+    def test__archive_reservations__moves_past_reservations_with_their_diners(self, template_session):
+        past = template_session.execute(select(func.count()).where(Reservation.end_datetime <= CUTOFF)).scalar()
+        links = count(template_session, diner_reservation_association)
+
+        assert archive_reservations(template_session, CUTOFF, batch_size=300) == past
+        assert count(template_session, reservation_archive) == past
+        assert template_session.execute(select(func.min(Reservation.end_datetime))).scalar() > CUTOFF
+        assert (count(template_session, diner_reservation_association)
+                + count(template_session, diner_reservation_archive)) == links
+        assert archive_reservations(template_session, CUTOFF) == 0
+
+    def test__archive_reservations__stops_after_max_batches(self, template_session):
+        assert archive_reservations(template_session, CUTOFF, batch_size=100, max_batches=2) == 200
+        archived_ends = template_session.execute(select(func.max(reservation_archive.c.end_datetime))).scalar()
+        # Oldest first
+        first_start = template_session.execute(select(func.min(Reservation.start_datetime))).scalar()
+        assert archived_ends <= first_start + timedelta(hours=2)
+
+    def test__bookings_after_archiving_everything__take_new_ids(self, template_session):
+        occupancy = select(restaurant_occupancy).order_by(*restaurant_occupancy.primary_key.columns)
+        archive_reservations(template_session, FIRST_DAY + timedelta(days=TEMPLATE_SPEC.days + 1))
+        assert count(template_session, Reservation.__table__) == 0
+        counted = template_session.execute(occupancy).all()
+
+        manager = ReservationManager(session=template_session)
+        diner_ids = random_groups(TEMPLATE_SPEC, 1, max_size=2)[0]
+        reservation = manager.book_reservation(AvailableReservationRequest(
+            diner_ids=diner_ids, start_time=FIRST_DAY + timedelta(days=TEMPLATE_SPEC.days + 2, hours=19), restaurant_id=1))
+        assert reservation.id > template_session.execute(select(func.max(reservation_archive.c.id))).scalar()
+        manager.delete_reservation(reservation.id)
+        # Its release counted, archived hours untouched
+        assert template_session.execute(occupancy).all() == counted
+
+    def test__searches_after_the_cutoff__are_unchanged(self, template_session):
+        manager = ReservationManager(session=template_session)
+        requests = [ReservationRequest(start_time=start_time + timedelta(days=7), diner_ids=diner_ids)
+                    for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, 20, max_size=4),
+                                                     random_slots(TEMPLATE_SPEC, 20))
+                    if start_time + timedelta(days=7) > CUTOFF]
+        before = [[restaurant.id for restaurant in manager.find_available_restaurant(request)] for request in requests]
+        archive_reservations(template_session, CUTOFF)
+        assert [[restaurant.id for restaurant in manager.find_available_restaurant(request)] for request in requests] == before
+
+    def test__diner_history__pages_through_live_and_archived_reservations(self, template_session):
+        diner_id = template_session.execute(select(diner_reservation_association.c.diner_id)).scalars().first()
+        expected = template_session.execute(select(diner_reservation_association.c.reservation_id).where(
+            diner_reservation_association.c.diner_id == diner_id
+        ).order_by(diner_reservation_association.c.end_datetime.desc())).scalars().all()
+        archive_reservations(template_session, CUTOFF)
+        manager = ReservationManager(session=template_session)
+
+        seen, archived, before = [], set(), FIRST_DAY + timedelta(days=TEMPLATE_SPEC.days + 1)
+        while before is not None:
+            page, before = manager.diner_history(diner_id, before=before, limit=3)
+            assert len(page) <= 3
+            seen += [reservation.id for reservation in page]
+            archived |= {reservation.archived for reservation in page}
+        assert seen == expected
+        assert archived == {True, False}
+
+    def test__diner_history__excludes_reservations_still_to_come(self, template_session):
+        manager = ReservationManager(session=template_session)
+        start_time = FIRST_DAY + timedelta(days=TEMPLATE_SPEC.days + 3, hours=19)
+        reservation = manager.book_reservation(AvailableReservationRequest(start_time=start_time, diner_ids=[1], restaurant_id=1))
+
+        assert reservation.id not in [past.id for past in manager.diner_history(1, before=start_time)[0]]
+        assert manager.diner_history(1, before=start_time + timedelta(hours=2))[0][0].id == reservation.id
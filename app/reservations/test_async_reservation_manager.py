@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.async_db import create_async_db_engine
+from app.models.config import DatabaseSettings
+from app.models.db import create_db_engine
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.change_feed import ChangeFeed, change_version
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.bench_concurrent_booking import SLOTS, TABLE_OVERLAPS, DINER_OVERLAPS
+from benchmarks.dataset import DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_file
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=100, diners=400, reservations=2000, days=5, diners_per_reservation=2)
+
+
+@pytest.fixture(scope='function')
+def settings(template_file):
+    return DatabaseSettings(url=str(template_file.url), pool_size=8, max_overflow=0)
+
+
+def run_with_manager(settings, call):
+    """Runs call(AsyncReservationManager factory) on a fresh event loop and async engine"""
+    async def main():
+        engine = create_async_db_engine(settings)
+        Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+        async def with_manager(method, *args):
+            async with Session() as session:
+                return await method(AsyncReservationManager(session=session), *args)
+        try:
+            return await call(with_manager)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+class TestAsyncReservationManager:
+    def test__find_available_restaurant__matches_sync_manager(self, settings):
+        requests = [ReservationRequest(start_time=start_time, diner_ids=diner_ids)
+                    for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, 10), random_slots(TEMPLATE_SPEC, 10))]
+        session = sessionmaker(bind=create_db_engine(settings))()
+        expected = [[restaurant.id for restaurant in ReservationManager(session=session).find_available_restaurant(request)]
+                    for request in requests]
+        session.close()
+
+        async def search(with_manager):
+            return [await with_manager(AsyncReservationManager.find_available_restaurant, request) for request in requests]
+
+        assert [[restaurant.id for restaurant in found] for found in run_with_manager(settings, search)] == expected
+
+    def test__book_then_delete(self, settings):
+        request = AvailableReservationRequest(start_time=datetime(2024, 9, 1, 19), diner_ids=[1, 2], restaurant_id=3)
+
+        async def book_and_delete(with_manager):
+            reservation = await with_manager(AsyncReservationManager.book_reservation, request)
+            with pytest.raises(HTTPException) as conflict:
+                await with_manager(AsyncReservationManager.book_reservation, request)
+            deleted = await with_manager(AsyncReservationManager.delete_reservation, reservation.id)
+            with pytest.raises(HTTPException) as missing:
+                await with_manager(AsyncReservationManager.delete_reservation, reservation.id)
+            return reservation, conflict.value.status_code, deleted, missing.value.status_code
+
+        reservation, conflict, deleted, missing = run_with_manager(settings, book_and_delete)
+        assert reservation.start_datetime == request.start_time
+        assert (conflict, deleted, missing) == (409, True, 400)
+
+    def test__cancel_reservations__in_one_transaction(self, settings):
+        requests = [AvailableReservationRequest(start_time=datetime(2024, 9, 2, hour), diner_ids=[1, 2], restaurant_id=3)
+                    for hour in (12, 19)]
+
+        async def book_and_cancel(with_manager):
+            booked = [(await with_manager(AsyncReservationManager.book_reservation, request)).id for request in requests]
+            cancelled = await with_manager(AsyncReservationManager.cancel_reservations, [*booked, 10 ** 9])
+            return booked, cancelled, await with_manager(AsyncReservationManager.cancel_diner_reservations, 1,
+                                                         datetime(2024, 9, 2))
+
+        booked, cancelled, again = run_with_manager(settings, book_and_cancel)
+        assert (cancelled, again) == (sorted(booked), [])
+
+    def test__change_feed__catches_up_off_the_event_loop(self, settings):
+        engine = create_db_engine(settings)
+        with sessionmaker(bind=engine)() as session:
+            feed = ChangeFeed(engine, change_version(session))
+        threads = []
+        catch_up = feed.catch_up
+        feed.catch_up = lambda: threads.append(threading.get_ident()) or catch_up()
+
+        async def search(with_manager):
+            async def with_feed(manager, request):
+                manager.change_feed = feed
+                return await manager.find_available_restaurant(request)
+            await with_manager(with_feed, ReservationRequest(start_time=datetime(2024, 11, 2, 19), diner_ids=[1, 2]))
+            return threading.get_ident()
+
+        loop_thread = run_with_manager(settings, search)
+        feed.close()
+        engine.dispose()
+        assert threads and loop_thread not in threads
+
+    def test__concurrent_bookings__never_overlap(self, settings, caplog):
+        caplog.set_level(logging.ERROR)
+        requests = [AvailableReservationRequest(start_time=SLOTS[number % len(SLOTS)].replace(month=10),
+                                                diner_ids=[TEMPLATE_SPEC.diners - number], restaurant_id=1 + number % 3)
+                    for number in range(60)]
+
+        async def book_all(with_manager):
+            async def book(request):
+                try:
+                    return "booked" if await with_manager(AsyncReservationManager.book_reservation, request) else "no_table"
+                except HTTPException as e:
+                    return e.status_code
+            return await asyncio.gather(*(book(request) for request in requests))
+
+        outcomes = run_with_manager(settings, book_all)
+        assert set(outcomes) <= {"booked", "no_table"}
+        assert outcomes.count("booked") > 0
+        with create_db_engine(settings).connect() as connection:
+            assert connection.execute(text(TABLE_OVERLAPS)).scalar() == 0
+            assert connection.execute(text(DINER_OVERLAPS)).scalar() == 0
+
+
+def count_statements(engine):
+    """Statements run on a sync engine, or the sync side of an async one"""
+    statements = []
+    event.listen(getattr(engine, 'sync_engine', engine), 'before_cursor_execute',
+                 lambda connection, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+class TestReadWriteRouting:
+    SEARCH = ReservationRequest(start_time=datetime(2024, 11, 1, 19), diner_ids=[3, 4])
+
+    def test__sync_manager__searches_on_the_read_engine(self, settings):
+        engine, read_engine = create_db_engine(settings), create_db_engine(settings.for_reads(), read_only=True)
+        writes, reads = count_statements(engine), count_statements(read_engine)
+        session, read_session = sessionmaker(bind=engine)(), sessionmaker(bind=read_engine)()
+        manager = ReservationManager(session=session, read_session=read_session)
+
+        found = manager.find_available_restaurant(self.SEARCH)
+        assert (len(reads), len(writes)) == (1, 0)
+        reservation = manager.book_reservation(AvailableReservationRequest(**self.SEARCH.model_dump(), restaurant_id=found[0].id))
+        assert len(reads) == 1 and len(writes) > 0
+        # pysqlite only opens a transaction for writes, the read connection sees the booking at once
+        assert manager.find_available_restaurant(self.SEARCH) == []
+        manager.delete_reservation(reservation.id)
+        session.close()
+        read_session.close()
+        engine.dispose()
+        read_engine.dispose()
+
+    def test__async_manager__searches_on_the_read_engine(self, settings):
+        async def main():
+            engine = create_async_db_engine(settings)
+            read_engine = create_async_db_engine(settings.for_reads(), read_only=True)
+            writes, reads = count_statements(engine), count_statements(read_engine)
+            try:
+                async with async_sessionmaker(bind=engine)() as session, async_sessionmaker(bind=read_engine)() as read_session:
+                    manager = AsyncReservationManager(session=session, read_session=read_session)
+                    found = await manager.find_available_restaurant(self.SEARCH)
+                    searched = (len(reads), len(writes))
+                    reservation = await manager.book_reservation(
+                        AvailableReservationRequest(**self.SEARCH.model_dump(), restaurant_id=found[0].id)
+                    )
+                    booked = (len(reads), len(writes) > 0)
+                    await manager.delete_reservation(reservation.id)
+                return found, searched, booked
+            finally:
+                await engine.dispose()
+                await read_engine.dispose()
+
+        found, searched, booked = asyncio.run(main())
+        assert found != []
+        assert searched == (1, 0)
+        assert booked == (1, True)
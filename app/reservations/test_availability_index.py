@@ -0,0 +1,99 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.reservations.availability_index import (
+    SLOT_MICROSECONDS, SLOTS_PER_DAY, AvailabilityIndex, TableCalendar, slot_masks, timestamp
+)
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.dataset import DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=200, diners=500, reservations=4000, days=5, diners_per_reservation=2)
+
+
+def day_of(value: datetime) -> int:
+    return timestamp(value) // (SLOTS_PER_DAY * SLOT_MICROSECONDS)
+
+
+def window(start_datetime: datetime, end_datetime: datetime):
+    return timestamp(start_datetime), timestamp(end_datetime)
+
+
+class TestSlotMasks:
+    def test__slot_masks__rounds_outwards(self):
+        masks = slot_masks(*window(datetime(2024, 8, 24, 19, 10), datetime(2024, 8, 24, 21, 10)))
+        assert masks == [(day_of(datetime(2024, 8, 24)), ((1 << 9) - 1) << (19 * 4))]  # 19:00 up to 21:15
+
+    def test__slot_masks__splits_windows_crossing_midnight(self):
+        masks = dict(slot_masks(*window(datetime(2024, 8, 24, 23), datetime(2024, 8, 25, 1))))
+        assert masks[day_of(datetime(2024, 8, 24))] == 0b1111 << (SLOTS_PER_DAY - 4)
+        assert masks[day_of(datetime(2024, 8, 25))] == 0b1111
+
+
+class TestTableCalendar:
+    def test__is_free__back_to_back_windows_do_not_overlap(self):
+        table = TableCalendar(table_id=1, restaurant_id=1, capacity=2)
+        table.book(*window(datetime(2024, 8, 24, 17, 10), datetime(2024, 8, 24, 19, 10)))
+
+        # Shares the 19:00 slot with the booking but starts after it ends
+        assert table.is_free(*window(datetime(2024, 8, 24, 19, 10), datetime(2024, 8, 24, 21, 10)))
+        assert not table.is_free(*window(datetime(2024, 8, 24, 19, 5), datetime(2024, 8, 24, 21, 5)))
+        assert table.is_free(*window(datetime(2024, 8, 24, 15), datetime(2024, 8, 24, 17, 10)))
+
+    def test__release__frees_slots_but_keeps_neighbours(self):
+        table = TableCalendar(table_id=1, restaurant_id=1, capacity=2)
+        table.book(*window(datetime(2024, 8, 24, 17), datetime(2024, 8, 24, 19)))
+        table.book(*window(datetime(2024, 8, 24, 19), datetime(2024, 8, 24, 21)))
+
+        assert table.release(*window(datetime(2024, 8, 24, 17), datetime(2024, 8, 24, 19)))
+
+        assert table.is_free(*window(datetime(2024, 8, 24, 17), datetime(2024, 8, 24, 19)))
+        assert not table.is_free(*window(datetime(2024, 8, 24, 18), datetime(2024, 8, 24, 20)))
+        assert table.days[day_of(datetime(2024, 8, 24))] == 0b11111111 << (19 * 4)
+
+
+class TestAvailabilityIndex:
+    def test__available_restaurant_ids__matches_sql_backend(self, template_session):
+        index = AvailabilityIndex.build(template_session)
+        sql = ReservationManager(session=template_session, search_backend='sql')
+        indexed = ReservationManager(session=template_session, availability_index=index)
+        rng = random.Random(3)
+        # Off-grid starts too, so the exact window check behind the slot masks is exercised
+        starts = [start + timedelta(minutes=rng.choice([0, 0, 5, 50, 65, 110, 115]))
+                  for start in random_slots(TEMPLATE_SPEC, 60)]
+
+        for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, 60), starts):
+            request = ReservationRequest(start_time=start_time, diner_ids=diner_ids)
+            expected = [restaurant.id for restaurant in sql.find_available_restaurant(request)]
+            assert [restaurant.id for restaurant in indexed.find_available_restaurant(request)] == expected
+
+    def test__manager__keeps_index_in_sync_on_book_and_delete(self, template_session):
+        index = AvailabilityIndex.build(template_session)
+        manager = ReservationManager(session=template_session, availability_index=index)
+        start_time, end_time = datetime(2024, 9, 1, 19), datetime(2024, 9, 1, 21)
+        free_before = index.free_tables(1, 2, start_time, end_time)
+        assert len(free_before) == len(index.restaurant_tables[1])
+
+        reservation = manager.book_reservation(
+            AvailableReservationRequest(start_time=start_time, diner_ids=[1, 2], restaurant_id=1)
+        )
+        assert index.reservation_count() == TEMPLATE_SPEC.reservations + 1
+        assert index.free_tables(1, 2, start_time, end_time) == [id for id in free_before if id != reservation.table_id]
+
+        manager.delete_reservation(reservation.id)
+        assert index.reservation_count() == TEMPLATE_SPEC.reservations
+        assert index.free_tables(1, 2, start_time, end_time) == free_before
+
+    def test__index_backend__needs_an_index(self, template_session):
+        with pytest.raises(ValueError):
+            ReservationManager(session=template_session, search_backend='index')
+
+    def test__memory_report__counts_every_table(self, template_session):
+        report = AvailabilityIndex.build(template_session).memory_report()
+        assert report["tables"] == TEMPLATE_SPEC.restaurants * 7
+        assert report["reservations"] == TEMPLATE_SPEC.reservations
+        assert 0 < report["bytes_per_table"] < 4096
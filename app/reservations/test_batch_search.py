@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import event
+
+from app.api.requests import MAX_BATCH_SLOTS, BatchReservationRequest, ReservationRequest
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.dataset import DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=200, diners=500, reservations=4000, days=5, diners_per_reservation=2)
+
+
+def per_slot(manager: ReservationManager, batch_request: BatchReservationRequest):
+    return [
+        (slot, [restaurant.id for restaurant in manager.find_available_restaurant(
+            ReservationRequest(start_time=slot, diner_ids=batch_request.diner_ids)
+        )])
+        for slot in batch_request.slots()
+    ]
+
+
+def ids_by_slot(availability):
+    return [(slot, [restaurant.id for restaurant in restaurants]) for slot, restaurants in availability]
+
+
+class TestBatchReservationRequest:
+    def test__slots__from_range_include_the_end(self):
+        request = BatchReservationRequest(diner_ids=[1], range_start=datetime(2024, 8, 24, 17),
+                                          range_end=datetime(2024, 8, 24, 22), step_minutes=30)
+        assert len(request.slots()) == 11
+        assert request.slots()[-1] == datetime(2024, 8, 24, 22)
+
+    def test__slots__from_start_times_are_distinct_and_sorted(self):
+        late, early = datetime(2024, 8, 24, 20), datetime(2024, 8, 24, 18)
+        assert BatchReservationRequest(diner_ids=[1], start_times=[late, early, late]).slots() == [early, late]
+
+    @pytest.mark.parametrize("fields", [
+        {},
+        {"start_times": [datetime(2024, 8, 24, 18)], "range_start": datetime(2024, 8, 24, 18)},
+        {"range_start": datetime(2024, 8, 24, 18)},
+        {"range_start": datetime(2024, 8, 24, 18), "range_end": datetime(2024, 8, 24, 17)},
+        {"range_start": datetime(2024, 8, 24, 18), "range_end": datetime(2024, 8, 24, 19), "step_minutes": 0},
+        {"range_start": datetime(2024, 8, 24), "range_end": datetime(2024, 8, 25), "step_minutes": 1},
+        {"start_times": []},
+    ])
+    def test__rejects_invalid_slots(self, fields):
+        with pytest.raises(ValidationError):
+            BatchReservationRequest(diner_ids=[1], **fields)
+
+    def test__accepts_max_batch_slots(self):
+        start = datetime(2024, 8, 24)
+        request = BatchReservationRequest(diner_ids=[1], range_start=start,
+                                          range_end=start + timedelta(minutes=15 * (MAX_BATCH_SLOTS - 1)),
+                                          step_minutes=15)
+        assert len(request.slots()) == MAX_BATCH_SLOTS
+
+
+class TestFindAvailableRestaurantsBySlot:
+    def test__matches_one_search_per_slot(self, template_session):
+        manager = ReservationManager(session=template_session)
+        for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, 10), random_slots(TEMPLATE_SPEC, 10)):
+            # Off-grid steps so reservations straddle slot boundaries
+            batch_request = BatchReservationRequest(diner_ids=diner_ids, range_start=start_time - timedelta(hours=3),
+                                                    range_end=start_time + timedelta(hours=3), step_minutes=25)
+            assert ids_by_slot(manager.find_available_restaurants_by_slot(batch_request)) == per_slot(manager, batch_request)
+
+    def test__index_backend__matches_sql(self, template_session):
+        sql = ReservationManager(session=template_session)
+        indexed = ReservationManager(session=template_session, availability_index=AvailabilityIndex.build(template_session))
+        for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, 5), random_slots(TEMPLATE_SPEC, 5)):
+            batch_request = BatchReservationRequest(diner_ids=diner_ids, range_start=start_time,
+                                                    range_end=start_time + timedelta(hours=5))
+            assert (ids_by_slot(indexed.find_available_restaurants_by_slot(batch_request))
+                    == ids_by_slot(sql.find_available_restaurants_by_slot(batch_request)))
+
+    def test__reads_the_range_in_two_statements(self, template_session):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        connection = template_session.connection()
+        event.listen(connection, "before_cursor_execute", listener)
+        try:
+            batch_request = BatchReservationRequest(diner_ids=[1, 2], range_start=datetime(2024, 8, 24, 17),
+                                                    range_end=datetime(2024, 8, 24, 22))
+            ReservationManager(session=template_session).find_available_restaurants_by_slot(batch_request)
+        finally:
+            event.remove(connection, "before_cursor_execute", listener)
+        assert len(statements) == 2
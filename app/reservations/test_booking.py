@@ -0,0 +1,51 @@
+import logging
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_concurrent_booking import seed, stress_bookings, stress_engine
+
+
+@pytest.fixture(scope='function')
+def engine(tmp_path):
+    engine = stress_engine(str(tmp_path), threads=16)
+    seed(engine)
+    yield engine
+    engine.dispose()
+
+
+class TestConcurrentBooking:
+    def test__stress__no_table_or_diner_is_double_booked(self, engine, caplog):
+        caplog.set_level(logging.ERROR)
+        result = stress_bookings(engine, threads=16, bookings=2000)
+
+        assert result["table_overlaps"] == 0
+        assert result["diner_overlaps"] == 0
+        assert result["booked"] > 0
+        assert result.get("gave_up", 0) == 0
+        assert sum(result.get(key, 0) for key in ("booked", "no_table", "diner_conflict")) == result["attempts"]
+
+    def test__overlap_guard__rejects_direct_table_double_booking(self, engine):
+        session = sessionmaker(bind=engine)()
+        insert = text("INSERT INTO reservations (table_id, start_datetime, end_datetime) VALUES (1, :start, :end)")
+        session.execute(insert, {"start": datetime(2024, 8, 24, 19), "end": datetime(2024, 8, 24, 21)})
+        with pytest.raises(IntegrityError):
+            session.execute(insert, {"start": datetime(2024, 8, 24, 20), "end": datetime(2024, 8, 24, 22)})
+        session.rollback()
+        session.close()
+
+    def test__overlap_guard__rejects_direct_diner_double_booking(self, engine):
+        session = sessionmaker(bind=engine)()
+        session.execute(text(
+            "INSERT INTO reservations (id, table_id, start_datetime, end_datetime) VALUES "
+            "(1, 1, '2024-08-24 19:00:00.000000', '2024-08-24 21:00:00.000000'), "
+            "(2, 2, '2024-08-24 20:00:00.000000', '2024-08-24 22:00:00.000000')"
+        ))
+        session.execute(text("INSERT INTO diner_reservation (diner_id, reservation_id) VALUES (1, 1)"))
+        with pytest.raises(IntegrityError):
+            session.execute(text("INSERT INTO diner_reservation (diner_id, reservation_id) VALUES (1, 2)"))
+        session.rollback()
+        session.close()
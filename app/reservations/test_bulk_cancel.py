@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import Reservation, RestaurantTable, diner_reservation_association
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.diner_schedule import DinerSchedule
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+from benchmarks.dataset import FIRST_DAY
+from common.tests.db_setup import template_copy
+from common.tests.factories import BulkFactory
+
+
+# Past the template's seeded days, every table is free
+EVENING = FIRST_DAY + timedelta(days=30, hours=19)
+
+
+@pytest.fixture(scope='function')
+def session(template_copy):
+    session = sessionmaker(bind=template_copy)()
+    yield session
+    session.close()
+
+
+def manager_with_structures(session) -> ReservationManager:
+    return ReservationManager(session=session, availability_index=AvailabilityIndex.build(session),
+                              search_cache=SearchCache(ttl_seconds=600), diner_schedule=DinerSchedule.build(session))
+
+
+def assert_structures_match_a_rebuild(manager: ReservationManager) -> None:
+    rebuilt_index, rebuilt_schedule = AvailabilityIndex.build(manager.session), DinerSchedule.build(manager.session)
+    assert {table_id: (list(table.starts), list(table.ends)) for table_id, table in manager.availability_index.tables.items()
+            if table.starts} == {table_id: (list(table.starts), list(table.ends))
+                                 for table_id, table in rebuilt_index.tables.items() if table.starts}
+    assert {diner_id: list(calendar.starts) for diner_id, calendar in manager.diner_schedule.diners.items()
+            if calendar.starts} == {diner_id: list(calendar.starts)
+                                    for diner_id, calendar in rebuilt_schedule.diners.items() if calendar.starts}
+
+
+class TestBulkCancel:
+    def test__cancel_reservations__takes_the_holds_and_skips_unknown_ids(self, template_copy, session):
+        with template_copy.begin() as connection:
+            factory = BulkFactory(connection)
+            [restaurant_id] = factory.restaurants(1)
+            # Two 2-tops pushed together for four
+            table_ids = factory.tables([restaurant_id], capacities=(2, 2), combination_group=1)
+            diner_ids = factory.diners(8)
+        manager = manager_with_structures(session)
+
+        def book(diners, start_time=EVENING):
+            return manager.book_reservation(AvailableReservationRequest(
+                diner_ids=diners, start_time=start_time, restaurant_id=restaurant_id))
+        combined, later = book(diner_ids[:4]), book(diner_ids[4:6], EVENING + timedelta(hours=3))
+        [hold_id] = session.scalars(select(Reservation.id).where(Reservation.combined_with_id == combined.id)).all()
+        search = ReservationRequest(diner_ids=diner_ids[6:], start_time=EVENING)
+        assert restaurant_id not in [restaurant.id for restaurant in manager.find_available_restaurant(search)]
+
+        assert manager.cancel_reservations([later.id, hold_id, combined.id, 10 ** 9]) == sorted([combined.id, later.id])
+        assert session.scalars(select(Reservation.id).where(Reservation.table_id.in_(table_ids))).all() == []
+        assert session.scalars(select(diner_reservation_association.c.diner_id).where(
+            diner_reservation_association.c.diner_id.in_(diner_ids))).all() == []
+        # The cached search saw both tables taken
+        assert restaurant_id in [restaurant.id for restaurant in manager.find_available_restaurant(search)]
+        assert_structures_match_a_rebuild(manager)
+        assert manager.cancel_reservations([combined.id, later.id]) == []
+
+    def test__cancel_restaurant_reservations__only_the_window(self, session):
+        manager = manager_with_structures(session)
+        start, end = FIRST_DAY + timedelta(days=2, hours=18), FIRST_DAY + timedelta(days=2, hours=23)
+        booked = select(Reservation.id).join(RestaurantTable, RestaurantTable.id == Reservation.table_id).where(
+            RestaurantTable.restaurant_id == 7, Reservation.combined_with_id.is_(None))
+        overlapping = session.scalars(booked.where(Reservation.start_datetime < end, Reservation.end_datetime > start)
+                                      .order_by(Reservation.id)).all()
+        others = session.scalars(booked.where(Reservation.id.not_in(overlapping))).all()
+        assert overlapping and others
+
+        with pytest.raises(HTTPException) as empty_window:
+            manager.cancel_restaurant_reservations(7, end, start)
+        assert empty_window.value.status_code == 400
+        assert manager.cancel_restaurant_reservations(7, start, end) == overlapping
+        assert session.scalars(booked).all() == others
+        assert_structures_match_a_rebuild(manager)
+
+    def test__cancel_diner_reservations__after_keeps_those_already_ended(self, session):
+        manager = manager_with_structures(session)
+        links = diner_reservation_association.c
+        after = FIRST_DAY + timedelta(days=7)
+        ends = dict(session.execute(select(links.reservation_id, links.end_datetime).where(links.diner_id == 5)).all())
+        assert any(end > after for end in ends.values()) and any(end <= after for end in ends.values())
+
+        assert manager.cancel_diner_reservations(5, after=after) == sorted(id for id, end in ends.items() if end > after)
+        assert manager.cancel_diner_reservations(5) == sorted(id for id, end in ends.items() if end <= after)
+        assert session.scalars(select(links.reservation_id).where(links.diner_id == 5)).all() == []
+        assert_structures_match_a_rebuild(manager)
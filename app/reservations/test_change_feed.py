@@ -0,0 +1,250 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import Diner, Restaurant, RestaurantTable, diner_dietary_restriction_association, reservation_changes
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.change_feed import (
+    ChangeFeed, begin_snapshot, change_version, install_change_log, prune_changes, remove_change_log
+)
+from app.reservations.diner_schedule import DinerSchedule
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+from benchmarks.dataset import FIRST_DAY, DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_file
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=30, diners=300, reservations=3000, days=5, diners_per_reservation=2)
+# Past the seeded days, every table is free
+EVENING = FIRST_DAY + timedelta(days=20, hours=19)
+
+
+@pytest.fixture(scope='function')
+def url(template_file):
+    """A file database, so separate processes and connections share it like uvicorn workers do"""
+    with sessionmaker(bind=template_file)() as session:
+        install_change_log(session)
+    return str(template_file.url)
+
+
+class Worker:
+    """What a worker with every in-memory structure builds at startup, as main.lifespan does"""
+    def __init__(self, url: str, change_feed: bool = True) -> None:
+        self.engine = create_engine(url)
+        self.session = sessionmaker(bind=self.engine)()
+        begin_snapshot(self.session)
+        version = change_version(self.session)
+        self.index = AvailabilityIndex.build(self.session)
+        self.schedule = DinerSchedule.build(self.session)
+        self.session.rollback()
+        self.cache = SearchCache(ttl_seconds=600)
+        self.feed = (ChangeFeed(self.engine, version, availability_index=self.index, search_cache=self.cache,
+                                diner_schedule=self.schedule) if change_feed else None)
+        self.manager = ReservationManager(session=self.session, availability_index=self.index,
+                                          search_cache=self.cache, diner_schedule=self.schedule,
+                                          change_feed=self.feed)
+
+    def find(self, diner_ids, start_time=EVENING):
+        return [restaurant.id for restaurant in self.manager.find_available_restaurant(
+            ReservationRequest(diner_ids=diner_ids, start_time=start_time))]
+
+    def close(self) -> None:
+        if self.feed is not None:
+            self.feed.close()
+        self.session.close()
+        self.engine.dispose()
+
+
+def unrestricted_groups(session, count: int, size: int):
+    diner_ids = session.scalars(select(Diner.id).where(Diner.dietary_restriction_mask == 0).limit(count * size)).all()
+    return [diner_ids[number * size:(number + 1) * size] for number in range(count)]
+
+
+def book(url: str, diner_ids, restaurant_id: int, start_time=EVENING) -> int:
+    """Runs in another process, on its own engine and a manager without any in-memory structure"""
+    engine = create_engine(url)
+    with sessionmaker(bind=engine)() as session:
+        reservation_id = ReservationManager(session=session).book_reservation(AvailableReservationRequest(
+            diner_ids=diner_ids, start_time=start_time, restaurant_id=restaurant_id)).id
+    engine.dispose()
+    return reservation_id
+
+
+def delete(url: str, reservation_id: int) -> None:
+    engine = create_engine(url)
+    with sessionmaker(bind=engine)() as session:
+        ReservationManager(session=session).delete_reservation(reservation_id)
+    engine.dispose()
+
+
+def add_table_and_restrict(url: str, restaurant_id: int, diner_ids, restricted_diner_id: int) -> int:
+    """Runs in another process: a 12-top for restaurant_id booked for diner_ids, and a restriction for the diner"""
+    engine = create_engine(url)
+    with sessionmaker(bind=engine)() as session:
+        session.add(RestaurantTable(restaurant_id=restaurant_id, capacity=12))
+        session.execute(insert(diner_dietary_restriction_association).values(
+            diner_id=restricted_diner_id, dietary_restriction_id=1))
+        session.commit()
+        reservation_id = ReservationManager(session=session).book_reservation(AvailableReservationRequest(
+            diner_ids=diner_ids, start_time=EVENING, restaurant_id=restaurant_id)).id
+    engine.dispose()
+    return reservation_id
+
+
+class TestChangeFeed:
+    def test__other_process_writes__never_served_stale(self, url):
+        worker, unfed = Worker(url), Worker(url, change_feed=False)
+        group, first, second = unrestricted_groups(worker.session, 3, size=5)
+        found = worker.find(group)
+        assert found and unfed.find(group) == found
+        restaurant_id = found[0]
+
+        # Spawned, not forked: nothing of this process' engines or structures reaches the other worker
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as other:
+            # The restaurant's two 6-tops taken over there, and then one of the group's diners
+            booked = [other.submit(book, url, diners, restaurant_id).result() for diners in (first, second)]
+            assert restaurant_id not in worker.find(group)
+            assert worker.find(group) == worker.find(group[::-1]) == [
+                restaurant.id for restaurant in ReservationManager(session=worker.session).find_available_restaurant(
+                    ReservationRequest(diner_ids=group, start_time=EVENING))
+            ]
+            diner_booked = other.submit(book, url, group[:1], found[1], EVENING + timedelta(hours=1)).result()
+            assert worker.find(group) == []
+            assert worker.schedule.booked_diner_ids(group, EVENING, EVENING + timedelta(hours=2)) == group[:1]
+            # Without the feed, the cached search still offers the booked restaurant to diners already booked
+            assert unfed.find(group) == found
+
+            for reservation_id in (*booked, diner_booked):
+                other.submit(delete, url, reservation_id).result()
+            assert worker.find(group) == found
+
+        rebuilt = AvailabilityIndex.build(worker.session)
+        assert worker.index.reservation_count() == rebuilt.reservation_count()
+        assert worker.feed.version == change_version(worker.session) and worker.feed.gaps == 0
+        worker.close()
+        unfed.close()
+
+    def test__own_and_other_writes__match_a_rebuild(self, url):
+        worker, other = Worker(url), Worker(url, change_feed=False)
+        other.session.execute(update(RestaurantTable).where(RestaurantTable.restaurant_id % 3 == 0,
+                                                            RestaurantTable.capacity == 2).values(combination_group=1))
+        other.session.commit()
+        booked = []
+        for number, (diner_ids, start_time) in enumerate(zip(random_groups(TEMPLATE_SPEC, 60, max_size=6, seed=3),
+                                                                      random_slots(TEMPLATE_SPEC, 60, seed=3))):
+            manager = (worker if number % 2 else other).manager
+            try:
+                reservation = manager.book_reservation(AvailableReservationRequest(
+                    diner_ids=diner_ids, start_time=start_time, restaurant_id=number % TEMPLATE_SPEC.restaurants + 1))
+            except Exception:
+                continue
+            if reservation is not None:
+                booked.append(reservation.id)
+        for number, reservation_id in enumerate(booked[::2]):
+            (worker if number % 2 else other).manager.delete_reservation(reservation_id)
+
+        worker.feed.catch_up()
+        rebuilt_index, rebuilt_schedule = AvailabilityIndex.build(worker.session), DinerSchedule.build(worker.session)
+        assert {table_id: (list(table.starts), list(table.ends)) for table_id, table in worker.index.tables.items()} == {
+            table_id: (list(table.starts), list(table.ends)) for table_id, table in rebuilt_index.tables.items()
+        }
+        assert {diner_id: list(calendar.starts) for diner_id, calendar in worker.schedule.diners.items() if calendar.starts} == {
+            diner_id: list(calendar.starts) for diner_id, calendar in rebuilt_schedule.diners.items()
+        }
+        worker.close()
+        other.close()
+
+    def test__other_process_reference_changes__reload_the_index(self, url):
+        worker = Worker(url)
+        large, pair, later = unrestricted_groups(worker.session, 3, size=10)
+        searches = [(large, EVENING), (later, EVENING), (later, EVENING + timedelta(hours=3)),
+                    (pair[:2], EVENING + timedelta(hours=3))]
+        assert worker.find(later, EVENING + timedelta(hours=3)) == []
+        restricted = worker.find(pair[:2], EVENING)
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as other:
+            other.submit(add_table_and_restrict, url, 4, large, pair[0]).result()
+        assert [worker.find(*search) for search in searches] == [
+            [restaurant.id for restaurant in ReservationManager(session=worker.session).find_available_restaurant(
+                ReservationRequest(diner_ids=diner_ids, start_time=start_time))] for diner_ids, start_time in searches
+        ]
+        # The new table was booked in the index as well, and the diner's restriction turns restaurants away
+        assert worker.find(later, EVENING) == [] and worker.find(later, EVENING + timedelta(hours=3)) == [4]
+        assert set(worker.find(pair[:2], EVENING)) < set(restricted)
+        rebuilt = AvailabilityIndex.build(worker.session)
+        assert {table_id: (table.capacity, list(table.starts)) for table_id, table in worker.index.tables.items()} == {
+            table_id: (table.capacity, list(table.starts)) for table_id, table in rebuilt.tables.items()
+        }
+        assert worker.index.diner_masks == rebuilt.diner_masks
+        worker.close()
+
+    def test__triggers__log_bookings_diners_and_reference_changes(self, url):
+        worker = Worker(url, change_feed=False)
+        assert worker.session.execute(select(reservation_changes)).all() == []
+        group = unrestricted_groups(worker.session, 1, size=2)[0]
+        reservation = worker.manager.book_reservation(AvailableReservationRequest(
+            diner_ids=group, start_time=EVENING, restaurant_id=1))
+        worker.session.execute(update(RestaurantTable).where(RestaurantTable.id == 1).values(capacity=3))
+        worker.session.commit()
+        # A bulk change logs a single marker, and so do consecutive ones
+        worker.session.execute(update(RestaurantTable).where(RestaurantTable.restaurant_id == 2).values(capacity=3))
+        worker.session.commit()
+        worker.manager.delete_reservation(reservation.id)
+        window = (EVENING, EVENING + timedelta(hours=2))
+        assert [tuple(row)[1:] for row in worker.session.execute(select(reservation_changes))] == [
+            ('booked', 1, reservation.table_id, None, *window),
+            *[('diner_booked', 1, None, diner_id, *window) for diner_id in group],
+            ('reference', None, None, None, None, None),
+            *[('diner_released', 1, None, diner_id, *window) for diner_id in group],
+            ('released', 1, reservation.table_id, None, *window),
+        ]
+        worker.close()
+
+    def test__pruned_changes__clear_the_cache_and_count_a_gap(self, url):
+        worker, other = Worker(url), Worker(url, change_feed=False)
+        group = unrestricted_groups(worker.session, 1, size=2)[0]
+        worker.cache.store(group, EVENING, [], worker.cache.version)
+        for hours in (0, 3):
+            other.manager.book_reservation(AvailableReservationRequest(
+                diner_ids=group, start_time=EVENING + timedelta(hours=hours), restaurant_id=1))
+        current = Worker(url)
+        assert prune_changes(other.session, keep=1) == 5
+        assert prune_changes(other.session, keep=1) == 0
+        assert worker.feed.catch_up() == 1
+        assert worker.feed.stats()["gaps"] == 1
+        assert worker.cache.stats()["entries"] == 0
+        # Built after the pruned changes, nothing was lost
+        assert current.feed.catch_up() == 0 and current.feed.stats()["gaps"] == 0
+        worker.close()
+        current.close()
+        other.close()
+
+    def test__reference_changes__leave_one_marker_the_feed_still_sees(self, url):
+        worker, other = Worker(url), Worker(url, change_feed=False)
+        assert worker.feed.catch_up() == 0
+        other.session.execute(update(RestaurantTable).where(RestaurantTable.restaurant_id == 1).values(capacity=3))
+        other.session.commit()
+        assert worker.feed.catch_up() == 1
+        # A bulk insert and an update in their own transactions, the marker the worker read replaced by one more
+        other.session.execute(insert(Restaurant), [{'name': f'Pop-up {number}'} for number in range(50)])
+        other.session.commit()
+        other.session.execute(update(RestaurantTable).where(RestaurantTable.restaurant_id == 2).values(capacity=3))
+        other.session.commit()
+        assert [row.kind for row in other.session.execute(select(reservation_changes))] == ['reference']
+        assert worker.feed.catch_up() == 1
+        assert worker.feed.stats()["gaps"] == 0 and worker.feed.version == change_version(worker.session)
+        worker.close()
+        other.close()
+
+    def test__removed_triggers__log_nothing(self, url):
+        worker = Worker(url, change_feed=False)
+        remove_change_log(worker.session)
+        group = unrestricted_groups(worker.session, 1, size=2)[0]
+        worker.manager.book_reservation(AvailableReservationRequest(diner_ids=group, start_time=EVENING, restaurant_id=1))
+        assert worker.session.execute(select(reservation_changes)).all() == []
+        worker.close()
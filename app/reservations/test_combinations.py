@@ -0,0 +1,187 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+from itertools import combinations
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest
+from app.models.db import Diner, Reservation, Restaurant, RestaurantTable
+from app.models.migrations import create_schema
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.booking import nearby_reservations_select
+from app.reservations.combinations import CombinableTable, cheapest_combination
+from app.reservations.reservation_manager import ReservationManager
+
+
+DAY = datetime(2099, 8, 24)
+
+
+def at(hour: int) -> datetime:
+    return DAY + timedelta(hours=hour)
+
+
+def brute_force(tables, size):
+    best = None
+    for count in range(1, len(tables) + 1):
+        for subset in combinations(tables, count):
+            if len({table.combination_group for table in subset}) != 1:
+                continue
+            seats = sum(table.capacity for table in subset)
+            if seats >= size and (best is None or (seats, count) < best):
+                best = (seats, count)
+    return best
+
+
+class TestCheapestCombination:
+    def test__fewest_seats_then_fewest_tables(self):
+        tables = [CombinableTable(1, 6, 1), CombinableTable(2, 4, 1), CombinableTable(3, 4, 1), CombinableTable(4, 2, 1)]
+        assert cheapest_combination(tables, 8) == (8, [1, 4])
+        assert cheapest_combination(tables, 9) == (10, [1, 2])
+        assert cheapest_combination(tables[1:], 8) == (8, [2, 3])
+        assert cheapest_combination(tables, 17) is None
+
+    def test__tables_only_combine_within_their_group(self):
+        tables = [CombinableTable(1, 4, 1), CombinableTable(2, 4, 2), CombinableTable(3, 6, 2), CombinableTable(4, 2, 2)]
+        assert cheapest_combination(tables, 8) == (8, [3, 4])
+        assert cheapest_combination(tables, 13) is None
+
+    def test__matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            tables = [CombinableTable(id, rng.choice((2, 2, 4, 6, 8)), rng.randint(1, 2)) for id in range(1, rng.randint(2, 9))]
+            size = rng.randint(2, 30)
+            combination = cheapest_combination(tables, size)
+            expected = brute_force(tables, size)
+            assert (combination and (combination.seats, len(combination.table_ids))) == expected
+
+    def test__node_limit__still_seats_the_group(self):
+        tables = [CombinableTable(id, 2 + id % 5, 1) for id in range(60)]
+        combination = cheapest_combination(tables, 101, node_limit=1)
+        assert combination.seats >= 101
+
+
+@pytest.fixture(scope='function')
+def session(tmp_path):
+    """
+    Restaurant 1: a 6-top and three combinable 4-tops. Restaurant 2: a 2-top only.
+    Restaurant 3: two combinable 2-tops in one group, a combinable 4-top in another.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'combinations.db'}")
+    create_schema(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Diner(name=f"Diner {number}") for number in range(1, 41)])
+    session.add_all([Restaurant(name=f"Restaurant {number}") for number in range(1, 4)])
+    session.flush()
+    session.add_all([
+        RestaurantTable(restaurant_id=1, capacity=6),
+        *[RestaurantTable(restaurant_id=1, capacity=4, combination_group=1) for _ in range(3)],
+        RestaurantTable(restaurant_id=2, capacity=2),
+        RestaurantTable(restaurant_id=3, capacity=2, combination_group=1),
+        RestaurantTable(restaurant_id=3, capacity=2, combination_group=1),
+        RestaurantTable(restaurant_id=3, capacity=4, combination_group=2),
+    ])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def book(manager, diner_ids, restaurant_id, hour=19):
+    return manager.book_reservation(AvailableReservationRequest(
+        start_time=at(hour), diner_ids=diner_ids, restaurant_id=restaurant_id
+    ))
+
+
+def found_by_every_backend(session, index, diner_ids, hour=19):
+    """Restaurant ids found by the SQL search, a page, the batch sweep and the index, which must agree"""
+    request = ReservationRequest(start_time=at(hour), diner_ids=diner_ids)
+    sql = ReservationManager(session=session)
+    found = [restaurant.id for restaurant in sql.find_available_restaurant(request)]
+    page, _ = sql.find_available_restaurant_page(ReservationPageRequest(**request.model_dump(), limit=10))
+    [(_, by_slot)] = sql.find_available_restaurants_by_slot(BatchReservationRequest(diner_ids=diner_ids, start_times=[at(hour)]))
+    indexed = index.available_restaurant_ids(diner_ids, at(hour), at(hour + 2))
+    assert [restaurant.id for restaurant in page] == [restaurant.id for restaurant in by_slot] == indexed == found
+    return found
+
+
+class TestCombinedBooking:
+    def test__search__finds_restaurants_seating_the_group_on_combined_tables(self, session):
+        index = AvailabilityIndex.build(session)
+        assert found_by_every_backend(session, index, list(range(1, 5))) == [1, 3]
+        assert found_by_every_backend(session, index, list(range(1, 9))) == [1]
+        assert found_by_every_backend(session, index, list(range(1, 14))) == []
+
+    def test__book__holds_every_combined_table(self, session):
+        index = AvailabilityIndex.build(session)
+        manager = ReservationManager(session=session, availability_index=index)
+        reservation = book(manager, list(range(1, 9)), restaurant_id=1)
+
+        holds = session.execute(select(Reservation.table_id, Reservation.combined_with_id)
+                                .where(Reservation.combined_with_id.isnot(None))).all()
+        assert reservation.table_id == 2
+        assert [tuple(hold) for hold in holds] == [(3, reservation.id)]
+        assert sorted(diner.id for diner in reservation.diners) == list(range(1, 9))
+        # One 4-top is left next to the 6-top
+        assert found_by_every_backend(session, index, list(range(11, 17))) == [1]
+        assert found_by_every_backend(session, index, list(range(11, 18))) == []
+        assert book(manager, list(range(11, 19)), restaurant_id=1) is None
+
+    def test__single_table__is_preferred_over_combining(self, session):
+        manager = ReservationManager(session=session)
+        assert book(manager, list(range(1, 7)), restaurant_id=1).table_id == 1
+        assert session.execute(select(Reservation).where(Reservation.combined_with_id.isnot(None))).first() is None
+
+    def test__delete__releases_every_combined_table(self, session):
+        index = AvailabilityIndex.build(session)
+        manager = ReservationManager(session=session, availability_index=index)
+        reservation = book(manager, list(range(1, 13)), restaurant_id=1)
+        reservation_id = reservation.id
+        assert found_by_every_backend(session, index, list(range(20, 27))) == []
+
+        with pytest.raises(HTTPException):
+            # A hold is not a reservation of its own
+            manager.delete_reservation(reservation_id + 1)
+        assert manager.delete_reservation(reservation_id)
+
+        assert session.execute(select(Reservation)).first() is None
+        assert found_by_every_backend(session, index, list(range(1, 13))) == [1]
+
+    def test__repack__leaves_combined_tables_in_place(self, session):
+        manager = ReservationManager(session=session)
+        couple = book(manager, [1, 2], restaurant_id=3)
+        group = book(manager, [3, 4, 5, 6], restaurant_id=3, hour=20)
+        assert (couple.table_id, group.table_id) == (6, 8)
+        combined = book(manager, [7, 8, 9, 10], restaurant_id=3, hour=21)
+        assert combined.table_id == 6
+
+        rows = session.execute(nearby_reservations_select(3, at(20), at(22))).all()
+        movable = {reservation_id: is_movable for reservation_id, *_, is_movable in rows}
+        assert movable == {couple.id: True, group.id: True, combined.id: False, combined.id + 1: False}
+
+    def test__async__books_and_deletes_combined_tables(self, session):
+        database_url = session.get_bind().url
+
+        async def book_and_delete():
+            engine = create_async_engine(f'sqlite+aiosqlite:///{database_url.database}')
+            try:
+                async with async_sessionmaker(bind=engine)() as async_session:
+                    manager = AsyncReservationManager(session=async_session, allocation='fit')
+                    reservation = await manager.book_reservation(AvailableReservationRequest(
+                        start_time=at(19), diner_ids=list(range(1, 13)), restaurant_id=1
+                    ))
+                    holds = (await async_session.execute(select(Reservation.table_id).where(
+                        Reservation.combined_with_id == reservation.id
+                    ))).scalars().all()
+                    await manager.delete_reservation(reservation.id)
+                    return reservation.table_id, holds
+            finally:
+                await engine.dispose()
+
+        assert asyncio.run(book_and_delete()) == (2, [3, 4])
+        assert session.execute(select(Reservation)).first() is None
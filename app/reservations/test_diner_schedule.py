@@ -0,0 +1,115 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.requests import AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.diner_schedule import DinerSchedule
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import booked_diners_select
+from app.reservations.search_cache import SearchCache
+from benchmarks.dataset import FIRST_DAY, DatasetSpec, random_slots
+from common.tests.db_setup import template_session
+
+
+# Few diners on many reservations, so every diner has a long history
+TEMPLATE_SPEC = DatasetSpec(restaurants=50, diners=60, reservations=3000, days=5, diners_per_reservation=4)
+
+
+def request_at(start_time: datetime, diner_ids, restaurant_id: int = 1) -> AvailableReservationRequest:
+    return AvailableReservationRequest(start_time=start_time, diner_ids=diner_ids, restaurant_id=restaurant_id)
+
+
+class TestDinerSchedule:
+    def test__booked_diner_ids__back_to_back_windows_do_not_overlap(self):
+        schedule = DinerSchedule()
+        evening = datetime(2099, 8, 24, 19)
+        schedule.add([1, 2], evening, evening + timedelta(hours=2))
+
+        assert schedule.booked_diner_ids([1, 2, 3], evening + timedelta(minutes=90), evening + timedelta(hours=3)) == [1, 2]
+        assert schedule.booked_diner_ids([1, 2], evening + timedelta(hours=2), evening + timedelta(hours=4)) == []
+        assert schedule.booked_diner_ids([1], evening - timedelta(hours=2), evening) == []
+
+        schedule.remove([1], evening, evening + timedelta(hours=2))
+        assert schedule.booked_diner_ids([1, 2], evening, evening + timedelta(hours=2)) == [2]
+
+    def test__build__matches_sql_on_long_histories(self, template_session):
+        schedule = DinerSchedule.build(template_session)
+        rng = random.Random(5)
+        off_grid = [FIRST_DAY + timedelta(hours=rng.randrange(24 * TEMPLATE_SPEC.days)) for _ in range(100)]
+        for start_time in random_slots(TEMPLATE_SPEC, 100) + off_grid:
+            diner_ids = rng.sample(range(1, TEMPLATE_SPEC.diners + 1), rng.randint(1, 20))
+            end_time = start_time + timedelta(hours=2)
+            expected = set(template_session.execute(booked_diners_select(diner_ids, start_time, end_time)).scalars())
+            assert set(schedule.booked_diner_ids(diner_ids, start_time, end_time)) == expected
+
+    def test__build__since_leaves_older_windows_to_sql(self, template_session):
+        since = FIRST_DAY + timedelta(days=3)
+        schedule = DinerSchedule.build(template_session, since=since)
+        full = DinerSchedule.build(template_session)
+        assert 0 < schedule.reservation_count() < full.reservation_count()
+        assert not schedule.covers(since - timedelta(minutes=1))
+        assert schedule.covers(since)
+
+
+class TestManagerWithDinerSchedule:
+    def test__find__rejects_group_with_a_booked_diner_on_every_backend(self, template_session):
+        index, schedule = AvailabilityIndex.build(template_session), DinerSchedule.build(template_session)
+        start_time = FIRST_DAY + timedelta(days=1, hours=19)
+        booked = template_session.execute(booked_diners_select(
+            list(range(1, TEMPLATE_SPEC.diners + 1)), start_time, start_time + timedelta(hours=2)
+        )).scalars().first()
+        group = [booked, TEMPLATE_SPEC.diners + 1]
+        search = ReservationRequest(start_time=start_time, diner_ids=group)
+        batch = BatchReservationRequest(diner_ids=group,
+                                        start_times=[start_time, start_time + timedelta(days=TEMPLATE_SPEC.days)])
+
+        for manager in (ReservationManager(session=template_session),
+                        ReservationManager(session=template_session, diner_schedule=schedule),
+                        ReservationManager(session=template_session, availability_index=index),
+                        ReservationManager(session=template_session, availability_index=index, diner_schedule=schedule)):
+            assert manager.find_available_restaurant(search) == []
+            assert manager.find_available_restaurant_page(ReservationPageRequest(**search.model_dump(), limit=5)) == ([], None)
+            [(_, booked_slot), (_, later_slot)] = manager.find_available_restaurants_by_slot(batch)
+            assert booked_slot == [] and later_slot != []
+
+    def test__book_and_delete__keep_the_schedule_in_sync(self, template_session):
+        schedule = DinerSchedule.build(template_session)
+        manager = ReservationManager(session=template_session, diner_schedule=schedule)
+        start_time = FIRST_DAY + timedelta(days=10, hours=19)
+
+        reservation = manager.book_reservation(request_at(start_time, [1, 2]))
+        assert schedule.booked_diner_ids([1, 2, 3], start_time, start_time + timedelta(hours=2)) == [1, 2]
+        with pytest.raises(HTTPException) as error:
+            manager.book_reservation(request_at(start_time + timedelta(minutes=30), [3, 2], restaurant_id=2))
+        assert error.value.status_code == 409
+
+        manager.delete_reservation(reservation.id)
+        assert schedule.booked_diner_ids([1, 2], start_time, start_time + timedelta(hours=2)) == []
+        assert manager.book_reservation(request_at(start_time, [2, 3], restaurant_id=2)) is not None
+
+    def test__book__stale_schedule_is_caught_by_the_diner_guard(self, template_session):
+        schedule = DinerSchedule.build(template_session)
+        start_time = FIRST_DAY + timedelta(days=10, hours=19)
+        # Booked by another process, this schedule never hears of it
+        ReservationManager(session=template_session).book_reservation(request_at(start_time, [1]))
+
+        manager = ReservationManager(session=template_session, diner_schedule=schedule)
+        with pytest.raises(HTTPException) as error:
+            manager.book_reservation(request_at(start_time, [1, 2], restaurant_id=2))
+        assert error.value.status_code == 409
+
+    def test__book__invalidates_cached_searches_of_the_booked_diners(self, template_session):
+        cache = SearchCache()
+        manager = ReservationManager(session=template_session, search_cache=cache,
+                                     diner_schedule=DinerSchedule.build(template_session))
+        start_time = FIRST_DAY + timedelta(days=10, hours=19)
+        search = ReservationRequest(start_time=start_time, diner_ids=[1, 5])
+        assert manager.find_available_restaurant(search) != []
+
+        reservation = manager.book_reservation(request_at(start_time, [5, 6], restaurant_id=7))
+        assert manager.find_available_restaurant(search) == []
+        manager.delete_reservation(reservation.id)
+        assert manager.find_available_restaurant(search) != []
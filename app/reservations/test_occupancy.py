@@ -0,0 +1,141 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, func, select, text, update
+
+from app.api.requests import AvailableReservationRequest, ReservationPageRequest, ReservationRequest
+from app.models.db import Restaurant, RestaurantTable, restaurant_occupancy
+from app.reservations.archive import archive_reservations
+from app.reservations.occupancy import rebuild_occupancy
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import available_restaurant_rows_select, covered_hours, has_occupancy_room
+from benchmarks.dataset import FIRST_DAY, DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_session
+
+
+# Busy enough that whole restaurants fill up for some hours
+TEMPLATE_SPEC = DatasetSpec(restaurants=30, diners=300, reservations=9000, days=8)
+
+
+@pytest.fixture(scope='function')
+def session(template_session):
+    # The 2-tops of every third restaurant combine
+    template_session.execute(update(RestaurantTable).where(
+        RestaurantTable.restaurant_id % 3 == 0, RestaurantTable.capacity == 2
+    ).values(combination_group=1))
+    template_session.commit()
+    return template_session
+
+
+def occupancy_rows(session):
+    return session.execute(select(restaurant_occupancy).order_by(*restaurant_occupancy.primary_key)).all()
+
+
+def assert_matches_rebuild(session):
+    kept = occupancy_rows(session)
+    rebuild_occupancy(session)
+    assert occupancy_rows(session) == kept
+
+
+def requests(count: int, seed: int):
+    """Groups and start times on and off the hour"""
+    starts = random_slots(TEMPLATE_SPEC, count, seed=seed)
+    return [ReservationRequest(diner_ids=diner_ids, start_time=start + timedelta(minutes=30 * (number % 2)))
+            for number, (diner_ids, start) in enumerate(zip(random_groups(TEMPLATE_SPEC, count, seed=seed), starts))]
+
+
+class TestOccupancy:
+    def test__triggers__match_a_rebuild_after_every_kind_of_write(self, session):
+        assert occupancy_rows(session)
+        assert_matches_rebuild(session)
+
+        manager = ReservationManager(session=session, allocation='repack')
+        booked = []
+        for number, request in enumerate(requests(120, seed=3)):
+            try:
+                reservation = manager.book_reservation(AvailableReservationRequest(
+                    **request.model_dump(), restaurant_id=number % TEMPLATE_SPEC.restaurants + 1
+                ))
+            except HTTPException:
+                continue
+            if reservation is not None:
+                booked.append(reservation.id)
+        assert booked
+        assert_matches_rebuild(session)
+
+        for reservation_id in booked[::2]:
+            manager.delete_reservation(reservation_id)
+        assert_matches_rebuild(session)
+
+        archive_reservations(session, FIRST_DAY + timedelta(days=3))
+        assert_matches_rebuild(session)
+
+    def test__restaurant_occupancy__counts_booked_and_free_tables(self, session):
+        manager = ReservationManager(session=session)
+        tables, slots = manager.restaurant_occupancy(1, FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=1))
+        assert tables == {2: 3, 4: 2, 6: 2}
+        assert slots and all(0 < slot.booked <= slot.tables == tables[slot.capacity] for slot in slots)
+        day, hour, capacity = slots[0].day, slots[0].hour, slots[0].capacity
+        busy = session.execute(text(
+            "SELECT count(DISTINCT reservations.table_id) FROM reservations "
+            "JOIN restaurant_tables ON restaurant_tables.id = reservations.table_id "
+            "WHERE restaurant_tables.restaurant_id = 1 AND restaurant_tables.capacity = :capacity "
+            "AND reservations.start_datetime < :slot_end AND reservations.end_datetime > :slot_start"
+        ), {"capacity": capacity, "slot_start": f"{day} {hour:02}:00:00.000000", "slot_end": f"{day} {hour:02}:59:59.999999"}).scalar()
+        assert slots[0].booked == busy
+        assert slots[0].free == slots[0].tables - busy
+
+        with pytest.raises(HTTPException):
+            manager.restaurant_occupancy(999, FIRST_DAY.date(), FIRST_DAY.date())
+        with pytest.raises(HTTPException):
+            manager.restaurant_occupancy(1, FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=40))
+
+    def test__archived_days__keep_their_occupancy(self, session):
+        manager = ReservationManager(session=session)
+        first_day, last_day = FIRST_DAY.date(), FIRST_DAY.date() + timedelta(days=3)
+        before = [manager.restaurant_occupancy(restaurant_id, first_day, last_day)
+                  for restaurant_id in range(1, TEMPLATE_SPEC.restaurants + 1)]
+        assert archive_reservations(session, FIRST_DAY + timedelta(days=3))
+        assert [manager.restaurant_occupancy(restaurant_id, first_day, last_day)
+                for restaurant_id in range(1, TEMPLATE_SPEC.restaurants + 1)] == before
+        assert_matches_rebuild(session)
+
+    def test__prefilter__finds_the_same_restaurants(self, session):
+        plain = ReservationManager(session=session)
+        prefiltered = ReservationManager(session=session, occupancy_prefilter=True)
+        found = skipped = 0
+        for request in requests(80, seed=5):
+            expected = plain.find_available_restaurant(request)
+            assert prefiltered.find_available_restaurant(request) == expected
+            end_datetime = request.start_time + timedelta(hours=2)
+            page = session.execute(available_restaurant_rows_select(
+                request.diner_ids, request.start_time, end_datetime, limit=100, occupancy_prefilter=True
+            )).all()
+            assert [row.id for row in page] == [restaurant.id for restaurant in expected]
+            found += len(expected)
+            skipped += session.scalar(select(func.count()).select_from(Restaurant).where(
+                ~has_occupancy_room(len(request.diner_ids), request.start_time, end_datetime)
+            ))
+        # Some restaurants were ruled out before their tables were checked, some still found
+        assert found and skipped
+
+    def test__prefilter__applies_to_pages(self, session):
+        statements = []
+        event.listen(session.get_bind(), 'before_cursor_execute',
+                     lambda connection, cursor, statement, *args: statements.append(statement))
+        page_requests = [ReservationPageRequest(**request.model_dump(), limit=5) for request in requests(20, seed=7)]
+        plain = [ReservationManager(session=session).find_available_restaurant_page(page_request)
+                 for page_request in page_requests]
+        assert not any("restaurant_occupancy" in statement for statement in statements)
+        assert [ReservationManager(session=session, occupancy_prefilter=True).find_available_restaurant_page(page_request)
+                for page_request in page_requests] == plain
+        assert any("restaurant_occupancy" in statement for statement in statements)
+
+    def test__covered_hours__only_whole_hours_inside_the_window(self):
+        start = FIRST_DAY.replace(hour=23)
+        assert covered_hours(start, start + timedelta(hours=2)) == [(start.date(), 23), (start.date() + timedelta(days=1), 0)]
+        assert covered_hours(start + timedelta(minutes=30), start + timedelta(hours=2, minutes=30)) == [
+            (start.date() + timedelta(days=1), 0)
+        ]
+        assert covered_hours(start + timedelta(minutes=10), start + timedelta(minutes=50)) == []
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.api.requests import ReservationPageRequest, ReservationRequest
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.pagination import decode_cursor, encode_cursor
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.dataset import DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_file, template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=200, diners=500, reservations=4000, days=5, diners_per_reservation=2)
+
+
+def searches(count: int):
+    return [ReservationRequest(start_time=start_time, diner_ids=diner_ids)
+            for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, count), random_slots(TEMPLATE_SPEC, count))]
+
+
+def all_pages(find_page, request: ReservationRequest, limit: int):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page, cursor = find_page(ReservationPageRequest(
+            start_time=request.start_time, diner_ids=request.diner_ids, limit=limit, cursor=cursor
+        ))
+        ids += [restaurant.id for restaurant in page]
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+class TestCursor:
+    def test__cursor__round_trips(self):
+        assert decode_cursor(encode_cursor(12345)) == 12345
+
+    @pytest.mark.parametrize("cursor", ["", "!!!", encode_cursor(1)[:-1] + "*", "YWZ0ZXI6eA"])
+    def test__decode_cursor__rejects_malformed(self, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+    def test__manager__invalid_cursor_is_a_bad_request(self, template_session):
+        request = ReservationPageRequest(start_time=random_slots(TEMPLATE_SPEC, 1)[0], diner_ids=[1], cursor="nope")
+        with pytest.raises(HTTPException) as error:
+            ReservationManager(session=template_session).find_available_restaurant_page(request)
+        assert error.value.status_code == 400
+
+
+class TestFindAvailableRestaurantPage:
+    @pytest.mark.parametrize("limit", [1, 7, 1000])
+    def test__pages__cover_the_full_search(self, template_session, limit):
+        manager = ReservationManager(session=template_session)
+        for request in searches(5):
+            expected = [restaurant.id for restaurant in manager.find_available_restaurant(request)]
+            ids, pages = all_pages(manager.find_available_restaurant_page, request, limit)
+            assert ids == expected
+            assert pages == max(1, -(-len(expected) // limit))
+
+    def test__index_backend__pages_like_sql(self, template_session):
+        sql = ReservationManager(session=template_session)
+        indexed = ReservationManager(session=template_session, availability_index=AvailabilityIndex.build(template_session))
+        for request in searches(5):
+            assert all_pages(indexed.find_available_restaurant_page, request, 9) == \
+                   all_pages(sql.find_available_restaurant_page, request, 9)
+
+    def test__async_stream__yields_the_full_search_in_pages(self, template_file):
+        requests = searches(3)
+        with Session(template_file) as session:
+            manager = ReservationManager(session=session)
+            expected = [[restaurant.id for restaurant in manager.find_available_restaurant(request)] for request in requests]
+
+        async def stream_all():
+            engine = create_async_engine(template_file.url.set(drivername='sqlite+aiosqlite'))
+            try:
+                async with async_sessionmaker(bind=engine)() as async_session:
+                    manager = AsyncReservationManager(session=async_session)
+                    streamed = []
+                    for request in requests:
+                        pages = [page async for page in manager.stream_available_restaurants(request, page_size=10)]
+                        assert all(len(page) <= 10 for page in pages)
+                        streamed.append([restaurant.id for page in pages for restaurant in page])
+                    return streamed
+            finally:
+                await engine.dispose()
+
+        assert asyncio.run(stream_all()) == expected
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import timedelta
+from math import cos, radians, sin
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.api.requests import ReservationRequest, ReservationSearchRequest
+from app.models.db import Restaurant
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.proximity import bounding_box, group_centroid_select, haversine_km, nearby_restaurants_select
+from app.reservations.reference_data import ReferenceData
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import RESERVATION_DURATION
+from benchmarks.dataset import DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_file, template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=400, diners=200, reservations=4000, days=3)
+
+
+def searches(count: int, **distance):
+    return [ReservationSearchRequest(diner_ids=diner_ids, start_time=start_time, **distance)
+            for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, count, max_size=4),
+                                             random_slots(TEMPLATE_SPEC, count))]
+
+
+def brute_force(session, request: ReservationSearchRequest):
+    """Every free restaurant with its distance from the group, nearest first, ties by id"""
+    centroid = session.execute(group_centroid_select(request.diner_ids)).one()
+    free = {restaurant.id for restaurant in ReservationManager(session=session).find_available_restaurant(
+        ReservationRequest(diner_ids=request.diner_ids, start_time=request.start_time)
+    )}
+    located = session.execute(select(Restaurant.id, Restaurant.latitude, Restaurant.longitude)).all()
+    return sorted((haversine_km(*centroid, latitude, longitude), id) for id, latitude, longitude in located if id in free)
+
+
+class TestGeometry:
+    def test__haversine__known_distances(self):
+        assert haversine_km(19.4326, -99.1332, 19.4326, -99.1332) == 0
+        # One degree of latitude, and Mexico City to Guadalajara
+        assert haversine_km(0, 0, 1, 0) == pytest.approx(111.195, abs=0.01)
+        assert haversine_km(19.4326, -99.1332, 20.6597, -103.3496) == pytest.approx(461, abs=2)
+
+    def test__bounding_box__holds_the_circle(self):
+        for latitude, longitude, radius in ((19.4, -99.15, 3), (60, 10, 500), (-33.9, 151.2, 40)):
+            min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius)
+            # Points on and inside the circle in every direction, stepped out in degrees then kept if within radius
+            for bearing in range(0, 360, 5):
+                for reach in (0.5, 0.999):
+                    degrees = radius / 111.195 * reach
+                    point_latitude = latitude + degrees * cos(radians(bearing))
+                    point_longitude = longitude + degrees * sin(radians(bearing)) / cos(radians(latitude))
+                    if haversine_km(latitude, longitude, point_latitude, point_longitude) <= radius:
+                        assert min_latitude <= point_latitude <= max_latitude
+                        assert min_longitude <= point_longitude <= max_longitude
+
+    def test__bounding_box__spans_every_longitude_near_a_pole_or_the_antimeridian(self):
+        assert bounding_box(89.5, 0, 100)[2:] == (-180.0, 180.0)
+        assert bounding_box(0, 179.9, 50)[2:] == (-180.0, 180.0)
+        assert bounding_box(0, 0, 50)[2:] != (-180.0, 180.0)
+
+
+class TestNearbyRestaurants:
+    def test__box__is_read_from_the_rtree(self, template_session):
+        start_time = random_slots(TEMPLATE_SPEC, 1)[0]
+        statement = nearby_restaurants_select([1, 2], start_time, start_time + timedelta(hours=RESERVATION_DURATION),
+                                              bounding_box(19.4, -99.15, 2))
+        compiled = str(statement.compile(compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in template_session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")]
+        assert any('restaurant_locations VIRTUAL TABLE' in step for step in plan)
+        assert not any(step.startswith('SCAN restaurants') for step in plan)
+
+    def test__manager__matches_ranking_every_free_restaurant(self, template_session):
+        manager = ReservationManager(session=template_session)
+        for request in searches(10, max_distance_km=6):
+            expected = [id for distance, id in brute_force(template_session, request) if distance <= 6]
+            assert [restaurant.id for restaurant in manager.find_available_restaurant(request)] == expected
+        for request in searches(10, nearest_k=7):
+            found = manager.find_available_restaurant(request)
+            assert [restaurant.id for restaurant in found] == [id for _, id in brute_force(template_session, request)[:7]]
+            assert [restaurant.distance_km for restaurant in found] == sorted(restaurant.distance_km for restaurant in found)
+        for request in searches(10, nearest_k=3, max_distance_km=1.5):
+            expected = [id for distance, id in brute_force(template_session, request) if distance <= 1.5][:3]
+            assert [restaurant.id for restaurant in manager.find_available_restaurant(request)] == expected
+
+    def test__reference_data__finds_the_same_restaurants(self, template_session):
+        plain = ReservationManager(session=template_session)
+        referenced = ReservationManager(session=template_session, reference_data=ReferenceData.build(template_session))
+        for request in searches(10, nearest_k=10):
+            assert referenced.find_available_restaurant(request) == plain.find_available_restaurant(request)
+
+    def test__async_manager__finds_the_same_restaurants(self, template_file):
+        requests = searches(10, nearest_k=5)
+        with Session(template_file) as session:
+            expected = [ReservationManager(session=session).find_available_restaurant(request) for request in requests]
+
+        async def find():
+            async_engine = create_async_engine(template_file.url.set(drivername='sqlite+aiosqlite'))
+            async with async_sessionmaker(bind=async_engine)() as async_session:
+                manager = AsyncReservationManager(session=async_session)
+                found = [await manager.find_available_restaurant(request) for request in requests]
+            await async_engine.dispose()
+            return found
+
+        assert asyncio.run(find()) == expected
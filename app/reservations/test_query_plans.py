@@ -0,0 +1,87 @@
+import re
+from datetime import datetime
+from typing import List, Set, Tuple
+
+import pytest
+from sqlalchemy import event
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import booked_diners_select
+from benchmarks.dataset import DatasetSpec
+from common.tests.db_setup import template_session
+
+
+HOT_TABLES = {
+    'reservations', 'restaurant_tables', 'restaurants', 'diner_reservation',
+    'diner_dietary_restriction', 'restaurant_dietary_restriction',
+}
+SCAN = re.compile(r'^SCAN (\w+)')
+
+
+# A small but analyzed dataset so the planner picks the same indexes it would in production
+TEMPLATE_SPEC = DatasetSpec(restaurants=300, diners=1000, reservations=5000, days=10, diners_per_reservation=2)
+
+
+@pytest.fixture(scope='function')
+def manager(template_session):
+    return ReservationManager(session=template_session)
+
+
+@pytest.fixture(scope='function')
+def connection(template_session):
+    return template_session.connection()
+
+
+def capture_statements(connection, call) -> List[Tuple[str, tuple]]:
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(connection, 'before_cursor_execute', record)
+    try:
+        call()
+    finally:
+        event.remove(connection, 'before_cursor_execute', record)
+    return [(statement, parameters) for statement, parameters in statements
+            if statement.lstrip().upper().startswith(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'))]
+
+
+def full_scans(connection, statements: List[Tuple[str, tuple]]) -> Set[Tuple[str, str]]:
+    """(table, plan line) for every hot table walked end to end, with or without a covering index"""
+    scans = set()
+    for statement, parameters in statements:
+        for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters):
+            match = SCAN.match(row[3])
+            if match and match.group(1) in HOT_TABLES:
+                scans.add((match.group(1), row[3]))
+    return scans
+
+
+class TestQueryPlans:
+    def test__find_available_restaurant__seeks_reservations_and_restrictions(self, connection, manager):
+        request = ReservationRequest(start_time=datetime(2024, 8, 3, 19), diner_ids=[1, 2, 3, 4, 5])
+        statements = capture_statements(connection, lambda: manager.find_available_restaurant(request))
+
+        # The result is every restaurant with a table for the group, walking those two is the output itself
+        scanned = {table for table, _ in full_scans(connection, statements)}
+        assert scanned <= {'restaurants', 'restaurant_tables'}
+
+    def test__book_reservation__uses_indexes_only(self, connection, manager):
+        # After the seeded days, so the group is free and the booking goes through every statement
+        request = AvailableReservationRequest(start_time=datetime(2024, 9, 1, 19), diner_ids=[1, 2, 3], restaurant_id=5)
+        statements = capture_statements(connection, lambda: manager.book_reservation(request))
+        assert full_scans(connection, statements) == set()
+
+    def test__delete_reservation__uses_indexes_only(self, connection, manager):
+        statements = capture_statements(connection, lambda: manager.delete_reservation(reservation_id=10))
+        assert full_scans(connection, statements) == set()
+
+    def test__diner_check__seeks_each_diners_window(self, connection, manager):
+        statement = booked_diners_select([1, 2, 3], datetime(2024, 8, 3, 19), datetime(2024, 8, 3, 21))
+        [(sql, parameters)] = capture_statements(connection, lambda: manager.session.execute(statement).all())
+        plan = [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        # Only the diners' reservations ending after the window starts, not their whole history
+        assert any('ix_diner_reservation_diner_window (diner_id=? AND end_datetime>?)' in line for line in plan)
+        assert 'reservations' not in ' '.join(plan)
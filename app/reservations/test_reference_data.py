@@ -0,0 +1,124 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.api.requests import AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest
+from app.models.db import Diner, diner_dietary_restriction_association
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.batch_search import candidate_tables_select
+from app.reservations.reference_data import ReferenceData, ReferenceSnapshot, group_filter
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import group_restriction_mask
+from app.reservations.test_async_reservation_manager import count_statements
+from benchmarks.dataset import DatasetSpec, random_groups, random_slots
+from common.tests.db_setup import template_file, template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=60, diners=300, reservations=3000, days=5)
+
+
+def searches(count: int):
+    return [ReservationRequest(diner_ids=diner_ids, start_time=start_time)
+            for diner_ids, start_time in zip(random_groups(TEMPLATE_SPEC, count, max_size=6),
+                                             random_slots(TEMPLATE_SPEC, count))]
+
+
+class TestReferenceSnapshot:
+    def test__build__matches_the_database(self, template_session):
+        snapshot = ReferenceSnapshot.build(template_session)
+        assert len(snapshot.restaurant_ids) == TEMPLATE_SPEC.restaurants
+        assert len(snapshot.diner_ids) == template_session.query(Diner).filter(Diner.dietary_restriction_mask != 0).count()
+        for diner_ids in random_groups(TEMPLATE_SPEC, 30, max_size=4):
+            assert snapshot.group_mask(diner_ids) == template_session.scalar(select(group_restriction_mask(diner_ids)))
+        for size in (1, 3, 6):
+            group_mask = snapshot.group_mask([1, 2, 3])
+            assert sorted(snapshot.candidate_tables(size, group_mask)) == sorted(
+                tuple(row) for row in template_session.execute(candidate_tables_select(list(range(1, size + 1)), group_mask))
+            )
+
+    def test__seating__counts_combination_groups(self):
+        snapshot = ReferenceSnapshot(
+            1, [(1, 'Two tops', 0), (2, 'Combinable', 3), (5, 'No tables', 7)],
+            [(10, 1, 2, None), (11, 1, 2, None), (20, 2, 4, 1), (21, 2, 4, 1), (22, 2, 6, None)],
+            [(3, 1), (4, 2)]
+        )
+        assert list(snapshot.largest_seating) == [2, 8, 0]
+        assert [snapshot.cannot_seat(restaurant_id, 3) for restaurant_id in (1, 2, 5, 6)] == [True, False, True, False]
+        assert snapshot.group_mask([1, 3, 4]) == 3
+        assert group_filter(snapshot, [3, 4]) == (True, 3)
+        assert group_filter(snapshot, [3] * 9) == (False, 1)
+        assert group_filter(None, [3] * 9) == (True, None)
+        assert snapshot.candidate_tables(5, 3) == [(20, 2, 'Combinable', 4, 1), (21, 2, 'Combinable', 4, 1),
+                                                   (22, 2, 'Combinable', 6, None)]
+        assert snapshot.memory_bytes() > 0
+        assert ReferenceSnapshot(1, [], [], []).seats_anywhere(1, 0) is False
+
+
+class TestReferenceData:
+    def test__refresh__swaps_in_the_next_version_only_when_changed(self, template_session):
+        reference_data = ReferenceData.build(template_session)
+        first = reference_data.snapshot
+        assert reference_data.refresh(template_session, if_changed=True) is False
+        assert reference_data.snapshot is first
+
+        diner_id = next(diner_id for diner_id in range(1, TEMPLATE_SPEC.diners + 1) if first.diner_mask(diner_id) == 0)
+        template_session.execute(insert(diner_dietary_restriction_association).values(
+            diner_id=diner_id, dietary_restriction_id=2
+        ))
+        assert reference_data.refresh(template_session, if_changed=True) is True
+        assert reference_data.snapshot.version == 2
+        assert reference_data.snapshot.diner_mask(diner_id) == 2
+        # The earlier snapshot is untouched, a reader holding it keeps a consistent view
+        assert first.diner_mask(diner_id) == 0
+        assert reference_data.swap(first) is False
+
+    def test__manager__finds_the_same_restaurants(self, template_session):
+        plain = ReservationManager(session=template_session)
+        referenced = ReservationManager(session=template_session, reference_data=ReferenceData.build(template_session))
+        for request in searches(30):
+            assert [restaurant.id for restaurant in referenced.find_available_restaurant(request)] == \
+                [restaurant.id for restaurant in plain.find_available_restaurant(request)]
+            page = ReservationPageRequest(**request.model_dump(), limit=5)
+            assert referenced.find_available_restaurant_page(page) == plain.find_available_restaurant_page(page)
+            batch = BatchReservationRequest(diner_ids=request.diner_ids, range_start=request.start_time,
+                                            range_end=request.start_time + timedelta(hours=4), step_minutes=60)
+            assert referenced.find_available_restaurants_by_slot(batch) == plain.find_available_restaurants_by_slot(batch)
+
+    def test__manager__answers_unseatable_groups_without_sql(self, template_session):
+        manager = ReservationManager(session=template_session, reference_data=ReferenceData.build(template_session))
+        request = searches(1)[0]
+        large = list(range(1, 8))
+        statements = count_statements(template_session.connection())
+        assert manager.find_available_restaurant(ReservationRequest(diner_ids=large, start_time=request.start_time)) == []
+        assert manager.book_reservation(AvailableReservationRequest(
+            diner_ids=large, start_time=request.start_time, restaurant_id=1
+        )) is None
+        assert statements == []
+
+        manager.find_available_restaurants_by_slot(BatchReservationRequest(
+            diner_ids=request.diner_ids, range_start=request.start_time,
+            range_end=request.start_time + timedelta(hours=4), step_minutes=60
+        ))
+        # Candidate tables come from the snapshot, only their reservations are read
+        assert len(statements) == 1
+
+    def test__async_manager__finds_the_same_restaurants(self, template_file):
+        with Session(template_file) as session:
+            reference_data = ReferenceData.build(session)
+            manager = ReservationManager(session=session)
+            expected = [[restaurant.id for restaurant in manager.find_available_restaurant(request)] for request in searches(10)]
+
+        async def find():
+            async_engine = create_async_engine(template_file.url.set(drivername='sqlite+aiosqlite'))
+            async with async_sessionmaker(bind=async_engine)() as async_session:
+                manager = AsyncReservationManager(session=async_session, reference_data=reference_data)
+                found = [[restaurant.id for restaurant in await manager.find_available_restaurant(request)]
+                         for request in searches(10)]
+            await async_engine.dispose()
+            return found
+
+        assert asyncio.run(find()) == expected
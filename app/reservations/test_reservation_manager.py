@@ -162,7 +162,7 @@ class TestReservationManager:
         assert restaurants[0] == expected_restaurant1
 
     def test__find_reservation__one_diner_already_booked(self, test_session):
-        """Two diners, Two restaurants, one diner already booked"""
+        """Two diners, Two restaurants, one diner already booked, so the group cannot book anywhere"""
         test_data = GenerateTestData(session=test_session)
 
         self.reservation_manager = ReservationManager(session=test_session)
@@ -180,7 +180,50 @@ class TestReservationManager:
 
         reservation_request = ReservationRequest(start_time=start_datetime, diner_ids=[diner1.id, diner2.id])
         restaurants = self.reservation_manager.find_available_restaurant(reservation_request=reservation_request)
-        assert len(restaurants) == 1
+        assert len(restaurants) == 0
+
+        reservation_request = ReservationRequest(start_time=start_datetime + timedelta(hours=2), diner_ids=[diner1.id, diner2.id])
+        restaurants = self.reservation_manager.find_available_restaurant(reservation_request=reservation_request)
+        assert len(restaurants) == 2
+
+    def test__find_reservation__other_table_still_free(self, test_session):
+        """One booked table should not hide a restaurant that has another free table"""
+        test_data = GenerateTestData(session=test_session)
+        self.reservation_manager = ReservationManager(session=test_session)
+        diner1 = test_data.add_test_diner(name="Guy1", dietary_restrictions=[])
+        diner2 = test_data.add_test_diner(name="Guy2", dietary_restrictions=[])
+        restaurant = test_data.add_test_restaurant(name="Rest1", dietary_restrictions=[])
+        table1 = test_data.add_table(capacity=2, restaurant_id=restaurant.id)
+        test_data.add_table(capacity=4, restaurant_id=restaurant.id)
+        start_datetime=datetime(2024, 8, 24, 16, 0, 0)
+        test_data.add_reservation(table_id=table1.id, diners=[diner1], start_datetime=start_datetime)
+
+        reservation_request = ReservationRequest(start_time=start_datetime, diner_ids=[diner2.id])
+        restaurants = self.reservation_manager.find_available_restaurant(reservation_request=reservation_request)
+        assert [result.id for result in restaurants] == [restaurant.id]
+
+    def test__find_reservation__restaurant_must_cover_every_restriction(self, test_session):
+        """Restaurants endorsing only part of the group's restrictions are filtered out"""
+        test_data = GenerateTestData(session=test_session)
+        test_data.add_dietary_restrictions()
+        dietary_restriction1 = test_session.get(DietaryRestriction, 1)
+        dietary_restriction2 = test_session.get(DietaryRestriction, 2)
+        dietary_restriction3 = test_session.get(DietaryRestriction, 3)
+
+        self.reservation_manager = ReservationManager(session=test_session)
+        diner1 = test_data.add_test_diner(name="Guy1", dietary_restrictions=[dietary_restriction1, dietary_restriction2])
+        diner2 = test_data.add_test_diner(name="Guy2", dietary_restrictions=[dietary_restriction2])
+
+        partial_restaurant = test_data.add_test_restaurant(name="Rest1", dietary_restrictions=[dietary_restriction1, dietary_restriction3])
+        test_data.add_table(capacity=2, restaurant_id=partial_restaurant.id)
+        expected_restaurant = test_data.add_test_restaurant(
+            name="Rest2", dietary_restrictions=[dietary_restriction1, dietary_restriction2, dietary_restriction3]
+        )
+        test_data.add_table(capacity=2, restaurant_id=expected_restaurant.id)
+
+        reservation_request = ReservationRequest(start_time=datetime(2024, 8, 24, 16, 0, 0), diner_ids=[diner1.id, diner2.id])
+        restaurants = self.reservation_manager.find_available_restaurant(reservation_request=reservation_request)
+        assert [result.id for result in restaurants] == [expected_restaurant.id]
 
     def test__book_reservation__no_conflicts(self, test_session):
         """Book a table from a restaurant for one person"""
@@ -206,12 +249,13 @@ class TestReservationManager:
         """Book a table from a restaurant with a time overlap"""
         test_data = GenerateTestData(session=test_session)
         diner1 = test_data.add_test_diner(name="Guy1", dietary_restrictions=[])
+        diner2 = test_data.add_test_diner(name="Guy2", dietary_restrictions=[])
         restaurant1 = test_data.add_test_restaurant(name="Rest1", dietary_restrictions=[])
         table1 = test_data.add_table(capacity=2, restaurant_id=restaurant1.id)
         start_datetime=datetime(2024, 8, 24, 16, 0, 0)
 
         test_data.add_reservation(table_id=table1.id,
-                                  diners=[diner1],
+                                  diners=[diner2],
                                   start_datetime=start_datetime + timedelta(hours=1))
         
         available_reservation_request = AvailableReservationRequest(
@@ -224,6 +268,49 @@ class TestReservationManager:
         reservation = self.reservation_manager.book_reservation(available_reservation_request=available_reservation_request)
         assert reservation == None
 
+    def test__book_reservation__diner_already_booked_elsewhere(self, test_session):
+        """A diner cannot hold two overlapping reservations, even at different restaurants"""
+        test_data = GenerateTestData(session=test_session)
+        diner1 = test_data.add_test_diner(name="Guy1", dietary_restrictions=[])
+        restaurant1 = test_data.add_test_restaurant(name="Rest1", dietary_restrictions=[])
+        restaurant2 = test_data.add_test_restaurant(name="Rest2", dietary_restrictions=[])
+        table1 = test_data.add_table(capacity=2, restaurant_id=restaurant1.id)
+        test_data.add_table(capacity=2, restaurant_id=restaurant2.id)
+        start_datetime=datetime(2024, 8, 24, 19, 0, 0)
+        test_data.add_reservation(table_id=table1.id, diners=[diner1], start_datetime=start_datetime)
+
+        available_reservation_request = AvailableReservationRequest(
+            start_time=start_datetime + timedelta(minutes=30),
+            diner_ids=[diner1.id],
+            restaurant_id=restaurant2.id
+        )
+
+        self.reservation_manager = ReservationManager(session=test_session)
+        with pytest.raises(HTTPException) as error:
+            self.reservation_manager.book_reservation(available_reservation_request=available_reservation_request)
+        assert error.value.status_code == 409
+
+    def test__book_reservation__picks_smallest_free_table(self, test_session):
+        """The smallest table that seats the group is booked, bigger ones stay free"""
+        test_data = GenerateTestData(session=test_session)
+        diner1 = test_data.add_test_diner(name="Guy1", dietary_restrictions=[])
+        diner2 = test_data.add_test_diner(name="Guy2", dietary_restrictions=[])
+        restaurant1 = test_data.add_test_restaurant(name="Rest1", dietary_restrictions=[])
+        test_data.add_table(capacity=6, restaurant_id=restaurant1.id)
+        small_table = test_data.add_table(capacity=2, restaurant_id=restaurant1.id)
+        test_data.add_table(capacity=1, restaurant_id=restaurant1.id)
+
+        available_reservation_request = AvailableReservationRequest(
+            start_time=datetime(2024, 8, 24, 19, 0, 0),
+            diner_ids=[diner1.id, diner2.id],
+            restaurant_id=restaurant1.id
+        )
+
+        self.reservation_manager = ReservationManager(session=test_session)
+        reservation = self.reservation_manager.book_reservation(available_reservation_request=available_reservation_request)
+        assert reservation.table_id == small_table.id
+        assert sorted(diner.id for diner in reservation.diners) == [diner1.id, diner2.id]
+
     def test__delete_reservation(self, test_session):
         test_data = GenerateTestData(session=test_session)
         diner1 = test_data.add_test_diner(name="Guy1", dietary_restrictions=[])
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import select
+
+from app.models.db import DietaryRestriction, Diner, Restaurant, restriction_bit
+from app.reservations import restriction_masks
+from app.reservations.restriction_masks import RestaurantMasks, diner_group_mask
+from app.reservations.search import satisfies_group
+from common.tests.db_setup import test_session
+
+
+@pytest.fixture(scope='function')
+def restrictions(test_session):
+    restrictions = [DietaryRestriction(name=name) for name in ("Vegan", "Gluten-Free", "Nut-Free")]
+    test_session.add_all(restrictions)
+    test_session.commit()
+    return restrictions
+
+
+class TestRestrictionMasks:
+    def test__masks__follow_restriction_changes(self, test_session, restrictions):
+        vegan, gluten_free, nut_free = restrictions
+        diner = Diner(name="Masked", dietary_restrictions=[vegan, nut_free])
+        test_session.add(diner)
+        test_session.commit()
+        assert diner.dietary_restriction_mask == restriction_bit(vegan.id) | restriction_bit(nut_free.id)
+
+        diner.dietary_restrictions.remove(vegan)
+        diner.dietary_restrictions.append(gluten_free)
+        test_session.commit()
+        assert diner.dietary_restriction_mask == restriction_bit(gluten_free.id) | restriction_bit(nut_free.id)
+
+    def test__satisfies_group__in_sql(self, test_session, restrictions):
+        vegan, gluten_free, _ = restrictions
+        test_session.add_all([
+            Restaurant(name="Both", dietary_restrictions=[vegan, gluten_free]),
+            Restaurant(name="Vegan", dietary_restrictions=[vegan]),
+            Diner(name="Group 1", dietary_restrictions=[vegan]),
+            Diner(name="Group 2", dietary_restrictions=[gluten_free]),
+        ])
+        test_session.commit()
+        diner_ids = test_session.execute(select(Diner.id)).scalars().all()
+
+        group_mask = diner_group_mask(test_session, diner_ids)
+        matching = test_session.execute(
+            select(Restaurant.name).where(satisfies_group(Restaurant.dietary_restriction_mask, group_mask))
+        ).scalars().all()
+        assert matching == ["Both"]
+
+    @pytest.mark.parametrize("vectorized", [True, False])
+    def test__restaurant_masks__matching(self, monkeypatch, vectorized):
+        if vectorized and restriction_masks.numpy is None:
+            pytest.skip("numpy is not installed")
+        if not vectorized:
+            monkeypatch.setattr(restriction_masks, 'numpy', None)
+        masks = RestaurantMasks(ids=[1, 2, 3, 4], masks=[0b000, 0b011, 0b111, 0b010])
+
+        assert masks.matching(0) == [1, 2, 3, 4]
+        assert masks.matching(0b010) == [2, 3, 4]
+        assert masks.matching(0b101) == [3]
+
+        masks.set_mask(1, 0b101)
+        assert masks.matching(0b101) == [1, 3]
+        assert masks.mask_of(1) == 0b101
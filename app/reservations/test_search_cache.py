@@ -0,0 +1,147 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.reservations.availability_index import IndexedRestaurant
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+from benchmarks.dataset import DatasetSpec, random_groups
+from common.tests.db_setup import template_session
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=50, diners=200, reservations=500, days=5, diners_per_reservation=2)
+
+EVENING = datetime(2024, 9, 1, 19)
+ROWS = [IndexedRestaurant(1, "one"), IndexedRestaurant(2, "two")]
+
+
+class TestSearchCache:
+    def test__lookup__hits_on_same_group_and_bucket(self):
+        cache = SearchCache(bucket_minutes=15)
+        assert cache.lookup([2, 1], EVENING) is None
+        cache.store([2, 1], EVENING, ROWS, cache.version)
+
+        assert cache.lookup([1, 2], EVENING + timedelta(minutes=14)) == ROWS
+        assert cache.lookup([1, 2], EVENING + timedelta(minutes=15)) is None
+        assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2, "evictions": 0, "expirations": 0,
+                                 "invalidations": 0}
+
+    def test__lookup__expires_after_ttl(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("app.reservations.search_cache.time.monotonic", lambda: now[0])
+        cache = SearchCache(ttl_seconds=30)
+        cache.store([1], EVENING, ROWS, cache.version)
+
+        now[0] += 29
+        assert cache.lookup([1], EVENING) == ROWS
+        now[0] += 1
+        assert cache.lookup([1], EVENING) is None
+        assert cache.stats()["expirations"] == 1
+        assert cache.stats()["entries"] == 0
+
+    def test__store__evicts_least_recently_used(self):
+        cache = SearchCache(max_entries=2)
+        for diner_id in (1, 2):
+            cache.store([diner_id], EVENING, ROWS, cache.version)
+        cache.lookup([1], EVENING)
+        cache.store([3], EVENING, ROWS, cache.version)
+
+        assert cache.lookup([2], EVENING) is None
+        assert cache.lookup([1], EVENING) == ROWS
+        assert cache.lookup([3], EVENING) == ROWS
+        assert cache.stats()["evictions"] == 1
+
+    def test__invalidate_booking__only_drops_overlapping_searches_listing_the_restaurant(self):
+        cache = SearchCache()
+        cache.store([1], EVENING, ROWS, cache.version)
+        cache.store([2], EVENING, [IndexedRestaurant(2, "two")], cache.version)
+        # The 16:59 bucket covers searches up to 17:00, which end as the booking starts
+        cache.store([3], EVENING - timedelta(hours=2, minutes=1), ROWS, cache.version)
+        cache.store([4], EVENING + timedelta(minutes=119), ROWS, cache.version)
+
+        cache.invalidate_booking(1, EVENING, EVENING + timedelta(hours=2))
+
+        assert cache.lookup([1], EVENING) is None
+        assert cache.lookup([4], EVENING + timedelta(minutes=119)) is None
+        assert cache.lookup([2], EVENING) is not None
+        assert cache.lookup([3], EVENING - timedelta(hours=2, minutes=1)) is not None
+        assert cache.stats()["invalidations"] == 2
+
+    def test__invalidate_booking__drops_overlapping_searches_of_booked_diners(self):
+        cache = SearchCache()
+        cache.store([1, 2], EVENING, [IndexedRestaurant(2, "two")], cache.version)
+        cache.store([3], EVENING, [IndexedRestaurant(2, "two")], cache.version)
+        cache.store([2], EVENING + timedelta(hours=3), [IndexedRestaurant(2, "two")], cache.version)
+
+        cache.invalidate_booking(1, EVENING, EVENING + timedelta(hours=2), diner_ids=[2, 5])
+
+        assert cache.lookup([1, 2], EVENING) is None
+        assert cache.lookup([3], EVENING) is not None
+        assert cache.lookup([2], EVENING + timedelta(hours=3)) is not None
+
+    def test__invalidate_release__drops_every_overlapping_search(self):
+        cache = SearchCache()
+        cache.store([1], EVENING, [], cache.version)
+        cache.store([2], EVENING - timedelta(minutes=90), [], cache.version)
+        cache.store([3], EVENING + timedelta(hours=2), [], cache.version)
+
+        cache.invalidate_release(EVENING, EVENING + timedelta(hours=2))
+
+        assert cache.lookup([1], EVENING) is None
+        assert cache.lookup([2], EVENING - timedelta(minutes=90)) is None
+        assert cache.lookup([3], EVENING + timedelta(hours=2)) == []
+
+    def test__store__skips_results_computed_before_a_write(self):
+        cache = SearchCache()
+        version = cache.version
+        cache.invalidate_release(EVENING, EVENING + timedelta(hours=2))
+        cache.store([1], EVENING, ROWS, version)
+        assert cache.lookup([1], EVENING) is None
+
+
+class TestCachedReservationManager:
+    def test__manager__invalidates_on_book_and_delete(self, template_session):
+        cache = SearchCache()
+        manager = ReservationManager(session=template_session, search_cache=cache)
+        evening = ReservationRequest(start_time=EVENING, diner_ids=[1, 2])
+        lunch = ReservationRequest(start_time=EVENING.replace(hour=12), diner_ids=[1, 2])
+        manager.find_available_restaurant(evening)
+        manager.find_available_restaurant(lunch)
+
+        reservation = manager.book_reservation(
+            AvailableReservationRequest(start_time=EVENING, diner_ids=[3], restaurant_id=1)
+        )
+        assert cache.stats()["invalidations"] == 1
+        assert cache.lookup(lunch.diner_ids, lunch.start_time) is not None
+
+        manager.find_available_restaurant(evening)
+        manager.delete_reservation(reservation.id)
+        assert cache.lookup(evening.diner_ids, evening.start_time) is None
+        assert cache.lookup(lunch.diner_ids, lunch.start_time) is not None
+
+    def test__manager__cached_results_match_uncached_under_writes(self, template_session):
+        cached = ReservationManager(session=template_session, search_cache=SearchCache())
+        uncached = ReservationManager(session=template_session)
+        rng = random.Random(9)
+        starts = [EVENING + timedelta(minutes=15 * step) for step in range(8)]
+        groups = random_groups(TEMPLATE_SPEC, 5)
+        booked = []
+
+        for step in range(200):
+            request = ReservationRequest(start_time=rng.choice(starts), diner_ids=rng.choice(groups))
+            expected = [restaurant.id for restaurant in uncached.find_available_restaurant(request)]
+            assert [restaurant.id for restaurant in cached.find_available_restaurant(request)] == expected
+
+            if booked and rng.random() < 0.3:
+                cached.delete_reservation(booked.pop(rng.randrange(len(booked))))
+            elif rng.random() < 0.5:
+                reservation = cached.book_reservation(AvailableReservationRequest(
+                    start_time=rng.choice(starts), diner_ids=[TEMPLATE_SPEC.diners - step],
+                    restaurant_id=rng.randint(1, 3)
+                ))
+                if reservation:
+                    booked.append(reservation.id)
+
+        assert cached.search_cache.stats()["hits"] > 0
@@ -0,0 +1,133 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest
+from app.models.async_db import create_async_db_engine
+from app.models.config import DatabaseSettings
+from app.models.db import Base, Diner, Reservation, Restaurant, RestaurantTable, create_db_engine
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.diner_schedule import DinerSchedule
+from app.reservations.write_queue import WriteQueue
+
+
+TABLES = 3
+DINERS = 40
+START = datetime(2030, 1, 5, 19)
+
+
+@pytest.fixture(scope='function')
+def settings(tmp_path):
+    """One restaurant with three two-tops and forty diners"""
+    settings = DatabaseSettings(url=f"sqlite:///{os.path.join(tmp_path, 'queue.db')}", pool_size=4, max_overflow=0)
+    engine = create_db_engine(settings)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    restaurant = Restaurant(name="Queue Restaurant")
+    session.add_all([restaurant] + [Diner(name=f"Diner {number}") for number in range(1, DINERS + 1)])
+    session.flush()
+    session.add_all([RestaurantTable(restaurant_id=restaurant.id, capacity=2) for _ in range(TABLES)])
+    session.commit()
+    session.close()
+    engine.dispose()
+    return settings
+
+
+def run_queued(settings, call, **manager_kwargs):
+    """Runs call(manager factory, queue) on a fresh event loop, every manager sharing one WriteQueue"""
+    async def main():
+        engine = create_async_db_engine(settings)
+        queue = WriteQueue(engine, batch_size=16)
+        Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+        async def with_manager(method, *args):
+            async with Session() as session:
+                return await method(AsyncReservationManager(session=session, write_queue=queue, **manager_kwargs), *args)
+        try:
+            return await call(with_manager, queue)
+        finally:
+            await queue.close()
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+def booking(diner_ids, start_time=START):
+    return AvailableReservationRequest(diner_ids=diner_ids, start_time=start_time, restaurant_id=1)
+
+
+async def outcome(call):
+    try:
+        return await call
+    except HTTPException as e:
+        return e.status_code
+
+
+class TestWriteQueue:
+    def test__concurrent_bookings__commit_in_batches_each_getting_its_own_result(self, settings):
+        async def book(with_manager, queue):
+            results = await asyncio.gather(*(
+                outcome(with_manager(AsyncReservationManager.book_reservation, booking([number * 2 + 1, number * 2 + 2])))
+                for number in range(DINERS // 2)
+            ))
+            return results, queue.batches, queue.writes
+
+        results, batches, writes = run_queued(settings, book)
+        booked = [result for result in results if result is not None]
+        # Every table taken once, the other groups told no table is free
+        assert len(booked) == TABLES
+        assert results.count(None) == DINERS // 2 - TABLES
+        assert sorted(reservation.table_id for reservation in booked) == list(range(1, TABLES + 1))
+        assert writes == DINERS // 2
+        assert batches < writes
+
+        session = sessionmaker(bind=create_db_engine(settings))()
+        assert session.scalar(select(func.count()).select_from(Reservation)) == TABLES
+        session.close()
+
+    def test__rejected_write__rolls_back_alone(self, settings):
+        async def write(with_manager, queue):
+            return await asyncio.gather(
+                outcome(with_manager(AsyncReservationManager.book_reservation, booking([1, 2]))),
+                # Diner 2 again in the same window, checked against the booking queued before it
+                outcome(with_manager(AsyncReservationManager.book_reservation, booking([2, 3]))),
+                outcome(with_manager(AsyncReservationManager.delete_reservation, 999)),
+                outcome(with_manager(AsyncReservationManager.book_reservation, booking([4, 5]))),
+            )
+
+        first, conflict, missing, last = run_queued(settings, write)
+        assert (conflict, missing) == (409, 400)
+        assert first.table_id != last.table_id
+
+        async def delete(with_manager, queue):
+            return await asyncio.gather(
+                outcome(with_manager(AsyncReservationManager.delete_reservation, first.id)),
+                outcome(with_manager(AsyncReservationManager.delete_reservation, first.id)),
+            )
+
+        assert run_queued(settings, delete) == [True, 400]
+        session = sessionmaker(bind=create_db_engine(settings))()
+        assert session.scalars(select(Reservation.id)).all() == [last.id]
+        session.close()
+
+    def test__diner_schedule__updated_after_the_commit(self, settings):
+        schedule = DinerSchedule()
+
+        async def write(with_manager, queue):
+            reservation = await with_manager(AsyncReservationManager.book_reservation, booking([6, 7]))
+            booked = schedule.booked_diner_ids([6, 7, 8], reservation.start_datetime, reservation.end_datetime)
+            # A booking the schedule misses in the same batch is still caught by the diner overlap guard
+            results = await asyncio.gather(
+                outcome(with_manager(AsyncReservationManager.book_reservation, booking([9, 10]))),
+                outcome(with_manager(AsyncReservationManager.book_reservation, booking([10, 11]))),
+            )
+            return booked, results
+
+        booked, (_, conflict) = run_queued(settings, write, diner_schedule=schedule)
+        assert sorted(booked) == [6, 7]
+        assert conflict == 409
@@ -0,0 +1,162 @@
+"""
+A single writer for bookings and deletions, committing many per transaction.
+
+Callers queue their write with a future and wait on it. One task drains the queue: it takes what
+is waiting, up to batch_size writes, runs them in order in one write transaction, each inside a
+SAVEPOINT, commits once and resolves every future with that write's own result or error. A write
+rejected by a conflict rolls back its savepoint only. As each write runs after the ones before it
+in the same transaction, it is checked against the state they leave, without a write lock to wait
+for between them. Under load the queue fills while the writer commits, so batches grow with it.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from .booking import BOOKING_ATTEMPTS, DinerAlreadyBooked, async_begin_immediate, backoff_seconds, diner_conflict
+
+
+DEFAULT_BATCH_SIZE = 64
+
+# A write run inside the writer's transaction, raising to reject it
+WriteOperation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class QueuedWrite(NamedTuple):
+    apply: WriteOperation
+    future: asyncio.Future
+
+
+# (result, None) of an applied write or (None, error) of a rejected one
+Outcome = Tuple[Any, Optional[Exception]]
+
+
+def rejection(error: Exception) -> Exception:
+    """What the caller of a write rejected inside its savepoint sees"""
+    if isinstance(error, HTTPException):
+        return error
+    conflict = diner_conflict(error)
+    if conflict is not None:
+        return conflict
+    # Another process took the table between our reads and insert, as book_atomically would retry
+    return HTTPException(status_code=503, detail="Could not book under contention, try again")
+
+
+class WriteQueue:
+    """
+    The queue and its writer task, per process. The writer starts on the event loop of the first
+    submit and again if a later submit comes from another loop; close() lets it finish what is queued.
+    Writes other processes make still take the database's lock between batches, a batch that cannot
+    get it is retried whole like a single booking would be.
+    """
+    def __init__(self, engine: AsyncEngine, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        # Results are read after the commit, outside the writer
+        self.session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+        self.batch_size = batch_size
+        self.batches = 0
+        self.writes = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._writer is not None and not self._writer.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._writer = loop.create_task(self._drain())
+
+    async def close(self) -> None:
+        if self._writer is None or self._loop is not asyncio.get_running_loop():
+            return
+        await self._queue.join()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+
+    async def submit(self, apply: WriteOperation) -> Any:
+        """Queues the write and returns its result once committed, or raises what rejected it"""
+        self.start()
+        future = self._loop.create_future()
+        self._queue.put_nowait(QueuedWrite(apply, future))
+        return await future
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "writes": self.writes, "queued": self._queue.qsize() if self._queue else 0}
+
+    async def _drain(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: List[QueuedWrite]) -> None:
+        # A caller that gave up before its turn has nothing written for it
+        batch = [write for write in batch if not write.future.done()]
+        if not batch:
+            return
+        for attempt in range(1, BOOKING_ATTEMPTS + 1):
+            try:
+                outcomes = await self._apply(batch)
+            except OperationalError as e:
+                if 'locked' not in str(e.orig) and 'busy' not in str(e.orig):
+                    self._fail(batch, e)
+                    return
+                logging.info(f"Write batch attempt {attempt} timed out on the write lock, retrying")
+                await asyncio.sleep(backoff_seconds(attempt))
+                continue
+            except Exception as e:
+                logging.error(f"Write batch of {len(batch)} failed: {e}")
+                self._fail(batch, e)
+                return
+            self.batches += 1
+            self.writes += len(batch)
+            for write, (result, error) in zip(batch, outcomes):
+                if write.future.done():
+                    continue
+                if error is None:
+                    write.future.set_result(result)
+                else:
+                    write.future.set_exception(error)
+            return
+        self._fail(batch, HTTPException(status_code=503, detail="Could not book under contention, try again"))
+
+    async def _apply(self, batch: List[QueuedWrite]) -> List[Outcome]:
+        async with self.session_factory() as session:
+            await async_begin_immediate(session)
+            if len(batch) == 1:
+                # Nothing to keep apart, the transaction is the write's own and no savepoint is needed
+                try:
+                    result = await batch[0].apply(session)
+                except (HTTPException, DinerAlreadyBooked, IntegrityError) as e:
+                    await session.rollback()
+                    return [(None, rejection(e))]
+                await session.commit()
+                return [(result, None)]
+            outcomes = []
+            for write in batch:
+                try:
+                    async with session.begin_nested():
+                        outcomes.append((await write.apply(session), None))
+                except (HTTPException, DinerAlreadyBooked, IntegrityError) as e:
+                    outcomes.append((None, rejection(e)))
+            await session.commit()
+            return outcomes
+
+    @staticmethod
+    def _fail(batch: List[QueuedWrite], error: Exception) -> None:
+        for write in batch:
+            if not write.future.done():
+                write.future.set_exception(error)
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest
+from app.instrumentation import Histogram, instrument_engines, track_statements
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.dataset import DatasetSpec
+from common.tests.db_setup import template_copy, template_file
+from common.tests.query_count import assert_max_statements
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=100, diners=400, reservations=2000, days=5, diners_per_reservation=2)
+# Neither diner is booked at 19:00 that day, the search finds restaurants
+SEARCH = ReservationRequest(start_time=datetime(2024, 8, 3, 19), diner_ids=[2, 3])
+
+
+@pytest.fixture(scope='module', autouse=True)
+def instrumented():
+    instrument_engines()
+
+
+@pytest.fixture(scope='function')
+def manager(template_copy):
+    session = sessionmaker(bind=template_copy)()
+    yield ReservationManager(session=session)
+    session.close()
+
+
+class TestStatementBudgets:
+    def test__find_available_restaurant__one_statement(self, manager):
+        with assert_max_statements(1):
+            manager.find_available_restaurant(SEARCH)
+
+    def test__find_available_restaurant_page__one_statement(self, manager):
+        with assert_max_statements(1):
+            manager.find_available_restaurant_page(ReservationPageRequest(**SEARCH.model_dump(), limit=10))
+
+    def test__find_available_restaurants_by_slot__two_statements(self, manager):
+        with assert_max_statements(2):
+            manager.find_available_restaurants_by_slot(BatchReservationRequest(
+                diner_ids=[1, 2], range_start=datetime(2024, 8, 3, 17), range_end=datetime(2024, 8, 3, 22)
+            ))
+
+    def test__book_and_delete_reservation__bounded_whatever_the_group_size(self, manager):
+        request = AvailableReservationRequest(start_time=datetime(2024, 9, 1, 19), diner_ids=[1, 2, 3, 4, 5, 6],
+                                              restaurant_id=1)
+        # BEGIN IMMEDIATE, the diner check, the insert, one insert for all diners and loading the reservation
+        with assert_max_statements(5):
+            reservation = manager.book_reservation(request)
+        # Deleting the diner links, then the reservation with any holds of combined tables
+        with assert_max_statements(2):
+            manager.delete_reservation(reservation.id)
+
+    def test__cancel_restaurant_reservations__bounded_whatever_the_count(self, manager):
+        # BEGIN IMMEDIATE, selecting the ids, then one delete each for the diner links and the reservations
+        with assert_max_statements(4):
+            cancelled = manager.cancel_restaurant_reservations(50, datetime(2024, 8, 1), datetime(2024, 8, 6))
+        assert len(cancelled) > 4
+
+    def test__assert_max_statements__fails_past_the_limit(self, manager):
+        with pytest.raises(AssertionError, match="2 SQL statements executed, at most 1 expected"):
+            with assert_max_statements(1):
+                manager.find_available_restaurant(SEARCH)
+                manager.find_available_restaurant(SEARCH)
+
+
+class TestRequestStats:
+    def test__track_statements__counts_rows_fetched(self, manager):
+        with track_statements() as stats:
+            found = manager.find_available_restaurant(SEARCH)
+        assert stats.statements == 1
+        assert stats.rows == len(found) > 0
+        assert stats.db_seconds > 0
+
+    def test__track_statements__counts_async_rows(self, template_file):
+        async def search():
+            engine = create_async_engine(template_file.url.set(drivername='sqlite+aiosqlite'))
+            try:
+                async with async_sessionmaker(bind=engine)() as session:
+                    with track_statements() as stats:
+                        found = await AsyncReservationManager(session=session).find_available_restaurant(SEARCH)
+                    return stats, found
+            finally:
+                await engine.dispose()
+
+        stats, found = asyncio.run(search())
+        assert stats.statements == 1
+        assert stats.rows == len(found) > 0
+
+    def test__untracked_statements__are_not_counted(self, manager):
+        with track_statements() as stats:
+            pass
+        manager.find_available_restaurant(SEARCH)
+        assert stats.statements == 0
+
+
+class TestHistogram:
+    def test__render__cumulative_buckets_sum_and_count(self):
+        histogram = Histogram("statements", "SQL statements", (1, 5))
+        for value in (1, 3, 9):
+            histogram.observe("find", value)
+        assert histogram.render() == [
+            "# HELP statements SQL statements",
+            "# TYPE statements histogram",
+            'statements_bucket{handler="find",le="1"} 1',
+            'statements_bucket{handler="find",le="5"} 2',
+            'statements_bucket{handler="find",le="+Inf"} 3',
+            'statements_sum{handler="find"} 13',
+            'statements_count{handler="find"} 3',
+        ]
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+import os
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app import main
+from app.api.requests import AvailableReservationRequest
+from app.models import async_db, db
+from app.models.config import (
+    ArchiveSettings, BookingSettings, ChangeFeedSettings, DatabaseSettings, ReferenceDataSettings, SearchSettings
+)
+from app.models.db import Reservation
+from app.reservations.change_feed import ChangeFeed, change_version, install_change_log
+from app.reservations.reference_data import ReferenceData
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+from app.reservations.write_queue import WriteQueue
+from benchmarks.soak_sessions import seed, soak
+
+
+@pytest.fixture(scope='function')
+def file_engine(tmp_path):
+    """A pooled SQLite file engine seeded with two diners and one restaurant with a four-top"""
+    settings = DatabaseSettings(url=f"sqlite:///{os.path.join(tmp_path, 'booking.db')}", pool_size=2, max_overflow=0)
+    engine = db.create_db_engine(settings)
+    seed(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='function')
+def request_engine(file_engine):
+    """The async engine the endpoints use, on the same seeded file"""
+    settings = DatabaseSettings(url=str(file_engine.url), pool_size=2, max_overflow=0)
+    engine = async_db.create_async_db_engine(settings)
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture(scope='function')
+def client(request_engine, monkeypatch):
+    factory = async_sessionmaker(bind=request_engine, expire_on_commit=False)
+    monkeypatch.setattr(async_db, 'AsyncSessionLocal', factory)
+    monkeypatch.setattr(async_db, 'AsyncReadSessionLocal', factory)
+    return TestClient(main.app)
+
+
+class TestSessionLifecycle:
+    def test__database_settings__echo_off_by_default(self, monkeypatch):
+        monkeypatch.delenv('BOOKING_DB_ECHO', raising=False)
+        assert DatabaseSettings.from_env().echo is False
+
+    def test__database_settings__reads_pool_from_env(self, monkeypatch):
+        monkeypatch.setenv('BOOKING_DB_ECHO', 'true')
+        monkeypatch.setenv('BOOKING_DB_POOL_SIZE', '20')
+        settings = DatabaseSettings.from_env()
+        assert settings.echo is True
+        assert settings.engine_kwargs()['pool_size'] == 20
+
+    def test__database_settings__memory_sqlite_has_no_pool_sizing(self):
+        settings = DatabaseSettings(url='sqlite:///:memory:')
+        assert 'pool_size' not in settings.engine_kwargs()
+
+    def test__database_settings__storage_mode_from_env(self, monkeypatch):
+        assert (DatabaseSettings.from_env().journal_mode, DatabaseSettings.from_env().synchronous) == ('wal', 'normal')
+        monkeypatch.setenv('BOOKING_DB_JOURNAL_MODE', 'DELETE')
+        monkeypatch.setenv('BOOKING_DB_SYNCHRONOUS', 'full')
+        monkeypatch.setenv('BOOKING_DB_BUSY_TIMEOUT_MS', '250')
+        monkeypatch.setenv('BOOKING_DB_READ_URL', 'sqlite:///replica.db')
+        settings = DatabaseSettings.from_env()
+        assert (settings.journal_mode, settings.synchronous, settings.busy_timeout_ms) == ('delete', 'full', 250)
+        assert settings.for_reads().url == 'sqlite:///replica.db'
+        monkeypatch.setenv('BOOKING_DB_JOURNAL_MODE', 'wall')
+        with pytest.raises(ValueError):
+            DatabaseSettings.from_env()
+
+    def test__archive_settings__off_by_default(self, monkeypatch):
+        assert ArchiveSettings.from_env().interval_seconds == 0
+        monkeypatch.setenv('BOOKING_ARCHIVE_INTERVAL_SECONDS', '60')
+        monkeypatch.setenv('BOOKING_ARCHIVE_RETENTION_DAYS', '30')
+        settings = ArchiveSettings.from_env()
+        assert (settings.interval_seconds, settings.retention_days, settings.batch_size) == (60.0, 30, 2000)
+
+    def test__booking_settings__write_queue_off_by_default(self, monkeypatch):
+        monkeypatch.delenv('BOOKING_WRITE_QUEUE', raising=False)
+        assert BookingSettings.from_env().write_queue is False
+        monkeypatch.setenv('BOOKING_WRITE_BATCH_SIZE', '0')
+        with pytest.raises(ValueError):
+            BookingSettings.from_env()
+
+    def test__reference_data_settings__off_by_default(self, monkeypatch):
+        assert ReferenceDataSettings.from_env() == ReferenceDataSettings(enabled=False, refresh_seconds=0.0)
+        monkeypatch.setenv('BOOKING_REFERENCE_DATA', 'on')
+        monkeypatch.setenv('BOOKING_REFERENCE_DATA_REFRESH_SECONDS', '300')
+        assert ReferenceDataSettings.from_env() == ReferenceDataSettings(enabled=True, refresh_seconds=300.0)
+
+    def test__change_feed_settings__off_by_default(self, monkeypatch):
+        assert ChangeFeedSettings.from_env() == ChangeFeedSettings(enabled=False, poll_seconds=1.0, retention=100_000,
+                                                                   prune_seconds=3600.0)
+        monkeypatch.setenv('BOOKING_CHANGE_FEED', 'on')
+        monkeypatch.setenv('BOOKING_CHANGE_FEED_POLL_SECONDS', '0.25')
+        monkeypatch.setenv('BOOKING_CHANGE_FEED_PRUNE_SECONDS', '0')
+        assert ChangeFeedSettings.from_env() == ChangeFeedSettings(enabled=True, poll_seconds=0.25, retention=100_000,
+                                                                   prune_seconds=0.0)
+        monkeypatch.setenv('BOOKING_CHANGE_FEED_RETENTION', '0')
+        with pytest.raises(ValueError):
+            ChangeFeedSettings.from_env()
+
+    def test__search_settings__occupancy_prefilter_off_by_default(self, monkeypatch):
+        monkeypatch.delenv('BOOKING_SEARCH_OCCUPANCY_PREFILTER', raising=False)
+        assert SearchSettings.from_env().occupancy_prefilter is False
+        monkeypatch.setenv('BOOKING_SEARCH_OCCUPANCY_PREFILTER', 'on')
+        assert SearchSettings.from_env().occupancy_prefilter is True
+
+    def test__search_settings__rejects_unknown_backend(self, monkeypatch):
+        monkeypatch.setenv('BOOKING_SEARCH_BACKEND', 'index')
+        assert SearchSettings.from_env().backend == 'index'
+        monkeypatch.setenv('BOOKING_SEARCH_BACKEND', 'cache')
+        with pytest.raises(ValueError):
+            SearchSettings.from_env()
+
+    def test__booking_settings__rejects_unknown_allocation(self, monkeypatch):
+        assert BookingSettings.from_env().allocation == 'smallest'
+        monkeypatch.setenv('BOOKING_ALLOCATION', 'Repack')
+        assert BookingSettings.from_env().allocation == 'repack'
+        monkeypatch.setenv('BOOKING_ALLOCATION', 'best')
+        with pytest.raises(ValueError):
+            BookingSettings.from_env()
+
+    def test__requests__return_connections_to_pool(self, client, request_engine):
+        payload = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2]}
+        for _ in range(20):
+            assert client.post("/find_reservation/", json=payload).status_code == 200
+        assert request_engine.sync_engine.pool.checkedout() == 0
+
+    def test__failed_request__rolls_back_and_closes(self, client, request_engine):
+        response = client.delete("/reservation/999")
+        assert response.status_code == 400
+        assert request_engine.sync_engine.pool.checkedout() == 0
+
+    def test__book_then_delete__uses_request_sessions(self, client, file_engine, request_engine):
+        response = client.post("/book_restaurant/", json={
+            "start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2], "restaurant_id": 1
+        })
+        assert response.status_code == 201
+        reservation_id = response.json()["id"]
+
+        assert client.delete(f"/reservation/{reservation_id}").status_code == 204
+        session = sessionmaker(bind=file_engine)()
+        assert session.get(Reservation, reservation_id) is None
+        session.close()
+        assert request_engine.sync_engine.pool.checkedout() == 0
+
+    def test__search_cache__serves_repeats_until_a_booking_overlaps(self, client, monkeypatch):
+        assert client.get("/search_cache/stats").status_code == 404
+        monkeypatch.setattr(main, 'search_cache', SearchCache())
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2]}
+        found = client.post("/find_reservation/", json=search).json()
+        assert client.post("/find_reservation/", json=search).json() == found
+
+        assert client.post("/book_restaurant/", json={**search, "restaurant_id": found[0]["id"]}).status_code == 201
+        assert client.post("/find_reservation/", json=search).json() == []
+        stats = client.get("/search_cache/stats").json()
+        assert (stats["hits"], stats["misses"], stats["invalidations"]) == (1, 2, 1)
+
+    def test__change_feed__drops_searches_another_worker_booked(self, client, file_engine, monkeypatch):
+        cache = SearchCache()
+        session = sessionmaker(bind=file_engine)()
+        install_change_log(session)
+        feed = ChangeFeed(file_engine, change_version(session), search_cache=cache)
+        monkeypatch.setattr(main, 'search_cache', cache)
+        monkeypatch.setattr(main, 'change_feed', feed)
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2]}
+        found = client.post("/find_reservation/", json=search).json()
+        assert found and client.post("/find_reservation/", json=search).json() == found
+
+        # Booked outside this app, as another worker would
+        ReservationManager(session=session).book_reservation(AvailableReservationRequest(
+            **search, restaurant_id=found[0]["id"]))
+        assert client.post("/find_reservation/", json=search).json() == []
+        assert feed.stats()["applied"] == 3
+        session.close()
+        feed.close()
+
+    def test__reference_data__turns_away_groups_no_table_seats(self, client, file_engine, monkeypatch):
+        session = sessionmaker(bind=file_engine)()
+        monkeypatch.setattr(main, 'reference_data', ReferenceData.build(session))
+        session.close()
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2, 3, 4, 5]}
+        assert client.post("/find_reservation/", json=search).json() == []
+        assert client.post("/book_restaurant/", json={**search, "restaurant_id": 1}).status_code == 404
+        assert [restaurant["id"] for restaurant in client.post("/find_reservation/", json={
+            **search, "diner_ids": [1, 2]
+        }).json()] == [1]
+
+    def test__write_queue__books_and_deletes_through_the_writer(self, client, request_engine, monkeypatch):
+        queue = WriteQueue(request_engine)
+        monkeypatch.setattr(main, 'write_queue', queue)
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2], "restaurant_id": 1}
+        booked = client.post("/book_restaurant/", json=search)
+        assert booked.status_code == 201
+        assert client.post("/book_restaurant/", json=search).status_code == 409
+        assert client.delete(f"/reservation/{booked.json()['id']}").status_code == 204
+        assert client.delete(f"/reservation/{booked.json()['id']}").status_code == 400
+        assert queue.writes == 4
+
+    def test__bulk_cancel__by_ids_restaurant_window_and_diner(self, client, request_engine, monkeypatch):
+        queue = WriteQueue(request_engine)
+        monkeypatch.setattr(main, 'write_queue', queue)
+        booked = [client.post("/book_restaurant/", json={
+            "start_time": start_time, "diner_ids": diner_ids, "restaurant_id": 1
+        }).json()["id"] for start_time, diner_ids in (("2024-08-24T19:00:00", [1, 2]), ("2024-08-24T22:00:00", [1]),
+                                                      ("2024-08-25T19:00:00", [2]))]
+
+        assert client.post("/reservations/cancel", json={"reservation_ids": [booked[0], 999]}).json() == {
+            "reservation_ids": [booked[0]]
+        }
+        assert client.post("/reservations/cancel", json={"reservation_ids": []}).status_code == 422
+        assert client.delete("/diners/1/reservations", params={"after": "2024-08-25T00:00:00"}).json() == {
+            "reservation_ids": []
+        }
+        assert client.delete("/diners/1/reservations").json() == {"reservation_ids": [booked[1]]}
+        window = {"start_time": "2024-08-25T00:00:00", "end_time": "2024-08-26T00:00:00"}
+        assert client.delete("/restaurants/1/reservations", params={
+            "start_time": window["end_time"], "end_time": window["start_time"]
+        }).status_code == 400
+        assert client.delete("/restaurants/1/reservations", params=window).json() == {"reservation_ids": [booked[2]]}
+        assert queue.writes == 7
+
+    def test__nearby_search__ranks_by_distance_from_the_diners(self, client, file_engine):
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2], "nearest_k": 5}
+        assert client.post("/find_reservation/", json=search).status_code == 400
+        with file_engine.begin() as connection:
+            connection.execute(text("UPDATE diners SET home_latitude = 19.40, home_longitude = -99.15"))
+            connection.execute(text("UPDATE restaurants SET latitude = 19.41, longitude = -99.15"))
+        found = client.post("/find_reservation/", json=search).json()
+        assert found == [{"id": 1, "restaurant_name": "Soak Restaurant", "distance_km": 1.112}]
+        assert client.post("/find_reservation/", json={**search, "max_distance_km": 1}).json() == []
+        assert client.post("/find_reservation/", json={**search, "nearest_k": 0}).status_code == 422
+
+    def test__distance_fields__rejected_where_searches_are_not_ranked(self, client):
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2], "nearest_k": 5}
+        for path, body in (("/find_reservation/page/", search), ("/find_reservation/stream/", search),
+                           ("/book_restaurant/", {**search, "restaurant_id": 1})):
+            response = client.post(path, json=body)
+            assert response.status_code == 422
+            assert "only apply to /find_reservation/" in response.text
+
+    def test__occupancy__follows_bookings_and_deletions(self, client):
+        booked = client.post("/book_restaurant/", json={
+            "start_time": "2024-08-24T19:30:00", "diner_ids": [1, 2], "restaurant_id": 1
+        }).json()
+        occupancy = client.get("/restaurants/1/occupancy", params={"start_date": "2024-08-24"}).json()
+        assert occupancy["tables"] == {"4": 1}
+        assert [(slot["hour"], slot["booked"], slot["free"]) for slot in occupancy["slots"]] == [(19, 1, 0), (20, 1, 0), (21, 1, 0)]
+        client.delete(f"/reservation/{booked['id']}")
+        assert client.get("/restaurants/1/occupancy", params={"start_date": "2024-08-24"}).json()["slots"] == []
+        assert client.get("/restaurants/99/occupancy", params={"start_date": "2024-08-24"}).status_code == 400
+        assert client.get("/restaurants/1/occupancy", params={
+            "start_date": "2024-08-01", "end_date": "2024-09-30"
+        }).status_code == 400
+
+    def test__batch_search__reports_each_slot(self, client):
+        assert client.post("/book_restaurant/", json={
+            "start_time": "2024-08-24T19:00:00", "diner_ids": [1], "restaurant_id": 1
+        }).status_code == 201
+        response = client.post("/find_reservation/batch/", json={
+            "diner_ids": [2], "range_start": "2024-08-24T17:00:00", "range_end": "2024-08-24T21:00:00",
+            "step_minutes": 60
+        })
+        assert response.status_code == 200
+        assert [len(slot["restaurants"]) for slot in response.json()] == [1, 0, 0, 0, 1]
+        assert client.post("/find_reservation/batch/", json={"diner_ids": [2]}).status_code == 422
+
+    def test__page_and_stream__return_the_search(self, client):
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2]}
+        found = client.post("/find_reservation/", json=search).json()
+        page = client.post("/find_reservation/page/", json={**search, "limit": 1}).json()
+        assert page == {"restaurants": found, "next_cursor": None}
+
+        streamed = client.post("/find_reservation/stream/", json=search)
+        assert streamed.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(line) for line in streamed.text.splitlines()] == found
+        assert client.post("/find_reservation/page/", json={**search, "cursor": "nope"}).status_code == 400
+
+    def test__occupancy_prefilter__also_narrows_pages_and_streams(self, client, request_engine, monkeypatch):
+        monkeypatch.setattr(main, 'search_settings', SearchSettings(occupancy_prefilter=True))
+        statements = []
+        event.listen(request_engine.sync_engine, 'before_cursor_execute',
+                     lambda connection, cursor, statement, *args: statements.append(statement))
+        search = {"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2]}
+        found = client.post("/find_reservation/", json=search).json()
+        assert client.post("/find_reservation/page/", json=search).json()["restaurants"] == found
+        assert [json.loads(line) for line in client.post("/find_reservation/stream/", json=search).text.splitlines()] == found
+        assert sum("restaurant_occupancy" in statement for statement in statements) == 3
+
+    def test__instrumentation__server_timing_and_metrics(self, client):
+        response = client.post("/find_reservation/", json={"start_time": "2024-08-24T19:00:00", "diner_ids": [1, 2]})
+        assert response.headers["server-timing"].startswith("db;dur=")
+        assert 'desc="1 statements, 1 rows"' in response.headers["server-timing"]
+
+        metrics = client.get("/metrics")
+        assert metrics.headers["content-type"].startswith("text/plain")
+        assert 'booking_request_statements_bucket{handler="find_available_tables",le="1"}' in metrics.text
+        assert 'booking_request_duration_seconds_count{handler="find_available_tables"}' in metrics.text
+
+    def test__soak__memory_and_connections_stay_flat(self, request_engine, caplog):
+        # pytest keeps every captured log record, which would show up as growth
+        caplog.set_level(logging.WARNING)
+        samples = soak(request_engine, requests=1600, sample_every=400)
+        assert all(sample["checked_out"] == 0 for sample in samples)
+        assert samples[-1]["connections_opened"] <= 2
+        # Compare the second half only so one-off warm-up allocations are excluded,
+        # a session leaked per request would grow by megabytes over 800 requests
+        assert samples[-1]["traced_kb"] - samples[len(samples) // 2 - 1]["traced_kb"] < 256
+
+    def test__diner_history__lists_past_reservations_page_by_page(self, client):
+        for hour in (12, 15, 19):
+            assert client.post("/book_restaurant/", json={
+                "start_time": f"2024-08-24T{hour}:00:00", "diner_ids": [1], "restaurant_id": 1
+            }).status_code == 201
+        first = client.get("/diners/1/reservations/history", params={"before": "2024-08-24T21:00:00", "limit": 2}).json()
+        assert [reservation["start_time"] for reservation in first["reservations"]] == ["2024-08-24T19:00:00", "2024-08-24T15:00:00"]
+        assert not any(reservation["archived"] for reservation in first["reservations"])
+        second = client.get("/diners/1/reservations/history", params={"before": first["next_before"], "limit": 2}).json()
+        assert [reservation["start_time"] for reservation in second["reservations"]] == ["2024-08-24T12:00:00"]
+        assert second["next_before"] is None
+        assert client.get("/diners/1/reservations/history", params={"limit": 0}).status_code == 422
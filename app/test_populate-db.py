@@ -1,6 +1,10 @@
 from typing import List
-from app.models.db import DietaryRestriction
-from populate_db import PopulateData
+from app.models.db import DietaryRestriction, Diner, Restaurant, RestaurantTable
+from sqlalchemy import text
+from populate_db import (
+    CITY_AREA, BulkPopulateData, DinerRecord, PopulateData, RestaurantRecord, csv_diners, csv_restaurants,
+    placeholder_location, synthetic_diners, synthetic_restaurants
+)
 from common.tests.db_setup import test_session
 
 
@@ -22,3 +26,70 @@ class TestPopulateDatabase:
         assert len(parsed_dietary_restrictions) == 2
         assert parsed_dietary_restrictions[0] == expected_result[0]
         assert parsed_dietary_restrictions[1] == expected_result[1]
+
+    def test__csv_restaurants__reads_each_table_size(self, tmp_path):
+        path = tmp_path / "restaurants.csv"
+        path.write_text(
+            "Name,No. of two-top tables,No. of four-top tables,No. of six-top tables,Endorsements\n"
+            'Lardo,4,2,1,"Vegan-Friendly, Gluten Free Options"\n'
+        )
+        [record] = list(csv_restaurants(str(path)))
+        latitude, longitude = placeholder_location("Lardo")
+        assert record == RestaurantRecord(name="Lardo", tables={2: 4, 4: 2, 6: 1}, dietary_restrictions=["Vegan", "Gluten"],
+                                          latitude=latitude, longitude=longitude)
+
+    def test__csv_locations__read_latitude_then_longitude(self, tmp_path):
+        diners, restaurants = tmp_path / "diners.csv", tmp_path / "restaurants.csv"
+        diners.write_text('Name,Home Location,Dietary Restrictions\nMichael,"19.4153107,-99.1804722",Vegetarian\n')
+        restaurants.write_text(
+            "Name,No. of two-top tables,No. of four-top tables,No. of six-top tables,Endorsements,Location\n"
+            'Lardo,4,2,1,,"19.4125,-99.1728"\nRosetta,3,2,0,,\n'
+        )
+        [diner] = list(csv_diners(str(diners)))
+        assert (diner.home_latitude, diner.home_longitude) == (19.4153107, -99.1804722)
+        lardo, rosetta = csv_restaurants(str(restaurants))
+        assert (lardo.latitude, lardo.longitude) == (19.4125, -99.1728)
+        # Without a Location, a stable point in the city
+        (min_latitude, max_latitude), (min_longitude, max_longitude) = CITY_AREA
+        assert min_latitude <= rosetta.latitude <= max_latitude and min_longitude <= rosetta.longitude <= max_longitude
+        assert (rosetta.latitude, rosetta.longitude) == placeholder_location("Rosetta")
+
+    def test__synthetic_sources__are_deterministic(self):
+        assert list(synthetic_restaurants(50, seed=3)) == list(synthetic_restaurants(50, seed=3))
+        assert list(synthetic_diners(50, seed=3)) == list(synthetic_diners(50, seed=3))
+
+    def test__bulk_resolve_restrictions__matches_name_prefixes(self, test_session):
+        PopulateData(session=test_session).populate_dietary_restrictions()
+        bulk_data = BulkPopulateData(session=test_session)
+        expected = test_session.query(DietaryRestriction.id)\
+            .filter(DietaryRestriction.name.in_(["Paleo", "Gluten-Free"])).order_by(DietaryRestriction.id).all()
+        assert bulk_data.resolve_restrictions(["Paleo", "Gluten"]) == [row.id for row in expected]
+
+    def test__bulk_load__writes_entities_tables_and_restrictions_in_chunks(self, test_session):
+        PopulateData(session=test_session).populate_dietary_restrictions()
+        bulk_data = BulkPopulateData(session=test_session, chunk_size=2)
+        restaurants = [
+            RestaurantRecord(name=f"Rest{number}", tables={2: 2, 6: 1}, dietary_restrictions=["Vegan"],
+                             latitude=19.4 + number / 100, longitude=-99.1) for number in range(5)
+        ]
+        diners = [DinerRecord(name=f"Guy{number}", dietary_restrictions=["Paleo", "Nut"]) for number in range(3)]
+
+        assert bulk_data.load_restaurants(restaurants) == 5
+        assert bulk_data.load_diners(diners) == 3
+
+        assert test_session.query(Restaurant).count() == 5
+        # Indexed as they are inserted
+        assert test_session.execute(text("SELECT count(*) FROM restaurant_locations")).scalar() == 5
+        assert test_session.query(RestaurantTable).count() == 15
+        rest = test_session.query(Restaurant).filter(Restaurant.name == "Rest4").one()
+        assert [restriction.name for restriction in rest.dietary_restrictions] == ["Vegan"]
+        guy = test_session.query(Diner).filter(Diner.name == "Guy2").one()
+        assert sorted(restriction.name for restriction in guy.dietary_restrictions) == ["Nut-Free", "Paleo"]
+
+    def test__load_restaurants__groups_combinable_tables(self, test_session):
+        bulk_data = BulkPopulateData(session=test_session)
+        bulk_data.load_restaurants([RestaurantRecord(name="Long table", tables={2: 3, 6: 1}, combinable_capacities=[2])])
+
+        groups = test_session.query(RestaurantTable.capacity, RestaurantTable.combination_group)\
+            .order_by(RestaurantTable.capacity).all()
+        assert [tuple(row) for row in groups] == [(2, 1), (2, 1), (2, 1), (6, None)]
@@ -0,0 +1,114 @@
+"""
+Groups seated by each table allocation strategy on replayed booking traces.
+
+    python -m benchmarks.bench_allocation --traces 2000 --groups 24 32 40
+
+A trace is one restaurant-day with the seeded dataset's tables (TABLE_CAPACITIES): --groups
+booking requests of 1 to 6 diners, starting every 15 minutes between 17:00 and 21:30, arriving
+in random order. Every trace is replayed through plan_booking with 'smallest' (the greedy choice
+book_reservation made until now), 'fit' and 'repack', counting the groups seated. --verify-db
+traces are also replayed through ReservationManager on SQLite, which must seat the same groups.
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest
+from app.models.config import ALLOCATION_STRATEGIES
+from app.models.db import Diner, Restaurant, RestaurantTable
+from app.models.migrations import create_schema
+from app.reservations.allocation import Booked, Table, plan_booking
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import RESERVATION_DURATION
+from .dataset import TABLE_CAPACITIES
+
+
+# Far enough ahead that every reservation of a trace can still be re-packed
+TRACE_DAY = datetime(2099, 8, 1)
+GROUP_SIZES = (1, 2, 3, 4, 5, 6)
+GROUP_WEIGHTS = (5, 45, 15, 20, 7, 8)
+START_TIMES = [TRACE_DAY + timedelta(hours=17, minutes=15 * step) for step in range(19)]
+TABLES = [Table(number, capacity) for number, capacity in enumerate(TABLE_CAPACITIES, start=1)]
+
+Trace = List[Tuple[int, datetime]]
+
+
+def random_traces(count: int, groups: int, seed: int = 42) -> List[Trace]:
+    rng = random.Random(seed)
+    return [[(rng.choices(GROUP_SIZES, GROUP_WEIGHTS)[0], rng.choice(START_TIMES)) for _ in range(groups)]
+            for _ in range(count)]
+
+
+def replay(trace: Trace, allocation: str) -> int:
+    """Groups of the trace seated, in memory"""
+    duration = timedelta(hours=RESERVATION_DURATION)
+    bookings: List[Booked] = []
+    for number, (size, start_time) in enumerate(trace, start=1):
+        plan = plan_booking(TABLES, bookings, size, start_time, start_time + duration, allocation)
+        if plan is None:
+            continue
+        moved = {move.reservation_id: move.to_table_id for move in plan.moves}
+        bookings = [booked._replace(table_id=moved.get(booked.id, booked.table_id)) for booked in bookings]
+        bookings.append(Booked(number, plan.table_id, start_time, start_time + duration, size))
+    return len(bookings)
+
+
+def replay_on_db(trace: Trace, allocation: str, directory: str) -> int:
+    """Groups of the trace seated through ReservationManager, on a fresh database"""
+    path = os.path.join(directory, f"{allocation}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    create_schema(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Restaurant(name="Trace"))
+    session.add_all([RestaurantTable(restaurant_id=1, capacity=table.capacity) for table in TABLES])
+    session.add_all([Diner(name=f"Diner {number}") for number in range(6 * len(trace))])
+    session.commit()
+
+    manager = ReservationManager(session=session, allocation=allocation)
+    seated = 0
+    for number, (size, start_time) in enumerate(trace):
+        # Diners are never shared between groups, only tables limit the trace
+        diner_ids = list(range(1 + 6 * number, 1 + 6 * number + size))
+        seated += manager.book_reservation(AvailableReservationRequest(
+            start_time=start_time, diner_ids=diner_ids, restaurant_id=1
+        )) is not None
+    session.close()
+    engine.dispose()
+    return seated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traces", type=int, default=2000)
+    parser.add_argument("--groups", type=int, nargs="+", default=[24, 32, 40], help="booking requests per trace")
+    parser.add_argument("--verify-db", type=int, default=5, help="traces per demand also replayed on SQLite")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    print(f"{args.traces} traces per demand, tables {TABLE_CAPACITIES}")
+    for groups in args.groups:
+        traces = random_traces(args.traces, groups)
+        seated = {allocation: sum(replay(trace, allocation) for trace in traces) for allocation in ALLOCATION_STRATEGIES}
+        greedy = seated['smallest']
+        print(f"{groups} requests per day: " + "  ".join(
+            f"{allocation}={count} ({count - greedy:+d}, {100 * (count - greedy) / greedy:+.1f}%)"
+            for allocation, count in seated.items()
+        ))
+
+        with tempfile.TemporaryDirectory() as directory:
+            mismatches = sum(replay(trace, allocation) != replay_on_db(trace, allocation, directory)
+                             for trace in traces[:args.verify_db] for allocation in ALLOCATION_STRATEGIES)
+        print(f"    database replay mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
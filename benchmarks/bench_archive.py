@@ -0,0 +1,106 @@
+"""
+Search latency over years of reservation history, before and after archiving it.
+
+    python -m benchmarks.bench_archive --restaurants 1000 --reservations 2000000 --years 5
+
+The dataset spreads --reservations over --years of days, two diners each. "Now" is --recent-days
+before its last day: searches, pages, batch searches and bookings go to slots from then on, diner
+histories to the past. Everything is timed on a copy of the cached dataset, then the copy's
+reservations ending before now are archived in batches and everything is timed again.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest
+from app.models.db import Reservation, diner_reservation_association
+from app.reservations.archive import archive_reservations
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import FIRST_DAY, SLOT_HOURS, DatasetSpec, dataset_engine, random_groups, slot_start
+from .timing import format_row, measure
+
+
+def time_operations(session, spec: DatasetSpec, args, label: str) -> None:
+    manager = ReservationManager(session=session)
+    rng = random.Random(3)
+    recent = [slot_start(rng.randrange(spec.days - args.recent_days, spec.days), rng.randrange(len(SLOT_HOURS)))
+              for _ in range(args.cases)]
+    groups = random_groups(spec, args.cases, max_size=4)
+    searches = [ReservationRequest(diner_ids=diner_ids, start_time=start_time) for diner_ids, start_time in zip(groups, recent)]
+    # Later slots than any dataset booking, so the bookings find tables
+    after = FIRST_DAY + timedelta(days=spec.days + 1)
+    bookings = [AvailableReservationRequest(diner_ids=diner_ids, restaurant_id=1 + number % spec.restaurants,
+                                            start_time=after + timedelta(hours=2 * number))
+                for number, diner_ids in enumerate(groups)]
+    diner_ids = [rng.randint(1, spec.diners) for _ in range(args.cases)]
+
+    def book_and_delete(request):
+        reservation = manager.book_reservation(request)
+        if reservation is not None:
+            manager.delete_reservation(reservation.id)
+
+    for name, call, cases in (
+        ("find", manager.find_available_restaurant, searches),
+        ("page of 20", lambda request: manager.find_available_restaurant_page(
+            ReservationPageRequest(**request.model_dump(), limit=20)), searches),
+        ("batch, evening", lambda request: manager.find_available_restaurants_by_slot(BatchReservationRequest(
+            diner_ids=request.diner_ids, range_start=request.start_time.replace(hour=17),
+            range_end=request.start_time.replace(hour=21), step_minutes=60)), searches),
+        ("book + delete", book_and_delete, bookings),
+        ("diner history, 20", lambda diner_id: manager.diner_history(diner_id, before=after, limit=20), diner_ids),
+    ):
+        print(format_row(f"{label:<9} {name}", measure(call, cases)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=1000)
+    parser.add_argument("--diners", type=int, default=20_000)
+    parser.add_argument("--reservations", type=int, default=2_000_000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--recent-days", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--cases", type=int, default=100)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations,
+                       days=365 * args.years, diners_per_reservation=2)
+    source = dataset_engine(spec)
+    source.dispose()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "archive.db")
+    shutil.copyfile(source.url.database, path)
+    engine = create_engine(f"sqlite:///{path}")
+    session = sessionmaker(bind=engine)()
+    try:
+        time_operations(session, spec, args, "history")
+
+        now = FIRST_DAY + timedelta(days=spec.days - args.recent_days)
+        started = time.perf_counter()
+        archived = archive_reservations(session, now, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - started
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+        live = session.execute(select(func.count()).select_from(Reservation)).scalar()
+        links = session.execute(select(func.count()).select_from(diner_reservation_association)).scalar()
+        print(f"archived {archived} reservations in {elapsed:.1f}s ({archived / elapsed:.0f}/s), "
+              f"{live} reservations and {links} diner links left")
+
+        time_operations(session, spec, args, "archived")
+    finally:
+        session.close()
+        engine.dispose()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
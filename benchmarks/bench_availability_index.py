@@ -0,0 +1,61 @@
+"""
+SQL vs in-memory availability index for ReservationManager.find_available_restaurant.
+
+    python -m benchmarks.bench_availability_index --restaurants 10000 --reservations 1000000
+
+Reports the index build time, bytes held per table and search latency on both backends,
+and checks that both backends return the same restaurants for every case.
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import ReservationRequest
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=1_000_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations)
+    engine = dataset_engine(spec, rebuild=args.rebuild)
+    session = sessionmaker(bind=engine)()
+    cases = [ReservationRequest(diner_ids=diner_ids, start_time=start_time)
+             for diner_ids, start_time in zip(random_groups(spec, args.searches), random_slots(spec, args.searches))]
+
+    started = time.perf_counter()
+    index = AvailabilityIndex.build(session)
+    build_seconds = time.perf_counter() - started
+    memory = index.memory_report()
+
+    sql = ReservationManager(session=session, search_backend='sql')
+    indexed = ReservationManager(session=session, availability_index=index)
+    mismatches = sum(
+        [restaurant.id for restaurant in sql.find_available_restaurant(case)]
+        != [restaurant.id for restaurant in indexed.find_available_restaurant(case)]
+        for case in cases
+    )
+
+    print(f"find_available_restaurant: {args.restaurants} restaurants, {args.reservations} reservations")
+    print(f"index build: {build_seconds:.2f}s, {memory['tables']} tables, "
+          f"{memory['bytes_per_table']:.0f} bytes per table, "
+          f"{memory['calendar_bytes'] / 2**20:.1f} MiB total")
+    print(format_row("sql backend", measure(sql.find_available_restaurant, cases)))
+    print(format_row("index backend", measure(indexed.find_available_restaurant, cases)))
+    print(f"result mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Batch search over a grid of start times vs one find_available_restaurant per start time.
+
+    python -m benchmarks.bench_batch_search --restaurants 10000 --reservations 1000000
+
+Each case is an evening grid, 17:00 to 22:00 every --step-minutes by default, for a random group.
+Reports latency per grid for both ways on the SQL backend and checks they return the same
+restaurants for every slot.
+"""
+import argparse
+import logging
+from datetime import timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import BatchReservationRequest, ReservationRequest
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=1_000_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--grids", type=int, default=10)
+    parser.add_argument("--step-minutes", type=int, default=30)
+    parser.add_argument("--hours", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations)
+    session = sessionmaker(bind=dataset_engine(spec))()
+    manager = ReservationManager(session=session)
+    cases = [
+        BatchReservationRequest(diner_ids=diner_ids, range_start=start_time.replace(hour=17, minute=0),
+                                range_end=start_time.replace(hour=17, minute=0) + timedelta(hours=args.hours),
+                                step_minutes=args.step_minutes)
+        for diner_ids, start_time in zip(random_groups(spec, args.grids), random_slots(spec, args.grids))
+    ]
+
+    def one_call_per_slot(batch_request: BatchReservationRequest):
+        return [(slot, manager.find_available_restaurant(ReservationRequest(start_time=slot, diner_ids=batch_request.diner_ids)))
+                for slot in batch_request.slots()]
+
+    def ids_by_slot(availability):
+        return [(slot, [restaurant.id for restaurant in restaurants]) for slot, restaurants in availability]
+
+    mismatches = sum(
+        ids_by_slot(manager.find_available_restaurants_by_slot(case)) != ids_by_slot(one_call_per_slot(case))
+        for case in cases
+    )
+
+    print(f"{len(cases[0].slots())} start times per grid: {args.restaurants} restaurants, {args.reservations} reservations")
+    print(format_row("one search per start time", measure(one_call_per_slot, cases)))
+    print(format_row("batch search", measure(manager.find_available_restaurants_by_slot, cases)))
+    print(f"result mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
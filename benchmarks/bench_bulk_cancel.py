@@ -0,0 +1,107 @@
+"""
+Cancelling many reservations at once against one DELETE /reservation/{id} per reservation.
+
+    python -m benchmarks.bench_bulk_cancel --restaurants 1000 --reservations 100000 --sizes 10 100 1000 10000
+
+For every size the same random booked reservations are cancelled twice, each time on a fresh copy of
+the cached dataset and with the availability index, diner schedule and search cache the app builds:
+once looping ReservationManager.delete_reservation as the endpoint does, a transaction per
+reservation, and once with cancel_reservations. A restaurant's evening and a diner's whole calendar
+are compared the same way, the loop deleting the ids the bulk cancellation selects.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from typing import Callable, List
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app.models.db import Reservation
+from app.reservations.availability_index import AvailabilityIndex
+from app.reservations.booking import cancel_diner_select, cancel_restaurant_select
+from app.reservations.diner_schedule import DinerSchedule
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+from .dataset import FIRST_DAY, DatasetSpec, dataset_engine
+
+
+def time_on_copy(source_path: str, directory: str, call: Callable[[ReservationManager], List[int]]) -> float:
+    """Seconds call(manager) takes on a fresh copy of the dataset, checking it cancelled something"""
+    path = os.path.join(directory, "cancel.db")
+    shutil.copyfile(source_path, path)
+    engine = create_engine(f"sqlite:///{path}")
+    session = sessionmaker(bind=engine)()
+    manager = ReservationManager(session=session, availability_index=AvailabilityIndex.build(session),
+                                 search_cache=SearchCache(), diner_schedule=DinerSchedule.build(session))
+    try:
+        started = time.perf_counter()
+        cancelled = call(manager)
+        elapsed = time.perf_counter() - started
+        assert cancelled, "nothing was cancelled"
+        return elapsed
+    finally:
+        session.close()
+        engine.dispose()
+        os.remove(path)
+
+
+def delete_each(reservation_ids: List[int]) -> Callable[[ReservationManager], List[int]]:
+    def call(manager: ReservationManager) -> List[int]:
+        for reservation_id in reservation_ids:
+            manager.delete_reservation(reservation_id)
+        return reservation_ids
+    return call
+
+
+def compare(name: str, source_path: str, directory: str, reservation_ids: List[int],
+            bulk: Callable[[ReservationManager], List[int]]) -> None:
+    looped = time_on_copy(source_path, directory, delete_each(reservation_ids))
+    cancelled = time_on_copy(source_path, directory, bulk)
+    print(f"{name:<24} {len(reservation_ids):>6} reservations  loop={looped * 1000:10.1f}ms  "
+          f"bulk={cancelled * 1000:8.1f}ms  {looped / cancelled:6.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=1000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10_000])
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations,
+                       days=args.days, diners_per_reservation=2)
+    source = dataset_engine(spec)
+    source_path = source.url.database
+    with sessionmaker(bind=source)() as session:
+        booked = session.scalars(select(Reservation.id).where(Reservation.combined_with_id.is_(None))).all()
+        start, end = FIRST_DAY + timedelta(days=1, hours=17), FIRST_DAY + timedelta(days=1, hours=23)
+        evening = sorted(session.scalars(cancel_restaurant_select(1, start, end)).all())
+        calendar = sorted(session.scalars(cancel_diner_select(1)).all())
+    source.dispose()
+
+    directory = tempfile.mkdtemp()
+    try:
+        rng = random.Random(5)
+        for size in args.sizes:
+            reservation_ids = sorted(rng.sample(booked, min(size, len(booked))))
+            compare("by ids", source_path, directory, reservation_ids,
+                    lambda manager: manager.cancel_reservations(reservation_ids))
+        compare("restaurant's evening", source_path, directory, evening,
+                lambda manager: manager.cancel_restaurant_reservations(1, start, end))
+        compare("diner's calendar", source_path, directory, calendar,
+                lambda manager: manager.cancel_diner_reservations(1))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Combined tables for large groups at worst-case restaurants.
+
+    python -m benchmarks.bench_combinations --tables 12 24 48 96 --restaurants 1000
+
+Solver: cheapest_combination on one restaurant whose tables all combine, with
+    mixed      capacities from the seeded sizes (2, 4, 6, 8), the common case
+    distinct   every table a different size, so no two tables are interchangeable
+and group sizes no subset hits exactly, which forces the search to prove its best set.
+The distinct case is the hard subset sum; its result is compared with the exhaustive optimum
+(SEARCH_NODE_LIMIT off) to show what the node budget costs in seats.
+
+End to end: --restaurants restaurants with --tables combinable tables each, half of them booked
+at the searched time, then find_available_restaurant and book_reservation for 12 to 30 diners.
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import Diner, Reservation, Restaurant, RestaurantTable
+from app.models.migrations import create_schema
+from app.reservations.combinations import CombinableTable, cheapest_combination
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import RESERVATION_DURATION
+from .timing import format_row, measure
+
+
+SEARCHED = datetime(2099, 8, 1, 19)
+
+
+def restaurant_tables(kind: str, tables: int, rng: random.Random):
+    if kind == "distinct":
+        capacities = rng.sample(range(2, 3 * tables), tables)
+    else:
+        capacities = [rng.choice((2, 4, 6, 8)) for _ in range(tables)]
+    return [CombinableTable(number, capacity, 1) for number, capacity in enumerate(capacities, start=1)]
+
+
+def awkward_size(tables, rng: random.Random) -> int:
+    """An odd size between a quarter and three quarters of the seats, so even capacities never match it"""
+    seats = sum(table.capacity for table in tables)
+    return rng.randrange(seats // 4, 3 * seats // 4) | 1
+
+
+def bench_solver(table_counts, cases: int) -> None:
+    rng = random.Random(42)
+    for kind in ("mixed", "distinct"):
+        for tables in table_counts:
+            restaurants = [restaurant_tables(kind, tables, rng) for _ in range(cases)]
+            sizes = [awkward_size(restaurant, rng) for restaurant in restaurants]
+            stats = measure(lambda case: cheapest_combination(*case), list(zip(restaurants, sizes)))
+            print(format_row(f"{kind:<8} {tables:>3} tables", stats))
+            if kind == "distinct" and tables <= 24:
+                extra = [cheapest_combination(restaurant, size).seats - cheapest_combination(restaurant, size, 10 ** 9).seats
+                         for restaurant, size in zip(restaurants, sizes)]
+                print(f"    seats above the exhaustive optimum: max {max(extra)}, mean {sum(extra) / len(extra):.2f}")
+
+
+def build_database(path: str, restaurants: int, tables: int) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    create_schema(engine)
+    rng = random.Random(7)
+    duration = timedelta(hours=RESERVATION_DURATION)
+    with engine.begin() as connection:
+        connection.execute(insert(Restaurant), [{"id": id, "name": f"Hall {id}"} for id in range(1, restaurants + 1)])
+        connection.execute(insert(Diner), [{"id": id, "name": f"Guest {id}"} for id in range(1, 31)])
+        connection.execute(insert(RestaurantTable), [
+            {"id": (restaurant - 1) * tables + number, "restaurant_id": restaurant,
+             "capacity": rng.choice((2, 4, 6, 8)), "combination_group": 1}
+            for restaurant in range(1, restaurants + 1) for number in range(1, tables + 1)
+        ])
+        connection.execute(insert(Reservation), [
+            {"table_id": table_id, "start_datetime": SEARCHED, "end_datetime": SEARCHED + duration}
+            for table_id in range(1, restaurants * tables + 1) if rng.random() < 0.5
+        ])
+    engine.dispose()
+
+
+def bench_end_to_end(restaurants: int, tables: int, cases: int, directory: str) -> None:
+    path = os.path.join(directory, f"combinations-{tables}.db")
+    build_database(path, restaurants, tables)
+    engine = create_engine(f"sqlite:///{path}")
+    session = sessionmaker(bind=engine)()
+    manager = ReservationManager(session=session)
+    rng = random.Random(3)
+    groups = [list(range(1, rng.randint(12, 30) + 1)) for _ in range(cases)]
+
+    def find(diner_ids):
+        return manager.find_available_restaurant(ReservationRequest(start_time=SEARCHED, diner_ids=diner_ids))
+
+    def book(number_and_group):
+        number, diner_ids = number_and_group
+        # Each booking on its own day, so the guests are never already booked
+        manager.book_reservation(AvailableReservationRequest(
+            start_time=SEARCHED + timedelta(days=1 + number), diner_ids=diner_ids,
+            restaurant_id=1 + number * 7919 % restaurants
+        ))
+
+    print(f"{restaurants} restaurants with {tables} combinable tables, half booked at {SEARCHED}")
+    print(format_row("find, 12 to 30 diners", measure(find, groups)))
+    print(format_row("book, 12 to 30 diners", measure(book, list(enumerate(groups)), warmup=0)))
+    session.close()
+    engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, nargs="+", default=[12, 24, 48, 96])
+    parser.add_argument("--restaurants", type=int, default=1000)
+    parser.add_argument("--cases", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    bench_solver(args.tables, args.cases)
+    with tempfile.TemporaryDirectory() as directory:
+        for tables in args.tables:
+            bench_end_to_end(args.restaurants, tables, args.cases // 4, directory)
+
+
+if __name__ == "__main__":
+    main()
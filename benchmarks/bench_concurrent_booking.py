@@ -0,0 +1,135 @@
+"""
+Concurrent booking stress test.
+
+    python -m benchmarks.bench_concurrent_booking --threads 32 --bookings 4000
+
+Many threads book the same few restaurants and overlapping slots at once, then the database is
+checked for any table or diner holding two overlapping reservations.
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest
+from app.models.config import DatabaseSettings
+from app.models.db import Diner, Restaurant, RestaurantTable, create_db_engine
+from app.models.migrations import create_schema
+from app.reservations.reservation_manager import ReservationManager
+
+
+# Starts one hour apart with two hour reservations, so neighbouring slots overlap
+SLOTS = [datetime(2024, 8, 24, 17) + timedelta(hours=hour) for hour in range(4)]
+
+TABLE_OVERLAPS = """
+    SELECT count(*) FROM reservations a JOIN reservations b
+      ON a.table_id = b.table_id AND a.id < b.id
+     AND a.start_datetime < b.end_datetime AND a.end_datetime > b.start_datetime
+"""
+DINER_OVERLAPS = """
+    SELECT count(*) FROM diner_reservation da
+      JOIN diner_reservation db ON da.diner_id = db.diner_id AND da.reservation_id < db.reservation_id
+      JOIN reservations a ON a.id = da.reservation_id
+      JOIN reservations b ON b.id = db.reservation_id
+     WHERE a.start_datetime < b.end_datetime AND a.end_datetime > b.start_datetime
+"""
+
+
+def stress_engine(directory: str, threads: int) -> Engine:
+    settings = DatabaseSettings(url=f"sqlite:///{os.path.join(directory, 'stress.db')}",
+                                pool_size=threads, max_overflow=0)
+    return create_db_engine(settings)
+
+
+def seed(engine: Engine, restaurants: int = 4, tables: int = 6, diners: int = 300) -> None:
+    create_schema(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Diner(name=f"Stress Diner {number}") for number in range(1, diners + 1)])
+    for number in range(1, restaurants + 1):
+        restaurant = Restaurant(name=f"Stress Restaurant {number}")
+        session.add(restaurant)
+        session.flush()
+        session.add_all([RestaurantTable(restaurant_id=restaurant.id, capacity=2 + 2 * (table % 3))
+                         for table in range(tables)])
+    session.commit()
+    session.close()
+
+
+def stress_bookings(engine: Engine, threads: int, bookings: int, restaurants: int = 4,
+                    diners: int = 300, seed_value: int = 42) -> Dict[str, float]:
+    """Fires `bookings` bookings from `threads` threads released together, returns outcome counts"""
+    Session = sessionmaker(bind=engine)
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+    per_thread = bookings // threads
+
+    def worker(worker_number: int) -> None:
+        rng = random.Random(seed_value + worker_number)
+        barrier.wait()
+        for _ in range(per_thread):
+            request = AvailableReservationRequest(
+                start_time=rng.choice(SLOTS),
+                diner_ids=rng.sample(range(1, diners + 1), rng.randint(1, 4)),
+                restaurant_id=rng.randint(1, restaurants)
+            )
+            session = Session()
+            try:
+                reservation = ReservationManager(session=session).book_reservation(request)
+                outcome = "booked" if reservation else "no_table"
+            except HTTPException as e:
+                outcome = {409: "diner_conflict", 503: "gave_up"}.get(e.status_code, str(e.status_code))
+            finally:
+                session.close()
+            with lock:
+                outcomes[outcome] += 1
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        table_overlaps = connection.execute(text(TABLE_OVERLAPS)).scalar()
+        diner_overlaps = connection.execute(text(DINER_OVERLAPS)).scalar()
+
+    return {
+        **outcomes,
+        "attempts": per_thread * threads,
+        "seconds": elapsed,
+        "bookings_per_second": per_thread * threads / elapsed,
+        "table_overlaps": table_overlaps,
+        "diner_overlaps": diner_overlaps,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--bookings", type=int, default=4000)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    engine = stress_engine(tempfile.mkdtemp(), args.threads)
+    seed(engine)
+    result = stress_bookings(engine, args.threads, args.bookings)
+    print(", ".join(f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Double-booking checks for groups of diners with long reservation histories.
+
+    python -m benchmarks.bench_diner_conflicts --diners 2000 --reservations 500000 --days 365
+
+Every reservation seats 4 diners, so each diner holds about 4 * reservations / diners of them.
+For groups of 1 to 20 diners, in windows inside the history and after it (where bookings land):
+    join       the check as it was, diner_reservation joined to reservations then filtered on the
+               window, which visits every reservation the diner ever held
+    indexed    booked_diners_select, a seek on ix_diner_reservation_diner_window
+    schedule   DinerSchedule.booked_diner_ids, a bisect per diner in memory
+Then book_reservation for 6-diner groups, the largest table, with and without the schedule, each
+booking deleted again so the cached dataset file is left as it was.
+"""
+import argparse
+import logging
+import random
+import time
+from datetime import timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest
+from app.models.db import Reservation, diner_reservation_association
+from app.reservations.diner_schedule import DinerSchedule
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import booked_diners_select, overlaps
+from .dataset import FIRST_DAY, DatasetSpec, dataset_engine, random_slots
+from .timing import format_row, measure
+
+
+def joined_booked_diners_select(diner_ids, start_datetime, end_datetime):
+    return select(diner_reservation_association.c.diner_id).join(
+        Reservation, Reservation.id == diner_reservation_association.c.reservation_id
+    ).where(
+        diner_reservation_association.c.diner_id.in_(diner_ids),
+        overlaps(start_datetime, end_datetime)
+    ).distinct()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=2000)
+    parser.add_argument("--diners", type=int, default=2000)
+    parser.add_argument("--reservations", type=int, default=500_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--cases", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations,
+                       days=args.days, diners_per_reservation=4)
+    session = sessionmaker(bind=dataset_engine(spec))()
+
+    started = time.perf_counter()
+    schedule = DinerSchedule.build(session)
+    print(f"schedule of {schedule.reservation_count()} diner reservations "
+          f"({schedule.reservation_count() / args.diners:.0f} per diner) built in {time.perf_counter() - started:.2f}s")
+
+    rng = random.Random(3)
+    after_history = FIRST_DAY + timedelta(days=args.days + 7)
+    windows = {
+        "in history": random_slots(spec, args.cases),
+        "after history": [after_history + timedelta(hours=rng.randrange(24 * 30)) for _ in range(args.cases)],
+    }
+    checks = {
+        "join": lambda diner_ids, start, end: session.execute(joined_booked_diners_select(diner_ids, start, end)).all(),
+        "indexed": lambda diner_ids, start, end: session.execute(booked_diners_select(diner_ids, start, end)).all(),
+        "schedule": schedule.booked_diner_ids,
+    }
+    for size in (1, 5, 10, 20):
+        for label, starts in windows.items():
+            cases = [(rng.sample(range(1, args.diners + 1), size), start, start + timedelta(hours=2)) for start in starts]
+            for name, check in checks.items():
+                print(format_row(f"{size:>2} diners {label:<13} {name}", measure(lambda case: check(*case), cases)))
+
+    groups = [rng.sample(range(1, args.diners + 1), 6) for _ in range(args.cases // 4)]
+    for name, manager in (("book, sql check", ReservationManager(session=session)),
+                          ("book, schedule", ReservationManager(session=session, diner_schedule=schedule))):
+        def book_and_delete(numbered_group):
+            number, diner_ids = numbered_group
+            reservation = manager.book_reservation(AvailableReservationRequest(
+                diner_ids=diner_ids, start_time=after_history + timedelta(hours=3 * number),
+                restaurant_id=1 + number % args.restaurants
+            ))
+            if reservation is not None:
+                manager.delete_reservation(reservation.id)
+        print(format_row(f" 6 diners {name} + delete", measure(book_and_delete, list(enumerate(groups)))))
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
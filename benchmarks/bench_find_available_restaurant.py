@@ -0,0 +1,84 @@
+"""
+Before/after benchmark for ReservationManager.find_available_restaurant.
+
+    python -m benchmarks.bench_find_available_restaurant --restaurants 10000 --reservations 1000000
+
+"before" is the original three round trip search (conflicting restaurants, restriction ids,
+one EXISTS per restriction), "after" is the single set-based statement in app.reservations.search.
+"""
+import argparse
+import logging
+from datetime import timedelta
+
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import ReservationRequest
+from app.models.db import (
+    DietaryRestriction, Reservation, Restaurant, RestaurantTable,
+    diner_dietary_restriction_association, restaurant_dietary_restriction_association
+)
+from app.reservations.reservation_manager import RESERVATION_DURATION, ReservationManager
+from .dataset import DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def legacy_find_available_restaurant(session, diner_ids, start_datetime):
+    """The search as it was before the set-based rewrite, kept for comparison"""
+    end_datetime = start_datetime + timedelta(hours=RESERVATION_DURATION)
+    conflicting_restaurants = session.query(Restaurant.id).join(RestaurantTable).join(Reservation).filter(
+        and_(Reservation.start_datetime < end_datetime, Reservation.end_datetime > start_datetime)
+    ).distinct().all()
+    conflicting_restaurant_ids = [row.id for row in conflicting_restaurants]
+
+    diner_dietary_restrictions = session.query(DietaryRestriction.id).join(diner_dietary_restriction_association)\
+        .filter(diner_dietary_restriction_association.c.diner_id.in_(diner_ids)).all()
+    diner_dietary_restriction_ids = [row.id for row in diner_dietary_restrictions]
+
+    return session.query(Restaurant).join(RestaurantTable).filter(
+        and_(
+            RestaurantTable.capacity >= len(diner_ids),
+            Restaurant.id.notin_(conflicting_restaurant_ids),
+            *[exists().where(
+                and_(
+                    restaurant_dietary_restriction_association.c.restaurant_id == Restaurant.id,
+                    restaurant_dietary_restriction_association.c.dietary_restriction_id == restriction_id
+                )
+            ) for restriction_id in diner_dietary_restriction_ids]
+        )
+    ).distinct().all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=1_000_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--legacy-searches", type=int, default=3,
+                        help="the legacy search runs one correlated EXISTS per restriction and per table row, "
+                             "so it can take minutes per call at full scale")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations)
+    engine = dataset_engine(spec, rebuild=args.rebuild)
+    session = sessionmaker(bind=engine)()
+    cases = list(zip(random_groups(spec, args.searches), random_slots(spec, args.searches)))
+
+    before = measure(lambda case: legacy_find_available_restaurant(session, *case),
+                     cases[:args.legacy_searches], warmup=0)
+    manager = ReservationManager(session=session)
+    after = measure(lambda case: manager.find_available_restaurant(
+        ReservationRequest(diner_ids=case[0], start_time=case[1])
+    ), cases)
+
+    print(f"find_available_restaurant: {args.restaurants} restaurants, {args.reservations} reservations")
+    print(format_row("before (3 round trips)", before))
+    print(format_row("after (single statement)", after))
+    print(f"speedup p50: {before['p50_ms'] / after['p50_ms']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Search latency while bookings are written, per storage mode.
+
+    python -m benchmarks.bench_mixed_load --restaurants 2000 --reservations 200000 --cycles 3
+
+A writer process alternates idle periods with write bursts while the main process searches through
+the read engine as fast as it can. A burst imports --import-rows reservations in one transaction, as
+a back-office load would, then books --rate times a second, each booking its own transaction, for
+the rest of the burst. Every search is tagged with whether a burst was running, so the two latency
+distributions can be compared. Modes, each on its own copy of the cached dataset:
+    delete/full      the rollback journal, SQLite's default: while a large transaction writes and
+                     commits, readers wait on its lock
+    wal/full         write-ahead log, readers keep reading the last committed snapshot
+    wal/normal       the default here, WAL only syncing at checkpoints
+Place --directory on a real disk to include fsync costs, /tmp may be in memory.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.config import DatabaseSettings
+from app.models.db import Reservation, create_db_engine
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import FIRST_DAY, SLOT_HOURS, TABLE_CAPACITIES, DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, summarize
+
+
+MODES = [("delete", "full"), ("wal", "full"), ("wal", "normal")]
+
+
+def imported_reservations(spec: DatasetSpec, day: datetime, rows: int) -> List[dict]:
+    """Back to back reservations from `day` on, spread over every table, so none overlap"""
+    tables = spec.restaurants * len(TABLE_CAPACITIES)
+    return [{"table_id": 1 + number % tables, "start_datetime": day + timedelta(hours=2 * (number // tables)),
+             "end_datetime": day + timedelta(hours=2 * (number // tables + 1))} for number in range(rows)]
+
+
+def write_bursts(settings: DatabaseSettings, spec: DatasetSpec, args, bursting, booked) -> None:
+    """The writer process: `cycles` times, sleeps `idle` seconds then writes for `burst` seconds"""
+    logging.getLogger().setLevel(logging.ERROR)
+    engine = create_db_engine(settings)
+    session = sessionmaker(bind=engine)()
+    manager = ReservationManager(session=session)
+    rng = random.Random(5)
+    # After the dataset's history, so bookings mostly find a table, and imports after those
+    first_day = FIRST_DAY + timedelta(days=spec.days + 1)
+    for cycle in range(args.cycles):
+        time.sleep(args.idle)
+        bursting.value = 1
+        started = time.perf_counter()
+        if args.import_rows:
+            import_day = first_day + timedelta(days=100 + 30 * cycle)
+            with engine.begin() as connection:
+                connection.execute(insert(Reservation), imported_reservations(spec, import_day, args.import_rows))
+        for number in range(int(args.rate * args.burst)):
+            if time.perf_counter() - started > args.burst:
+                break
+            time.sleep(max(0.0, started + number / args.rate - time.perf_counter()))
+            request = AvailableReservationRequest(
+                diner_ids=rng.sample(range(1, spec.diners + 1), 2),
+                start_time=first_day + timedelta(days=rng.randrange(60), hours=rng.choice(SLOT_HOURS)),
+                restaurant_id=rng.randint(1, spec.restaurants)
+            )
+            try:
+                if manager.book_reservation(request) is not None:
+                    booked.value += 1
+            except HTTPException:
+                session.rollback()
+        bursting.value = 0
+    time.sleep(args.idle)
+    session.close()
+    engine.dispose()
+
+
+def run_mode(path: str, spec: DatasetSpec, journal_mode: str, synchronous: str, args) -> None:
+    settings = DatabaseSettings(url=f"sqlite:///{path}", journal_mode=journal_mode, synchronous=synchronous,
+                                pool_size=2, max_overflow=0)
+    # The writer's first connection sets the journal mode, before any reader opens the file
+    write_engine = create_db_engine(settings)
+    write_engine.connect().close()
+    read_engine = create_db_engine(settings.for_reads(), read_only=True)
+    read_session = sessionmaker(bind=read_engine)()
+    manager = ReservationManager(session=read_session, read_session=read_session)
+    searches = [ReservationRequest(diner_ids=diner_ids, start_time=start_time)
+                for diner_ids, start_time in zip(random_groups(spec, 500, max_size=4), random_slots(spec, 500))]
+
+    bursting, booked = multiprocessing.Value('b', 0), multiprocessing.Value('i', 0)
+    writer = multiprocessing.Process(target=write_bursts, args=(
+        settings, spec, args, bursting, booked
+    ))
+    writer.start()
+    timings = {0: [], 1: []}
+    number = 0
+    while writer.is_alive():
+        during_burst = bursting.value
+        started = time.perf_counter()
+        manager.find_available_restaurant(searches[number % len(searches)])
+        timings[during_burst].append((time.perf_counter() - started) * 1000)
+        number += 1
+    writer.join()
+
+    label = f"{journal_mode}/{synchronous}"
+    print(f"{label}: {args.cycles} bursts, each importing {args.import_rows} reservations, {booked.value} bookings")
+    for during_burst, name in ((0, "idle"), (1, "write burst")):
+        stats = summarize(timings[during_burst])
+        print(f"{format_row(f'  search, {name}', stats)} p99={stats['p99_ms']:9.2f}ms max={stats['max_ms']:9.2f}ms")
+    read_session.close()
+    read_engine.dispose()
+    write_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=2000)
+    parser.add_argument("--diners", type=int, default=5000)
+    parser.add_argument("--reservations", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=1.0)
+    parser.add_argument("--burst", type=float, default=4.0)
+    parser.add_argument("--rate", type=float, default=20.0, help="bookings per second during a burst")
+    parser.add_argument("--import-rows", type=int, default=50_000, help="reservations imported at the start of a burst")
+    parser.add_argument("--directory", default=None)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations, days=args.days)
+    source = dataset_engine(spec)
+    source.dispose()
+    directory = tempfile.mkdtemp(dir=args.directory)
+    try:
+        for journal_mode, synchronous in MODES:
+            path = os.path.join(directory, f"mixed-{journal_mode}-{synchronous}.db")
+            shutil.copyfile(source.url.database, path)
+            run_mode(path, spec, journal_mode, synchronous, args)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
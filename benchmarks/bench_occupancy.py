@@ -0,0 +1,106 @@
+"""
+Searches with and without the restaurant_occupancy pre-filter, and what keeping the table costs.
+
+    python -m benchmarks.bench_occupancy --restaurants 1000 --days 7 --booked 0.1 0.5 0.9
+
+For each share of table slots booked, the same groups and start times, on and off the hour, are
+searched three ways: the default search joining restaurants to the free ones, the same checks made
+per restaurant, and those per restaurant checks after has_occupancy_room. Then restaurant_occupancy
+is rebuilt from scratch, and a few hundred bookings and deletions are timed with its triggers and
+again after dropping them.
+"""
+import argparse
+import logging
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import OCCUPANCY_TRIGGERS, restaurant_occupancy
+from app.reservations.occupancy import rebuild_occupancy
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import RESERVATION_DURATION, available_restaurant_rows_select
+from .dataset import SLOT_HOURS, TABLE_CAPACITIES, DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def searches(spec: DatasetSpec, count: int):
+    return [ReservationRequest(diner_ids=diner_ids, start_time=start + timedelta(minutes=30 * (number % 2)))
+            for number, (diner_ids, start) in enumerate(zip(random_groups(spec, count, max_size=6),
+                                                            random_slots(spec, count)))]
+
+
+def time_writes(session, spec: DatasetSpec, count: int) -> float:
+    """Milliseconds per booking and deletion of `count` bookings, rolled back to the same state after"""
+    manager = ReservationManager(session=session)
+    booked = []
+    started = time.perf_counter()
+    for number, request in enumerate(searches(spec, count)):
+        try:
+            reservation = manager.book_reservation(AvailableReservationRequest(
+                **request.model_dump(), restaurant_id=number % spec.restaurants + 1
+            ))
+        except Exception:
+            continue
+        if reservation is not None:
+            booked.append(reservation.id)
+    for reservation_id in booked:
+        manager.delete_reservation(reservation_id)
+    return (time.perf_counter() - started) * 1000 / max(1, len(booked) * 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=1000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--booked", type=float, nargs="+", default=[0.1, 0.5, 0.9])
+    parser.add_argument("--cases", type=int, default=40)
+    parser.add_argument("--writes", type=int, default=300)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    for share in args.booked:
+        slots = args.restaurants * len(TABLE_CAPACITIES) * args.days * len(SLOT_HOURS)
+        spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=int(slots * share),
+                           days=args.days)
+        engine = dataset_engine(spec)
+        session = sessionmaker(bind=engine)()
+        requests = searches(spec, args.cases)
+        print(f"{spec.restaurants} restaurants, {spec.reservations} reservations, {share:.0%} of table slots booked")
+        try:
+            for name, per_restaurant, prefilter in (
+                ("joined", False, False), ("per restaurant", True, False), ("per restaurant, prefilter", True, True),
+            ):
+                def find(request: ReservationRequest):
+                    end_datetime = request.start_time + timedelta(hours=RESERVATION_DURATION)
+                    return session.execute(available_restaurant_rows_select(
+                        request.diner_ids, request.start_time, end_datetime, occupancy_prefilter=prefilter,
+                        # A limit past every restaurant takes the per restaurant form without cutting the result
+                        limit=spec.restaurants + 1 if per_restaurant else None
+                    )).all()
+                print(format_row(name, measure(find, requests)))
+
+            started = time.perf_counter()
+            rows = rebuild_occupancy(session)
+            print(f"rebuild: {rows} occupancy rows in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+            with_triggers = time_writes(session, spec, args.writes)
+            with engine.begin() as connection:
+                for name in ('insert', 'delete', 'update'):
+                    connection.execute(text(f'DROP TRIGGER reservations_occupancy_{name}'))
+            without_triggers = time_writes(session, spec, args.writes)
+            with engine.begin() as connection:
+                for ddl in OCCUPANCY_TRIGGERS:
+                    connection.execute(ddl)
+            print(f"book or delete: {with_triggers:.2f}ms with occupancy triggers, {without_triggers:.2f}ms without")
+            assert session.scalar(select(func.count()).select_from(restaurant_occupancy)) == rows
+        finally:
+            session.close()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Memory and latency of a large search: Restaurant entities vs (id, name) keyset pages.
+
+    python -m benchmarks.bench_pagination --restaurants 10000 --reservations 1000000
+
+Searches for small groups, which most restaurants can seat, comparing
+    entities    ReservationManager.find_available_restaurant, every Restaurant loaded at once
+    rows        one (id, name) statement for the whole result
+    pages       the whole result walked in keyset pages of --page-size, one page held at a time,
+                and the first page alone
+Peak Python allocations per search are measured with tracemalloc, latency separately without it.
+"""
+import argparse
+import logging
+import tracemalloc
+from datetime import timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import ReservationPageRequest, ReservationRequest
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search import RESERVATION_DURATION, available_restaurant_rows_select
+from .dataset import DatasetSpec, dataset_engine, random_slots
+from .timing import format_row, measure
+
+
+def peak_kib(call, cases) -> float:
+    peaks = []
+    for case in cases:
+        tracemalloc.start()
+        call(case)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return max(peaks) / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=1_000_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations)
+    session = sessionmaker(bind=dataset_engine(spec))()
+    manager = ReservationManager(session=session)
+    # Diner 1 alone, the same slot grid as the other benchmarks
+    cases = [ReservationRequest(start_time=start_time, diner_ids=[1]) for start_time in random_slots(spec, args.searches)]
+
+    def entities(request: ReservationRequest) -> int:
+        results = manager.find_available_restaurant(request)
+        count = len(results)
+        session.expunge_all()
+        return count
+
+    def rows(request: ReservationRequest) -> int:
+        end_datetime = request.start_time + timedelta(hours=RESERVATION_DURATION)
+        return len(session.execute(available_restaurant_rows_select(request.diner_ids, request.start_time, end_datetime)).all())
+
+    def pages(request: ReservationRequest) -> int:
+        count, cursor = 0, None
+        while True:
+            page, cursor = manager.find_available_restaurant_page(ReservationPageRequest(
+                start_time=request.start_time, diner_ids=request.diner_ids, limit=args.page_size, cursor=cursor
+            ))
+            count += len(page)
+            if cursor is None:
+                return count
+
+    def first_page(request: ReservationRequest) -> int:
+        page, _ = manager.find_available_restaurant_page(ReservationPageRequest(
+            start_time=request.start_time, diner_ids=request.diner_ids, limit=args.page_size
+        ))
+        return len(page)
+
+    counts = [entities(case) for case in cases]
+    assert counts == [rows(case) for case in cases] == [pages(case) for case in cases]
+
+    print(f"{sum(counts) // len(counts)} restaurants per search: {args.restaurants} restaurants, "
+          f"{args.reservations} reservations")
+    for name, call in (("entities", entities), ("rows", rows), (f"all pages of {args.page_size}", pages),
+                       ("first page", first_page)):
+        print(format_row(name, measure(call, cases)) + f" peak={peak_kib(call, cases):9.0f}KiB")
+
+
+if __name__ == "__main__":
+    main()
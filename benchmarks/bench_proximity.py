@@ -0,0 +1,104 @@
+"""
+Neighbourhood searches through the restaurant_locations R*Tree against searching the whole city.
+
+    python -m benchmarks.bench_proximity --restaurants 100000 --reservations 200000
+
+Every restaurant and diner of the dataset sits somewhere in CITY_AREA. The same groups and start
+times are searched four ways: the plain search over every restaurant, the nearest 50, everything
+within 2 km, and the plain search with its results ranked by distance in Python, which is what the
+R*Tree saves. For the nearby searches the restaurants the R*Tree let through to the availability
+check are counted, summed over every radius a nearest_k search widened to.
+"""
+import argparse
+import logging
+import statistics
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import ReservationSearchRequest
+from app.models.db import Restaurant, restaurant_locations
+from app.reservations.proximity import bounding_box, group_centroid_select, haversine_km, search_radii
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def boxes_searched(engine, call) -> int:
+    """How many R*Tree searches call() ran, one per radius"""
+    searched = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if 'restaurant_locations' in statement:
+            searched.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        call()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return len(searched)
+
+
+def candidates(session, request: ReservationSearchRequest, searches: int) -> int:
+    """Restaurants inside the boxes of the first `searches` radii, the ones checked for a free table"""
+    centroid = session.execute(group_centroid_select(request.diner_ids)).one()
+    locations = restaurant_locations.c
+    total = 0
+    for radius, _ in zip(search_radii(request.max_distance_km, request.nearest_k), range(searches)):
+        min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(*centroid, radius)
+        total += session.execute(select(func.count()).select_from(restaurant_locations).where(
+            locations.max_latitude >= min_latitude, locations.min_latitude <= max_latitude,
+            locations.max_longitude >= min_longitude, locations.min_longitude <= max_longitude,
+        )).scalar()
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=100_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--cases", type=int, default=30)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations, days=args.days)
+    engine = dataset_engine(spec)
+    session = sessionmaker(bind=engine)()
+    manager = ReservationManager(session=session)
+    groups = list(zip(random_groups(spec, args.cases, max_size=6), random_slots(spec, args.cases)))
+
+    # Every location read up front, the ranking alone is timed
+    located = {id: (latitude, longitude) for id, latitude, longitude in session.execute(
+        select(Restaurant.id, Restaurant.latitude, Restaurant.longitude))}
+
+    def ranked_in_python(request: ReservationSearchRequest):
+        centroid = session.execute(group_centroid_select(request.diner_ids)).one()
+        found = manager.find_available_restaurant(request)
+        return sorted(found, key=lambda restaurant: haversine_km(*centroid, *located[restaurant.id]))[:50]
+
+    try:
+        print(f"{spec.restaurants} restaurants over {spec.days} days")
+        for name, distance, call in (
+            ("whole city", {}, manager.find_available_restaurant),
+            ("whole city, ranked in python", {}, ranked_in_python),
+            ("nearest_k=50", {"nearest_k": 50}, manager.find_available_restaurant),
+            ("max_distance_km=2", {"max_distance_km": 2}, manager.find_available_restaurant),
+        ):
+            requests = [ReservationSearchRequest(diner_ids=diner_ids, start_time=start_time, **distance)
+                        for diner_ids, start_time in groups]
+            row = format_row(name, measure(call, requests))
+            if distance:
+                checked = [candidates(session, request, boxes_searched(
+                    engine, lambda: manager.find_available_restaurant(request))) for request in requests]
+                row += f" checked={statistics.fmean(checked):.0f} of {spec.restaurants}"
+            print(row)
+    finally:
+        session.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
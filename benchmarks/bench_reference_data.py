@@ -0,0 +1,131 @@
+"""
+Size and build time of the reference data snapshot, and what it saves searches and bookings.
+
+    python -m benchmarks.bench_reference_data --restaurants 100000 --diners 1000000
+
+Builds ReferenceSnapshot from the cached dataset a few times, timing each build and the fingerprint
+check the periodic refresh runs, and measures its footprint twice: memory_bytes() over its arrays,
+and the tracemalloc growth while building one. The same rows held in dicts of tuples, as a plain
+cache would keep them, are measured the same way for comparison. Then the SQL backend is timed with
+and without the snapshot, on ordinary groups and on groups of 7, which no table seats.
+"""
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+from datetime import timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, BatchReservationRequest, ReservationPageRequest, ReservationRequest
+from app.models.db import Diner, Restaurant, RestaurantTable
+from app.reservations.reference_data import ReferenceData, ReferenceSnapshot
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import FIRST_DAY, DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def dict_reference(session) -> tuple:
+    """The snapshot's content as dicts of tuples"""
+    restaurants = {id: (name, mask) for id, name, mask in session.execute(
+        select(Restaurant.id, Restaurant.name, Restaurant.dietary_restriction_mask))}
+    tables = {}
+    for id, restaurant_id, capacity, combination_group in session.execute(select(
+        RestaurantTable.id, RestaurantTable.restaurant_id, RestaurantTable.capacity, RestaurantTable.combination_group
+    )):
+        tables.setdefault(restaurant_id, []).append((id, capacity, combination_group))
+    diners = dict(session.execute(select(Diner.id, Diner.dietary_restriction_mask).where(Diner.dietary_restriction_mask != 0)).all())
+    return restaurants, tables, diners
+
+
+def traced_size(build) -> int:
+    """Bytes still allocated once build() returns, with its result alive"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def time_operations(session, spec: DatasetSpec, reference_data, args, label: str) -> None:
+    manager = ReservationManager(session=session, reference_data=reference_data)
+    groups = random_groups(spec, args.cases, max_size=6)
+    searches = [ReservationRequest(diner_ids=diner_ids, start_time=start_time)
+                for diner_ids, start_time in zip(groups, random_slots(spec, args.cases))]
+    after = FIRST_DAY + timedelta(days=spec.days + 1)
+    bookings = [AvailableReservationRequest(diner_ids=diner_ids, restaurant_id=1 + number % spec.restaurants,
+                                            start_time=after + timedelta(hours=2 * number))
+                for number, diner_ids in enumerate(groups)]
+    large = [ReservationRequest(diner_ids=list(range(number * 7 + 1, number * 7 + 8)), start_time=request.start_time)
+             for number, request in enumerate(searches)]
+
+    def book_and_delete(request):
+        reservation = manager.book_reservation(request)
+        if reservation is not None:
+            manager.delete_reservation(reservation.id)
+
+    for name, call, cases in (
+        ("find", manager.find_available_restaurant, searches),
+        ("page of 20", lambda request: manager.find_available_restaurant_page(
+            ReservationPageRequest(**request.model_dump(), limit=20)), searches),
+        ("batch, 3 slots", lambda request: manager.find_available_restaurants_by_slot(BatchReservationRequest(
+            diner_ids=request.diner_ids, range_start=request.start_time,
+            range_end=request.start_time + timedelta(hours=4), step_minutes=120)), searches),
+        ("book + delete", book_and_delete, bookings),
+        ("find, 7 diners", manager.find_available_restaurant, large),
+        ("book, 7 diners", lambda request: manager.book_reservation(AvailableReservationRequest(
+            **request.model_dump(), restaurant_id=1)), large),
+    ):
+        print(format_row(f"{label:<10} {name}", measure(call, cases)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=100_000)
+    parser.add_argument("--diners", type=int, default=1_000_000)
+    parser.add_argument("--reservations", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--builds", type=int, default=3)
+    parser.add_argument("--cases", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations, days=args.days)
+    engine = dataset_engine(spec)
+    session = sessionmaker(bind=engine)()
+    try:
+        builds = []
+        for version in range(1, args.builds + 1):
+            started = time.perf_counter()
+            snapshot = ReferenceSnapshot.build(session, version)
+            builds.append(time.perf_counter() - started)
+        print(f"snapshot of {len(snapshot.restaurant_ids)} restaurants, {len(snapshot.table_ids)} tables, "
+              f"{len(snapshot.diner_ids)} of {spec.diners} diners with restrictions")
+        print(f"build: best {min(builds):.2f}s, worst {max(builds):.2f}s over {args.builds}")
+        reference_data = ReferenceData(snapshot)
+        started = time.perf_counter()
+        reference_data.changed(session)
+        print(f"fingerprint check: {(time.perf_counter() - started) * 1000:.0f}ms")
+
+        started = time.perf_counter()
+        dict_reference(session)
+        dict_build = time.perf_counter() - started
+        print(f"memory_bytes: {snapshot.memory_bytes() / 2 ** 20:.1f} MiB")
+        print(f"tracemalloc, snapshot: {traced_size(lambda: ReferenceSnapshot.build(session)) / 2 ** 20:.1f} MiB")
+        print(f"tracemalloc, dicts:    {traced_size(lambda: dict_reference(session)) / 2 ** 20:.1f} MiB "
+              f"(built in {dict_build:.2f}s)")
+
+        time_operations(session, spec, None, args, "sql")
+        time_operations(session, spec, reference_data, args, "reference")
+    finally:
+        session.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
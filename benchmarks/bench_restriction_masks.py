@@ -0,0 +1,76 @@
+"""
+Dietary restriction filter: per-restriction EXISTS vs restriction bitmasks.
+
+    python -m benchmarks.bench_restriction_masks --restaurants 100000
+
+Every variant returns the ids of the restaurants endorsing all restrictions of a random group:
+    exists   one correlated EXISTS per restriction of the group (the original search)
+    sql mask restaurant_mask & group_mask = group_mask in SQL
+    numpy    the same test vectorized over RestaurantMasks, plain Python when NumPy is missing
+"""
+import argparse
+import logging
+
+from sqlalchemy import and_, exists, select
+from sqlalchemy.orm import sessionmaker
+
+from app.models.db import Restaurant, diner_dietary_restriction_association, restaurant_dietary_restriction_association
+from app.reservations import restriction_masks
+from app.reservations.restriction_masks import RestaurantMasks, diner_group_mask
+from app.reservations.search import satisfies_group
+from .dataset import DatasetSpec, dataset_engine, random_groups
+from .timing import format_row, measure
+
+
+def exists_filter(session, diner_ids):
+    restriction_ids = session.execute(
+        select(diner_dietary_restriction_association.c.dietary_restriction_id)
+        .where(diner_dietary_restriction_association.c.diner_id.in_(diner_ids)).distinct()
+    ).scalars().all()
+    return session.execute(select(Restaurant.id).where(and_(*[
+        exists().where(
+            restaurant_dietary_restriction_association.c.restaurant_id == Restaurant.id,
+            restaurant_dietary_restriction_association.c.dietary_restriction_id == restriction_id
+        ) for restriction_id in restriction_ids
+    ])).order_by(Restaurant.id)).scalars().all()
+
+
+def sql_mask_filter(session, diner_ids):
+    group_mask = diner_group_mask(session, diner_ids)
+    return session.execute(
+        select(Restaurant.id).where(satisfies_group(Restaurant.dietary_restriction_mask, group_mask)).order_by(Restaurant.id)
+    ).scalars().all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=100_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=10_000, days=7)
+    session = sessionmaker(bind=dataset_engine(spec, rebuild=args.rebuild))()
+    # Groups with at least one restriction, unrestricted groups match every restaurant whatever the filter
+    groups = [group for group in random_groups(spec, args.searches * 4) if diner_group_mask(session, group)][:args.searches]
+
+    masks = RestaurantMasks.load(session)
+    mismatches = sum(
+        exists_filter(session, group) != sql_mask_filter(session, group)
+        or sql_mask_filter(session, group) != masks.matching(diner_group_mask(session, group))
+        for group in groups
+    )
+
+    print(f"restriction filter: {args.restaurants} restaurants, {len(groups)} restricted groups")
+    print(format_row("exists per restriction", measure(lambda group: exists_filter(session, group), groups)))
+    print(format_row("sql mask", measure(lambda group: sql_mask_filter(session, group), groups)))
+    group_masks = [diner_group_mask(session, group) for group in groups]
+    print(format_row("numpy mask" if restriction_masks.numpy is not None else "python mask (no numpy)",
+                     measure(masks.matching, group_masks)))
+    print(f"result mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
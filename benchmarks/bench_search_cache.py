@@ -0,0 +1,77 @@
+"""
+find_available_restaurant with and without the SearchCache in front of it.
+
+    python -m benchmarks.bench_search_cache --restaurants 10000 --reservations 1000000
+
+Searches are drawn from a pool of --distinct (group, slot) pairs so popular ones repeat, and every
+--write-every searches a reservation is booked or the previous one deleted through the cached
+manager, invalidating what it overlaps. Reports latency for both managers, the hit ratio and the
+cache counters. Every booking is deleted again so the cached dataset file is left as it was.
+"""
+import argparse
+import logging
+import random
+
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.reservations.reservation_manager import ReservationManager
+from app.reservations.search_cache import SearchCache
+from .dataset import DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import format_row, measure
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=10_000)
+    parser.add_argument("--reservations", type=int, default=1_000_000)
+    parser.add_argument("--diners", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=50)
+    parser.add_argument("--write-every", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=args.diners, reservations=args.reservations)
+    session = sessionmaker(bind=dataset_engine(spec))()
+    pool = [ReservationRequest(diner_ids=diner_ids, start_time=start_time)
+            for diner_ids, start_time in zip(random_groups(spec, args.distinct), random_slots(spec, args.distinct))]
+    rng = random.Random(11)
+    # Skewed towards the first requests of the pool, like popular times and groups
+    cases = [pool[min(int(rng.expovariate(5 / args.distinct)), args.distinct - 1)] for _ in range(args.searches)]
+
+    uncached = ReservationManager(session=session)
+    cache = SearchCache()
+    cached = ReservationManager(session=session, search_cache=cache)
+    booked = []
+    searched = 0
+
+    def search_and_write(case: ReservationRequest) -> None:
+        nonlocal searched
+        cached.find_available_restaurant(case)
+        searched += 1
+        if searched % args.write_every:
+            return
+        if booked:
+            cached.delete_reservation(booked.pop())
+            return
+        reservation = cached.book_reservation(AvailableReservationRequest(
+            diner_ids=[args.diners - searched % args.diners], start_time=case.start_time,
+            restaurant_id=rng.randint(1, args.restaurants)
+        ))
+        if reservation:
+            booked.append(reservation.id)
+
+    print(f"find_available_restaurant: {args.restaurants} restaurants, {args.reservations} reservations, "
+          f"{args.distinct} distinct searches, a write every {args.write_every}")
+    print(format_row("uncached", measure(uncached.find_available_restaurant, cases)))
+    print(format_row("cached, with writes", measure(search_and_write, cases, warmup=0)))
+    for reservation_id in booked:
+        cached.delete_reservation(reservation_id)
+
+    stats = cache.stats()
+    print(f"hit ratio: {stats['hits'] / max(1, stats['hits'] + stats['misses']):.2f}, counters: {stats}")
+
+
+if __name__ == "__main__":
+    main()
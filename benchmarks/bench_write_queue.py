@@ -0,0 +1,103 @@
+"""
+Booking throughput with each request committing on its own against the single-writer queue.
+
+    python -m benchmarks.bench_write_queue --writers 1 16 128 --bookings 2000
+
+Concurrent coroutines book through AsyncReservationManager as the endpoint does, each with its own
+session from the app's default pool (5 + 10 overflow), on a fresh SQLite file in WAL mode. The
+"session" path runs book_atomically per request, one BEGIN IMMEDIATE and commit each; the "queue"
+path hands every booking to one WriteQueue. Run once per --synchronous setting: with FULL every
+commit is an fsync, with NORMAL in WAL mode only checkpoints are. Afterwards the file is checked
+for a table or diner holding two overlapping reservations.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.api.requests import AvailableReservationRequest
+from app.models.async_db import create_async_db_engine
+from app.models.config import DatabaseSettings
+from app.models.db import create_db_engine
+from app.reservations.async_reservation_manager import AsyncReservationManager
+from app.reservations.write_queue import WriteQueue
+from .bench_concurrent_booking import DINER_OVERLAPS, TABLE_OVERLAPS, seed
+
+
+RESTAURANTS = 40
+DINERS = 3000
+SLOTS = [datetime(2030, 1, 1, 17) + timedelta(days=day, hours=hour) for day in range(30) for hour in range(0, 6, 2)]
+
+
+async def book_concurrently(settings: DatabaseSettings, writers: int, bookings: int, queued: bool,
+                            seed_value: int = 42) -> Dict[str, float]:
+    engine = create_async_db_engine(settings)
+    Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+    queue = WriteQueue(engine) if queued else None
+    outcomes = Counter()
+    per_writer = bookings // writers
+
+    async def writer(number: int) -> None:
+        rng = random.Random(seed_value + number)
+        for _ in range(per_writer):
+            request = AvailableReservationRequest(
+                start_time=rng.choice(SLOTS), diner_ids=rng.sample(range(1, DINERS + 1), rng.randint(1, 4)),
+                restaurant_id=rng.randint(1, RESTAURANTS)
+            )
+            async with Session() as session:
+                try:
+                    reservation = await AsyncReservationManager(session=session, write_queue=queue).book_reservation(request)
+                    outcomes["booked" if reservation else "no_table"] += 1
+                except HTTPException as e:
+                    outcomes[{409: "diner_conflict", 503: "gave_up"}.get(e.status_code, str(e.status_code))] += 1
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(number) for number in range(writers)))
+        elapsed = time.perf_counter() - started
+        if queue is not None:
+            await queue.close()
+            outcomes["batches"] = queue.batches
+    finally:
+        await engine.dispose()
+    return {**outcomes, "seconds": elapsed, "bookings_per_second": per_writer * writers / elapsed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--bookings", type=int, default=2000)
+    parser.add_argument("--synchronous", nargs="+", default=["normal", "full"])
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    for synchronous in args.synchronous:
+        for writers in args.writers:
+            for queued in (False, True):
+                path = os.path.join(tempfile.mkdtemp(), 'writes.db')
+                settings = DatabaseSettings(url=f"sqlite:///{path}", synchronous=synchronous)
+                engine = create_db_engine(settings)
+                seed(engine, restaurants=RESTAURANTS, tables=6, diners=DINERS)
+                result = asyncio.run(book_concurrently(settings, writers, args.bookings, queued))
+                with engine.connect() as connection:
+                    result["table_overlaps"] = connection.execute(text(TABLE_OVERLAPS)).scalar()
+                    result["diner_overlaps"] = connection.execute(text(DINER_OVERLAPS)).scalar()
+                engine.dispose()
+                label = f"{synchronous:<6} {writers:>3} writers, {'queue' if queued else 'session'}"
+                print(f"{label:<28} " + ", ".join(
+                    f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}" for key, value in result.items()
+                ))
+
+
+if __name__ == "__main__":
+    main()
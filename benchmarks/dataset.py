@@ -0,0 +1,160 @@
+"""
+Seeded synthetic datasets for the benchmarks.
+Rows are written with Core executemany inserts so that millions of reservations load in seconds.
+"""
+import os
+import random
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import Engine
+
+from app.models.db import (
+    Base, DietaryRestriction, Diner, Reservation, Restaurant, RestaurantTable,
+    diner_dietary_restriction_association, diner_reservation_association,
+    restaurant_dietary_restriction_association
+)
+from app.models.migrations import LATEST_VERSION, create_schema
+
+
+RESTRICTION_NAMES = ["Nut-Free", "Paleo", "Gluten-Free", "Vegetarian", "Vegan"]
+TABLE_CAPACITIES = [2, 2, 2, 4, 4, 6, 6]
+SLOT_HOURS = [11, 13, 15, 17, 19, 21]
+FIRST_DAY = datetime(2024, 8, 1)
+# (latitude range, longitude range) restaurants and diner homes are spread over, Mexico City like the seed data
+CITY_AREA = ((19.30, 19.50), (-99.25, -99.05))
+CHUNK_SIZE = 50_000
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    restaurants: int = 10_000
+    diners: int = 10_000
+    reservations: int = 1_000_000
+    days: int = 60
+    diners_per_reservation: int = 0
+    seed: int = 42
+
+    @property
+    def file_name(self) -> str:
+        return (f"bench-r{self.restaurants}-d{self.diners}-res{self.reservations}"
+                f"-days{self.days}-dpr{self.diners_per_reservation}-s{self.seed}-v{LATEST_VERSION}.db")
+
+
+def _chunks(rows: Iterator[dict], size: int = CHUNK_SIZE) -> Iterator[List[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert(engine: Engine, table, rows: Iterator[dict]) -> None:
+    with engine.begin() as connection:
+        for chunk in _chunks(rows):
+            connection.execute(insert(table), chunk)
+
+
+def slot_start(day: int, slot: int) -> datetime:
+    return FIRST_DAY + timedelta(days=day, hours=SLOT_HOURS[slot])
+
+
+def diner_reservations(rng: random.Random, spec: DatasetSpec, bookings: List[tuple]) -> Iterator[dict]:
+    """Seats random diners, never giving one diner two reservations in the same slot"""
+    busy = set()
+    for reservation_id, (_, day, slot) in enumerate(bookings, start=1):
+        start_datetime = slot_start(day, slot)
+        seated = attempts = 0
+        while seated < spec.diners_per_reservation and attempts < 100 * spec.diners_per_reservation:
+            attempts += 1
+            diner_id = rng.randint(1, spec.diners)
+            if (diner_id, day, slot) in busy:
+                continue
+            busy.add((diner_id, day, slot))
+            seated += 1
+            yield {"diner_id": diner_id, "reservation_id": reservation_id, "start_datetime": start_datetime,
+                   "end_datetime": start_datetime + timedelta(hours=2)}
+
+
+def build_dataset(engine: Engine, spec: DatasetSpec) -> None:
+    """Creates the schema and fills it deterministically from spec.seed"""
+    rng = random.Random(spec.seed)
+    # Locations draw from their own generator, so the rest of a seed's dataset stays as it was
+    places = random.Random(spec.seed + 1)
+    restriction_ids = list(range(1, len(RESTRICTION_NAMES) + 1))
+    Base.metadata.drop_all(engine)
+    create_schema(engine)
+
+    _insert(engine, DietaryRestriction.__table__,
+            ({"id": id, "name": name} for id, name in zip(restriction_ids, RESTRICTION_NAMES)))
+    _insert(engine, Restaurant.__table__,
+            ({"id": id, "name": f"Restaurant {id}", "latitude": places.uniform(*CITY_AREA[0]),
+              "longitude": places.uniform(*CITY_AREA[1])} for id in range(1, spec.restaurants + 1)))
+    _insert(engine, restaurant_dietary_restriction_association, (
+        {"restaurant_id": restaurant_id, "dietary_restriction_id": restriction_id}
+        for restaurant_id in range(1, spec.restaurants + 1)
+        for restriction_id in rng.sample(restriction_ids, rng.randint(0, len(restriction_ids)))
+    ))
+    _insert(engine, RestaurantTable.__table__, (
+        {"restaurant_id": restaurant_id, "capacity": capacity}
+        for restaurant_id in range(1, spec.restaurants + 1)
+        for capacity in TABLE_CAPACITIES
+    ))
+    _insert(engine, Diner.__table__,
+            ({"id": id, "name": f"Diner {id}", "home_latitude": places.uniform(*CITY_AREA[0]),
+              "home_longitude": places.uniform(*CITY_AREA[1])} for id in range(1, spec.diners + 1)))
+    _insert(engine, diner_dietary_restriction_association, (
+        {"diner_id": diner_id, "dietary_restriction_id": restriction_id}
+        for diner_id in range(1, spec.diners + 1)
+        for restriction_id in rng.sample(restriction_ids, rng.choice([0, 0, 0, 1, 1, 2]))
+    ))
+
+    table_count = spec.restaurants * len(TABLE_CAPACITIES)
+    booked = set()
+    while len(booked) < min(spec.reservations, table_count * spec.days * len(SLOT_HOURS)):
+        booked.add((rng.randint(1, table_count), rng.randrange(spec.days), rng.randrange(len(SLOT_HOURS))))
+    bookings = sorted(booked)
+
+    def reservations():
+        for id, (table_id, day, slot) in enumerate(bookings, start=1):
+            start_datetime = slot_start(day, slot)
+            yield {"id": id, "table_id": table_id, "start_datetime": start_datetime,
+                   "end_datetime": start_datetime + timedelta(hours=2)}
+
+    _insert(engine, Reservation.__table__, reservations())
+    if spec.diners_per_reservation:
+        _insert(engine, diner_reservation_association, diner_reservations(rng, spec, bookings))
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+
+def dataset_engine(spec: DatasetSpec, directory: str = None, rebuild: bool = False) -> Engine:
+    """Returns an engine on a cached dataset file, building it on first use"""
+    directory = directory or os.environ.get("BENCHMARK_DATA_DIR", "/tmp/nelo-benchmarks")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, spec.file_name)
+    exists = os.path.exists(path)
+    engine = create_engine(f"sqlite:///{path}")
+    if rebuild or not exists:
+        started = time.perf_counter()
+        logging.info(f"Building benchmark dataset {path}")
+        build_dataset(engine, spec)
+        logging.info(f"Built dataset in {time.perf_counter() - started:.1f}s")
+    return engine
+
+
+def random_groups(spec: DatasetSpec, count: int, max_size: int = 6, seed: int = 7) -> List[List[int]]:
+    rng = random.Random(seed)
+    return [rng.sample(range(1, spec.diners + 1), rng.randint(1, max_size)) for _ in range(count)]
+
+
+def random_slots(spec: DatasetSpec, count: int, seed: int = 11) -> List[datetime]:
+    rng = random.Random(seed)
+    return [slot_start(rng.randrange(spec.days), rng.randrange(len(SLOT_HOURS))) for _ in range(count)]
@@ -0,0 +1,164 @@
+"""
+Load test of the sync (threadpool) and async request paths.
+
+    python -m benchmarks.load_test --clients 1 50 500 --requests 2000
+
+Each variant runs in its own uvicorn process on a seeded SQLite file:
+    sync   the handlers as plain `def` on ReservationManager, as before the async path (sync_app below)
+    async  app.main:app, `async def` handlers on AsyncReservationManager and aiosqlite
+Clients are asyncio tasks sharing one httpx.AsyncClient. Each sends search requests, plus
+bookings on free future dates when --book-ratio is set, and p50/p99 latency and requests/sec
+are reported per variant and concurrency.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import timedelta
+from typing import Dict, List
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, status
+from sqlalchemy.orm.session import Session
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.api.responses import ReservationResponse, RestaurantResponse
+from app.models.db import get_session
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import DatasetSpec, dataset_engine, random_groups, random_slots
+
+
+VARIANTS = {"sync": "benchmarks.load_test:sync_app", "async": "app.main:app"}
+
+sync_app = FastAPI()
+
+
+@sync_app.post("/find_reservation/", status_code=status.HTTP_200_OK)
+def sync_find_available_tables(request: ReservationRequest, session: Session = Depends(get_session)):
+    results = ReservationManager(session=session).find_available_restaurant(request)
+    return [RestaurantResponse(id=result.id, restaurant_name=result.name) for result in results]
+
+
+@sync_app.post("/book_restaurant/", status_code=status.HTTP_201_CREATED)
+def sync_book_table(available_reservation_request: AvailableReservationRequest, session: Session = Depends(get_session)):
+    reservation = ReservationManager(session=session).book_reservation(available_reservation_request)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="No available table found")
+    return ReservationResponse(id=reservation.id, restaurant_id=available_reservation_request.restaurant_id,
+                               diner_ids=available_reservation_request.diner_ids)
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(variant: str, database_path: str, port: int, pool_size: int) -> subprocess.Popen:
+    environment = {
+        **os.environ,
+        "BOOKING_DB_URL": f"sqlite:///{database_path}",
+        "BOOKING_DB_POOL_SIZE": str(pool_size),
+        "BOOKING_DB_MAX_OVERFLOW": "0",
+        "PYTHONPATH": os.pathsep.join([os.getcwd(), os.environ.get("PYTHONPATH", "")]),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", VARIANTS[variant], "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{variant} server did not start on port {port}")
+
+
+def payloads(spec: DatasetSpec, count: int, book_ratio: float, seed: int = 5) -> List[tuple]:
+    """(path, json) pairs, bookings go to days after the seeded ones so they do not conflict"""
+    rng = random.Random(seed)
+    requests = []
+    for number, (diner_ids, start_time) in enumerate(zip(random_groups(spec, count), random_slots(spec, count))):
+        if rng.random() < book_ratio:
+            start_time = start_time + timedelta(days=spec.days + number)
+            requests.append(("/book_restaurant/", {"start_time": start_time.isoformat(), "diner_ids": diner_ids,
+                                                   "restaurant_id": rng.randint(1, spec.restaurants)}))
+        else:
+            requests.append(("/find_reservation/", {"start_time": start_time.isoformat(), "diner_ids": diner_ids}))
+    return requests
+
+
+async def drive(port: int, clients: int, requests: List[tuple]) -> Dict[str, float]:
+    queue = list(reversed(requests))
+    latencies, failures = [], 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+        async def worker() -> None:
+            nonlocal failures
+            while queue:
+                path, payload = queue.pop()
+                started = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    failures += response.status_code >= 500
+                except httpx.TransportError:
+                    failures += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "failures": failures,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "requests_per_second": len(latencies) / elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--requests", type=int, default=2000, help="per variant and concurrency level")
+    parser.add_argument("--variants", nargs="+", choices=sorted(VARIANTS), default=["sync", "async"])
+    parser.add_argument("--book-ratio", type=float, default=0.0)
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--restaurants", type=int, default=1000)
+    parser.add_argument("--reservations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    spec = DatasetSpec(restaurants=args.restaurants, diners=10_000, reservations=args.reservations, days=30)
+    engine = dataset_engine(spec)
+    database_path = engine.url.database
+    engine.dispose()
+
+    print(f"{'variant':<8} {'clients':>7} {'requests':>8} {'failures':>8} {'p50':>10} {'p99':>10} {'req/s':>8}")
+    for variant in args.variants:
+        port = free_port()
+        server = start_server(variant, database_path, port, args.pool_size)
+        try:
+            for clients in args.clients:
+                result = asyncio.run(drive(port, clients, payloads(spec, args.requests, args.book_ratio, seed=clients)))
+                print(f"{variant:<8} {clients:>7} {result['requests']:>8} {result['failures']:>8} "
+                      f"{result['p50_ms']:>8.1f}ms {result['p99_ms']:>8.1f}ms {result['requests_per_second']:>8.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
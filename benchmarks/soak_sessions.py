@@ -0,0 +1,95 @@
+"""
+Soak test for the per-request session lifecycle.
+
+    python -m benchmarks.soak_sessions --requests 100000
+
+Drives the FastAPI app in-process against a seeded SQLite file and samples traced Python memory,
+pool checkouts of the async request engine and the number of DBAPI connections ever opened.
+All three should stay flat.
+"""
+import argparse
+import gc
+import logging
+import os
+import resource
+import tempfile
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.main import app as booking_app
+from app.models import async_db, db
+from app.models.config import DatabaseSettings
+from app.models.db import Base, Diner, Restaurant, RestaurantTable
+
+
+def seed(engine: Engine) -> None:
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    restaurant = Restaurant(name="Soak Restaurant")
+    session.add_all([Diner(name="Soak Diner 1"), Diner(name="Soak Diner 2"), restaurant])
+    session.flush()
+    session.add(RestaurantTable(restaurant_id=restaurant.id, capacity=4))
+    session.commit()
+    session.close()
+
+
+def soak(engine: AsyncEngine, requests: int, sample_every: int, trace_memory: bool = True) -> List[Dict[str, float]]:
+    """
+    Replays search requests through the app, returning one sample per sample_every requests.
+    tracemalloc is precise but slows every request down, peak RSS is always recorded.
+    """
+    opened = []
+    event.listen(engine.sync_engine, "connect", lambda *args: opened.append(1))
+    original_factories = async_db.AsyncSessionLocal, async_db.AsyncReadSessionLocal
+    async_db.AsyncSessionLocal = async_db.AsyncReadSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+    samples = []
+    try:
+        client = TestClient(booking_app)
+        payload = {"start_time": datetime(2024, 8, 24, 19).isoformat(), "diner_ids": [1, 2]}
+        if trace_memory:
+            tracemalloc.start()
+        for request_number in range(1, requests + 1):
+            response = client.post("/find_reservation/", json=payload)
+            assert response.status_code == 200, response.text
+            if request_number % sample_every == 0:
+                gc.collect()
+                samples.append({
+                    "requests": request_number,
+                    "traced_kb": tracemalloc.get_traced_memory()[0] / 1024 if trace_memory else 0.0,
+                    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    "checked_out": engine.sync_engine.pool.checkedout(),
+                    "connections_opened": len(opened),
+                })
+    finally:
+        tracemalloc.stop()
+        async_db.AsyncSessionLocal, async_db.AsyncReadSessionLocal = original_factories
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--sample-every", type=int, default=10_000)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    directory = tempfile.mkdtemp()
+    settings = DatabaseSettings(url=f"sqlite:///{os.path.join(directory, 'soak.db')}")
+    seed(db.create_db_engine(settings))
+    engine = async_db.create_async_db_engine(settings)
+    for sample in soak(engine, args.requests, args.sample_every, trace_memory=args.trace_memory):
+        print(f"requests={sample['requests']:<7} traced={sample['traced_kb']:9.1f}KB "
+              f"max_rss={sample['max_rss_kb']}KB "
+              f"checked_out={sample['checked_out']} connections_opened={sample['connections_opened']}")
+
+
+if __name__ == "__main__":
+    main()
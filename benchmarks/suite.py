@@ -0,0 +1,213 @@
+"""
+Benchmark suite for the reservation hot paths, with a stored baseline to catch regressions.
+
+    python -m benchmarks.suite                                  # small and medium, compared to baseline.json
+    python -m benchmarks.suite --scales large --output large.json
+    python -m benchmarks.suite --update-baseline                # after an intended change
+
+For every scale and calendar, find_available_restaurant, book_reservation and delete_reservation
+run through ReservationManager on a private copy of a seeded SQLite dataset, so runs are offline
+and reproducible and the cached datasets are never written to. Calendars are
+    empty    no reservations at all
+    booked   BOOKED_OCCUPANCY of every table slot taken, with diners seated on them
+Each result records latency percentiles and the most statements any single call executed.
+The run fails when a call executes more statements than in the baseline, or when its p50 is
+slower than the baseline by more than --latency-tolerance and --latency-floor-ms together.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.reservations.reservation_manager import ReservationManager
+from .dataset import SLOT_HOURS, TABLE_CAPACITIES, DatasetSpec, dataset_engine, random_groups, random_slots
+from .timing import measure
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+BOOKED_OCCUPANCY = 0.6
+# 100 diners per restaurant keeps about 4% of them seated in any booked slot, like a real city
+SCALES = {
+    "tiny": DatasetSpec(restaurants=20, diners=2_000, reservations=0, days=7, diners_per_reservation=1),
+    "small": DatasetSpec(restaurants=100, diners=10_000, reservations=0, days=14, diners_per_reservation=1),
+    "medium": DatasetSpec(restaurants=1_000, diners=100_000, reservations=0, days=14, diners_per_reservation=1),
+    "large": DatasetSpec(restaurants=10_000, diners=1_000_000, reservations=0, days=7, diners_per_reservation=1),
+}
+CALENDARS = ("empty", "booked")
+
+
+def calendar_spec(scale: str, calendar: str) -> DatasetSpec:
+    spec = SCALES[scale]
+    if calendar == "empty":
+        return spec
+    slots = spec.restaurants * len(TABLE_CAPACITIES) * spec.days * len(SLOT_HOURS)
+    return replace(spec, reservations=int(slots * BOOKED_OCCUPANCY))
+
+
+class StatementCounter:
+    """Counts the statements an engine executes, per call of the wrapped function"""
+    def __init__(self, engine: Engine) -> None:
+        self.count = 0
+        self.per_call: List[int] = []
+        event.listen(engine, "before_cursor_execute", self._executed)
+
+    def _executed(self, *args) -> None:
+        self.count += 1
+
+    def wrap(self, call: Callable) -> Callable:
+        def counted(case):
+            before = self.count
+            try:
+                return call(case)
+            finally:
+                self.per_call.append(self.count - before)
+        return counted
+
+    def take(self) -> List[int]:
+        per_call, self.per_call = self.per_call, []
+        return per_call
+
+
+def run_calendar(scale: str, calendar: str, operations: int, directory: str) -> Dict[str, dict]:
+    """Times every operation on a copy of the dataset, returns {"scale/calendar/operation": result}"""
+    spec = calendar_spec(scale, calendar)
+    source = dataset_engine(spec)
+    path = os.path.join(directory, f"{scale}-{calendar}.db")
+    shutil.copyfile(source.url.database, path)
+    source.dispose()
+
+    engine = create_engine(f"sqlite:///{path}")
+    counter = StatementCounter(engine)
+    session = sessionmaker(bind=engine)()
+    manager = ReservationManager(session=session)
+    groups, slots = random_groups(spec, operations, max_size=4), random_slots(spec, operations)
+    outcomes = {"booked": 0, "no_table": 0, "conflict": 0}
+    booked: List[int] = []
+
+    def find(case):
+        return manager.find_available_restaurant(ReservationRequest(start_time=case[1], diner_ids=case[0]))
+
+    def book(case):
+        # Spread over restaurants, every slot is one of the seeded ones so booked calendars are contended
+        number, (diner_ids, start_time) = case
+        try:
+            reservation = manager.book_reservation(AvailableReservationRequest(
+                start_time=start_time, diner_ids=diner_ids, restaurant_id=1 + number * 7919 % spec.restaurants
+            ))
+        except HTTPException:
+            session.rollback()
+            outcomes["conflict"] += 1
+            return
+        if reservation is None:
+            outcomes["no_table"] += 1
+            return
+        outcomes["booked"] += 1
+        booked.append(reservation.id)
+
+    def delete(reservation_id):
+        manager.delete_reservation(reservation_id)
+
+    results = {}
+    try:
+        for operation, call, cases, warmup in (
+            ("find", find, list(zip(groups, slots)), 1),
+            ("book", book, list(enumerate(zip(groups, slots))), 0),
+            ("delete", delete, booked, 0),
+        ):
+            stats = measure(counter.wrap(call), cases, warmup=warmup)
+            per_call = counter.take()
+            results[f"{scale}/{calendar}/{operation}"] = {
+                **{name: round(value, 3) for name, value in stats.items() if name != "runs"},
+                "runs": stats["runs"],
+                "queries_max": max(per_call, default=0),
+                "reservations": spec.reservations,
+            }
+        results[f"{scale}/{calendar}/book"]["outcomes"] = outcomes
+    finally:
+        session.close()
+        engine.dispose()
+    return results
+
+
+def run_suite(scales: List[str], calendars: List[str] = CALENDARS, operations: int = 50) -> Dict[str, dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for scale in scales:
+            for calendar in calendars:
+                results.update(run_calendar(scale, calendar, operations, directory))
+        return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], latency_tolerance: float = 0.5,
+            latency_floor_ms: float = 2.0) -> List[str]:
+    """Regressions of results against baseline, results missing from either side are not compared"""
+    regressions = []
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result["queries_max"] > expected["queries_max"]:
+            regressions.append(f"{key}: {result['queries_max']} statements per call, baseline {expected['queries_max']}")
+        slower = result["p50_ms"] - expected["p50_ms"]
+        if result["p50_ms"] > expected["p50_ms"] * (1 + latency_tolerance) and slower > latency_floor_ms:
+            regressions.append(f"{key}: p50 {result['p50_ms']:.2f}ms, baseline {expected['p50_ms']:.2f}ms")
+    return regressions
+
+
+def load_baseline(path: str) -> Optional[Dict[str, dict]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    parser.add_argument("--calendars", nargs="+", choices=CALENDARS, default=list(CALENDARS))
+    parser.add_argument("--operations", type=int, default=50, help="calls per operation, scale and calendar")
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="merge these results into the baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5, help="allowed p50 slowdown, 0.5 is +50%%")
+    parser.add_argument("--latency-floor-ms", type=float, default=2.0, help="p50 slowdowns below this never fail")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    results = run_suite(args.scales, args.calendars, args.operations)
+    for key, result in results.items():
+        print(f"{key:<24} p50={result['p50_ms']:9.2f}ms p95={result['p95_ms']:9.2f}ms "
+              f"statements={result['queries_max']:<3} runs={result['runs']}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    baseline = load_baseline(args.baseline) or {}
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({**baseline, **results}, baseline_file, indent=2, sort_keys=True)
+        print(f"baseline updated: {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.latency_tolerance, args.latency_floor_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
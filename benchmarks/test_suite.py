@@ -0,0 +1,44 @@
+import pytest
+
+from benchmarks.suite import BASELINE_PATH, compare, load_baseline, run_suite
+
+
+RESULT = {"p50_ms": 10.0, "queries_max": 3}
+
+
+@pytest.fixture(scope='module')
+def tiny_results(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("BENCHMARK_DATA_DIR", str(tmp_path_factory.mktemp("suite")))
+        return run_suite(["tiny"], operations=10)
+
+
+class TestCompare:
+    def test__compare__flags_more_statements(self):
+        assert compare({"s/c/find": {**RESULT, "queries_max": 4}}, {"s/c/find": RESULT}) == [
+            "s/c/find: 4 statements per call, baseline 3"
+        ]
+
+    @pytest.mark.parametrize("p50_ms, regressed", [(14.9, False), (15.1, False), (16.0, True)])
+    def test__compare__flags_latency_past_tolerance_and_floor(self, p50_ms, regressed):
+        # +50% of 10ms is 15ms, and the 5.5ms floor still lets 15.1ms through
+        regressions = compare({"s/c/find": {**RESULT, "p50_ms": p50_ms}}, {"s/c/find": RESULT},
+                              latency_tolerance=0.5, latency_floor_ms=5.5)
+        assert bool(regressions) == regressed
+
+    def test__compare__ignores_results_missing_from_the_baseline(self):
+        assert compare({"s/c/find": {**RESULT, "queries_max": 99}}, {}) == []
+
+
+class TestSuite:
+    def test__run_suite__covers_every_operation_and_calendar(self, tiny_results):
+        assert sorted(tiny_results) == sorted(
+            f"tiny/{calendar}/{operation}" for calendar in ("empty", "booked") for operation in ("find", "book", "delete")
+        )
+        assert tiny_results["tiny/empty/book"]["outcomes"]["booked"] == 10
+        assert tiny_results["tiny/booked/find"]["reservations"] > 0
+
+    def test__run_suite__statement_counts_match_the_baseline(self, tiny_results):
+        # Latency depends on the machine, statement counts do not
+        regressions = compare(tiny_results, load_baseline(BASELINE_PATH), latency_tolerance=float("inf"))
+        assert regressions == []
@@ -0,0 +1,35 @@
+import statistics
+import time
+from typing import Callable, Dict, Iterable, List
+
+
+def measure(call: Callable, cases: Iterable, warmup: int = 1) -> Dict[str, float]:
+    """Runs call(case) for every case and returns latency percentiles in milliseconds"""
+    cases = list(cases)
+    for case in cases[:warmup]:
+        call(case)
+
+    timings = []
+    for case in cases:
+        started = time.perf_counter()
+        call(case)
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    """Percentiles of latencies already measured in milliseconds"""
+    timings = sorted(timings)
+    return {
+        "runs": len(timings),
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        "max_ms": timings[-1],
+    }
+
+
+def format_row(name: str, stats: Dict[str, float]) -> str:
+    return (f"{name:<32} runs={stats['runs']:<5} mean={stats['mean_ms']:9.2f}ms "
+            f"p50={stats['p50_ms']:9.2f}ms p95={stats['p95_ms']:9.2f}ms")
@@ -1,15 +1,84 @@
+"""
+Database fixtures for tests.
+
+test_session is an empty schema per test. Tests that need realistic volumes share a template
+instead: TEMPLATE_SPEC's seeded dataset, built once and cached as a file like the benchmarks'
+(under BENCHMARK_DATA_DIR), so later runs only open it. A module needing another size sets a
+TEMPLATE_SPEC of its own, every test of the module then gets that template. Each test gets either
+
+    template_copy     an in-memory copy of the template through SQLite's backup API, for tests
+                      that write like the app does, BEGIN IMMEDIATE and commits included
+    template_file     the same copy as a file in the test's tmp_path, for tests opening engines of
+                      their own on it: aiosqlite, several connections or other processes
+    template_session  a session on the template itself inside a transaction rolled back after
+                      the test; its commits only release a SAVEPOINT, so nothing reaches the file
+
+Import just the fixtures a test uses, e.g.
+    from common.tests.db_setup import template_copy
+template_engine is the template itself, for tests checking it was left as it was.
+"""
+from typing import Dict, Optional
+
 import pytest
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
 from app.models.db import Base
+from app.models.migrations import create_schema
+from benchmarks.dataset import DatasetSpec, dataset_engine
+
+
+TEMPLATE_SPEC = DatasetSpec(restaurants=1000, diners=10_000, reservations=100_000, days=14, diners_per_reservation=2)
+
+
+def copy_database(source: Engine, path: Optional[str] = None) -> Engine:
+    """
+    An engine on a copy of source, in memory unless a file path is given. The in-memory copy lives
+    on the engine's single connection, so every session of the engine sees the same database.
+    """
+    if path is None:
+        target = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    else:
+        target = create_engine(f"sqlite:///{path}")
+    with source.connect() as source_connection, target.connect() as target_connection:
+        source_connection.connection.driver_connection.backup(target_connection.connection.driver_connection)
+    return target
+
+
+_empty_schema: Optional[Engine] = None
+
+
+def empty_schema_copy() -> Engine:
+    """The latest schema without rows, created once per process and copied from then on"""
+    global _empty_schema
+    if _empty_schema is None:
+        _empty_schema = create_engine('sqlite://', poolclass=StaticPool)
+        create_schema(_empty_schema)
+    return copy_database(_empty_schema)
+
+
+_templates: Dict[DatasetSpec, Engine] = {}
+
+
+def template_database(spec: DatasetSpec = TEMPLATE_SPEC) -> Engine:
+    """A seeded template, built on first use and read from its cached file afterwards, opened once per process"""
+    if spec not in _templates:
+        _templates[spec] = dataset_engine(spec)
+    return _templates[spec]
+
+
+def module_template(request: pytest.FixtureRequest) -> Engine:
+    """The template of the requesting test's module, its own TEMPLATE_SPEC or the shared one"""
+    return template_database(getattr(request.module, 'TEMPLATE_SPEC', TEMPLATE_SPEC))
 
 
 @pytest.fixture(scope='function')
 def test_session():
     """Returns an SQLAlchemy session, and after the test tears down everything properly."""
-    # Use an in-memory SQLite database for testing
-    engine = create_engine('sqlite:///:memory:')
-    Base.metadata.create_all(engine)
+    # A fresh in-memory database with every table, index and trigger
+    engine = empty_schema_copy()
 
     connection = engine.connect()
     transaction = connection.begin()
@@ -24,4 +93,45 @@ def test_session():
     session.close()
     transaction.rollback()
     connection.close()
-    
\ No newline at end of file
+    engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def template_engine(request):
+    """The template itself, for tests checking what the others left of it"""
+    return module_template(request)
+
+
+@pytest.fixture(scope='function')
+def template_copy(request):
+    """An engine on this test's own in-memory copy of the template"""
+    engine = copy_database(module_template(request))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='function')
+def template_file(request, tmp_path):
+    """An engine on this test's own copy of the template in a file, str(engine.url) opens it elsewhere"""
+    engine = copy_database(module_template(request), str(tmp_path / 'template.db'))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='function')
+def template_session(request):
+    """
+    A session on the template whose writes are all rolled back after the test. pysqlite only opens
+    a transaction before DML, so it is begun explicitly: the session's SAVEPOINTs then nest inside
+    it, and begin_immediate sees a transaction already open.
+    """
+    connection = module_template(request).connect()
+    transaction = connection.begin()
+    connection.exec_driver_sql('BEGIN')
+    session = Session(bind=connection, join_transaction_mode='create_savepoint')
+
+    yield session
+
+    session.close()
+    transaction.rollback()
+    connection.close()
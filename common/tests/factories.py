@@ -0,0 +1,103 @@
+"""
+Bulk rows for tests, written with Core executemany inserts on one connection.
+
+Ids are handed out from the table's current max(id), so a factory call returns the ids it wrote
+without reading anything back, and thousands of rows cost a few statements instead of a commit
+and refresh each:
+
+    factory = BulkFactory(connection)
+    restaurant_ids = factory.restaurants(1000)
+    table_ids = factory.tables(restaurant_ids, capacities=(2, 4))
+    diner_ids = factory.diners(5000)
+    factory.reservations([(table_id, start) for table_id in table_ids[::2]], diner_ids=...)
+
+Restriction masks and the windows on diner links are filled by the schema's triggers, as for any insert.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Connection
+
+from app.models.db import (
+    DietaryRestriction, Diner, Reservation, Restaurant, RestaurantTable, diner_dietary_restriction_association,
+    diner_reservation_association, restaurant_dietary_restriction_association
+)
+from app.reservations.search import RESERVATION_DURATION
+
+
+CHUNK_SIZE = 50_000
+
+
+class BulkFactory:
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+
+    def _next_ids(self, table, count: int) -> List[int]:
+        first = (self.connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+        return list(range(first, first + count))
+
+    def _insert(self, table, rows: Sequence[dict]) -> None:
+        for start in range(0, len(rows), CHUNK_SIZE):
+            self.connection.execute(insert(table), rows[start:start + CHUNK_SIZE])
+
+    def dietary_restrictions(self, names: Iterable[str]) -> List[int]:
+        names = list(names)
+        ids = self._next_ids(DietaryRestriction.__table__, len(names))
+        self._insert(DietaryRestriction.__table__, [{"id": id, "name": name} for id, name in zip(ids, names)])
+        return ids
+
+    def diners(self, count: int, restriction_ids: Sequence[int] = (),
+               home: Optional[Tuple[float, float]] = None) -> List[int]:
+        """`count` diners named "Diner <id>", each holding every one of restriction_ids"""
+        ids = self._next_ids(Diner.__table__, count)
+        latitude, longitude = home or (None, None)
+        self._insert(Diner.__table__, [{"id": id, "name": f"Diner {id}", "home_latitude": latitude,
+                                        "home_longitude": longitude} for id in ids])
+        self._insert(diner_dietary_restriction_association, [
+            {"diner_id": id, "dietary_restriction_id": restriction_id} for id in ids for restriction_id in restriction_ids
+        ])
+        return ids
+
+    def restaurants(self, count: int, restriction_ids: Sequence[int] = (),
+                    location: Optional[Tuple[float, float]] = None) -> List[int]:
+        """`count` restaurants named "Restaurant <id>", each endorsing every one of restriction_ids"""
+        ids = self._next_ids(Restaurant.__table__, count)
+        latitude, longitude = location or (None, None)
+        self._insert(Restaurant.__table__, [{"id": id, "name": f"Restaurant {id}", "latitude": latitude,
+                                             "longitude": longitude} for id in ids])
+        self._insert(restaurant_dietary_restriction_association, [
+            {"restaurant_id": id, "dietary_restriction_id": restriction_id}
+            for id in ids for restriction_id in restriction_ids
+        ])
+        return ids
+
+    def tables(self, restaurant_ids: Sequence[int], capacities: Sequence[int] = (2, 4, 6),
+               combination_group: Optional[int] = None) -> List[int]:
+        """One table of each capacity per restaurant, in restaurant then capacity order"""
+        ids = self._next_ids(RestaurantTable.__table__, len(restaurant_ids) * len(capacities))
+        pairs = [(restaurant_id, capacity) for restaurant_id in restaurant_ids for capacity in capacities]
+        self._insert(RestaurantTable.__table__, [
+            {"id": id, "restaurant_id": restaurant_id, "capacity": capacity, "combination_group": combination_group}
+            for id, (restaurant_id, capacity) in zip(ids, pairs)
+        ])
+        return ids
+
+    def reservations(self, bookings: Sequence[Tuple[int, datetime]],
+                     diner_ids: Optional[Sequence[Sequence[int]]] = None,
+                     duration: timedelta = timedelta(hours=RESERVATION_DURATION)) -> List[int]:
+        """
+        A reservation per (table_id, start_datetime), with the diners at the same position of diner_ids.
+        The overlap guards still reject a table or diner booked twice in a window.
+        """
+        ids = self._next_ids(Reservation.__table__, len(bookings))
+        self._insert(Reservation.__table__, [
+            {"id": id, "table_id": table_id, "start_datetime": start, "end_datetime": start + duration}
+            for id, (table_id, start) in zip(ids, bookings)
+        ])
+        if diner_ids is not None:
+            self._insert(diner_reservation_association, [
+                {"diner_id": diner_id, "reservation_id": id, "start_datetime": start, "end_datetime": start + duration}
+                for id, (_, start), diners in zip(ids, bookings, diner_ids) for diner_id in diners
+            ])
+        return ids
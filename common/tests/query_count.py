@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+from app.instrumentation import RequestStats, instrument_engines, track_statements
+
+
+@contextmanager
+def assert_max_statements(limit: int) -> Iterator[RequestStats]:
+    """
+    Fails if the block executes more than `limit` SQL statements on any engine, e.g.
+
+        with assert_max_statements(1):
+            manager.find_available_restaurant(request)
+
+    so a search or booking that starts issuing one query per row is caught.
+    """
+    instrument_engines()
+    with track_statements() as stats:
+        yield stats
+    assert stats.statements <= limit, f"{stats.statements} SQL statements executed, at most {limit} expected"
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.api.requests import AvailableReservationRequest, ReservationRequest
+from app.models.db import Diner, Reservation, RestaurantTable
+from app.reservations.reservation_manager import ReservationManager
+from benchmarks.dataset import FIRST_DAY, random_groups, random_slots
+from common.tests.db_setup import TEMPLATE_SPEC, template_copy, template_engine, template_session
+from common.tests.factories import BulkFactory
+
+
+CASES = 200
+SEARCHES = list(zip(random_groups(TEMPLATE_SPEC, CASES, max_size=4), random_slots(TEMPLATE_SPEC, CASES)))
+
+
+def reservations(engine) -> int:
+    with engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(Reservation)).scalar()
+
+
+class TestTemplateDatabase:
+    def test__template__holds_the_seeded_dataset(self, template_engine):
+        assert reservations(template_engine) == TEMPLATE_SPEC.reservations
+
+    def test__template_copy__keeps_writes_to_itself(self, template_engine, template_copy):
+        session = sessionmaker(bind=template_copy)()
+        # Past the seeded days, every restaurant is free
+        diner_ids, start_time = [1, 2], FIRST_DAY + timedelta(days=30, hours=19)
+        restaurant = ReservationManager(session=session).find_available_restaurant(
+            ReservationRequest(diner_ids=diner_ids, start_time=start_time))[0]
+        ReservationManager(session=session).book_reservation(AvailableReservationRequest(
+            diner_ids=diner_ids, start_time=start_time, restaurant_id=restaurant.id))
+        session.close()
+        assert reservations(template_copy) == TEMPLATE_SPEC.reservations + 1
+        assert reservations(template_engine) == TEMPLATE_SPEC.reservations
+
+    def test__template_session__rolls_back_its_commits(self, template_engine, template_session):
+        template_session.query(Reservation).filter(Reservation.id <= 1000).delete()
+        template_session.commit()
+        assert template_session.scalar(select(func.count()).select_from(Reservation)) == TEMPLATE_SPEC.reservations - 1000
+        assert reservations(template_engine) == TEMPLATE_SPEC.reservations
+
+    def test__bulk_factory__rows_are_searchable_and_bookable(self, template_copy):
+        start_time = FIRST_DAY + timedelta(days=30, hours=19)
+        with template_copy.begin() as connection:
+            factory = BulkFactory(connection)
+            [restriction_id] = factory.dietary_restrictions(["Kosher"])
+            restaurant_ids = factory.restaurants(3, restriction_ids=[restriction_id])
+            table_ids = factory.tables(restaurant_ids, capacities=(2, 4))
+            diner_ids = factory.diners(10, restriction_ids=[restriction_id])
+            # Restaurant one booked on both tables
+            factory.reservations([(table_id, start_time) for table_id in table_ids[:2]],
+                                 diner_ids=[diner_ids[:2], diner_ids[2:4]])
+
+        session = sessionmaker(bind=template_copy)()
+        manager = ReservationManager(session=session)
+        assert session.get(Diner, diner_ids[0]).dietary_restriction_mask == 1 << (restriction_id - 1)
+        found = manager.find_available_restaurant(ReservationRequest(diner_ids=diner_ids[4:7], start_time=start_time))
+        assert [restaurant.id for restaurant in found] == restaurant_ids[1:]
+        assert manager.find_available_restaurant(ReservationRequest(diner_ids=diner_ids[:1], start_time=start_time)) == []
+        session.close()
+
+
+@pytest.mark.parametrize('diner_ids, start_time', SEARCHES)
+def test__found_restaurant__books_and_the_group_is_then_busy(template_session, diner_ids, start_time):
+    """Hundreds of cases against the template, each rolled back"""
+    manager = ReservationManager(session=template_session)
+    request = ReservationRequest(diner_ids=diner_ids, start_time=start_time)
+    found = manager.find_available_restaurant(request)
+    if not found:
+        return
+    reservation = manager.book_reservation(AvailableReservationRequest(
+        diner_ids=diner_ids, start_time=start_time, restaurant_id=found[0].id))
+    assert template_session.get(RestaurantTable, reservation.table_id).restaurant_id == found[0].id
+    assert manager.find_available_restaurant(request) == []